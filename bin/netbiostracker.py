@@ -40,8 +40,8 @@ def main():
     _logger.info('=== Starting netbiostracker ===')
 
     addresses = tracker.get_addresses_to_scan(config.get_exceptions())
-    scanresult = tracker.scan(addresses, config.get_encoding())
-    parsed_results = tracker.parse(scanresult, config.get_encoding())
+    parsed_results = tracker.scan(addresses, config.get_encoding(),
+                                  **config.get_scan_options())
     tracker.update_database(parsed_results)
 
     _logger.info('Scanned %d addresses, got %d results in %.2f seconds',
@@ -27,23 +27,30 @@ import sys
 import signal
 import argparse
 import logging
+import time
 
 import nav.daemon
 from nav import buildconf
 from nav.config import NAV_CONFIG
 from nav.daemon import safesleep as sleep
 from nav.logs import init_generic_logging
-from nav.statemon import statistics
 from nav.statemon import megaping
 from nav.statemon import db
 from nav.statemon import config
-from nav.statemon import circbuf
+from nav.statemon import statistics
 from nav.statemon.event import Event
-from nav.statemon.netbox import Netbox
+from nav.statemon.hoststate import HostStates
+from nav.metrics.carbon import send_metrics
 
 
 _logger = logging.getLogger('nav.pping')
 
+# Channel notified by the database when netboxes are added, removed or changed
+NETBOX_CHANNEL = 'netbox_changed'
+# Maximum number of seconds between full reloads of the host list, in case
+# notifications are lost
+HOST_LIST_MAX_AGE = 600
+
 
 def main():
     args = make_argparser().parse_args()
@@ -83,42 +90,55 @@ class Pinger(object):
         self.pinger = megaping.MegaPing(socket)
         self._nrping = int(self.config.get("nrping", 3))
         # To keep status...
-        self.netboxmap = {}  # hash netboxid -> netbox
-        self.down = []       # list of netboxids down
-        self.replies = {}    # hash netboxid -> circbuf
-        self.ip_to_netboxid = {}
+        self.states = HostStates(self._nrping)
+        self._listening = None  # connection_count of the LISTEN connection
+        self._host_list_time = 0
+
+    @property
+    def netboxmap(self):
+        return self.states.netboxes
+
+    @property
+    def down(self):
+        return self.states.down
 
     def update_host_list(self):
         """
         Fetches all netboxes from the NAVdb, and updates
-        internal data structures.
+        internal data structures, if the database has notified us of changes
+        to the netbox table since the last time.
         """
+        if not self._is_host_list_changed():
+            return
         _logger.debug("Getting hosts from database...")
         hosts = self.db.hosts_to_ping()
-        netboxmap = {}
-        self.ip_to_netboxid = {}
-        for host in hosts:
-            netboxid, sysname, ip, up = host
-            netbox = Netbox(netboxid, sysname, ip, up)
-            if netbox.netboxid not in self.netboxmap:
-                # new netbox. Be sure to get it's state
-                if netbox.up != 'y':
-                    _logger.debug(
-                        "Got new netbox, %s, currently "
-                        "marked down in navDB", netbox.ip)
-                    self.down.append(netbox.netboxid)
-            if netbox.netboxid not in self.replies:
-                self.replies[netbox.netboxid] = circbuf.CircBuf(self._nrping)
-                if netbox.up != 'y':
-                    self.replies[netbox.netboxid].reset_all_to(-1)
-            netboxmap[netbox.netboxid] = netbox
-            self.ip_to_netboxid[netbox.ip] = netbox.netboxid
-        # Update netboxmap
-        self.netboxmap = netboxmap
-        _logger.debug("We now got %i hosts in our list to ping",
-                      len(self.netboxmap))
+        self._host_list_time = time.time()
+        added, changed, removed = self.states.set_netboxes(hosts)
+        _logger.debug("We now got %i hosts in our list to ping (%d added, "
+                      "%d changed, %d removed)", len(self.states),
+                      len(added), len(changed), len(removed))
         # then update our pinger object
-        self.pinger.set_hosts(self.ip_to_netboxid.keys())
+        if added or changed or removed:
+            self.pinger.set_hosts(self.states.ip_to_netboxid.keys())
+
+    def _is_host_list_changed(self):
+        if time.time() - self._host_list_time > HOST_LIST_MAX_AGE:
+            self._listen()
+            return True
+        if self._listening != self.db.connection_count:
+            # notifications may have been lost while reconnecting
+            self._listen()
+            return True
+        try:
+            return bool(self.db.get_notifications())
+        except db.DbError:
+            return True
+
+    def _listen(self):
+        try:
+            self._listening = self.db.listen(NETBOX_CHANNEL)
+        except db.DbError:
+            self._listening = None
 
     def generate_events(self):
         """
@@ -126,28 +146,9 @@ class Pinger(object):
         """
         _logger.debug("Checks which hosts didn't answer")
         answers = self.pinger.results()
-        for ip, rtt in answers:
-            # rtt = round trip time (-1 => host didn't reply)
-            netboxid = self.ip_to_netboxid.get(ip)
-            self.replies[netboxid].push(rtt)
-            netbox = self.netboxmap[netboxid]
-            if rtt != -1:
-                statistics.update(netbox.sysname, 'N', 'UP', rtt)
-            else:
-                # ugly...
-                statistics.update(netbox.sysname, 'N', 'DOWN', 5)
-
-        down_now = []
-        # Find out which netboxes to consider down
-        for (netboxid, replies) in self.replies.items():
-            if replies[:self._nrping] == [-1]*self._nrping:
-                down_now.append(netboxid)
-
-        _logger.debug("No answer from %i hosts", len(down_now))
-        # Detect state changes since last run
-        report_down = set(down_now) - set(self.down)
-        report_up = set(self.down) - set(down_now)
-        self.down = down_now
+        report_down, report_up = self.states.update(answers)
+        self._send_metrics(answers)
+        _logger.debug("No answer from %i hosts", len(self.states.down))
 
         # Reporting netboxes as down
         _logger.debug("Starts reporting %i hosts as down", len(report_down))
@@ -165,11 +166,7 @@ class Pinger(object):
         # Reporting netboxes as up
         _logger.debug("Starts reporting %i hosts as up", len(report_up))
         for netboxid in report_up:
-            try:
-                netbox = self.netboxmap[netboxid]
-            except:
-                _logger.info("Netbox %s is no longer with us...", netboxid)
-                continue
+            netbox = self.netboxmap[netboxid]
             new_event = Event(None,
                               netbox.netboxid,
                               None,  # deviceid
@@ -180,6 +177,26 @@ class Pinger(object):
             self.db.new_event(new_event)
             _logger.info("%s marked as up.", netbox)
 
+    def _send_metrics(self, answers):
+        """Sends the round trip times and packet loss of all hosts to
+        Graphite in a single batch.
+        """
+        timestamp = time.time()
+        metrics = []
+        for ip, rtt in answers:
+            netboxid = self.states.ip_to_netboxid.get(ip)
+            if netboxid is None:
+                continue
+            sysname = self.netboxmap[netboxid].sysname
+            if rtt != -1:
+                metrics.extend(statistics.make_metrics(
+                    sysname, timestamp, Event.UP, rtt))
+            else:
+                # ugly...
+                metrics.extend(statistics.make_metrics(
+                    sysname, timestamp, Event.DOWN, 5))
+        send_metrics(metrics)
+
     def main(self):
         """
         Loops until SIGTERM is caught.
@@ -21,111 +21,128 @@ This program controls the service monitoring in NAV.
 """
 import os
 import sys
-import time
-import random
 import signal
 import argparse
 import logging
+import time
+
+from django.utils import six
+from twisted.internet import reactor, task, threads
 
 from nav import buildconf
 import nav.daemon
-from nav.daemon import safesleep as sleep
 from nav.logs import init_generic_logging
-from nav.statemon import RunQueue, config, db
+from nav.statemon import config, db
+from nav.statemon.runtime import CheckerRuntime
 
 
 _logger = logging.getLogger('nav.servicemon')
 
+# Database notification channels that signal changes to the checkers
+CHANGE_CHANNELS = ('service_changed', 'netbox_changed')
+# Reload the checkers at least this often (in seconds), in case a change
+# notification was missed
+CHECKER_LIST_MAX_AGE = 600
+
 
 class Controller:
     def __init__(self, foreground=False):
         if not foreground:
             signal.signal(signal.SIGHUP, self.signalhandler)
-        signal.signal(signal.SIGTERM, self.signalhandler)
-        signal.signal(signal.SIGINT, self.signalhandler)
 
         self.conf = config.serviceconf()
         init_generic_logging(stderr=True, read_config=True)
-        self._isrunning = 1
-        self._checkers = []
         self._looptime = int(self.conf.get("checkinterval", 60))
         _logger.debug("Setting checkinterval=%i", self._looptime)
         self.db = db.db()
-        _logger.debug("Reading database config")
-        _logger.debug("Setting up runqueue")
-        self._runqueue = RunQueue.RunQueue(controller=self)
+        _logger.debug("Setting up checker runtime")
+        max_concurrent = int(self.conf.get('maxconcurrent', 1000))
+        max_threads = int(self.conf.get('maxthreads', six.MAXSIZE))
+        _logger.info("Setting maxconcurrent=%i, maxthreads=%i",
+                     max_concurrent, max_threads)
+        self.runtime = CheckerRuntime(self._looptime,
+                                      max_concurrent=max_concurrent,
+                                      max_threads=max_threads)
         self.dirty = 1
+        self._checker_list_time = 0
+        self._listening = None
 
     def get_checkers(self):
         """
-        Fetches new checkers from the NAV database and appends them to
-        the runqueue.
+        Fetches new checkers from the NAV database and hands them to the
+        checker runtime, if the services have changed.
         """
-        newcheckers = self.db.get_checkers(self.dirty)
+        deferred = threads.deferToThread(self._load_checkers)
+        deferred.addCallback(self._update_checkers)
+        deferred.addErrback(self._log_failure)
+        return deferred
+
+    def _load_checkers(self):
+        if not self._is_checker_list_changed():
+            return None
+        checkers = self.db.get_checkers(self.dirty)
+        self._checker_list_time = time.time()
+        return checkers
+
+    def _is_checker_list_changed(self):
+        if time.time() - self._checker_list_time > CHECKER_LIST_MAX_AGE:
+            self._listen()
+            return True
+        if self._listening != self.db.connection_count:
+            # notifications may have been lost while reconnecting
+            self._listen()
+            return True
+        try:
+            return bool(self.db.get_notifications())
+        except db.DbError:
+            return True
+
+    def _listen(self):
+        try:
+            for channel in CHANGE_CHANNELS:
+                self._listening = self.db.listen(channel)
+        except db.DbError:
+            self._listening = None
+
+    def _update_checkers(self, newcheckers):
+        if newcheckers is None:
+            return
         self.dirty = 0
         # make sure we don't delete all checkers if we get an empty
         # list from the database (maybe we have lost connection to
         # the db)
         if newcheckers:
-            s = []
-            for i in newcheckers:
-                if i in self._checkers:
-                    oldchecker = self._checkers[self._checkers.index(i)]
-                    s.append(oldchecker)
-                else:
-                    s.append(i)
-
-            self._checkers = s
-        elif self.db.status and self._checkers:
+            self.runtime.set_checkers(newcheckers)
+        elif self.db.status and len(self.runtime):
             _logger.info("No checkers left in database, flushing list.")
-            self._checkers = []
+            self.runtime.set_checkers([])
+        _logger.debug("%d checkers scheduled, %d checks completed",
+                      len(self.runtime), self.runtime.checks_completed)
 
-        # Randomize order of checker plugins
-        random.shuffle(self._checkers)
+    @staticmethod
+    def _log_failure(failure):
+        _logger.error("Failed to update checkers: %s",
+                      failure.getErrorMessage())
 
     def main(self):
         """
-        Loops until SIGTERM is caught. The looptime is defined
-        by self._looptime
+        Runs the reactor until SIGTERM or SIGINT is caught. The checkers are
+        reloaded from the database every self._looptime seconds.
         """
         self.db.start()
-        while self._isrunning:
-            start = time.time()
-            self.get_checkers()
-
-            wait = self._looptime - (time.time() - start)
-            if wait <= 0:
-                _logger.warning("System clock has drifted backwards, "
-                               "resetting loop delay")
-                wait = self._looptime
-            if self._checkers:
-                pause = wait/(len(self._checkers)*2)
-            else:
-                pause = 0
-            for checker in self._checkers:
-                self._runqueue.enq(checker)
-                sleep(pause)
-
-            wait = self._looptime - (time.time() - start)
-            _logger.debug("Waiting %i seconds.", wait)
-            if wait <= 0:
-                _logger.critical("Only superman can do this. Humans cannot "
-                                "wait for %i seconds.", wait)
-                wait %= self._looptime
-                sleep(wait)
-            else:
-                sleep(wait)
+        self.runtime.start()
+        reactor.addSystemEventTrigger('before', 'shutdown', self.shutdown)
+        loop = task.LoopingCall(self.get_checkers)
+        loop.start(self._looptime)
+        reactor.run()
+
+    def shutdown(self):
+        """Stops the checker runtime"""
+        _logger.info("Shutting down.")
+        self.runtime.stop()
 
     def signalhandler(self, signum, _):
-        if signum == signal.SIGTERM:
-            _logger.info("Caught SIGTERM. Exiting.")
-            self._runqueue.terminate()
-            sys.exit(0)
-        elif signum == signal.SIGINT:
-            _logger.info("Caught SIGINT. Exiting.")
-            self._runqueue.terminate()
-            sys.exit(0)
-        elif signum == signal.SIGHUP:
+        if signum == signal.SIGHUP:
             # reopen the logfile
             _logger.info("Caught SIGHUP. Reopening logfile...")
             logfile = open(self.conf.logfile, 'a')
@@ -16,83 +16,209 @@
 #
 """Counts active ip-addresses in a prefix and stores the data in rrd-files"""
 
+from collections import defaultdict
+from datetime import datetime, timedelta
 import logging
+import math
 import time
 
-from django.db import connection
+from django.utils.six.moves import range
+from IPy import IP
+
+from nav.models.fields import INFINITY
+from nav.models.manage import Arp, Prefix
+from nav.prefixindex import ADDRESS_BITS, PrefixIndex
 
 _logger = logging.getLogger(__name__)
 
+INTERVAL = timedelta(minutes=30)
+
 
 def collect(days=None):
     """Collect data from database
 
-    Use either a quick query for updates only, or a slow one for walking
-    through historic data.
+    Either counts the currently active arp records, or walks through historic
+    data in 30 minute intervals. In both cases, the arp records are read only
+    once, using a server-side cursor.
+
+    :returns: A list of (netaddr, timeentry, ipcount, maccount) tuples,
+              ordered by timeentry.
     """
 
     starttime = time.time()
+    now = datetime.now()
     intervals = get_intervals(days) if days else 0
+    counter = ActiveIpCounter(get_prefixes(), now, intervals)
 
     if intervals:
         _logger.debug('Collecting %s intervals', intervals)
-        query = get_interval_query(intervals)
+        arp = Arp.objects.filter(end_time__gte=now - intervals * INTERVAL,
+                                 start_time__lte=now)
     else:
-        query = get_static_query()
-
-    _logger.debug(query)
-
-    cursor = connection.cursor()
-    cursor.execute(query)
-
-    _logger.debug('Query executed in %.2f seconds', time.time() - starttime)
-
-    return cursor.fetchall()
-
-
-def get_interval_query(intervals):
-    """Return query for collecting data for a time interval"""
-
-    query = """
-    SELECT
-        netaddr,
-        timeentry,
-        COUNT(DISTINCT ip) AS ipcount,
-        COUNT(DISTINCT mac) AS maccount
-    FROM vlan
-    JOIN prefix USING (vlanid)
-    CROSS JOIN (
-        SELECT
-            now() - generate_series(0,%s) * INTERVAL '30 minutes' AS timeentry)
-        AS series
-    LEFT JOIN arp ON (
-        ip << netaddr AND
-        (timeentry >= start_time AND timeentry <= end_time))
-    WHERE vlan.nettype NOT IN ('loopback') AND ip IS NOT NULL
-    GROUP BY netaddr, timeentry
-    ORDER BY timeentry
-    """ % intervals
-
-    return query
-
-
-def get_static_query():
-    """Return for query for doing a static collection"""
-    query = """
-    SELECT
-        netaddr,
-        now() AS timeentry,
-        COUNT(DISTINCT ip) AS ipcount,
-        COUNT(DISTINCT mac) AS maccount
-    FROM vlan
-    JOIN prefix USING (vlanid)
-    LEFT JOIN arp ON (ip << netaddr AND arp.end_time = 'infinity')
-    WHERE vlan.nettype NOT IN ('loopback')
-    GROUP BY netaddr, timeentry
-    ORDER BY timeentry
-    """
+        arp = Arp.objects.filter(end_time__gte=INFINITY)
+
+    records = arp.values_list('ip', 'mac', 'start_time', 'end_time')
+    count = 0
+    for ip, mac, start_time, end_time in records.iterator():
+        if intervals:
+            in_intervals = counter.get_interval_range(start_time, end_time)
+            counter.add(ip, mac, in_intervals)
+        else:
+            counter.add(ip, mac)
+        count += 1
+
+    _logger.debug('Counted %s arp records in %.2f seconds',
+                  count, time.time() - starttime)
+
+    return counter.get_rows(include_empty=not intervals)
+
 
-    return query
+def get_prefixes():
+    """Returns the network addresses of all prefixes to collect data for"""
+    prefixes = Prefix.objects.filter(vlan__isnull=False).exclude(
+        vlan__net_type='loopback')
+    return set(prefixes.values_list('net_address', flat=True))
+
+
+class ActiveIpCounter(object):
+    """Counts distinct IP and MAC addresses per prefix and time interval.
+
+    Time intervals are numbered backwards from now, so that interval k
+    represents the point in time that is k * INTERVAL before now. Every
+    address is counted in each of the prefixes that contain it.
+
+    Rather than keeping a set of addresses for every interval, the counter
+    keeps the ranges of intervals in which each address was active. The
+    counts of each prefix are computed by sweeping over the start and end
+    points of these ranges, so that memory use depends on the number of arp
+    records, not on the number of intervals.
+
+    """
+    def __init__(self, prefixes, now, intervals=0):
+        """
+        :param prefixes: An iterable of prefix network addresses.
+        :param now: The point in time represented by interval 0.
+        :param intervals: The number of the oldest interval to count.
+        """
+        self.prefixes = set(prefixes)
+        self.now = now
+        self.intervals = intervals
+        self._index = PrefixIndex(
+            (prefix, prefix) for prefix in self.prefixes
+            if not _is_host_prefix(IP(prefix)))
+        self._ip_ranges = defaultdict(list)  # ip int -> [(first, last), ...]
+        self._mac_ranges = defaultdict(list)  # (prefix, mac int) -> ditto
+        self._prefix_ips = defaultdict(set)  # prefix -> set of ip ints
+
+    def get_interval_range(self, start_time, end_time):
+        """Returns the range of intervals whose point in time is within the
+        time span from start_time to end_time.
+        """
+        seconds = INTERVAL.total_seconds()
+        first = math.ceil((self.now - end_time).total_seconds() / seconds)
+        last = math.floor((self.now - start_time).total_seconds() / seconds)
+        return range(max(0, int(first)), min(self.intervals, int(last)) + 1)
+
+    def add(self, ip, mac, intervals=(0,)):
+        """Counts an ip and mac address pair in a range of intervals"""
+        runs = _get_runs(intervals)
+        if not runs:
+            return
+        address = IP(ip)
+        prefixes = self._index.lookup_all(address)
+        if not prefixes:
+            return
+        address = address.int()
+        mac = int(mac.replace(':', ''), 16)
+        self._ip_ranges[address].extend(runs)
+        for prefix in prefixes:
+            self._prefix_ips[prefix].add(address)
+            self._mac_ranges[(prefix, mac)].extend(runs)
+
+    def get_rows(self, include_empty=False):
+        """Returns a list of (netaddr, timeentry, ipcount, maccount) tuples,
+        ordered by timeentry.
+
+        :param include_empty: Include prefixes without any addresses in
+                              interval 0, with counts of 0.
+        """
+        macs = defaultdict(list)
+        for prefix, mac in self._mac_ranges:
+            macs[prefix].append(mac)
+
+        counts = {}  # (prefix, interval) -> (ipcount, maccount)
+        for prefix, addresses in self._prefix_ips.items():
+            ipcounts = _count_active(self._ip_ranges[address]
+                                     for address in addresses)
+            maccounts = dict(_count_active(self._mac_ranges[(prefix, mac)]
+                                           for mac in macs[prefix]))
+            for interval, ipcount in ipcounts:
+                counts[(prefix, interval)] = (ipcount,
+                                              maccounts.get(interval, 0))
+        if include_empty:
+            for prefix in self.prefixes:
+                counts.setdefault((prefix, 0), (0, 0))
+
+        rows = []
+        for prefix, interval in sorted(counts, key=lambda k: (-k[1], k[0])):
+            ipcount, maccount = counts[(prefix, interval)]
+            rows.append((prefix, self.now - interval * INTERVAL,
+                         ipcount, maccount))
+        return rows
+
+
+def _get_runs(intervals):
+    """Returns a list of (first, last) tuples describing the runs of
+    consecutive numbers in an iterable of interval numbers.
+    """
+    if isinstance(intervals, range):
+        return [(intervals[0], intervals[-1])] if intervals else []
+    runs = []
+    for interval in sorted(intervals):
+        if runs and interval <= runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], interval)
+        else:
+            runs.append((interval, interval))
+    return runs
+
+
+def _count_active(range_lists):
+    """Counts the number of items active in each interval.
+
+    :param range_lists: An iterable with one list of (first, last) interval
+                        ranges per item. An item's ranges may overlap.
+    :returns: A generator of (interval, count) tuples for every interval in
+              which at least one item is active.
+    """
+    deltas = defaultdict(int)
+    for ranges in range_lists:
+        for first, last in _merge_ranges(ranges):
+            deltas[first] += 1
+            deltas[last + 1] -= 1
+
+    active = 0
+    points = sorted(deltas)
+    for point, next_point in zip(points, points[1:]):
+        active += deltas[point]
+        if active:
+            for interval in range(point, next_point):
+                yield interval, active
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def _is_host_prefix(prefix):
+    """Host prefixes cannot contain any other addresses than themselves"""
+    return prefix.prefixlen() == ADDRESS_BITS[prefix.version()]
 
 
 def get_intervals(days):
@@ -20,14 +20,13 @@ import logging
 import time
 from IPy import IP
 
-from django.utils.six.moves import range
-
 import nav.activeipcollector.collector as collector
 from nav.metrics.carbon import send_metrics
 from nav.metrics.templates import metric_path_for_prefix
 
 _logger = logging.getLogger(__name__)
 DATABASE_CATEGORY = 'activeip'
+METRICS_BATCH_SIZE = 3000
 
 
 def run(days=None):
@@ -38,26 +37,28 @@ def run(days=None):
 def store(data):
     """Sends data to carbon for storage in Graphite.
 
-    :param data: a cursor.fetchall object containing all database rows we
-    are to store
+    The metrics are sent in batches of METRICS_BATCH_SIZE.
 
-    """
+    :param data: a list of (netaddr, timeentry, ipcount, maccount) tuples, as
+                 returned by collector.collect()
 
-    # Suspecting package drop - dividing into chunks and giving some
-    # breathing room for each batch of updates.
-    chunks = [data[x:x+100] for x in range(0, len(data), 100)]
-    for chunk in chunks:
-        for db_tuple in chunk:
-            store_tuple(db_tuple)
-        time.sleep(2)
+    """
+    batch = []
+    for db_tuple in data:
+        batch.extend(get_metrics(db_tuple))
+        if len(batch) >= METRICS_BATCH_SIZE:
+            send_metrics(batch)
+            batch = []
+    if batch:
+        send_metrics(batch)
 
     _logger.info('Sent %s updates', len(data))
 
 
-def store_tuple(db_tuple):
-    """Sends data to whisper with correct metric path
+def get_metrics(db_tuple):
+    """Returns the metric tuples for a row of collected data
 
-    :param db_tuple: a row from a rrd_fetchall object
+    :param db_tuple: a (netaddr, timeentry, ipcount, maccount) tuple
 
     """
     prefix, when, ip_count, mac_count = db_tuple
@@ -65,13 +66,11 @@ def store_tuple(db_tuple):
 
     when = get_timestamp(when)
 
-    metrics = [
+    return [
         (metric_path_for_prefix(prefix, 'ip_count'), (when, ip_count)),
         (metric_path_for_prefix(prefix, 'mac_count'), (when, mac_count)),
         (metric_path_for_prefix(prefix, 'ip_range'), (when, ip_range))
     ]
-    _logger.debug(metrics)
-    send_metrics(metrics)
 
 
 def find_range(prefix):
@@ -20,15 +20,17 @@
 
 import gc
 import logging
+from collections import OrderedDict
 from datetime import datetime
 
 from django.db import transaction, reset_queries
 from django.utils.lru_cache import lru_cache
 
 from nav.models.profiles import (Account, AccountAlertQueue, AlertSubscription,
-                                 AlertAddress, FilterGroup, AlertPreference,
-                                 TimePeriod)
+                                 AlertAddress, AlertSender, Filter,
+                                 FilterGroup, AlertPreference, TimePeriod)
 from nav.models.event import AlertQueue
+from nav.alertengine.filtermatcher import FilterMatcher
 
 
 _logger = logging.getLogger(__name__)
@@ -65,8 +67,15 @@ def check_alerts(debug=False):
     if num_new_alerts:
         handle_new_alerts(new_alerts)
 
-    # Get all queued alerts.
-    queued_alerts = AccountAlertQueue.objects.all()
+    # Get all queued alerts, along with everything needed to decide when and
+    # how to send them
+    queued_alerts = AccountAlertQueue.objects.select_related(
+        'account',
+        'alert__source', 'alert__netbox', 'alert__device', 'alert__history',
+        'subscription__alert_address__account',
+        'subscription__alert_address__type',
+        'subscription__time_period__profile__alertpreference',
+    ).prefetch_related('alert__messages')
 
     _logger.debug('Checking %d queued alerts', len(queued_alerts))
 
@@ -129,7 +138,15 @@ def check_alerts(debug=False):
 @transaction.atomic()
 def handle_new_alerts(new_alerts):
     """Handles new alerts on the queue"""
-    memoized_check_alert = lru_cache()(check_alert_against_filtergroupcontents)
+    # Filters are evaluated in memory against snapshots of the new alerts,
+    # instead of querying the database for every alert and filter
+    matcher = FilterMatcher(new_alerts)
+
+    @lru_cache()
+    def memoized_check_alert(alert, filtergroupcontents, atype):
+        return check_alert_against_filtergroupcontents(
+            alert, filtergroupcontents, atype, matcher=matcher)
+
     _logger = logging.getLogger('nav.alertengine.handle_new_alerts')
     accounts = []
 
@@ -265,6 +282,9 @@ def handle_queued_alerts(queued_alerts, now=None):
     num_resolved_alerts_ignored = 0
     num_failed_sends = 0
 
+    # (queued alert, daily, weekly) tuples of alerts that should be sent
+    to_send = []
+
     for queued_alert in queued_alerts:
         send, daily, weekly = False, False, False
 
@@ -402,9 +422,17 @@ def handle_queued_alerts(queued_alerts, now=None):
                 )
                 num_resolved_alerts_ignored += 1
                 queued_alert.delete()
+            else:
+                to_send.append((queued_alert, daily, weekly))
+
+        del queued_alert
+    del queued_alerts
 
-            # Try to send alert
-            elif queued_alert.send():
+    # Send the alerts, grouped by the address they are sent to
+    for batch in group_by_address(to_send):
+        sent = send_queued_alerts([queued for queued, _, _ in batch])
+        for (queued_alert, daily, weekly), was_sent in zip(batch, sent):
+            if was_sent:
                 num_sent_alerts += 1
 
                 if weekly:
@@ -415,13 +443,49 @@ def handle_queued_alerts(queued_alerts, now=None):
             else:
                 num_failed_sends += 1
 
-        del queued_alert
-    del queued_alerts
+    AlertSender.close_dispatchers()
 
     return (sent_daily, sent_weekly, num_sent_alerts, num_failed_sends,
             num_resolved_alerts_ignored)
 
 
+def group_by_address(to_send):
+    """Groups a sequence of (queued alert, ...) tuples by the alert address
+    of each queued alert, in order of first appearance.
+    """
+    batches = OrderedDict()
+    for item in to_send:
+        address_id = item[0].subscription.alert_address_id
+        batches.setdefault(address_id, []).append(item)
+    return list(batches.values())
+
+
+def send_queued_alerts(queued_alerts):
+    """Sends account queued alerts that are all sent to the same alert address.
+
+    If the alert sender of the address is configured to send digests, and
+    there are at least as many alerts as its digest threshold, the alerts are
+    sent as a single message.
+
+    :returns: A list of booleans that tell whether each of the queued alerts
+              were sent.
+
+    """
+    address = queued_alerts[0].subscription.alert_address
+    try:
+        threshold = address.type.get_digest_threshold()
+    except AlertSender.DoesNotExist:
+        threshold = 0  # AccountAlertQueue.send() reports this
+
+    if len(queued_alerts) > 1 and 0 < threshold <= len(queued_alerts):
+        _logger.info('Sending %d alerts to %s as a digest',
+                     len(queued_alerts), address.address)
+        sent = AccountAlertQueue.send_digest(queued_alerts)
+        return [sent] * len(queued_alerts)
+
+    return [queued.send() for queued in queued_alerts]
+
+
 def alert_should_be_ignored(queued_alert, subscription, now):
     """Returns True if the subscription specifies that the queued_alert should
     be ignored.
@@ -435,8 +499,13 @@ def alert_should_be_ignored(queued_alert, subscription, now):
             subscription.type != AlertSubscription.NOW)
 
 
-def check_alert_against_filtergroupcontents(alert, filtergroupcontents, atype):
-    """Checks a given alert against an array of filtergroupcontents"""
+def check_alert_against_filtergroupcontents(alert, filtergroupcontents, atype,
+                                            matcher=None):
+    """Checks a given alert against an array of filtergroupcontents
+
+    :param matcher: An optional FilterMatcher to verify filters with, instead
+                    of querying the database for each filter.
+    """
 
     _logger = logging.getLogger(
         'nav.alertengine.check_alert_against_filtergroupcontents')
@@ -445,6 +514,8 @@ def check_alert_against_filtergroupcontents(alert, filtergroupcontents, atype):
         _logger.debug("Emtpy filtergroup")
         return False
 
+    verify = matcher.verify if matcher else Filter.verify
+
     # Allways assume that the match will fail
     matches = False
 
@@ -453,7 +524,7 @@ def check_alert_against_filtergroupcontents(alert, filtergroupcontents, atype):
 
         # If we have not matched the message see if we can match it
         if not matches and content.include:
-            matches = content.filter.verify(alert) == content.positive
+            matches = verify(content.filter, alert) == content.positive
 
             if matches:
                 _logger.debug('alert %d: got included by filter %d in %s',
@@ -461,7 +532,7 @@ def check_alert_against_filtergroupcontents(alert, filtergroupcontents, atype):
 
         # If the alert has been matched try excluding it
         elif matches and not content.include:
-            matches = content.filter.verify(alert) != content.positive
+            matches = verify(content.filter, alert) != content.positive
 
             # Log that we excluded the alert
             if not matches:
@@ -36,17 +36,29 @@ import logging
 from django.core.validators import validate_email
 from django.forms import ValidationError
 
-from nav.models.event import AlertQueueMessage
-
 _logger = logging.getLogger('nav.alertengine.dispatchers')
 
 
 class Dispatcher(object):
     """Base class for dispatchers"""
 
+    # Dispatchers that can send several alerts as a single message set this,
+    # and implement send_digest()
+    SUPPORTS_DIGEST = False
+
     def __init__(self, config=None):
         self.config = config if config is not None else {}
 
+    @property
+    def digest_threshold(self):
+        """The number of alerts to the same address in a single alertengine
+        run that should be sent as a single message instead, or 0 if digests
+        are disabled.
+        """
+        if not self.SUPPORTS_DIGEST:
+            return 0
+        return int(self.config.get('digest_threshold', 0))
+
     def send(self, address, alert, language='en'):
         """Sends an alert to a specific address for a specific language
 
@@ -56,18 +68,33 @@ class Dispatcher(object):
         """
         raise NotImplementedError
 
+    def send_digest(self, address, alerts, language='en'):
+        """Sends several alerts to a specific address as a single message
+
+        :type address: nav.models.profiles.AlertAddress
+        :param alerts: A list of nav.models.event.AlertQueue objects
+        :param language: A two-letter ISO language code string
+        """
+        raise FatalDispatcherException(
+            "%s does not support digests" % self.__class__.__name__)
+
+    def close(self):
+        """Releases resources kept between alerts, like open connections.
+
+        Called at the end of every alertengine run.
+        """
+
     def get_message(self, alert, language, message_type):
         """Gets the message to be sent"""
-        try:
-            return alert.messages.get(language=language,
-                                      type=message_type).message
-        except AlertQueueMessage.DoesNotExist:
+        message = find_message(alert, language, message_type)
+        if message is None:
             return self.get_fallback_message(alert, language, message_type)
+        return message
 
     def get_fallback_message(self, alert, language, message_type):
         """Gets a fallback message if the original alert is missing"""
         # Try using longest message in english
-        messages = list(alert.messages.filter(language='en'))
+        messages = [m for m in alert.messages.all() if m.language == 'en']
         messages.sort(key=lambda m: len(m.message))
 
         if messages:
@@ -101,6 +128,20 @@ class FatalDispatcherException(DispatcherException):
     pass
 
 
+def find_message(alert, language, message_type):
+    """Returns the text of an alert message of a given type and language, or
+    None if there is no such message.
+
+    The messages of the alert are searched in memory, so that messages
+    prefetched with the alert are reused for every recipient.
+
+    """
+    for message in alert.messages.all():
+        if message.language == language and message.type == message_type:
+            return message.message
+    return None
+
+
 def is_valid_email(address):
     """Validates a string as an e-mail address"""
     try:
@@ -17,9 +17,10 @@
 """E-Mail dispatcher implementation"""
 
 import logging
+import socket
 from smtplib import SMTPException, SMTPRecipientsRefused
 
-from django.core.mail import EmailMessage
+from django.core.mail import EmailMessage, get_connection
 
 from nav.alertengine.dispatchers import (Dispatcher, DispatcherException,
                                          FatalDispatcherException,
@@ -29,15 +30,21 @@ _logger = logging.getLogger('nav.alertengine.dispatchers.email')
 
 
 class Email(Dispatcher):
-    """E-Mail dispatcher"""
+    """E-Mail dispatcher.
 
-    def send(self, address, alert, language='en'):
-        message = self.get_message(alert, language, 'email')
+    A single SMTP connection is kept open for all the alerts that are sent
+    during an alertengine run.
 
-        # Extract the subject
-        subject = message.splitlines(1)[0].lstrip('Subject:').strip()
-        # Remove the subject line
-        message = '\n'.join(message.splitlines()[1:])
+    """
+    SUPPORTS_DIGEST = True
+
+    def __init__(self, *args, **kwargs):
+        super(Email, self).__init__(*args, **kwargs)
+        self._connection = None
+
+    def send(self, address, alert, language='en'):
+        subject, message = self._split_message(
+            self.get_message(alert, language, 'email'))
 
         headers = {
             'X-NAV-Alert-ID': alert.id,
@@ -50,16 +57,66 @@ class Email(Dispatcher):
             'X-NAV-Alert-History-ID': alert.history_id,
         }
 
+        if not address.DEBUG_MODE:
+            self._send_email(subject, message, address, headers)
+        else:
+            _logger.debug('alert %d: In testing mode, would have sent '
+                          'email to %s', alert.id, address.address)
+
+    def send_digest(self, address, alerts, language='en'):
+        subject = '%d alerts from NAV' % len(alerts)
+        parts = []
+        for alert in alerts:
+            alert_subject, message = self._split_message(
+                self.get_message(alert, language, 'email'))
+            parts.append('%s\n%s\n\n%s' % (
+                alert_subject, '=' * len(alert_subject), message.strip()))
+        message = '\n\n\n'.join(parts)
+
+        headers = {
+            'X-NAV-Alert-ID': ', '.join(str(alert.id) for alert in alerts),
+        }
+
+        if not address.DEBUG_MODE:
+            self._send_email(subject, message, address, headers)
+        else:
+            _logger.debug('alerts %s: In testing mode, would have sent '
+                          'digest email to %s', headers['X-NAV-Alert-ID'],
+                          address.address)
+
+    def close(self):
+        if self._connection is None:
+            return
         try:
-            if not address.DEBUG_MODE:
-                email = EmailMessage(subject=subject, body=message,
-                                     to=[address.address], headers=headers)
-                email.send(fail_silently=False)
-            else:
-                _logger.debug('alert %d: In testing mode, would have sent '
-                              'email to %s', alert.id, address.address)
+            self._connection.close()
+        except (SMTPException, socket.error) as err:
+            _logger.debug('Error while closing SMTP connection: %s', err)
+        finally:
+            self._connection = None
+
+    @staticmethod
+    def _split_message(message):
+        """Splits an email message into its subject and its body"""
+        # Extract the subject
+        subject = message.splitlines(1)[0].lstrip('Subject:').strip()
+        # Remove the subject line
+        message = '\n'.join(message.splitlines()[1:])
+        return subject, message
+
+    def _send_email(self, subject, message, address, headers):
+        try:
+            if self._connection is None:
+                self._connection = get_connection(fail_silently=False)
+                self._connection.open()
+            email = EmailMessage(subject=subject, body=message,
+                                 to=[address.address], headers=headers,
+                                 connection=self._connection)
+            email.send(fail_silently=False)
 
         except SMTPException as err:
+            # The server may have closed the connection, so open a new one
+            # for the next message
+            self.close()
             msg = 'Could not send email: %s" ' % err
             if (isinstance(err, SMTPRecipientsRefused) or
                 (hasattr(err, "smtp_code") and
@@ -69,6 +126,10 @@ class Email(Dispatcher):
             # Reraise as DispatcherException so that we can catch it further up
             raise DispatcherException(msg)
 
+        except Exception:
+            self.close()
+            raise
+
     @staticmethod
     def is_valid_address(address):
         return is_valid_email(address)
@@ -1,15 +1,29 @@
 """A sender for slack messages"""
 
 import json
+import logging
+import socket
 
 from django.utils import six
-from django.utils.six.moves.urllib.request import Request, urlopen
+from django.utils.six.moves import http_client
+from django.utils.six.moves.urllib.parse import urlsplit
 
-from nav.alertengine.dispatchers import Dispatcher
+from nav.alertengine.dispatchers import (Dispatcher, DispatcherException,
+                                         FatalDispatcherException)
+
+_logger = logging.getLogger('nav.alertengine.dispatchers.slack')
+
+# Seconds to wait for Slack to respond
+TIMEOUT = 30
 
 
 class Slack(Dispatcher):
-    """Dispatch messages to Slack"""
+    """Dispatch messages to Slack.
+
+    The HTTP connection to each webhook host is kept open for all the alerts
+    that are sent during an alertengine run.
+
+    """
     def __init__(self, *args, **kwargs):
         super(Slack, self).__init__(*args, **kwargs)
 
@@ -18,11 +32,12 @@ class Slack(Dispatcher):
         self.channel = self.config.get('channel')
         self.emoji = self.config.get('emoji')
         self.verify = self.config.get('verify', True)
+        self._connections = {}  # (scheme, netloc) -> HTTPConnection
 
     def send(self, address, alert, language='en'):
         """Send a message to Slack"""
         params = {
-            'text': alert.messages.get(language=language, type='sms').message,
+            'text': self.get_message(alert, language, 'sms'),
             'username': self.username,
             'channel': self.channel,
             'icon_emoji': self.emoji
@@ -30,9 +45,60 @@ class Slack(Dispatcher):
         payload = json.dumps(params)
         if isinstance(payload, six.text_type):
             payload = payload.encode("utf-8")
-        request = Request(address.address, payload,
-                          {'Content-Type': 'application/json'})
-        urlopen(request)
+        self._post(address.address, payload)
+
+    def close(self):
+        for connection in self._connections.values():
+            connection.close()
+        self._connections.clear()
+
+    def _post(self, url, payload):
+        url = urlsplit(url)
+        if url.scheme not in ('http', 'https'):
+            raise FatalDispatcherException("Invalid webhook URL %s" %
+                                           url.geturl())
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+        headers = {'Content-Type': 'application/json'}
+
+        key = (url.scheme, url.netloc)
+        # A kept-alive connection may have been closed by the server, so we
+        # retry once on a fresh connection
+        attempts = 2 if key in self._connections else 1
+        for attempt in range(attempts):
+            connection = self._get_connection(*key)
+            try:
+                connection.request('POST', path, payload, headers)
+                response = connection.getresponse()
+                body = response.read()
+                break
+            except (http_client.HTTPException, socket.error) as error:
+                connection.close()
+                del self._connections[key]
+                if attempt == attempts - 1:
+                    raise DispatcherException(
+                        "Could not post to Slack: %s" % error)
+
+        if response.status >= 400:
+            msg = "Slack responded with %s %s: %s" % (
+                response.status, response.reason,
+                body[:200].decode('utf-8', 'replace'))
+            if response.status >= 500 or response.status == 429:
+                raise DispatcherException(msg)
+            raise FatalDispatcherException(msg)
+        _logger.debug("posted to %s: %s", url.netloc, response.status)
+
+    def _get_connection(self, scheme, netloc):
+        if (scheme, netloc) not in self._connections:
+            if scheme == 'https':
+                connection = http_client.HTTPSConnection(netloc,
+                                                         timeout=TIMEOUT)
+            else:
+                connection = http_client.HTTPConnection(netloc,
+                                                        timeout=TIMEOUT)
+            self._connections[(scheme, netloc)] = connection
+        return self._connections[(scheme, netloc)]
 
     @staticmethod
     def is_valid_address(address):
@@ -21,8 +21,8 @@ import logging
 from django.db import DatabaseError, IntegrityError
 
 from nav.models.profiles import SMSQueue
-from nav.models.event import AlertQueueMessage
-from nav.alertengine.dispatchers import Dispatcher, DispatcherException
+from nav.alertengine.dispatchers import (Dispatcher, DispatcherException,
+                                         find_message)
 
 _logger = logging.getLogger('nav.alertengine.dispatchers.sms')
 
@@ -52,16 +52,13 @@ class Sms(Dispatcher):
                             alert.id, address.account)
 
     def get_fallback_message(self, alert, language, message_type):
-        try:
-            return alert.messages.get(language='en', type=message_type).message
-        except AlertQueueMessage.DoesNotExist:
-            pass
+        message = find_message(alert, 'en', message_type)
+        if message is not None:
+            return message
 
-        try:
-            message = alert.messages.get(language='en', type='email').message
+        message = find_message(alert, 'en', 'email')
+        if message is not None:
             return message.split('\n')[0]
-        except AlertQueueMessage.DoesNotExist:
-            pass
 
         return '%s: No sms message for %d' % (alert.netbox, alert.id)
 
@@ -0,0 +1,466 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""In-memory matching of alerts against alert profile filters.
+
+Filter.verify() asks the database whether a single alert matches a single
+filter, which amounts to one query for every alert and filter pair when new
+alerts are checked against the subscriptions of every account.
+
+A FilterMatcher instead compiles each filter once into Python predicates,
+and evaluates them against snapshots of the attributes of a batch of
+alerts.  The snapshots are loaded with a single query for each distinct set
+of attributes used by a filter.
+
+The compiled predicates mirror the queries built by Filter.verify(): All
+conditions on a multi-valued relation must be met by the same related row,
+and an alert is only excluded when it meets all the exclusion (not equals)
+conditions of a filter.  Filters with expressions that cannot be evaluated
+the same way in Python, like ordering comparisons of strings and IP
+addresses, are still verified by the database.
+
+"""
+import binascii
+import logging
+import operator
+import re
+import socket
+from collections import defaultdict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import models
+from django.utils import six
+from django.utils.lru_cache import lru_cache
+
+from nav.models.event import AlertQueue
+from nav.models.manage import Location
+from nav.models.profiles import MatchField, Operator
+
+_logger = logging.getLogger(__name__)
+
+TEXT_FIELDS = (models.CharField, models.TextField)
+NUMBER_FIELDS = (models.IntegerField, models.FloatField)
+
+ORDERING_OPERATORS = {
+    Operator.GREATER: operator.gt,
+    Operator.GREATER_EQ: operator.ge,
+    Operator.LESS: operator.lt,
+    Operator.LESS_EQ: operator.le,
+}
+
+
+class UnsupportedExpression(Exception):
+    """An expression cannot be evaluated outside the database"""
+
+
+class FilterMatcher(object):
+    """Verifies a batch of alerts against alert profile filters"""
+
+    def __init__(self, alerts):
+        """
+        :param alerts: The AlertQueue objects to verify.  Alerts outside
+                       this batch are verified by the database.
+        """
+        self.alert_ids = set(alert.id for alert in alerts)
+        self._compiled = {}  # filter id -> CompiledFilter or None
+        self._rows = {}  # paths -> {alert id: [row, ...]}
+        self._location_children = None
+
+    def verify(self, filtr, alert):
+        """Returns True if alert matches filtr, exactly like
+        filtr.verify(alert) would.
+        """
+        compiled = self.get_compiled_filter(filtr)
+        if compiled is None or alert.id not in self.alert_ids:
+            return filtr.verify(alert)
+
+        matches = compiled.matches(self._get_rows(compiled.paths)[alert.id])
+        _logger.debug('alert %d: %s filter %d', alert.id,
+                      'matches' if matches else 'did not match', filtr.id)
+        return matches
+
+    def get_compiled_filter(self, filtr):
+        """Returns a CompiledFilter for filtr, or None if filtr can only be
+        verified by the database.
+        """
+        if filtr.id not in self._compiled:
+            try:
+                compiled = compile_filter(filtr,
+                                          self._get_location_descendants)
+            except UnsupportedExpression as error:
+                _logger.debug('filter %d will be verified by the database: '
+                              '%s', filtr.id, error)
+                compiled = None
+            self._compiled[filtr.id] = compiled
+        return self._compiled[filtr.id]
+
+    def _get_rows(self, paths):
+        if paths not in self._rows:
+            rows = defaultdict(list)
+            result = AlertQueue.objects.filter(
+                id__in=self.alert_ids).values_list('pk', *paths)
+            for row in result:
+                rows[row[0]].append(row[1:])
+            self._rows[paths] = rows
+        return self._rows[paths]
+
+    def _get_location_descendants(self, location_ids):
+        if self._location_children is None:
+            self._location_children = defaultdict(list)
+            for locationid, parentid in Location.objects.values_list(
+                    'id', 'parent_id'):
+                self._location_children[parentid].append(locationid)
+                self._location_children.setdefault(locationid, [])
+
+        children = self._location_children
+        descendants = set()
+        stack = [locationid for locationid in location_ids
+                 if locationid in children]
+        while stack:
+            locationid = stack.pop()
+            if locationid not in descendants:
+                descendants.add(locationid)
+                stack.extend(children[locationid])
+        return descendants
+
+
+class CompiledFilter(object):
+    """A filter compiled into predicates on the attributes of an alert"""
+
+    def __init__(self, includes, excludes):
+        """
+        :param includes: A list of (path, predicate) tuples, which must all
+                         be true for the same row of attributes.
+        :param excludes: A list of (path, predicate) tuples on single-valued
+                         attributes.  An alert is excluded if all of them are
+                         true.
+        """
+        self.paths = tuple(sorted(set(
+            path for path, _predicate in includes + excludes)))
+        index = dict((path, i) for i, path in enumerate(self.paths))
+        self.includes = [(index[path], predicate)
+                         for path, predicate in includes]
+        self.excludes = [(index[path], predicate)
+                         for path, predicate in excludes]
+
+    def matches(self, rows):
+        """Returns True if the alert with the given rows of attributes matches
+        this filter.
+
+        :param rows: A list of tuples of attribute values, in the order given
+                     by self.paths.  Multi-valued relations yield one row per
+                     combination of related objects.
+        """
+        if not any(self._is_included(row) for row in rows):
+            return False
+        if self.excludes and all(predicate(rows[0][i])
+                                 for i, predicate in self.excludes):
+            return False
+        return True
+
+    def _is_included(self, row):
+        return all(predicate(row[i]) for i, predicate in self.includes)
+
+
+def compile_filter(filtr, get_location_descendants):
+    """Compiles the expressions of a filter, mirroring the query built by
+    Filter.verify().
+
+    :param get_location_descendants: A function that returns the set of ids
+                                     of the given location ids and all their
+                                     descendants.
+    :raises UnsupportedExpression: if the filter cannot be evaluated in
+                                   Python.
+    """
+    # Keyed by the same lookups as the query in Filter.verify(), so that
+    # later expressions replace earlier ones in the same way
+    includes = {}
+    excludes = {}
+    extras = []
+
+    for expression in filtr.expression_set.select_related('match_field'):
+        match_field = expression.match_field
+        value = expression.value
+
+        if match_field.data_type == MatchField.IP:
+            path = _get_path(match_field)
+            extras.append((path, _compile_ip(expression.operator, value)))
+
+        elif match_field.name == 'Location':
+            path = MatchField.FOREIGN_MAP[MatchField.LOCATION]
+            locations = get_location_descendants(value.split('|'))
+            includes[path + '__in'] = (path, _make_in(locations))
+
+        elif expression.operator == Operator.WILDCARD:
+            path = _get_path(match_field)
+            if not isinstance(_get_field(match_field), TEXT_FIELDS):
+                raise UnsupportedExpression(
+                    'wildcard match on non-text field %s' %
+                    match_field.value_id)
+            extras.append((path, _make_like(value, re.IGNORECASE)))
+
+        else:
+            path = _get_path(match_field)
+            lookup = path + expression.get_operator_mapping()
+            predicate = _compile_lookup(_get_field(match_field),
+                                        expression.operator, value)
+            if expression.operator == Operator.NOT_EQUAL:
+                if _is_multivalued(path):
+                    raise UnsupportedExpression(
+                        'exclusion on multi-valued relation %s' % path)
+                excludes[lookup] = (path, predicate)
+            else:
+                includes[lookup] = (path, predicate)
+
+    return CompiledFilter(list(includes.values()) + extras,
+                          list(excludes.values()))
+
+
+def _get_path(match_field):
+    path = match_field.get_lookup_mapping()
+    if path is None:
+        raise UnsupportedExpression('unknown match field %s' %
+                                    match_field.value_id)
+    _is_multivalued(path)  # validates the path
+    return path
+
+
+def _get_field(match_field):
+    """Returns the model field that the lookups of match_field are prepared
+    by, which must be a text or number field.
+    """
+    model, attname = MatchField.MODEL_MAP[match_field.value_id]
+    field = [f for f in model._meta.fields if f.attname == attname][0]
+    if field.is_relation:
+        field = field.target_field
+    if not isinstance(field, TEXT_FIELDS + NUMBER_FIELDS):
+        raise UnsupportedExpression('unsupported field type %s of %s' % (
+            field.get_internal_type(), match_field.value_id))
+    return field
+
+
+def _is_multivalued(path):
+    """Returns True if path traverses a multi-valued relation from
+    AlertQueue.
+    """
+    opts = AlertQueue._meta
+    try:
+        for name in path.split('__'):
+            field = opts.get_field(name)
+            if field.many_to_many or field.one_to_many:
+                return True
+            if field.is_relation:
+                opts = field.related_model._meta
+    except FieldDoesNotExist as error:
+        raise UnsupportedExpression(error)
+    return False
+
+
+def _compile_lookup(field, operator_type, value):
+    if operator_type in (Operator.EQUALS, Operator.NOT_EQUAL):
+        return _make_in([_prepare(field, value)])
+
+    elif operator_type == Operator.IN:
+        return _make_in(_prepare(field, v) for v in value.split('|'))
+
+    elif operator_type in ORDERING_OPERATORS:
+        if not isinstance(field, NUMBER_FIELDS):
+            raise UnsupportedExpression(
+                'ordering comparison of non-numeric field')
+        compare = ORDERING_OPERATORS[operator_type]
+        wanted = _prepare(field, value)
+        return lambda x: x is not None and compare(x, wanted)
+
+    elif operator_type == Operator.REGEXP:
+        return _make_regexp(value)
+
+    elif operator_type == Operator.STARTSWITH:
+        wanted = value.upper()
+        return lambda x: (x is not None
+                          and six.text_type(x).upper().startswith(wanted))
+
+    elif operator_type == Operator.ENDSWITH:
+        wanted = value.upper()
+        return lambda x: (x is not None
+                          and six.text_type(x).upper().endswith(wanted))
+
+    elif operator_type == Operator.CONTAINS:
+        wanted = value.upper()
+        return lambda x: x is not None and wanted in six.text_type(x).upper()
+
+    raise UnsupportedExpression('unsupported operator %s' % operator_type)
+
+
+def _prepare(field, value):
+    """Converts value to the type of field, like the ORM does in lookups"""
+    try:
+        return field.get_prep_value(value)
+    except (TypeError, ValueError, ValidationError):
+        raise UnsupportedExpression('invalid value %r for %s' %
+                                    (value, field.get_internal_type()))
+
+
+def _make_in(values):
+    values = set(values)
+    return lambda x: x is not None and x in values
+
+
+# Escapes that mean the same in Python and PostgreSQL regular expressions.
+# Others, like \b (backspace in PostgreSQL) or \y (word boundary), don't.
+_PORTABLE_ESCAPES = frozenset('dDsSwWnrtfv')
+
+
+def _make_regexp(pattern):
+    """Returns a predicate that matches like the PostgreSQL ~* operator"""
+    _check_portable_regexp(pattern)
+    try:
+        regexp = re.compile(pattern, re.IGNORECASE | re.UNICODE)
+    except re.error as error:
+        raise UnsupportedExpression('invalid regexp %r: %s' % (pattern, error))
+    return lambda x: (x is not None
+                      and regexp.search(six.text_type(x)) is not None)
+
+
+def _check_portable_regexp(pattern):
+    """Raises UnsupportedExpression if pattern uses syntax that is either
+    specific to PostgreSQL or behaves differently in Python's re module.
+    """
+    if pattern.startswith('***'):
+        raise UnsupportedExpression('regexp director %r' % pattern[:4])
+    chars = iter(enumerate(pattern))
+    for index, char in chars:
+        following = pattern[index + 1:index + 2]
+        if char == '\\':
+            next(chars, None)
+            if following.isalnum() and following not in _PORTABLE_ESCAPES:
+                raise UnsupportedExpression(
+                    'regexp escape \\%s in %r' % (following, pattern))
+        elif char == '[' and following in (':', '.', '='):
+            raise UnsupportedExpression(
+                'regexp bracket expression [%s in %r' % (following, pattern))
+        elif (char == '(' and following == '?'
+              and pattern[index + 2:index + 3] not in (':', '=', '!')):
+            raise UnsupportedExpression(
+                'regexp extension (?%s in %r' % (pattern[index + 2:index + 3],
+                                                 pattern))
+
+
+def _make_like(pattern, flags=0):
+    """Returns a predicate that matches like a PostgreSQL LIKE pattern"""
+    regexp = []
+    chars = iter(pattern)
+    for char in chars:
+        if char == '\\':
+            char = next(chars, None)
+            if char is None:
+                raise UnsupportedExpression(
+                    'LIKE pattern must not end with escape character')
+            regexp.append(re.escape(char))
+        elif char == '%':
+            regexp.append('.*')
+        elif char == '_':
+            regexp.append('.')
+        else:
+            regexp.append(re.escape(char))
+    regexp = re.compile('(?:%s)\\Z' % ''.join(regexp),
+                        re.DOTALL | re.UNICODE | flags)
+    return lambda x: x is not None and regexp.match(x) is not None
+
+
+#
+# IP addresses, which are matched using PostgreSQL inet operators
+#
+
+def _compile_ip(operator_type, value):
+    if operator_type in (Operator.IN, Operator.CONTAINS):
+        wanted = [_parse_inet(v) for v in value.split('|')]
+        if operator_type == Operator.IN:
+            return _make_inet_predicate(
+                lambda address: any(_is_within(address, net)
+                                    for net in wanted))
+        return _make_inet_predicate(
+            lambda address: any(_is_within(net, address) for net in wanted))
+
+    elif operator_type in (Operator.EQUALS, Operator.NOT_EQUAL):
+        wanted = _parse_inet(value)
+        if operator_type == Operator.EQUALS:
+            return _make_inet_predicate(lambda address: address == wanted)
+        return _make_inet_predicate(lambda address: address != wanted)
+
+    elif operator_type == Operator.WILDCARD:
+        like = _make_like(value)
+        return lambda x: x is not None and like(_host(x))
+
+    elif operator_type == Operator.REGEXP:
+        regexp = _make_regexp(value)
+        return lambda x: x is not None and regexp(_host(x))
+
+    raise UnsupportedExpression('unsupported IP operator %s' % operator_type)
+
+
+def _make_inet_predicate(test):
+    def _predicate(value):
+        if value is None:
+            return False
+        address = _parse_stored_inet(six.text_type(value))
+        return address is not None and test(address)
+    return _predicate
+
+
+def _host(value):
+    """Returns the address part of an inet value, like host() does"""
+    return six.text_type(value).split('/')[0]
+
+
+def _parse_inet(value):
+    """Parses an inet value into a (family, maximum prefix length, prefix
+    length, address as an integer) tuple.
+
+    :raises UnsupportedExpression: if value is not a plain IPv4 or IPv6
+                                   address with an optional prefix length.
+    """
+    address, slash, prefixlen = value.partition('/')
+    for family, maxlen in ((socket.AF_INET, 32), (socket.AF_INET6, 128)):
+        try:
+            packed = socket.inet_pton(family, str(address))
+        except (socket.error, ValueError):
+            continue
+        if not slash:
+            prefixlen = maxlen
+        elif prefixlen.isdigit() and int(prefixlen) <= maxlen:
+            prefixlen = int(prefixlen)
+        else:
+            break
+        return family, maxlen, prefixlen, int(binascii.hexlify(packed), 16)
+    raise UnsupportedExpression('invalid inet value %r' % value)
+
+
+@lru_cache(maxsize=4096)
+def _parse_stored_inet(value):
+    try:
+        return _parse_inet(value)
+    except UnsupportedExpression:
+        return None
+
+
+def _is_within(address, network):
+    """Returns True if address is contained within or equals network, like
+    the <<= operator.
+    """
+    family, maxlen, prefixlen, bits = network
+    if address[0] != family or address[2] < prefixlen:
+        return False
+    shift = maxlen - prefixlen
+    return address[3] >> shift == bits >> shift
@@ -43,7 +43,8 @@ from nav.config import find_configfile
 from nav.errors import GeneralException
 from nav.models.arnold import Identity, Event
 from nav.models.manage import Interface, Prefix
-from nav.netbiostracker.tracker import scan, parse_get_workstations
+from nav.netbiostracker.nbstat import UNKNOWN
+from nav.netbiostracker.tracker import scan
 from nav.portadmin.snmputils import SNMPFactory
 from nav.util import is_valid_ip
 
@@ -497,12 +498,10 @@ def get_host_name(ip):
 def get_netbios(ip):
     """Get netbiosname of computer with ip"""
 
-    netbios_dump = scan([ip], verbose=True)
-    if not netbios_dump:
-        return ""
-
-    parsed_results = parse_get_workstations(netbios_dump)
-    return parsed_results.get(ip, "")
+    for result in scan([ip]):
+        if result.name != UNKNOWN:
+            return result.name
+    return ""
 
 
 def check_non_block(ip):
@@ -19,8 +19,12 @@ import logging
 import os
 from pprint import pformat
 import re
+import time
 
-from django.template import loader
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+from django.utils import six
+from django.utils.functional import lazy
 
 from nav.models.event import AlertQueue as Alert, EventQueue as Event, AlertType
 from nav.models.event import AlertHistory
@@ -160,6 +164,10 @@ class AlertGenerator(dict):
         history = self.make_alert_history()
         if history:
             history.save()
+            if self.state == Event.STATE_START:
+                unresolved.add(history)
+            elif self.state == Event.STATE_END:
+                unresolved.remove(history)
             self._post_alert_messages(history)
         return history
 
@@ -210,16 +218,9 @@ TEMPLATE_PATTERN = re.compile(r"^(?P<alert_type>\w+)-"
 
 DEFAULT_LANGUAGE = "en"
 
-
-def ensure_alert_templates_are_available():
-    """Inserts the ALERT_TEMPLATE_DIR into Django's TEMPLATE_DIRS list"""
-    from django.conf import settings
-
-    for config in settings.TEMPLATES:
-        if (config.get('BACKEND') ==
-                'django.template.backends.django.DjangoTemplates'
-                and ALERT_TEMPLATE_DIR not in config['DIRS']):
-            config['DIRS'] += (ALERT_TEMPLATE_DIR,)
+# Maximum number of seconds between checks for changes in the template tree
+TEMPLATE_CHECK_INTERVAL = 60
+DJANGO_TEMPLATE_BACKEND = 'django.template.backends.django.DjangoTemplates'
 
 
 def render_templates(alert):
@@ -229,7 +230,6 @@ def render_templates(alert):
     :return: A list of (TemplateDetails, <rendered_unicode>) tuples
 
     """
-    ensure_alert_templates_are_available()
     templates = (
         get_list_of_templates_for(alert.event_type.id, alert.alert_type)
         or get_list_of_templates_for(alert.event_type.id)
@@ -246,12 +246,13 @@ def render_templates(alert):
 
 
 def _render_template(details, alert):
-    template = loader.get_template(details.name)
+    template = _template_registry.get_template(details)
     context = dict(alert)
     context.update(vars(alert))
     context.update(dict(msgtype=details.msgtype,
                         language=details.language))
-    context.update(dict(context_dump=pformat(context)))
+    # Only dumped if the template uses it or debug logging is enabled
+    context.update(dict(context_dump=_lazy_format_context(dict(context))))
 
     _template_logger.debug("rendering alert template with context:\n%s",
                            context['context_dump'])
@@ -260,28 +261,134 @@ def _render_template(details, alert):
     return details, output
 
 
+def _format_context(context):
+    return six.text_type(pformat(context))
+
+
+_lazy_format_context = lazy(_format_context, six.text_type)
+
+
 def get_list_of_templates_for(event_type, alert_type="default"):
     """Returns a list of TemplateDetails objects for the available alert
     message templates for the given event_type and alert_type.
 
     """
-    def _matcher(name):
-        match = TEMPLATE_PATTERN.search(name)
-        if match and match.group('alert_type') == alert_type:
-            return match
-
-    directory = os.path.join(ALERT_TEMPLATE_DIR, event_type)
-    if os.path.isdir(directory):
-        matches = [(_matcher(name), os.path.join(event_type, name))
-                   for name in os.listdir(directory)]
-    else:
-        matches = []
-    return [TemplateDetails(name,
-                            match.group('msgtype'),
-                            match.group('language') or DEFAULT_LANGUAGE)
-            for match, name in matches if match]
+    return _template_registry.get_templates(event_type, alert_type)
+
+
+class AlertTemplateRegistry(object):
+    """Keeps an index of the alert message templates in a directory tree, and
+    the compiled templates.
+
+    The tree is scanned once, and then rescanned whenever a file or
+    directory in it has been modified, which is checked at most every
+    check_interval seconds.  Compiled templates are discarded on changes.
+
+    Templates are compiled by a template engine of their own, configured like
+    NAV's Django template engine, but with the template directory first in
+    its search path, so that templates can include or extend other
+    templates in the tree.
+
+    """
+    def __init__(self, directory, check_interval=TEMPLATE_CHECK_INTERVAL,
+                 clock=time.time):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.clock = clock
+        self._templates = {}  # (event type, alert type) -> [TemplateDetails]
+        self._compiled = {}  # TemplateDetails -> compiled template
+        self._engine = None
+        self._mtimes = None  # path -> modification time
+        self._next_check = None
+
+    def get_templates(self, event_type, alert_type="default"):
+        """Returns a list of TemplateDetails objects for the available
+        templates for the given event_type and alert_type.
+        """
+        self._refresh()
+        return list(self._templates.get((event_type, alert_type), ()))
+
+    def get_template(self, details):
+        """Returns the compiled template described by a TemplateDetails
+        object.
+        """
+        self._refresh()
+        if details not in self._compiled:
+            if self._engine is None:
+                self._engine = self._make_engine()
+            self._compiled[details] = self._engine.get_template(details.name)
+        return self._compiled[details]
+
+    def _make_engine(self):
+        config = next((config for config in settings.TEMPLATES
+                       if config.get('BACKEND') == DJANGO_TEMPLATE_BACKEND),
+                      {})
+        return DjangoTemplates({
+            'NAME': 'alertmsg',
+            'DIRS': [self.directory] + list(config.get('DIRS', [])),
+            'APP_DIRS': config.get('APP_DIRS', False),
+            'OPTIONS': config.get('OPTIONS', {}),
+        })
+
+    def _refresh(self):
+        now = self.clock()
+        if self._next_check is not None and now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+
+        mtimes = self._get_mtimes()
+        if mtimes != self._mtimes:
+            if self._mtimes is not None:
+                _logger.info("alert message templates have changed, "
+                             "reloading")
+            self._templates = self._scan(mtimes)
+            self._compiled.clear()
+            # the engine may have cached templates included by others
+            self._engine = None
+            self._mtimes = mtimes
+
+    def _get_mtimes(self):
+        """Returns the modification times of the template directory, the
+        event type directories and the files in them.
+        """
+        mtimes = {}
+        if not self.directory or not os.path.isdir(self.directory):
+            return mtimes
+        mtimes[''] = os.stat(self.directory).st_mtime
+        for event_type in os.listdir(self.directory):
+            directory = os.path.join(self.directory, event_type)
+            if not os.path.isdir(directory):
+                continue
+            mtimes[event_type] = os.stat(directory).st_mtime
+            for name in os.listdir(directory):
+                path = os.path.join(event_type, name)
+                try:
+                    mtimes[path] = os.stat(
+                        os.path.join(self.directory, path)).st_mtime
+                except OSError:
+                    pass  # removed since it was listed
+        return mtimes
+
+    @staticmethod
+    def _scan(mtimes):
+        """Builds the template index from the paths found by _get_mtimes()"""
+        templates = {}
+        for path in sorted(mtimes):
+            event_type, _, name = path.partition(os.sep)
+            match = TEMPLATE_PATTERN.search(name)
+            if not match:
+                continue
+            details = TemplateDetails(path,
+                                      match.group('msgtype'),
+                                      match.group('language')
+                                      or DEFAULT_LANGUAGE)
+            key = (event_type, match.group('alert_type'))
+            templates.setdefault(key, []).append(details)
+        return templates
 
 
 # pylint sucks on namedtuples
 # pylint: disable=C0103
 TemplateDetails = namedtuple("TemplateDetails", "name msgtype language")
+
+_template_registry = AlertTemplateRegistry(ALERT_TEMPLATE_DIR)
@@ -21,6 +21,9 @@ SQL is needed::
 
     CREATE RULE eventq_notify AS ON INSERT TO eventq DO ALSO NOTIFY new_event;
 
+Cached VLAN topology graphs are discarded when a topology_changed
+notification is received.
+
 """
 import logging
 import sched
@@ -37,11 +40,15 @@ from nav.eventengine.plugin import EventHandler
 from nav.eventengine.alerts import AlertGenerator
 from nav.eventengine.config import EVENTENGINE_CONF
 from nav.eventengine import unresolved
+from nav.eventengine import topology
 from nav.models.event import EventQueue as Event
 import nav.db
 
 _logger = logging.getLogger(__name__)
 
+EVENT_CHANNEL = 'new_event'
+TOPOLOGY_CHANNEL = 'topology_changed'
+
 
 def harakiri():
     """Kills the entire daemon when no database is available"""
@@ -84,12 +91,18 @@ class EventEngine(object):
     # too often, since we rely on PostgreSQL notification when new events are
     # inserted into the queue.
     CHECK_INTERVAL = 30
+    # the map of unresolved alerts is kept up to date as alerts are posted,
+    # but is reloaded regularly to pick up changes made by others
+    UNRESOLVED_RELOAD_INTERVAL = 300
+    # the maximum number of events to load and handle in one transaction
+    BATCH_SIZE = 1000
     PLUGIN_TASKS_PRIORITY = 1
     _logger = logging.getLogger(__name__)
 
     def __init__(self, target="eventEngine", config=EVENTENGINE_CONF):
         self._scheduler = sched.scheduler(time.time, self._notifysleep)
         self._unfinished = set()
+        self._unresolved_load_time = 0
         self.target = target
         self.config = config
         self.handlers = EventHandler.load_and_find_subclasses()
@@ -119,9 +132,15 @@ class EventEngine(object):
                 self._listen()
                 return
             if conn.notifies:
-                self._logger.debug("got event notification from database")
-                self._schedule_next_queuecheck()
+                channels = set(notify.channel for notify in conn.notifies)
                 del conn.notifies[:]
+                if TOPOLOGY_CHANNEL in channels:
+                    self._logger.debug("got topology change notification "
+                                       "from database")
+                    topology.invalidate_topology_cache()
+                if EVENT_CHANNEL in channels:
+                    self._logger.debug("got event notification from database")
+                    self._schedule_next_queuecheck()
         else:
             self._logger.debug("regular sleep for %ss", delay)
             time.sleep(delay)
@@ -156,9 +175,15 @@ class EventEngine(object):
         """
         _logger.debug("registering event listener with PostgreSQL")
         cursor = connection.cursor()
-        cursor.execute('LISTEN new_event')
+        cursor.execute('LISTEN %s' % EVENT_CHANNEL)
+        cursor.execute('LISTEN %s' % TOPOLOGY_CHANNEL)
+        # changes may have been missed while not listening
+        topology.invalidate_topology_cache()
 
     def _load_new_events_and_reschedule(self):
+        if (time.time() - self._unresolved_load_time
+                > self.UNRESOLVED_RELOAD_INTERVAL):
+            self._load_unresolved_alerts()
         self.load_new_events()
         self._schedule_next_queuecheck(
             self.CHECK_INTERVAL,
@@ -171,31 +196,67 @@ class EventEngine(object):
         self._scheduler.enter(delay, 0, action, ())
 
     @swallow_unhandled_exceptions
-    @transaction.atomic()
+    @retry_on_db_loss()
+    def _load_unresolved_alerts(self):
+        self._logger.debug("loading unresolved alerts")
+        unresolved.update()
+        self._unresolved_load_time = time.time()
+
+    @swallow_unhandled_exceptions
     def load_new_events(self):
         "Loads and processes new events on the queue, if any"
         self._logger.debug("checking for new events on queue")
-        events = Event.objects.filter(target=self.target).order_by('id')
-        if events:
-            old_events = [event for event in events
-                          if event.id in self._unfinished]
-            new_events = [event for event in events
-                          if event.id not in self._unfinished]
-            self._logger.info("found %d new and %d old events in queue db",
-                              len(new_events), len(old_events))
-            for event in new_events:
-                unresolved.update()
-                try:
-                    self.handle_event(event)
-                except Exception:
-                    self._logger.exception("Unhandled exception while "
-                                           "handling %s, deleting event",
-                                           event)
-                    if event.id:
-                        event.delete()
+        last_id = 0
+        count = self.BATCH_SIZE
+        while count >= self.BATCH_SIZE:
+            count, last_id = self._load_event_batch(last_id)
 
         self._log_task_queue()
 
+    @transaction.atomic()
+    def _load_event_batch(self, after_id):
+        """Loads and processes a batch of events from the queue.
+
+        :param after_id: Only events with ids above this are loaded.
+        :returns: A tuple of the number of events loaded and the id of the
+                  last event loaded.
+
+        """
+        start = time.time()
+        events = list(
+            Event.objects.filter(target=self.target, id__gt=after_id)
+            .select_related('netbox', 'event_type')
+            .prefetch_related('variables')
+            .order_by('id')[:self.BATCH_SIZE])
+        if not events:
+            return 0, after_id
+
+        last_id = events[-1].id
+        new_events = [event for event in events
+                      if event.id not in self._unfinished]
+        self._logger.info("found %d new and %d old events in queue db",
+                          len(new_events), len(events) - len(new_events))
+        for event in new_events:
+            try:
+                self.handle_event(event)
+            except Exception:
+                self._logger.exception("Unhandled exception while "
+                                       "handling %s, deleting event",
+                                       event)
+                # alert states posted while handling it may have been
+                # rolled back
+                unresolved.update()
+                self._unresolved_load_time = time.time()
+                if event.id:
+                    event.delete()
+
+        if new_events:
+            elapsed = time.time() - start
+            self._logger.info("handled %d events in %.2fs (%.1f events/s)",
+                              len(new_events), elapsed,
+                              len(new_events) / elapsed if elapsed else 0)
+        return len(events), last_id
+
     def _log_task_queue(self):
         _logger = logging.getLogger(__name__ + '.queue')
         _logger.debug("about to log task queue: %d", len(self._scheduler.queue))
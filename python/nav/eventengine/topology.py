@@ -17,28 +17,49 @@
 import logging
 import socket
 import datetime
+import time
+from collections import deque
 
 import networkx
-from networkx.exception import NetworkXException
 from nav.models.manage import SwPortVlan, Netbox, Prefix, Arp, Cam
 
 _logger = logging.getLogger(__name__)
 
 
+# The maximum number of seconds to cache a VLAN graph, in case a
+# notification about a topology change was missed
+TOPOLOGY_MAX_AGE = 3600
+
+
 def netbox_appears_reachable(netbox):
     """Returns True if netbox appears to be reachable through the known
     topology.
 
     """
-    target_path = get_path_to_netbox(netbox)
     nav = NAVServer.make_for(netbox.ip)
-    nav_path = get_path_to_netbox(nav) if nav else True
+    paths = get_paths_to_netboxes([netbox, nav] if nav else [netbox])
+    target_path = paths[netbox]
+    nav_path = paths[nav] if nav else True
     _logger.debug("reachability paths, target_path=%(target_path)r, "
                   "nav_path=%(nav_path)r", locals())
     return bool(target_path and nav_path)
 
 
-def get_path_to_netbox(netbox):
+def get_paths_to_netboxes(netboxes):
+    """Returns likely paths from multiple netboxes to their apparent
+    gateways/routers, as get_path_to_netbox() does.
+
+    The netboxes that are down are only looked up once, so that netboxes in
+    the same VLAN are all evaluated using a single search of the VLAN graph.
+
+    :returns: A dict of {netbox: path}.
+
+    """
+    down = get_down_netbox_ids()
+    return {netbox: get_path_to_netbox(netbox, down) for netbox in netboxes}
+
+
+def get_path_to_netbox(netbox, down=None):
     """Returns a likely path from netbox to its apparent gateway/router.
 
     If any switches on the path, or the router itself is down,
@@ -46,6 +67,9 @@ def get_path_to_netbox(netbox):
     if there is insufficient information for NAV to find a likely path,
     a True value is returned.
 
+    :param down: The set of ids of netboxes that are currently down, if
+                 already known.
+
     """
     prefix = netbox.get_prefix()
     if not prefix:
@@ -62,49 +86,152 @@ def get_path_to_netbox(netbox):
     router = router_port.interface.netbox
     _logger.debug("reachability check for %s on %s (router: %s)",
                   netbox, prefix, router)
+    if netbox == router:
+        return [router]
 
-    graph = get_graph_for_vlan(prefix.vlan)
-    try:
-        netbox.add_to_graph(graph)
-    except AttributeError:
-        pass
+    topology = _topology_cache.get(prefix.vlan)
+    neighbors = topology.get_neighbors(netbox)
 
     # first, see if any path exists
-    if not _path_exists(graph, netbox, router):
+    if not topology.is_connected(neighbors, router):
         _logger.warning("cannot find a path between %s and %s on VLAN %s",
                         netbox, router, prefix.vlan)
         return True
 
-    # now, remove nodes that are down and see if a path still exists
-    strip_down_nodes_from_graph(graph, keep=netbox)
-
-    if netbox not in graph or router not in graph:
-        if router.up == router.UP_UP:
-            _logger.warning("%(netbox)s topology problem: router %(router)s "
-                            "is up, but not in VLAN graph for %(prefix)r. "
-                            "Defaulting to 'reachable' status.", locals())
-            return True
-        _logger.debug("%s not reachable, router or box not in graph: %r",
-                      netbox, graph.edges())
+    # now, see if a path exists through the nodes that are up
+    if router.up != router.UP_UP:
+        _logger.debug("%s not reachable, router %s is down", netbox, router)
         return False
 
-    try:
-        path = networkx.shortest_path(graph, netbox, router)
-    except NetworkXException as error:
-        _logger.debug("an internal networkx exception was raised in "
-                      "shortest_path, assuming no path was found: %s", error)
-        path = []
-    else:
-        _logger.debug("path to %s: %r", netbox, path)
+    if down is None:
+        down = get_down_netbox_ids()
+    path = topology.get_router_tree(router, down).get_path(netbox, neighbors)
+    _logger.debug("path to %s: %r", netbox, path)
     return path
 
 
-def _path_exists(graph, source, target):
-    try:
-        path = networkx.shortest_path(graph, source, target)
-    except NetworkXException:
+def get_down_netbox_ids():
+    """Returns the set of ids of netboxes that are currently not up"""
+    return frozenset(
+        Netbox.objects.exclude(up=Netbox.UP_UP).values_list('id', flat=True))
+
+
+def invalidate_topology_cache():
+    """Discards all cached VLAN graphs"""
+    _topology_cache.clear()
+
+
+class TopologyCache(object):
+    """A cache of VlanTopology objects"""
+
+    def __init__(self, max_age=TOPOLOGY_MAX_AGE):
+        self.max_age = max_age
+        self._topologies = {}
+
+    def get(self, vlan):
+        """Returns the VlanTopology of vlan, building it if necessary"""
+        topology = self._topologies.get(vlan.id)
+        if topology is None or time.time() - topology.created > self.max_age:
+            topology = VlanTopology(get_graph_for_vlan(vlan))
+            self._topologies[vlan.id] = topology
+        return topology
+
+    def clear(self):
+        """Discards all cached topologies"""
+        if self._topologies:
+            _logger.debug("discarding %d cached VLAN graphs",
+                          len(self._topologies))
+        self._topologies.clear()
+
+
+class VlanTopology(object):
+    """The layer 2 topology of a VLAN, and reachability searches in it.
+
+    Since the graph may be shared between searches, it must not be modified.
+    Instead of removing netboxes that are down from the graph, searches are
+    given the set of ids of netboxes to avoid.
+
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        self.created = time.time()
+        self._components = {}
+        for index, nodes in enumerate(networkx.connected_components(graph)):
+            for node in nodes:
+                self._components[node] = index
+        self._router_trees = {}
+
+    def get_neighbors(self, node):
+        """Returns the neighbors of a netbox or a NAVServer in the graph"""
+        if isinstance(node, NAVServer):
+            return node.get_switches_from_cam()
+        if node in self.graph:
+            return list(self.graph.adj[node])
+        return []
+
+    def is_connected(self, neighbors, router):
+        """Returns True if any of neighbors is connected to the router in
+        the graph, regardless of the states of the netboxes.
+        """
+        component = self._components.get(router)
+        return any(neighbor == router or (
+            component is not None
+            and self._components.get(neighbor) == component)
+                   for neighbor in neighbors)
+
+    def get_router_tree(self, router, down):
+        """Returns a RouterTree of the netboxes that are reachable from
+        router without passing through any of the netboxes in down.
+        """
+        cached = self._router_trees.get(router)
+        if cached is None or cached.down != down:
+            cached = RouterTree(self.graph, router, down)
+            self._router_trees[router] = cached
+        return cached
+
+
+class RouterTree(object):
+    """A breadth first search tree of the netboxes that are reachable from
+    a router through netboxes that are up.
+    """
+    def __init__(self, graph, router, down):
+        self.router = router
+        self.down = down
+        self.parents = {router: None}
+        self.depths = {router: 0}
+        queue = deque([router])
+        while queue:
+            node = queue.popleft()
+            if node not in graph:
+                continue
+            for neighbor in graph.adj[node]:
+                if neighbor not in self.parents and neighbor.id not in down:
+                    self.parents[neighbor] = node
+                    self.depths[neighbor] = self.depths[node] + 1
+                    queue.append(neighbor)
+
+    def get_path(self, node, neighbors):
+        """Returns a shortest path from node to the router, through one of
+        the node's neighbors, or an empty list if there is no such path.
+        """
+        if node in self.parents:
+            return self._path_from(node)
+        reachable = [neighbor for neighbor in neighbors
+                     if neighbor in self.depths]
+        if not reachable:
+            return []
+        nearest = min(reachable, key=self.depths.get)
+        return [node] + self._path_from(nearest)
+
+    def _path_from(self, node):
         path = []
-    return bool(path)
+        while node is not None:
+            path.append(node)
+            node = self.parents[node]
+        return path
+
+
+_topology_cache = TopologyCache()
 
 
 def get_graph_for_vlan(vlan):
@@ -139,18 +266,6 @@ def get_graph_for_vlan(vlan):
     return graph
 
 
-def strip_down_nodes_from_graph(graph, keep=None):
-    """Strips all nodes (netboxes) from graph that are currently down.
-
-    :param keep: A node to keep regardless of its current status.
-
-    """
-    removable = set(node for node in graph.nodes()
-                    if node.up != node.UP_UP and node != keep)
-    graph.remove_nodes_from(removable)
-    return len(removable)
-
-
 def strip_down_links_from_graph(graph):
     """Strips all edges (links) from graph where any of the involved
     interfaces are down.
@@ -200,11 +315,6 @@ class NAVServer(object):
         if matches:
             return matches[0]
 
-    def add_to_graph(self, graph):
-        """Adds edge between myself and all neighboring switches"""
-        for switch in self.get_switches_from_cam():
-            graph.add_edge(self, switch)
-
     def get_switches_from_cam(self):
         """Gets all neighboring switches"""
         mac = self.get_mac_from_arp()
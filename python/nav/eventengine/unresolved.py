@@ -30,7 +30,12 @@ def get_map():
 
 
 def update():
-    """Updates the map of unresolved alerts from the database"""
+    """Updates the map of unresolved alerts from the database.
+
+    AlertGenerator keeps the map up to date with the alert states posted by
+    the event engine itself, so a full update is only needed at startup and
+    to pick up changes made by other programs.
+    """
     # yes mr. pylint, we use global state, this module acts as a singleton
     # pylint: disable=W0603
     global _unresolved_alerts_map
@@ -39,6 +44,19 @@ def update():
                                   for alert in unresolved)
 
 
+def add(alert):
+    """Adds a newly posted, unresolved AlertHistory entry to the map"""
+    _unresolved_alerts_map[alert.get_key()] = alert
+
+
+def remove(alert):
+    """Removes a newly resolved AlertHistory entry from the map"""
+    key = alert.get_key()
+    existing = _unresolved_alerts_map.get(key)
+    if existing is not None and existing.pk == alert.pk:
+        del _unresolved_alerts_map[key]
+
+
 def refers_to_unresolved_alert(event):
     """Verifies whether an event appears to refer to a currently
     unresolved alert state.
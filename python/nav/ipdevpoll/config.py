@@ -32,10 +32,22 @@ class IpdevpollConfig(NAVConfigParser):
 [ipdevpoll]
 logfile = ipdevpolld.log
 max_concurrent_jobs = 500
+bulk_storage = no
+scheduler = classic
+max_concurrent_cost = 0
+max_start_jitter = 300
+incremental_diffing = no
+incremental_resync_interval = 6h
+
+[multiprocess]
+max_worker_load = 0
+max_worker_memory_growth = 0
 
 [snmp]
 timeout = 1.5
 max-repetitions = 10
+bulk-columns = 10
+max-in-flight = 2
 
 [plugins]
 
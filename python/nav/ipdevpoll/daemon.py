@@ -124,6 +124,7 @@ class IPDevPollProcess(object):
 
         def log_scheduler_jobs():
             JobScheduler.log_active_jobs(logging.INFO)
+            JobScheduler.log_lateness(logging.INFO)
 
         self.job_loggers.append(log_scheduler_jobs)
 
@@ -187,6 +188,7 @@ class IPDevPollProcess(object):
 
         def log_scheduler_jobs():
             JobScheduler.log_active_jobs(logging.INFO)
+            JobScheduler.log_lateness(logging.INFO)
 
         self.job_loggers.append(log_scheduler_jobs)
         self.job_loggers.append(self.work_pool.log_summary)
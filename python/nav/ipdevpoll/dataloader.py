@@ -32,10 +32,12 @@ from the database can be executed in a separate thread to avoid
 interfering with the daemon's asynchronous operations.
 
 """
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 import logging
+import pickle
 
 import django.db
+from twisted.internet.defer import succeed
 
 from nav.models import manage, event
 from nav import ipdevpoll
@@ -60,6 +62,77 @@ def load_netbox(netbox_id):
     return storage.shadowify(netbox)
 
 
+NetboxSnapshot = namedtuple('NetboxSnapshot', 'version data')
+
+
+class NetboxSnapshotCache(dict):
+    """A versioned cache of serialized Netbox shadow objects.
+
+    The dictionary keys are netbox table primary keys, the values are
+    NetboxSnapshot tuples.  The netbox loaders of a scheduler process store
+    snapshots of every netbox they load, so that they can be sent to worker
+    processes along with jobs, sparing the workers from loading the netboxes
+    from the database on every job run.
+
+    """
+    def store(self, netbox):
+        """Stores a snapshot of a netbox.
+
+        :param netbox: A shadows.Netbox object.
+        :returns: The stored NetboxSnapshot. Its version will only be
+                  incremented if the netbox has changed since the previous
+                  snapshot.
+
+        """
+        data = pickle.dumps(netbox, protocol=2)
+        current = self.get(netbox.id)
+        if current and current.data == data:
+            return current
+        snapshot = NetboxSnapshot(current.version + 1 if current else 1, data)
+        self[netbox.id] = snapshot
+        return snapshot
+
+    def load(self, netbox_id, version):
+        """Loads a netbox from a cached snapshot.
+
+        Every call returns a new object, so a job is free to modify it.
+
+        :param netbox_id: A Netbox integer primary key.
+        :param version: The snapshot version to load.
+        :returns: A shadows.Netbox object, or None if no snapshot of the
+                  requested version is cached.
+
+        """
+        snapshot = self.get(netbox_id)
+        if snapshot and snapshot.version == version:
+            return pickle.loads(snapshot.data)
+
+
+netbox_snapshots = NetboxSnapshotCache()
+
+
+def load_netbox_from_cache_or_db(netbox_id, version=None):
+    """Loads a single Netbox, preferably from the snapshot cache.
+
+    Falls back to loading the Netbox from the database in a thread if no
+    snapshot of the requested version is cached.
+
+    :param version: The snapshot version to load. If None, the Netbox is
+                    always loaded from the database, as there is no way to
+                    tell whether a cached snapshot is current.
+    :returns: A deferred whose result is a nav.ipdevpoll.shadows.netbox.Netbox
+              object.
+
+    """
+    if version is not None:
+        netbox = netbox_snapshots.load(netbox_id, version)
+        if netbox is not None:
+            return succeed(netbox)
+    _logger.debug("no cached snapshot (version %s) of netbox %s, loading "
+                  "from database", version, netbox_id)
+    return run_in_thread(load_netbox, netbox_id)
+
+
 class NetboxLoader(dict):
     """Loads netboxes from the database, synchronously or asynchronously.
 
@@ -125,10 +198,13 @@ class NetboxLoader(dict):
         # update self
         for i in lost_ids:
             del self[i]
+            netbox_snapshots.pop(i, None)
         for i in new_ids:
             self[i] = netbox_dict[i]
         for i in same_ids:
             self[i].copy(netbox_dict[i])
+        for i in current_ids:
+            netbox_snapshots.store(self[i])
 
         self.peak_count = max(self.peak_count, len(self))
 
@@ -0,0 +1,180 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Fingerprints of previously collected record sets.
+
+Collectors of large, mostly static record sets, such as forwarding tables
+and ARP caches, need to compare what they collected with the open records in
+the database.  Loading every open record on every run is mostly work that
+confirms that nothing changed.
+
+Instead, a collector can split its collected records into groups (such as
+one group per switch port), and keep a compact digest of each group in
+NetboxInfo.  On the next run, only the database records of the groups whose
+digest changed need to be loaded and compared.
+
+Since the digests are only as good as the assumption that the database
+still reflects the previous run, a full comparison is made every once in a
+while anyway.
+
+"""
+import hashlib
+import json
+import time
+
+from django.db import transaction
+
+from nav.models import manage
+from nav.util import parse_interval
+from nav.ipdevpoll.config import ipdevpoll_conf
+
+INFO_KEY_NAME = 'fingerprints'
+DEFAULT_RESYNC_INTERVAL = '6h'
+
+
+class Fingerprints(object):
+    """A set of digests of grouped records, as collected at some point in
+    time.
+
+    """
+    def __init__(self, digests, synced=None):
+        """
+        :param digests: A dict of {group_key: digest}.
+        :param synced: The time of the last full comparison of these groups
+                       against the database, as a Unix timestamp.
+
+        """
+        self.digests = digests
+        self.synced = synced if synced is not None else time.time()
+
+    def __repr__(self):
+        return "<Fingerprints groups=%d synced=%s>" % (len(self.digests),
+                                                       self.synced)
+
+    @classmethod
+    def from_groups(cls, groups, synced=None):
+        """Makes fingerprints from a dict of {group_key: records}.
+
+        Group keys are converted to strings. Records are converted to
+        strings before being digested, so their string representations
+        should be stable.
+
+        """
+        digests = dict((str(key), get_digest(records))
+                       for key, records in groups.items())
+        return cls(digests, synced)
+
+    @classmethod
+    def from_json(cls, value):
+        """Deserializes fingerprints, returning None if value isn't valid"""
+        try:
+            data = json.loads(value)
+            return cls(dict(data['digests']), float(data['synced']))
+        except (ValueError, TypeError, KeyError):
+            return None
+
+    def to_json(self):
+        """Serializes these fingerprints"""
+        return json.dumps({'synced': self.synced, 'digests': self.digests},
+                          sort_keys=True)
+
+    def get_changed_groups(self, previous):
+        """Returns the keys of groups whose digests differ from a set of
+        previous fingerprints, including groups found in only one of them.
+
+        """
+        keys = set(self.digests).union(previous.digests)
+        return set(key for key in keys
+                   if self.digests.get(key) != previous.digests.get(key))
+
+    def is_stale(self, max_age=None):
+        """Returns True if the last full comparison is older than max_age
+        seconds.
+
+        """
+        if max_age is None:
+            max_age = get_resync_interval()
+        return time.time() - self.synced > max_age
+
+
+def get_digest(records):
+    """Returns a short digest of an unordered collection of records"""
+    digest = hashlib.md5()
+    for record in sorted(str(record) for record in records):
+        digest.update(record.encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()[:16]
+
+
+def diff_groups(groups, previous):
+    """Fingerprints groups of collected records and compares them to the
+    previous fingerprints.
+
+    :param groups: A dict of {group_key: records}.
+    :param previous: The previous Fingerprints, or None.
+    :returns: A tuple (fingerprints, changed), where fingerprints are the new
+              fingerprints to store, and changed is the set of (string) group
+              keys whose database records need to be compared, or None if
+              all records need to be compared.
+
+    """
+    if previous is None or previous.is_stale():
+        return Fingerprints.from_groups(groups), None
+    current = Fingerprints.from_groups(groups, previous.synced)
+    return current, current.get_changed_groups(previous)
+
+
+def is_incremental_enabled():
+    """Returns True if ipdevpoll is configured to diff collected records
+    incrementally.
+
+    """
+    return ipdevpoll_conf.getboolean('ipdevpoll', 'incremental_diffing',
+                                     fallback=False)
+
+
+def get_resync_interval():
+    """Returns the configured maximum number of seconds between full
+    comparisons of collected records against the database.
+
+    """
+    return parse_interval(ipdevpoll_conf.get(
+        'ipdevpoll', 'incremental_resync_interval',
+        fallback=DEFAULT_RESYNC_INTERVAL))
+
+
+def load_fingerprints(netbox_id, variable):
+    """Synchronously loads stored fingerprints for a netbox.
+
+    :returns: A Fingerprints instance, or None if no valid fingerprints were
+              stored.
+
+    """
+    value = manage.NetboxInfo.objects.filter(
+        netbox__id=netbox_id, key=INFO_KEY_NAME, variable=variable,
+    ).values_list('value', flat=True).first()
+    if value is not None:
+        return Fingerprints.from_json(value)
+
+
+def save_fingerprints(netbox_id, variable, fingerprints):
+    """Synchronously stores the fingerprints of a netbox"""
+    with transaction.atomic():
+        manage.NetboxInfo.objects.filter(
+            netbox__id=netbox_id, key=INFO_KEY_NAME, variable=variable,
+        ).delete()
+        manage.NetboxInfo.objects.create(
+            netbox_id=netbox_id, key=INFO_KEY_NAME, variable=variable,
+            value=fingerprints.to_json())
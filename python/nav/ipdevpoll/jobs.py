@@ -39,6 +39,7 @@ from .utils import log_unhandled_failure
 from .snmp.common import snmp_parameter_factory
 
 _logger = logging.getLogger(__name__)
+SLOWEST_SAVES_TO_LOG = 5
 ports = cycle([snmpprotocol.port() for i in range(50)])
 
 
@@ -80,9 +81,11 @@ class JobHandler(object):
     _timing_logger = ContextLogger(suffix='timings')
     _start_time = datetime.datetime.min
 
-    def __init__(self, name, netbox, plugins=None, interval=None):
+    def __init__(self, name, netbox, plugins=None, interval=None,
+                 netbox_version=None):
         self.name = name
         self.netbox_id = netbox
+        self.netbox_version = netbox_version
         self.netbox = None
         self.cancelled = threading.Event()
         self.interval = interval
@@ -237,8 +240,8 @@ class JobHandler(object):
                   plugins ran).
 
         """
-        self.netbox = yield db.run_in_thread(dataloader.load_netbox,
-                                             self.netbox_id)
+        self.netbox = yield dataloader.load_netbox_from_cache_or_db(
+            self.netbox_id, self.netbox_version)
         self._log_context.update(dict(job=self.name,
                                       sysname=self.netbox.sysname))
         self._logger.debug("Job %r started with plugins: %r",
@@ -337,6 +340,7 @@ class JobHandler(object):
     def _reset_timers(self):
         self._start_time = datetime.datetime.now()
         self._plugin_times = []
+        self._save_times = []
 
     def _start_plugin_timer(self, plugin):
         now = datetime.datetime.now()
@@ -355,10 +359,15 @@ class JobHandler(object):
         times = [(plugin, stop-start)
                  for (plugin, start, stop) in self._plugin_times]
         plugin_total = sum((i[1] for i in times), datetime.timedelta(0))
+        save_total = sum((i[1] for i in self._save_times),
+                         datetime.timedelta(0))
+        save_mode = ("bulk" if storage.is_bulk_storage_enabled()
+                     else "per-object")
 
         times.append(("Plugin total", plugin_total))
+        times.append(("Save total (%s)" % save_mode, save_total))
         times.append(("Job total", job_total))
-        times.append(("Job overhead", job_total - plugin_total))
+        times.append(("Job overhead", job_total - plugin_total - save_total))
 
         log_text = []
         longest_label = max(len(i[0]) for i in times)
@@ -368,7 +377,7 @@ class JobHandler(object):
             log_text.append(format % (plugin, delta))
 
         dashes = "-" * max(len(i) for i in log_text)
-        log_text.insert(-3, dashes)
+        log_text.insert(-4, dashes)
         log_text.insert(-2, dashes)
 
         log_text.insert(0, "Job %r timings for %s:" %
@@ -439,12 +448,17 @@ class JobHandler(object):
 
             for manager in self.storage_queue:
                 self._raise_if_cancelled()
+                manager_start = datetime.datetime.now()
                 manager.save()
+                self._save_times.append(
+                    (manager.cls.__name__,
+                     datetime.datetime.now() - manager_start))
 
             end_time = time.time()
             total_time = (end_time - start_time) * 1000.0
 
             self._log_containers("containers after save")
+            self._log_save_timings()
 
             return total_time
         except AbortedJobError:
@@ -459,6 +473,16 @@ class JobHandler(object):
                                    django.db.connection.queries[-1])
             raise
 
+    def _log_save_timings(self):
+        """Logs the save time of the slowest container classes"""
+        if not self._timing_logger.isEnabledFor(logging.DEBUG):
+            return
+        slowest = sorted(self._save_times, key=lambda i: i[1], reverse=True)
+        self._timing_logger.debug(
+            "Job %r save timings for %s: %s", self.name, self.netbox.sysname,
+            ", ".join("%s=%s" % (name, delta)
+                      for name, delta in slowest[:SLOWEST_SAVES_TO_LOG]))
+
     def _log_containers(self, prefix=None):
         log = self._queue_logger
         if not log.isEnabledFor(logging.DEBUG):
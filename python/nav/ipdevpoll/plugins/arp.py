@@ -33,6 +33,11 @@ CISCO-IETF-IP-MIB       -- based on an early draft of the revised IP-MIB
 Although the ARP protocol is only related to IPv4, this plugin keeps
 the name for historical reasons.
 
+If incremental diffing is enabled in ipdevpoll.conf, collected mappings are
+grouped by address block (/24 for IPv4, /64 for IPv6), and a digest of each
+group is stored in NetboxInfo.  Only the open ARP records of address blocks
+whose digest changed since the previous run are loaded from the database.
+
 """
 
 import operator
@@ -46,15 +51,19 @@ from nav.mibs.ipv6_mib import Ipv6Mib
 from nav.mibs.cisco_ietf_ip_mib import CiscoIetfIpMib
 
 from nav.models import manage
+from nav.prefixindex import PrefixIndex
 from nav.ipdevpoll import Plugin, db
-from nav.ipdevpoll import storage, shadows
+from nav.ipdevpoll import storage, shadows, fingerprints
 
 INCOMPLETE_MAC = '00:00:00:00:00:00'
+FINGERPRINT_VARIABLE = 'arp'
+# The prefix lengths of the address blocks mappings are grouped by
+BLOCK_PREFIX_LENGTH = {4: 24, 6: 64}
 
 
 class Arp(Plugin):
     """Collects ARP records for IPv4 devices and NDP cache for IPv6 devices."""
-    prefix_cache = []  # prefix cache, should be sorted by descending mask length
+    prefix_cache = PrefixIndex()  # maps prefixes to prefix ids
     prefix_cache_update_time = datetime.min
     prefix_cache_max_age = timedelta(minutes=5)
 
@@ -113,8 +122,15 @@ class Arp(Plugin):
         if stripped:
             self._logger.debug("stripped %d incomplete mappings", stripped)
 
+        blocks = None
+        if fingerprints.is_incremental_enabled():
+            blocks = yield self._find_changed_blocks(found_mappings)
+        if blocks is not None:
+            found_mappings = set((ip, mac) for ip, mac in found_mappings
+                                 if ip and get_address_block(ip) in blocks)
+
         # Get open mappings from database to compare with
-        open_mappings = yield self._load_existing_mappings()
+        open_mappings = yield self._load_existing_mappings(blocks)
 
         new_mappings = found_mappings.difference(open_mappings)
         expireable_mappings = set(open_mappings).difference(found_mappings)
@@ -128,17 +144,66 @@ class Arp(Plugin):
                                  for mapping in expireable_mappings)
 
     @defer.inlineCallbacks
-    def _load_existing_mappings(self):
+    def _find_changed_blocks(self, mappings):
+        """Compares the fingerprints of the mappings found in each address
+        block to those of the previous run, and adds the new fingerprints to
+        the container repository.
+
+        Returns:
+
+          A deferred whose result is the set of address blocks whose mappings
+          have changed, or None if all mappings should be compared.
+        """
+        groups = {}
+        for ip, mac in mappings:
+            if not ip:
+                continue
+            groups.setdefault(get_address_block(ip), []).append(
+                "%s %s" % (ip.strCompressed(), mac))
+        previous = yield db.run_in_thread(
+            fingerprints.load_fingerprints, self.netbox.id,
+            FINGERPRINT_VARIABLE)
+        current, changed = fingerprints.diff_groups(groups, previous)
+        self._save_fingerprints(current)
+        if changed is not None:
+            self._logger.debug("%d of %d address blocks changed since last "
+                               "run", len(changed), len(groups))
+        defer.returnValue(changed)
+
+    def _save_fingerprints(self, current):
+        info = self.containers.factory(
+            (fingerprints.INFO_KEY_NAME, FINGERPRINT_VARIABLE),
+            shadows.NetboxInfo)
+        info.netbox = self.containers.factory(None, shadows.Netbox)
+        info.key = fingerprints.INFO_KEY_NAME
+        info.variable = FINGERPRINT_VARIABLE
+        info.value = current.to_json()
+
+    @defer.inlineCallbacks
+    def _load_existing_mappings(self, blocks=None):
         """Load the existing ARP records for this box from the db.
 
+        Arguments:
+
+          blocks -- An optional set of address blocks to limit the loaded
+                    records to.
+
         Returns:
 
           A deferred whose result is a dictionary: { (ip, mac): arpid }
         """
+        if blocks is not None and not blocks:
+            defer.returnValue({})
+
         self._logger.debug("Loading open arp records from database")
         open_arp_records_queryset = manage.Arp.objects.filter(
             netbox__id=self.netbox.id,
-            end_time__gte=datetime.max).values('id', 'ip', 'mac')
+            end_time__gte=datetime.max)
+        if blocks is not None:
+            open_arp_records_queryset = open_arp_records_queryset.extra(
+                where=["arp.ip << ANY(%s::inet[])"], params=[sorted(blocks)])
+        open_arp_records_queryset = open_arp_records_queryset.values(
+            'id', 'ip', 'mac')
         open_arp_records = yield db.run_in_thread(
             storage.shadowify_queryset_and_commit,
             open_arp_records_queryset)
@@ -165,11 +230,10 @@ class Arp(Plugin):
         cls._logger.debug(
             "Populating prefix cache with %d prefixes", len(prefixes))
 
-        prefixes = [(IP(p['net_address']), p['id']) for p in prefixes]
-        prefixes.sort(key=operator.itemgetter(1), reverse=True)
-
-        del cls.prefix_cache[:]
-        cls.prefix_cache.extend(prefixes)
+        # For duplicate prefixes, the one with the highest id is kept
+        prefixes = sorted(prefixes, key=operator.itemgetter('id'))
+        cls.prefix_cache = PrefixIndex(
+            (p['net_address'], p['id']) for p in prefixes)
 
     def _make_new_mappings(self, mappings):
         """Convert a sequence of (ip, mac) tuples into a Arp shadow containers.
@@ -217,9 +281,7 @@ class Arp(Plugin):
 
           An integer prefix ID, or None if no matches were found.
         """
-        for prefix_addr, prefix_id in self.prefix_cache:
-            if ip in prefix_addr:
-                return prefix_id
+        return self.prefix_cache.lookup(ip)
 
 
 def ipv6_address_in_mappings(mappings):
@@ -232,3 +294,11 @@ def ipv6_address_in_mappings(mappings):
         if ip and ip.version() == 6:
             return True
     return False
+
+
+def get_address_block(ip):
+    """Returns the address block that an IP address is grouped by, as a
+    string.
+
+    """
+    return ip.make_net(BLOCK_PREFIX_LENGTH[ip.version()]).strCompressed()
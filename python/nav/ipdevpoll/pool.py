@@ -18,18 +18,23 @@ from __future__ import print_function
 
 import datetime
 import os
+import resource
 import sys
 import logging
+from collections import deque, namedtuple
 
 from twisted.protocols import amp
 from twisted.internet import reactor, protocol
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import Deferred, inlineCallbacks, returnValue
+from twisted.python.failure import Failure
 from twisted.internet.endpoints import ProcessEndpoint, StandardIOEndpoint
 import twisted.internet.endpoints
 
 from django.utils import six
 
-from . import control, jobs
+from . import control, jobs, dataloader, config
+
+PAGE_SIZE = resource.getpagesize()
 
 
 def initialize_worker():
@@ -54,6 +59,26 @@ class Shutdown(amp.Command):
     response = []
 
 
+class UpdateNetbox(amp.Command):
+    """Represent a netbox snapshot for sending to workers"""
+    arguments = [
+        (b'netbox', amp.Integer()),
+        (b'version', amp.Integer()),
+        (b'snapshot', amp.String()),
+    ]
+    response = []
+    requiresAnswer = False
+
+
+class ForgetNetbox(amp.Command):
+    """Represent a netbox removal notice for sending to workers"""
+    arguments = [
+        (b'netbox', amp.Integer()),
+    ]
+    response = []
+    requiresAnswer = False
+
+
 class Job(amp.Command):
     """Represent a job for sending to a worker"""
     arguments = [
@@ -63,6 +88,9 @@ class Job(amp.Command):
         (b'interval', amp.Integer()),  # Needs to be included in database record.
                                        # Not used for scheduling
         (b'serial', amp.Integer()),  # Serial number needed for cancelling
+        # Snapshot version of the netbox to run the job for, if one has been
+        # sent to the worker:
+        (b'netbox_version', amp.Integer(optional=True)),
     ]
     response = [(b'result', amp.Boolean()),
                 (b'reschedule', amp.Integer())]
@@ -89,7 +117,8 @@ class JobHandler(amp.CommandLocator):
         return result
 
     @Job.responder
-    def execute_job(self, netbox, job, plugins, interval, serial):
+    def execute_job(self, netbox, job, plugins, interval, serial,
+                    netbox_version=None):
         self._logger.debug("Process {pid} received job {job} for"
                            " netbox {netbox}"
                            " with plugins {plugins}".format(
@@ -97,7 +126,7 @@ class JobHandler(amp.CommandLocator):
                                job=job,
                                netbox=netbox,
                                plugins=",".join(plugins)),)
-        job = jobs.JobHandler(job, netbox, plugins, interval)
+        job = jobs.JobHandler(job, netbox, plugins, interval, netbox_version)
         self.jobs[serial] = job
         deferred = job.run()
         deferred.addBoth(self.job_done, serial)
@@ -110,6 +139,17 @@ class JobHandler(amp.CommandLocator):
         deferred.addErrback(handle_reschedule)
         return deferred
 
+    @UpdateNetbox.responder
+    def update_netbox(self, netbox, version, snapshot):
+        dataloader.netbox_snapshots[netbox] = dataloader.NetboxSnapshot(
+            version, snapshot)
+        return {}
+
+    @ForgetNetbox.responder
+    def forget_netbox(self, netbox):
+        dataloader.netbox_snapshots.pop(netbox, None)
+        return {}
+
     @Cancel.responder
     def cancel(self, serial):
         if serial in self.jobs:
@@ -119,6 +159,8 @@ class JobHandler(amp.CommandLocator):
     @Shutdown.responder
     def shutdown(self):
         self.done = True
+        if not self.jobs:
+            reactor.callLater(3, reactor.stop)
         return {}
 
     def log_jobs(self):
@@ -138,6 +180,7 @@ class ProcessAMP(amp.AMP):
         super(ProcessAMP, self).__init__(**kwargs)
         self.is_worker = is_worker
         self.lost_handler = None
+        self.connection_lost = False
 
     def makeConnection(self, transport):
         if not hasattr(transport, 'getPeer'):
@@ -147,6 +190,7 @@ class ProcessAMP(amp.AMP):
         super(ProcessAMP, self).makeConnection(transport)
 
     def connectionLost(self, reason):
+        self.connection_lost = True
         super(ProcessAMP, self).connectionLost(reason)
         if self.is_worker:
             if reactor.running:
@@ -166,8 +210,11 @@ class InlinePool(object):
             del self.active_jobs[deferred]
         return result
 
-    def execute_job(self, job, netbox, plugins=None, interval=None):
+    def execute_job(self, job, netbox, plugins=None, interval=None,
+                    on_start=None):
         job = jobs.JobHandler(job, netbox, plugins, interval)
+        if on_start:
+            on_start()
         deferred = job.run()
         self.active_jobs[deferred] = job
         deferred.addBoth(self.job_done, deferred)
@@ -177,6 +224,25 @@ class InlinePool(object):
         if deferred in self.active_jobs:
             self.active_jobs[deferred].cancel()
 
+    def forget_netboxes(self, netbox_ids):
+        """Jobs run in this process load their netboxes from the database,
+        so there's nothing to forget"""
+        pass
+
+    def set_cost_estimator(self, estimator):
+        """Jobs run in this process aren't placed, so costs are ignored"""
+        pass
+
+
+# A job waiting in a worker's queue. deferred is the deferred returned to
+# the caller of WorkerPool.execute_job, on_start is an optional function to
+# call when the job is sent to a worker.
+PendingJob = namedtuple('PendingJob', 'deferred command kwargs cost on_start')
+
+
+def _default_cost(_job, _netbox):
+    return 1.0
+
 
 class Worker(object):
     """This class holds information about one worker process as seen from
@@ -192,17 +258,28 @@ class Worker(object):
         self.threadpoolsize = threadpoolsize
         self.max_jobs = max_jobs
         self.started_at = None
+        # {netbox_id: snapshot version} of the snapshots sent to this worker
+        self.netbox_versions = {}
+        # Estimated cost of the jobs currently running in this worker
+        self.load = 0.0
+        self.queue = deque()
+        self.queued_cost = 0.0
+        self.retiring = False
+        self.memory_baseline = None
 
     def __repr__(self):
         return (
             "<Worker pid={pid} ready={ready} active={active} max={max} "
-            "total={total} started_at={started_at}>"
+            "total={total} load={load:.1f} queued={queued} "
+            "started_at={started_at}>"
         ).format(
             pid=self.pid,
             ready=not self.done(),
             active=self.active_jobs,
             max=self.max_concurrent_jobs,
             total=self.total_jobs,
+            load=self.load,
+            queued=len(self.queue),
             started_at=self.started_at,
         )
 
@@ -232,7 +309,71 @@ class Worker(object):
         return getattr(self, '_pid', None)
 
     def done(self):
-        return self.max_jobs and (self.total_jobs >= self.max_jobs)
+        return self.retiring or (
+            self.max_jobs and (self.total_jobs >= self.max_jobs))
+
+    def has_capacity(self, cost, max_load):
+        """Returns True if a job of the given cost can start in this worker
+        without exceeding max_load.
+
+        A worker with no running jobs always has capacity.
+
+        """
+        return (not max_load or not self.load or
+                self.load + cost <= max_load)
+
+    def get_expected_load(self):
+        """Returns the estimated cost of all running and queued jobs"""
+        return self.load + self.queued_cost
+
+    def enqueue(self, job):
+        self.queue.append(job)
+        self.queued_cost += job.cost
+
+    def dequeue(self):
+        job = self.queue.popleft()
+        self.queued_cost = max(0.0, self.queued_cost - job.cost)
+        return job
+
+    def unqueue(self, deferred):
+        """Removes the queued job whose result is deferred.
+
+        :returns: The removed PendingJob, or None if it wasn't queued here.
+
+        """
+        for job in self.queue:
+            if job.deferred is deferred:
+                self.queue.remove(job)
+                self.queued_cost = max(0.0, self.queued_cost - job.cost)
+                return job
+
+    def get_memory_usage(self):
+        """Returns the resident memory size of this worker, in bytes, or None
+        if it cannot be determined.
+
+        """
+        try:
+            with open('/proc/%d/statm' % self.pid) as statm:
+                return int(statm.read().split()[1]) * PAGE_SIZE
+        except (IOError, OSError, ValueError, IndexError, TypeError):
+            return None
+
+    def get_memory_growth(self):
+        """Returns the growth in resident memory size (in bytes) since this
+        worker completed its first job, or None if it cannot be determined.
+
+        """
+        usage = self.get_memory_usage()
+        if usage is None:
+            return None
+        if self.memory_baseline is None:
+            self.memory_baseline = usage
+        return usage - self.memory_baseline
+
+    def retire(self):
+        """Tells this worker to exit once its running jobs are done"""
+        self.retiring = True
+        self.process.callRemote(Shutdown)
 
     def _worker_died(self, process, reason):
         if not self.done():
@@ -256,6 +397,34 @@ class Worker(object):
     def cancel(self, serial):
         return self.process.callRemote(Cancel, serial=serial)
 
+    def push_netbox(self, netbox_id):
+        """Ensures this worker has the latest snapshot of a netbox.
+
+        If there is no snapshot that can be sent to the worker, the worker is
+        told to forget any older snapshot it has, so that it will load the
+        netbox from the database instead of running the job on stale data.
+
+        :returns: The snapshot version the worker has, or None if there is no
+                  snapshot the worker can use.
+
+        """
+        snapshot = dataloader.netbox_snapshots.get(netbox_id)
+        if not snapshot or len(snapshot.data) > amp.MAX_VALUE_LENGTH:
+            self.forget_netboxes([netbox_id])
+            return None
+        if self.netbox_versions.get(netbox_id) != snapshot.version:
+            self.process.callRemote(UpdateNetbox, netbox=netbox_id,
+                                    version=snapshot.version,
+                                    snapshot=snapshot.data)
+            self.netbox_versions[netbox_id] = snapshot.version
+        return snapshot.version
+
+    def forget_netboxes(self, netbox_ids):
+        """Tells this worker to drop its snapshots of the given netboxes"""
+        for netbox_id in netbox_ids:
+            if self.netbox_versions.pop(netbox_id, None) is not None:
+                self.process.callRemote(ForgetNetbox, netbox=netbox_id)
+
 
 class WorkerPool(object):
     """This class represent a pool of worker processes to which jobs can
@@ -269,15 +438,33 @@ class WorkerPool(object):
         self.target_count = workers
         self.max_jobs = max_jobs
         self.threadpoolsize = threadpoolsize
+        self.max_worker_load = config.ipdevpoll_conf.getfloat(
+            'multiprocess', 'max_worker_load')
+        self.max_memory_growth = config.ipdevpoll_conf.getint(
+            'multiprocess', 'max_worker_memory_growth') * 1024 * 1024
+        self.estimate_cost = _default_cost
+        self.steal_count = 0
+        self.recycle_count = 0
         for i in range(self.target_count):
             self._spawn_worker()
         self.serial = 0
         self.jobs = dict()
 
+    def set_cost_estimator(self, estimator):
+        """Sets the function used to estimate job costs for job placement.
+
+        :param estimator: A callable that takes a job name and a netbox id
+                          as arguments, and returns the expected run time of
+                          that job, in seconds.
+
+        """
+        self.estimate_cost = estimator
+
     def worker_died(self, worker):
         self.workers.remove(worker)
         if not worker.done():
             self._spawn_worker()
+        self._requeue(worker)
 
     @inlineCallbacks
     def _spawn_worker(self):
@@ -285,33 +472,130 @@ class WorkerPool(object):
         self.workers.add(worker)
 
     def _cleanup(self, result, deferred):
-        serial, worker = self.jobs[deferred]
+        serial, worker, cost = self.jobs[deferred]
         del self.jobs[deferred]
         worker.active_jobs -= 1
+        worker.load = max(0.0, worker.load - cost)
+        self._check_memory_growth(worker)
+        self._run_queued_jobs(worker)
         return result
 
-    def _execute(self, command, **kwargs):
+    def _execute(self, command, cost=1.0, on_start=None, **kwargs):
+        job = PendingJob(Deferred(), command, kwargs, cost, on_start)
+        self._place(job)
+        return job.deferred
+
+    def _place(self, job):
+        """Starts a job in the least loaded worker that has capacity for it,
+        or queues it in the worker with the least expected load.
+
+        """
         ready_workers = [w for w in self.workers if not w.done()]
         if not ready_workers:
             raise RuntimeError("No ready workers")
-        worker = min(ready_workers, key=lambda x: x.active_jobs)
+        available = [w for w in ready_workers
+                     if w.has_capacity(job.cost, self.max_worker_load)]
+        if available:
+            worker = min(available, key=lambda x: x.load)
+            self._dispatch(worker, job)
+        else:
+            worker = min(ready_workers, key=lambda x: x.get_expected_load())
+            worker.enqueue(job)
+
+    def _dispatch(self, worker, job):
+        kwargs = job.kwargs
+        if job.command is Job:
+            kwargs['netbox_version'] = worker.push_netbox(kwargs['netbox'])
         self.serial += 1
-        deferred = worker.execute(self.serial, command, **kwargs)
+        worker.load += job.cost
+        deferred = worker.execute(self.serial, job.command, **kwargs)
         if worker.done():
             self._spawn_worker()
-        self.jobs[deferred] = (self.serial, worker)
-        deferred.addBoth(self._cleanup, deferred)
-        return deferred
+        self.jobs[job.deferred] = (self.serial, worker, job.cost)
+        if job.on_start:
+            job.on_start()
+        deferred.addBoth(self._cleanup, job.deferred)
+        deferred.chainDeferred(job.deferred)
+
+    def _run_queued_jobs(self, worker):
+        """Starts as many queued jobs in worker as its capacity allows,
+        stealing jobs from other workers' queues when its own is empty.
+
+        """
+        if worker.process.connection_lost:
+            return
+        while not worker.done():
+            victim = worker if worker.queue else self._find_steal_victim(worker)
+            if not victim:
+                return
+            if not worker.has_capacity(victim.queue[0].cost,
+                                       self.max_worker_load):
+                return
+            job = victim.dequeue()
+            if victim is not worker:
+                self.steal_count += 1
+                self._logger.debug("Worker %s stole job from worker %s",
+                                   worker.pid, victim.pid)
+            self._dispatch(worker, job)
+
+    def _find_steal_victim(self, worker):
+        victims = [w for w in self.workers if w is not worker and w.queue]
+        if victims:
+            return max(victims, key=lambda x: x.queued_cost)
+
+    def _requeue(self, worker):
+        """Places the queued jobs of a worker that can no longer run them"""
+        while worker.queue:
+            job = worker.dequeue()
+            try:
+                self._place(job)
+            except Exception:
+                job.deferred.errback(Failure())
+
+    def _check_memory_growth(self, worker):
+        if (not self.max_memory_growth or worker.done() or
+                worker.process.connection_lost):
+            return
+        growth = worker.get_memory_growth()
+        if growth is not None and growth > self.max_memory_growth:
+            self._logger.info("Recycling worker %s, which has grown by %d "
+                              "MiB", worker.pid, growth // (1024 * 1024))
+            self.recycle_count += 1
+            worker.retire()
+            self._spawn_worker()
+            self._requeue(worker)
 
     def cancel(self, deferred):
+        for worker in self.workers:
+            job = worker.unqueue(deferred)
+            if job:
+                job.deferred.errback(
+                    jobs.AbortedJobError("Job cancelled before it started"))
+                return
         if deferred not in self.jobs:
             self._logger.debug("Cancelling job that isn't known")
             return
-        serial, worker = self.jobs[deferred]
+        serial, worker, _cost = self.jobs[deferred]
         return worker.cancel(serial)
 
-    def execute_job(self, job, netbox, plugins=None, interval=None):
-        deferred = self._execute(Job, job=job, netbox=netbox,
+    def forget_netboxes(self, netbox_ids):
+        """Tells all workers to drop their snapshots of the given netboxes"""
+        for worker in self.workers:
+            worker.forget_netboxes(netbox_ids)
+
+    def execute_job(self, job, netbox, plugins=None, interval=None,
+                    on_start=None):
+        """Runs a job for a netbox in one of the workers.
+
+        :param on_start: A function to call when the job is sent to a worker,
+                         which may be some time after this call if the
+                         workers are busy.
+        :returns: A deferred whose result is the job's result.
+
+        """
+        deferred = self._execute(Job, cost=self.estimate_cost(job, netbox),
+                                 on_start=on_start,
+                                 job=job, netbox=netbox,
                                  plugins=plugins, interval=interval)
 
         def handle_reschedule(result):
@@ -324,10 +608,37 @@ class WorkerPool(object):
         deferred.addCallback(lambda x: x['result'])
         return deferred
 
+    def get_stats(self):
+        """Returns a dict of pool-level statistics"""
+        return {
+            'workers': [
+                {
+                    'pid': worker.pid,
+                    'active_jobs': worker.active_jobs,
+                    'total_jobs': worker.total_jobs,
+                    'load': worker.load,
+                    'queued_jobs': len(worker.queue),
+                    'queued_cost': worker.queued_cost,
+                    'memory': worker.get_memory_usage(),
+                    'retiring': worker.retiring,
+                }
+                for worker in self.workers
+            ],
+            'queue_length': sum(len(worker.queue) for worker in self.workers),
+            'steal_count': self.steal_count,
+            'recycle_count': self.recycle_count,
+        }
+
     def log_summary(self):
-        self._logger.info("{active} out of {target} workers running".format(
-            active=len(self.workers),
-            target=self.target_count))
+        stats = self.get_stats()
+        self._logger.info("{active} out of {target} workers running, "
+                          "{queued} jobs queued, {steals} jobs stolen, "
+                          "{recycled} workers recycled".format(
+                              active=len(self.workers),
+                              target=self.target_count,
+                              queued=stats['queue_length'],
+                              steals=stats['steal_count'],
+                              recycled=stats['recycle_count']))
         for worker in self.workers:
             self._logger.info(" - %r", worker)
 
@@ -17,10 +17,12 @@
 
 import logging
 import datetime
+import heapq
 import time
+import itertools
 from operator import itemgetter
 from collections import defaultdict
-from random import randint
+from random import randint, uniform
 from math import ceil
 
 from twisted.python.failure import Failure
@@ -35,7 +37,8 @@ from nav import ipdevpoll
 from nav.ipdevpoll import db
 from nav.ipdevpoll.snmp import SnmpError, AgentProxy
 from nav.metrics.carbon import send_metrics
-from nav.metrics.templates import metric_prefix_for_ipdevpoll_job
+from nav.metrics.templates import (metric_prefix_for_ipdevpoll_job,
+                                   metric_path_for_ipdevpoll_lateness)
 from nav.tableformat import SimpleTableFormatter
 
 from nav.ipdevpoll.utils import log_unhandled_failure
@@ -46,6 +49,13 @@ from .jobs import JobHandler, AbortedJobError, SuggestedReschedule
 
 _logger = logging.getLogger(__name__)
 
+SCHEDULERS = ('classic', 'deadline')
+# Upper bounds (in seconds) of the job lateness histogram buckets
+LATENESS_BUCKETS = (0, 1, 5, 15, 60, 300, 900, 3600)
+DEFAULT_JOB_COST = 10.0  # seconds
+COST_SMOOTHING = 0.3
+COST_HISTORY = datetime.timedelta(days=1)
+
 
 class NetboxJobScheduler(object):
     """Netbox job schedule handler.
@@ -59,6 +69,8 @@ class NetboxJobScheduler(object):
     global_job_queue = []
     global_intensity = config.ipdevpoll_conf.getint('ipdevpoll',
                                                     'max_concurrent_jobs')
+    deadline_queue = None
+    lateness = defaultdict(lambda: LatenessHistogram())
     _logger = ipdevpoll.ContextLogger()
 
     def __init__(self, job, netbox, pool):
@@ -72,9 +84,14 @@ class NetboxJobScheduler(object):
         self._deferred = Deferred()
         self._next_call = None
         self._last_job_started_at = 0
+        self._worker_started_at = None
         self.running = False
         self._start_time = None
         self._current_job = None
+        self._due = None
+        self._cost = None
+        self.queued = False
+        self.admitted_cost = 0.0
         self.callLater = reactor.callLater
 
     def get_current_runtime(self):
@@ -83,9 +100,33 @@ class NetboxJobScheduler(object):
 
     def start(self):
         """Start polling schedule."""
-        self._next_call = self.callLater(0, self.run_job)
+        delay = 0
+        if self.deadline_queue is not None:
+            delay = self._get_initial_delay()
+        self._due = time.time() + delay
+        self._next_call = self.callLater(delay, self.run_job)
         return self._deferred
 
+    def _get_initial_delay(self):
+        """Returns the number of seconds until the first run of this job.
+
+        A job that isn't yet overdue according to its last logged run is
+        delayed until it is due. Overdue jobs are randomly spread across the
+        job interval (up to a configured maximum), so that a restarted
+        ipdevpoll doesn't try to run every job at once.
+
+        """
+        last_updated = self.netbox.last_updated.get(self.job.name)
+        if last_updated:
+            next_run = last_updated + datetime.timedelta(
+                seconds=self.job.interval)
+            delay = (next_run - datetime.datetime.now()).total_seconds()
+            if delay > 0:
+                return delay
+        max_jitter = config.ipdevpoll_conf.getint('ipdevpoll',
+                                                  'max_start_jitter')
+        return uniform(0, min(self.job.interval, max_jitter))
+
     def cancel(self):
         """Cancel scheduling of this job for this box.
 
@@ -116,12 +157,17 @@ class NetboxJobScheduler(object):
             self.pool.cancel(self._current_job)
 
     def run_job(self, dummy=None):
-        if self.is_running():
+        if self.is_running() or self.queued:
             self._logger.info("Previous %r job is still running for %s, "
                               "not running again now.",
                               self.job.name, self.netbox.sysname)
             return
 
+        if self.deadline_queue is not None:
+            self._cost = None  # pick up the latest cost estimate
+            self.deadline_queue.push(self)
+            return
+
         if self.is_job_limit_reached():
             self._logger.debug("intensity limit reached for %s - waiting to "
                                "run for %s", self.job.name, self.netbox.sysname)
@@ -135,14 +181,23 @@ class NetboxJobScheduler(object):
             return
 
         # We're ok to start a polling run.
+        self.execute_job()
+
+    def execute_job(self):
+        """Dispatches this job to the worker pool, regardless of limits"""
+        self._record_lateness()
         try:
             self._start_time = datetime.datetime.now()
+            self._worker_started_at = None
             deferred = self.pool.execute_job(self.job.name, self.netbox.id,
                                              plugins=self.job.plugins,
-                                             interval=self.job.interval)
+                                             interval=self.job.interval,
+                                             on_start=self._job_started)
             self._current_job = deferred
         except Exception:
             self._log_unhandled_error(Failure())
+            if self.deadline_queue is not None:
+                self.deadline_queue.refund(self)
             self.reschedule(60)
             return
 
@@ -156,6 +211,33 @@ class NetboxJobScheduler(object):
 
         deferred.addCallback(self._unregister_handler)
 
+    def _job_started(self):
+        """Notes the time the job was sent to a worker"""
+        self._worker_started_at = time.time()
+
+    def _record_lateness(self):
+        if self._due is None:
+            return
+        lateness = max(0, time.time() - self._due)
+        bucket = self.lateness[self.job.name].add(lateness)
+        _COUNTERS.increment(
+            metric_path_for_ipdevpoll_lateness(self.job.name, bucket))
+        _COUNTERS.start()
+
+    def get_estimated_cost(self):
+        """Returns the estimated run time of this job, in seconds"""
+        if self._cost is None:
+            self._cost = JobCostEstimator.instance.get(self.job.name,
+                                                       self.netbox.id)
+        return self._cost
+
+    def get_latest_start(self):
+        """Returns the latest time this job can start and still be expected
+        to finish before its next run is due.
+
+        """
+        return self._due + self.job.interval - self.get_estimated_cost()
+
     def is_running(self):
         return self.running
 
@@ -239,6 +321,7 @@ class NetboxJobScheduler(object):
         self._logger.debug("Next %r job for %s will be in %d seconds (%s)",
                            self.job.name, self.netbox.sysname, delay, next_time)
 
+        self._due = time.time() + delay
         if self._next_call.active():
             self._next_call.reset(delay)
         else:
@@ -254,8 +337,17 @@ class NetboxJobScheduler(object):
         """Remove a JobHandler from internal data structures."""
         if self.running:
             self.uncount_job()
-            self.unqueue_next_job()
-            self.unqueue_next_global_job()
+            # The cost of a job does not include time spent waiting in a
+            # worker queue, and is unknown if the job never left the queue
+            if self._worker_started_at is not None:
+                JobCostEstimator.instance.update(
+                    self.job.name, self.netbox.id,
+                    time.time() - self._worker_started_at)
+            if self.deadline_queue is not None:
+                self.deadline_queue.release(self)
+            else:
+                self.unqueue_next_job()
+                self.unqueue_next_global_job()
         return result
 
     def count_job(self):
@@ -315,6 +407,211 @@ class NetboxJobScheduler(object):
             self.job_queues[self.job.name] = []
         return self.job_queues[self.job.name]
 
+    @classmethod
+    def enable_deadline_scheduling(cls):
+        """Switches all job scheduling to a global deadline queue"""
+        if cls.deadline_queue is None:
+            max_cost = config.ipdevpoll_conf.getfloat('ipdevpoll',
+                                                      'max_concurrent_cost')
+            cls.deadline_queue = DeadlineQueue(max_cost)
+
+
+class DeadlineQueue(object):
+    """A global priority queue of due jobs, waiting for admission to the
+    worker pool.
+
+    Jobs are ordered by their slack, i.e. by the latest time they can be
+    started and still be expected to finish before their next run is due,
+    using the measured cost (run time) of each job. Jobs are admitted as
+    long as the global and per-job concurrency limits allow, and as long as
+    the estimated total cost of the running jobs stays within max_cost
+    seconds (unless max_cost is 0).
+
+    """
+    def __init__(self, max_cost=0):
+        self.max_cost = max_cost
+        self.running_cost = 0.0
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, scheduler):
+        """Queues a due job and admits as many queued jobs as possible"""
+        scheduler.queued = True
+        heapq.heappush(self._heap, (scheduler.get_latest_start(),
+                                    next(self._counter), scheduler))
+        self.dispatch()
+
+    def release(self, scheduler):
+        """Releases the resources of a finished job and admits as many queued
+        jobs as possible.
+
+        """
+        self.refund(scheduler)
+        self.dispatch()
+
+    def refund(self, scheduler):
+        """Returns the cost admitted for a job to the budget, without
+        admitting any queued jobs.
+
+        """
+        self.running_cost = max(0.0,
+                                self.running_cost - scheduler.admitted_cost)
+        scheduler.admitted_cost = 0.0
+
+    def dispatch(self):
+        """Admits queued jobs, in order of slack, until a limit is reached"""
+        deferred = []
+        while self._heap and not NetboxJobScheduler.is_global_limit_reached():
+            entry = self._heap[0]
+            scheduler = entry[-1]
+            if scheduler.cancelled:
+                heapq.heappop(self._heap)
+                continue
+            if scheduler.is_job_limit_reached():
+                deferred.append(heapq.heappop(self._heap))
+                continue
+            cost = scheduler.get_estimated_cost()
+            if self._is_over_budget(cost):
+                break
+            heapq.heappop(self._heap)
+            self._admit(scheduler, cost)
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+
+    def _is_over_budget(self, cost):
+        return (self.max_cost > 0 and self.running_cost > 0 and
+                self.running_cost + cost > self.max_cost)
+
+    def _admit(self, scheduler, cost):
+        scheduler.queued = False
+        scheduler.admitted_cost = cost
+        self.running_cost += cost
+        scheduler.execute_job()
+
+
+class JobCostEstimator(object):
+    """Estimates the cost (run time) of jobs for individual netboxes.
+
+    Estimates are seeded from the recent durations logged in the
+    ipdevpoll_job_log table, and refined as jobs finish.
+
+    """
+    instance = None
+
+    def __init__(self):
+        self._costs = {}
+        self._job_costs = {}
+
+    def get(self, job_name, netbox_id):
+        """Returns the estimated cost of a job for a netbox, in seconds"""
+        cost = self._costs.get((job_name, netbox_id))
+        if cost is None:
+            cost = self._job_costs.get(job_name, DEFAULT_JOB_COST)
+        return cost
+
+    def update(self, job_name, netbox_id, runtime):
+        """Updates the cost estimate of a job from a measured run time"""
+        key = (job_name, netbox_id)
+        current = self._costs.get(key)
+        if current is None:
+            self._costs[key] = runtime
+        else:
+            self._costs[key] = (COST_SMOOTHING * runtime +
+                                (1 - COST_SMOOTHING) * current)
+
+    def set_costs(self, costs):
+        """Replaces all cost estimates.
+
+        :param costs: A dict of {(job_name, netbox_id): seconds}.
+
+        """
+        self._costs = dict(costs)
+        totals = defaultdict(list)
+        for (job_name, _netbox_id), cost in iteritems(self._costs):
+            totals[job_name].append(cost)
+        self._job_costs = dict((job_name, sum(costs) / len(costs))
+                               for job_name, costs in iteritems(totals))
+
+    def load(self):
+        """Asynchronously loads cost estimates from the job log"""
+        deferred = db.run_in_thread(load_job_costs)
+        deferred.addCallback(self.set_costs)
+        deferred.addErrback(self._log_load_failure)
+        return deferred
+
+    @staticmethod
+    def _log_load_failure(failure):
+        log_unhandled_failure(_logger, failure,
+                              "Could not load job costs from job log")
+
+
+JobCostEstimator.instance = JobCostEstimator()
+
+
+def load_job_costs(since=None):
+    """Loads the mean duration of recent successful jobs from the job log.
+
+    :returns: A dict of {(job_name, netbox_id): seconds}.
+
+    """
+    from nav.models.manage import IpdevpollJobLog
+    from django.db.models import Avg
+
+    if since is None:
+        since = datetime.datetime.now() - COST_HISTORY
+    logs = IpdevpollJobLog.objects.filter(
+        end_time__gte=since, success=True, duration__isnull=False,
+    ).values('job_name', 'netbox').annotate(cost=Avg('duration'))
+    return dict(((log['job_name'], log['netbox']), log['cost'])
+                for log in logs)
+
+
+class LatenessHistogram(object):
+    """A histogram of how late jobs started, compared to when they were due"""
+    def __init__(self, buckets=LATENESS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, lateness):
+        """Adds a lateness observation, in seconds.
+
+        :returns: The label of the bucket the observation was counted in.
+
+        """
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if lateness <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.total += lateness
+        self.max = max(self.max, lateness)
+        return self.get_labels()[index]
+
+    def get_labels(self):
+        """Returns the bucket labels, in bucket order"""
+        return ["le_%d" % bound for bound in self.buckets] + ["inf"]
+
+    def items(self):
+        """Returns a list of (label, count) tuples, in bucket order"""
+        return list(zip(self.get_labels(), self.counts))
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def __str__(self):
+        return "n=%d mean=%.1fs max=%.1fs %s" % (
+            self.count, self.mean, self.max,
+            " ".join("%s:%d" % item for item in self.items()))
+
 
 class JobScheduler(object):
     active_schedulers = set()
@@ -335,6 +632,16 @@ class JobScheduler(object):
 
     @classmethod
     def initialize_from_config_and_run(cls, pool, onlyjob=None):
+        JobCostEstimator.instance.load()
+        pool.set_cost_estimator(JobCostEstimator.instance.get)
+        scheduler = config.ipdevpoll_conf.get('ipdevpoll', 'scheduler')
+        if scheduler == 'deadline':
+            cls._logger.info("using deadline-based job scheduling")
+            NetboxJobScheduler.enable_deadline_scheduling()
+        elif scheduler not in SCHEDULERS:
+            cls._logger.warning("unknown scheduler %r, using classic",
+                                scheduler)
+
         descriptors = config.get_jobs()
         schedulers = [JobScheduler(d, pool) for d in descriptors
                       if not onlyjob or (d.name == onlyjob)]
@@ -402,6 +709,8 @@ class JobScheduler(object):
         # Deschedule removed and changed boxes
         for netbox_id in removed_ids.union(changed_ids):
             self.cancel_netbox_scheduler(netbox_id)
+        if removed_ids:
+            self.pool.forget_netboxes(removed_ids)
 
         # Schedule new and changed boxes
         def _lastupdated(netboxid):
@@ -462,6 +771,20 @@ class JobScheduler(object):
                         "no active jobs (%d JobHandlers)",
                         JobHandler.get_instance_count())
 
+        queue = NetboxJobScheduler.deadline_queue
+        if queue is not None:
+            _logger.log(level, "%d jobs waiting in deadline queue, "
+                        "%.1f seconds of estimated job cost running",
+                        len(queue), queue.running_cost)
+
+    @classmethod
+    def log_lateness(cls, level=logging.DEBUG):
+        """Logs the job start lateness histograms"""
+        _logger = logging.getLogger("%s.lateness" % __name__)
+        lateness = NetboxJobScheduler.lateness
+        for job_name in sorted(lateness):
+            _logger.log(level, "%s: %s", job_name, lateness[job_name])
+
 
 class CounterFlusher(defaultdict):
     """
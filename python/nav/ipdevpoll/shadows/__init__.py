@@ -601,6 +601,12 @@ class SwPortVlan(Shadow):
 class Arp(Shadow):
     __shadowclass__ = manage.Arp
 
+    @classmethod
+    def supports_bulk_save(cls):
+        # save() only skips the lookup of existing records, which is done for
+        # all records at once by bulk saves
+        return True
+
     def save(self, containers):
         if not self.id:
             return super(Arp, self).save(containers)
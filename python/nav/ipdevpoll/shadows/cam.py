@@ -42,6 +42,12 @@ grace period of MAX_MISS_COUNT collector runs.  If a "closed" cam record is
 found again within MAX_MISS_COUNT collector runs, the existing record can be
 reclaimed by resetting end_time to infinity.
 
+If incremental diffing is enabled in ipdevpoll.conf, a digest of the MAC
+addresses found on each port is stored in NetboxInfo after each run.  Only the
+open records of ports whose digest changed since the previous run are loaded
+and compared, along with any records still in their grace period.  Every
+other port is assumed to be unchanged.
+
 """
 import datetime
 import logging
@@ -52,11 +58,14 @@ from django.db import transaction
 
 from nav.models import manage
 from nav.models.fields import INFINITY
-from nav.ipdevpoll.storage import DefaultManager
+from nav.ipdevpoll.storage import (DefaultManager, update_in_bulk,
+                                   BULK_BATCH_SIZE)
+from nav.ipdevpoll import fingerprints
 from .netbox import Netbox
 from .interface import Interface
 
 MAX_MISS_COUNT = 3
+FINGERPRINT_VARIABLE = 'cam'
 
 
 Cam = namedtuple('Cam', 'ifindex mac')
@@ -74,13 +83,18 @@ class CamManager(DefaultManager):
     _missing = None
     _new = None
     _ifnames = None
+    _fingerprints = None
+    _changed_ports = None
 
     def __init__(self, *args, **kwargs):
         super(CamManager, self).__init__(*args, **kwargs)
         self.netbox = self.containers.get(None, Netbox)
+        self.incremental = fingerprints.is_incremental_enabled()
 
     def prepare(self):
         self._remove_sentinel()
+        if self.incremental:
+            self._find_changed_ports()
         self._load_open_records()
         self._map_found_to_open()
         self._log_stats()
@@ -89,16 +103,52 @@ class CamManager(DefaultManager):
         if Cam.sentinel in self.containers[Cam]:
             del self.containers[Cam][Cam.sentinel]
 
+    def _find_changed_ports(self):
+        """Compares the fingerprints of the MAC addresses found on each port
+        to those of the previous run, to find which ports need their open
+        records compared.
+
+        """
+        ports = {}
+        for cam in self.get_managed():
+            ports.setdefault(cam.ifindex, []).append(cam.mac)
+        previous = fingerprints.load_fingerprints(self.netbox.id,
+                                                  FINGERPRINT_VARIABLE)
+        self._fingerprints, changed = fingerprints.diff_groups(ports,
+                                                               previous)
+        if changed is not None:
+            self._changed_ports = set(int(key) for key in changed
+                                      if key.isdigit())
+            # Records without an ifindex are always compared, as they cannot
+            # be told apart by their port fingerprints
+            self._changed_ports.add(None)
+            self._logger.debug("%d of %d ports changed since last run",
+                               len(self._changed_ports), len(ports))
+
     def _load_open_records(self):
         match_open = Q(end_time__gte=INFINITY) | Q(miss_count__gte=0)
         camlist = manage.Cam.objects.filter(netbox__id=self.netbox.id)
-        camlist = camlist.filter(match_open).values_list(
+        camlist = camlist.filter(match_open)
+        if self._changed_ports is not None:
+            in_grace_period = Q(end_time__lt=INFINITY, miss_count__gte=0)
+            ifindexes = [ifindex for ifindex in self._changed_ports
+                         if ifindex is not None]
+            camlist = camlist.filter(Q(ifindex__in=ifindexes) |
+                                     Q(ifindex__isnull=True) |
+                                     in_grace_period)
+        camlist = camlist.values_list(
             'ifindex', 'mac', 'id', 'end_time', 'miss_count')
         self._previously_open = dict((Cam(*cam[0:2]), CamDetails(*cam[2:]))
                                      for cam in camlist)
 
     def _map_found_to_open(self):
         self._now_open = set(self.get_managed())
+        if self._changed_ports is not None:
+            # Records on unchanged ports are known to be open already
+            self._now_open = set(
+                cam for cam in self._now_open
+                if cam.ifindex in self._changed_ports
+                or cam in self._previously_open)
         self._new = self._now_open.difference(self._previously_open)
 
         missing = set(self._previously_open).difference(self._now_open)
@@ -119,6 +169,20 @@ class CamManager(DefaultManager):
 
     @transaction.atomic()
     def save(self):
+        if self.bulk:
+            self._create_new_in_bulk()
+        else:
+            self._create_new()
+
+        # reclaim recently closed records
+        keepers = (self._previously_open[cam] for cam in self._keepers)
+        reclaim = [cam.id for cam in keepers if cam.end_time < INFINITY]
+        if reclaim:
+            self._logger.debug("reclaiming %r", reclaim)
+            manage.Cam.objects.filter(id__in=reclaim).update(
+                end_time=INFINITY, miss_count=0)
+
+    def _create_new(self):
         # Reuse the same object over and over in an attempt to avoid the
         # overhead of Python object creation
         record = manage.Cam(
@@ -131,13 +195,15 @@ class CamManager(DefaultManager):
             record.mac = cam.mac
             record.save()
 
-        # reclaim recently closed records
-        keepers = (self._previously_open[cam] for cam in self._keepers)
-        reclaim = [cam.id for cam in keepers if cam.end_time < INFINITY]
-        if reclaim:
-            self._logger.debug("reclaiming %r", reclaim)
-            manage.Cam.objects.filter(id__in=reclaim).update(
-                end_time=INFINITY, miss_count=0)
+    def _create_new_in_bulk(self):
+        start_time = datetime.datetime.now()
+        records = [
+            manage.Cam(netbox_id=self.netbox.id, sysname=self.netbox.sysname,
+                       start_time=start_time, end_time=INFINITY,
+                       port=self._get_port_for(cam.ifindex),
+                       ifindex=cam.ifindex, mac=cam.mac)
+            for cam in self._new]
+        manage.Cam.objects.bulk_create(records, batch_size=BULK_BATCH_SIZE)
 
     def _get_port_for(self, ifindex):
         """Gets a port name from an ifindex, either from newly collected or
@@ -162,23 +228,49 @@ class CamManager(DefaultManager):
         return self._ifnames.get(ifindex, '')
 
     def cleanup(self):
-        for cam_detail in self._missing:
-            self._close_missing(cam_detail)
+        if self.bulk:
+            self._close_missing_in_bulk()
+        else:
+            for cam_detail in self._missing:
+                self._close_missing(cam_detail)
+        if self._fingerprints is not None:
+            # Only stored once all changes are made, so that a failed run
+            # causes a new comparison of the affected ports on the next run
+            fingerprints.save_fingerprints(self.netbox.id,
+                                           FINGERPRINT_VARIABLE,
+                                           self._fingerprints)
+
+    @transaction.atomic()
+    def _close_missing_in_bulk(self):
+        now = datetime.datetime.now()
+        updates = [(cam_detail.id, self._get_closing_update(cam_detail, now))
+                   for cam_detail in self._missing]
+        self._logger.debug("closing %d records", len(updates))
+        update_in_bulk(manage.Cam, [(pkey, upd) for pkey, upd in updates
+                                    if upd])
 
     @classmethod
     def _close_missing(cls, cam_detail):
-        upd = {}
         cls._logger.debug("closing %r", cam_detail)
+        upd = cls._get_closing_update(cam_detail, datetime.datetime.now())
+        if upd:
+            manage.Cam.objects.filter(id=cam_detail.id).update(**upd)
+
+    @staticmethod
+    def _get_closing_update(cam_detail, now):
+        """Returns a dict of the attributes to update to close a missing
+        cam record.
+
+        """
+        upd = {}
         if cam_detail.end_time >= INFINITY:
-            upd['end_time'] = datetime.datetime.now()
+            upd['end_time'] = now
 
         if cam_detail.miss_count >= 0:
             miss_count = cam_detail.miss_count + 1
             upd['miss_count'] = (miss_count if miss_count < MAX_MISS_COUNT
                                  else None)
-
-        if upd:
-            manage.Cam.objects.filter(id=cam_detail.id).update(**upd)
+        return upd
 
     @classmethod
     def add_sentinel(cls, containers):
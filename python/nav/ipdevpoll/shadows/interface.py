@@ -263,6 +263,13 @@ class Interface(Shadow):
     manager = InterfaceManager
     ifoperstatus_change = None
 
+    @classmethod
+    def supports_bulk_save(cls):
+        # get_existing_model() only differs from the default implementation
+        # in that it won't look up existing objects by anything but the
+        # primary key, as InterfaceManager has already set existing models.
+        return True
+
     def is_linkstate_changed(self):
         return bool(self.ifoperstatus_change)
 
@@ -0,0 +1,251 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Multi-column GETBULK table retrieval.
+
+Instead of walking one table column after another, a BulkTableRetriever
+walks several columns at once, by putting one varbind per column into each
+GETBULK request, and keeps a number of such requests in flight
+concurrently.
+
+How many repetitions to ask for in each request is tuned per agent: The
+number is reduced when requests time out, and limited to the number of
+varbinds an agent has been observed to fit into a response.  The tuning is
+kept for the lifetime of the process, so that the next job polling the same
+agent starts out with what was learned by the previous one.
+
+"""
+import logging
+
+from twisted.internet.defer import Deferred
+from twisted.internet.error import TimeoutError
+
+from nav.oids import OID
+
+_logger = logging.getLogger(__name__)
+
+# Number of times the repetition count may be reduced during a single table
+# retrieval before giving up on timeouts or empty responses
+MAX_BACKOFFS = 3
+
+_agent_tunings = {}
+
+
+class AgentTuning(object):
+    """Learned GETBULK parameters for a single SNMP agent"""
+
+    def __init__(self, max_repetitions):
+        self.configured = max_repetitions
+        self.max_repetitions = max_repetitions
+        # The largest number of varbinds the agent has been seen to fit into
+        # a single response, if it has been seen to truncate any
+        self.max_varbinds = None
+
+    def __repr__(self):
+        return "<AgentTuning max_repetitions=%s max_varbinds=%s>" % (
+            self.max_repetitions, self.max_varbinds)
+
+    def get_repetitions(self, column_count):
+        """Returns the number of repetitions to request for a number of
+        columns.
+
+        """
+        repetitions = self.max_repetitions
+        if self.max_varbinds:
+            repetitions = min(repetitions, self.max_varbinds // column_count)
+        return max(1, repetitions)
+
+    def back_off(self, repetitions):
+        """Halves the number of repetitions, after a request for this many
+        repetitions timed out.
+
+        """
+        self.max_repetitions = max(1, min(self.max_repetitions,
+                                          repetitions // 2))
+
+    def recover(self):
+        """Cautiously increases the number of repetitions towards the
+        configured value, after a retrieval completed without timeouts.
+
+        """
+        if self.max_repetitions < self.configured:
+            self.max_repetitions += 1
+
+    def truncated(self, varbind_count):
+        """Records that the agent truncated a response to varbind_count
+        varbinds.
+
+        """
+        self.max_varbinds = max(1, varbind_count)
+
+
+def get_agent_tuning(agent, max_repetitions):
+    """Returns the AgentTuning of an agent, creating one if needed"""
+    key = (str(agent.ip), getattr(agent, 'port', None))
+    tuning = _agent_tunings.get(key)
+    if tuning is None or tuning.configured != max_repetitions:
+        tuning = _agent_tunings[key] = AgentTuning(max_repetitions)
+    return tuning
+
+
+class _Column(object):
+    """The retrieval status of a single table column"""
+    def __init__(self, oid):
+        self.start_oid = oid
+        self.prefix = tuple(OID(oid))
+        self.last = self.prefix
+        self.result = []
+        self.finished = False
+        self.busy = False
+
+    def add(self, oid, value):
+        """Adds a response varbind to this column, or marks this column as
+        finished if the varbind is outside of it.
+
+        """
+        oid = tuple(oid)
+        if oid[:len(self.prefix)] == self.prefix and oid > self.last:
+            self.result.append((oid, value))
+            self.last = oid
+        else:
+            self.finished = True
+
+
+class BulkTableRetriever(object):
+    """Retrieves a set of table columns using multi-varbind GETBULK
+    requests.
+
+    The result is a dict like the one returned by AgentProxy.getTable():
+    {column_oid: {oid_string: value}}, where each column_oid is the OID as
+    given to the constructor.
+
+    """
+    def __init__(self, agent, oids, tuning, max_columns=10, max_in_flight=1):
+        """
+        :param agent: The AgentProxy to issue GETBULK requests through.
+        :param oids: A list of column OIDs to retrieve.
+        :param tuning: The AgentTuning of the agent.
+        :param max_columns: The maximum number of columns to retrieve in a
+                            single request.
+        :param max_in_flight: The maximum number of concurrent requests.
+
+        """
+        self.agent = agent
+        self.columns = [_Column(oid) for oid in oids]
+        self.tuning = tuning
+        self.max_columns = max(1, max_columns)
+        self.max_in_flight = max(1, max_in_flight)
+        self.in_flight = 0
+        self.backoffs = 0
+        self.deferred = None
+
+    def retrieve(self):
+        """Starts the retrieval.
+
+        :returns: A deferred whose result is the retrieved table columns.
+
+        """
+        self.deferred = Deferred()
+        self._request_more()
+        return self.deferred
+
+    def _request_more(self):
+        while self.in_flight < self.max_in_flight:
+            if self.deferred.called:
+                return
+            idle = [c for c in self.columns if not c.finished and not c.busy]
+            if not idle:
+                break
+            self._request(idle[:self.max_columns])
+
+        if not self.in_flight and not self.deferred.called:
+            if not self.backoffs:
+                self.tuning.recover()
+            self.deferred.callback(self._get_result())
+
+    def _request(self, chunk):
+        repetitions = self.tuning.get_repetitions(len(chunk))
+        for column in chunk:
+            column.busy = True
+        self.in_flight += 1
+        deferred = self.agent._getbulk(0, repetitions,
+                                       [column.last for column in chunk])
+        deferred.addCallbacks(self._handle_response, self._handle_failure,
+                              callbackArgs=(chunk, repetitions),
+                              errbackArgs=(chunk, repetitions))
+        deferred.addErrback(self._fail)
+
+    def _release(self, chunk):
+        self.in_flight -= 1
+        for column in chunk:
+            column.busy = False
+
+    def _handle_response(self, varbinds, chunk, repetitions):
+        self._release(chunk)
+        if self.deferred.called:
+            return
+
+        if not varbinds:
+            # Agents answer with endOfMibView rather than nothing at all, so
+            # this is most likely a tooBig error, which pynetsnmp hides
+            if self._can_back_off(chunk, repetitions):
+                self.tuning.truncated(repetitions * len(chunk) // 2)
+                return self._request_more()
+            for column in chunk:
+                column.finished = True
+            return self._request_more()
+
+        count = len(chunk)
+        for index, (oid, value) in enumerate(varbinds):
+            column = chunk[index % count]
+            if not column.finished:
+                column.add(oid, value)
+
+        if len(varbinds) < repetitions * count and not any(
+                column.finished for column in chunk):
+            self.tuning.truncated(len(varbinds))
+        self._request_more()
+
+    def _handle_failure(self, failure, chunk, repetitions):
+        self._release(chunk)
+        if self.deferred.called:
+            return
+        failure.trap(TimeoutError)
+        if self._can_back_off(chunk, repetitions):
+            _logger.debug("%r timed out requesting %d repetitions, backing "
+                          "off", self.agent, repetitions)
+            self.tuning.back_off(repetitions)
+            return self._request_more()
+        return failure
+
+    def _can_back_off(self, chunk, repetitions):
+        if self.backoffs >= MAX_BACKOFFS:
+            return False
+        if repetitions <= 1 and len(chunk) <= 1:
+            return False
+        self.backoffs += 1
+        if repetitions <= 1:
+            self.max_columns = max(1, len(chunk) // 2)
+        return True
+
+    def _fail(self, failure):
+        if not self.deferred.called:
+            self.deferred.errback(failure)
+
+    def _get_result(self):
+        return dict(
+            (column.start_oid,
+             dict((str(OID(oid)), value) for oid, value in column.result))
+            for column in self.columns)
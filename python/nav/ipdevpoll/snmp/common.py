@@ -19,33 +19,108 @@ import logging
 from functools import wraps
 from collections import namedtuple
 
+from django.utils import six
 from twisted.internet import reactor
-from twisted.internet.defer import succeed
+from twisted.internet.defer import (Deferred, succeed, inlineCallbacks,
+                                    returnValue)
 from twisted.internet.task import deferLater
 
+from nav.oids import OID
+from .bulk import BulkTableRetriever, get_agent_tuning
+
 _logger = logging.getLogger(__name__)
 
 
 def cache_for_session(func):
-    """Decorator for AgentProxyMixIn.getTable to cache responses"""
-    def _wrapper(*args, **kwargs):
-        self, oids = args[0], args[1]
+    """Decorator for AgentProxyMixIn.getTable to cache responses.
+
+    Every walked subtree is cached for the lifetime of the AgentProxy, which
+    normally means for the duration of a single job.  A request for an OID
+    that lies within an already walked subtree is served from the cache,
+    while a request for an OID within a subtree that is currently being
+    walked waits for that walk to complete, instead of walking the same
+    subtree again.
+
+    """
+    def _wrapper(self, oids, *args, **kwargs):
         cache = getattr(self, '_result_cache')
-        key = tuple(oids)
-        if key not in cache:
-            df = func(*args, **kwargs)
-            if df:
-                df.addCallback(_cache_result, cache, key)
-            return df
-        else:
-            return succeed(cache[key])
+        pending = getattr(self, '_pending_tables')
+        subtrees = []
+        to_fetch = []
+        for oid in oids:
+            key = tuple(OID(oid))
+            prefix = _find_prefix(cache, key)
+            if prefix is not None:
+                subtrees.append((oid, succeed(cache[prefix])))
+                continue
+            prefix = _find_prefix(pending, key)
+            if prefix is not None:
+                waiter = Deferred()
+                pending[prefix].append(waiter)
+                subtrees.append((oid, waiter))
+                continue
+            pending[key] = []
+            waiter = Deferred()
+            pending[key].append(waiter)
+            subtrees.append((oid, waiter))
+            to_fetch.append(oid)
+
+        if to_fetch:
+            df = func(self, to_fetch, *args, **kwargs)
+            df.addCallbacks(_cache_subtrees, _fail_pending,
+                            callbackArgs=(to_fetch, cache, pending),
+                            errbackArgs=(to_fetch, pending))
+        return _collect_subtrees(subtrees)
 
     return wraps(func)(_wrapper)
 
 
-def _cache_result(result, cache, key):
-    cache[key] = result
-    return result
+def _find_prefix(subtrees, key):
+    """Returns the key of subtrees that equals or is a prefix of key"""
+    for length in range(len(key), 0, -1):
+        if key[:length] in subtrees:
+            return key[:length]
+
+
+def _cache_subtrees(result, oids, cache, pending):
+    for oid in oids:
+        key = tuple(OID(oid))
+        subtree = result.get(oid, {})
+        cache[key] = subtree
+        for waiter in pending.pop(key, []):
+            waiter.callback(subtree)
+
+
+def _fail_pending(failure, oids, pending):
+    for oid in oids:
+        for waiter in pending.pop(tuple(OID(oid)), []):
+            waiter.errback(failure)
+
+
+@inlineCallbacks
+def _collect_subtrees(subtrees):
+    """Builds a getTable result from a list of (oid, deferred subtree)"""
+    result = {}
+    try:
+        for oid, deferred in subtrees:
+            subtree = yield deferred
+            result[oid] = _narrow_subtree(subtree, oid)
+    except Exception:
+        for _oid, deferred in subtrees:
+            deferred.addErrback(lambda failure: None)
+        raise
+    returnValue(result)
+
+
+def _narrow_subtree(subtree, oid):
+    """Returns a copy of the part of a walked subtree that lies below oid"""
+    prefix = str(OID(oid)) + '.'
+    return dict((key, value) for key, value in subtree.items()
+                if _as_oid_str(key).startswith(prefix))
+
+
+def _as_oid_str(oid):
+    return oid if isinstance(oid, six.string_types) else str(OID(oid))
 
 
 def throttled(func):
@@ -88,6 +163,7 @@ class AgentProxyMixIn(object):
         else:
             self.snmp_parameters = SNMP_DEFAULTS
         self._result_cache = {}
+        self._pending_tables = {}
         self._last_request = 0
         self.throttle_delay = self.snmp_parameters.throttle_delay
 
@@ -107,9 +183,25 @@ class AgentProxyMixIn(object):
     # hey, we're mimicking someone else's API here, never mind the bollocks:
     # pylint: disable=C0111,C0103
     @cache_for_session
-    def getTable(self, *args, **kwargs):
+    def getTable(self, oids, **kwargs):
+        if self.snmp_parameters.bulk_columns > 1 and self.supports_getbulk():
+            tuning = get_agent_tuning(self,
+                                      self.snmp_parameters.max_repetitions)
+            retriever = BulkTableRetriever(
+                self, oids, tuning,
+                max_columns=self.snmp_parameters.bulk_columns,
+                max_in_flight=self.snmp_parameters.max_in_flight)
+            return retriever.retrieve()
         kwargs['maxRepetitions'] = self.snmp_parameters.max_repetitions
-        return super(AgentProxyMixIn, self).getTable(*args, **kwargs)
+        return super(AgentProxyMixIn, self).getTable(oids, **kwargs)
+
+    def supports_getbulk(self):
+        """Returns True if this agent is queried using an SNMP version that
+        supports GETBULK requests.
+
+        """
+        version = str(getattr(self, 'snmpVersion', '1')).lstrip('v')
+        return version != '1'
 
     # hey, we're mimicking someone else's API here, never mind the bollocks:
     # pylint: disable=C0111,C0103
@@ -132,10 +224,13 @@ class AgentProxyMixIn(object):
 
 # pylint: disable=C0103
 SNMPParameters = namedtuple('SNMPParameters',
-                            'timeout max_repetitions throttle_delay')
+                            'timeout max_repetitions throttle_delay '
+                            'bulk_columns max_in_flight')
+SNMPParameters.__new__.__defaults__ = (1, 1)
 
 SNMP_DEFAULTS = SNMPParameters(timeout=1.5, max_repetitions=50,
-                               throttle_delay=0)
+                               throttle_delay=0, bulk_columns=1,
+                               max_in_flight=1)
 
 
 # pylint: disable=W0212
@@ -155,6 +250,8 @@ def snmp_parameter_factory(host=None):
             ('max-repetitions', config.getint),
             ('timeout', config.getfloat),
             ('throttle-delay', config.getfloat),
+            ('bulk-columns', config.getint),
+            ('max-in-flight', config.getint),
     ]:
         if config.has_option(section, var):
             key = var.replace('-', '_')
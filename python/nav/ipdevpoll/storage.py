@@ -14,13 +14,19 @@
 # License along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
 """Storage layer for ipdevpoll"""
+import time
+from collections import defaultdict
 
 import django.db.models
-from django.db import transaction
+from django.db import transaction, connection
 from django.utils import six
 
 from nav import toposort
 from nav import ipdevpoll
+from nav.ipdevpoll.config import ipdevpoll_conf
+
+# The maximum number of rows to insert in a single bulk INSERT statement
+BULK_BATCH_SIZE = 1000
 
 
 class MetaShadow(type):
@@ -76,6 +82,7 @@ class DefaultManager(object):
         """
         self.cls = cls
         self.containers = containers
+        self.bulk = is_bulk_storage_enabled()
 
     def prepare(self):
         """Prepares managed shadows in containers"""
@@ -83,8 +90,210 @@ class DefaultManager(object):
 
     def save(self):
         """Saves managed shadows in containers"""
-        for obj in self.get_managed():
-            obj.save(self.containers)
+        if self.bulk and self.cls.supports_bulk_save():
+            self.save_in_bulk()
+        else:
+            for obj in self.get_managed():
+                obj.save(self.containers)
+
+    @transaction.atomic()
+    def save_in_bulk(self):
+        """Saves managed shadows in containers using set-based operations.
+
+        Existing database rows are resolved for all managed shadows at once,
+        using one query per lookup key, instead of one query per shadow.
+        Deletions and updates are merged into as few statements as possible,
+        while new rows are created using multi-row INSERT statements.
+
+        """
+        managed = list(self.get_managed())
+        if not managed:
+            return
+        start_time = time.time()
+        existing = self.resolve_existing_models(managed)
+
+        deletes, updates, creates = [], [], []
+        for obj in managed:
+            model = existing.get(obj)
+            if obj.delete and model:
+                deletes.append(model.pk)
+            elif model:
+                updates.append(obj)
+            else:
+                creates.append(obj)
+
+        model_cls = self.cls.__shadowclass__
+        if deletes:
+            model_cls.objects.filter(pk__in=deletes).delete()
+        updated = self._update_in_bulk(updates)
+        created = self._create_in_bulk(creates)
+
+        self._logger.debug(
+            "bulk saved %d %s containers in %.3f s: created=%d updated=%d "
+            "unchanged=%d deleted=%d", len(managed), self.cls.__name__,
+            time.time() - start_time, created, updated,
+            len(updates) - updated, len(deletes))
+
+    def resolve_existing_models(self, shadows):
+        """Finds the existing database rows represented by a list of shadows.
+
+        The lookup order of Shadow.get_existing_model() is retained: Shadows
+        are first looked up by primary key, then by each of the shadow class'
+        __lookups__ in turn, but each lookup is only a single query for all
+        the shadows.  Shadows that cannot be resolved unambiguously this way
+        are passed to their own get_existing_model() method.
+
+        :returns: A dict mapping shadows to Django model objects. Shadows not
+                  represented in the database are not present in the result.
+
+        """
+        result = {}
+        unresolved = []
+        for obj in shadows:
+            cached = getattr(obj, '_cached_existing_model', None)
+            if cached:
+                result[obj] = cached
+            else:
+                unresolved.append(obj)
+
+        pkey = self.cls._meta.pk
+        by_pk = [obj for obj in unresolved if obj.get_primary_key()]
+        unresolved = [obj for obj in unresolved if not obj.get_primary_key()]
+        fallbacks = [obj for obj in by_pk
+                     if isinstance(obj.get_primary_key(), Shadow)]
+        by_pk = [obj for obj in by_pk if obj not in fallbacks]
+        if by_pk:
+            rows = self.cls.__shadowclass__.objects.in_bulk(
+                [obj.get_primary_key() for obj in by_pk])
+            for obj in by_pk:
+                model = rows.get(_normalize(pkey, obj.get_primary_key()))
+                if model:
+                    obj.set_existing_model(model)
+                    result[obj] = model
+                else:
+                    fallbacks.append(obj)
+
+        for lookup in self.cls.__lookups__:
+            if not unresolved:
+                break
+            matched, unresolved, ambiguous = self._resolve_by_lookup(
+                lookup, unresolved)
+            for obj, model in matched:
+                obj.set_existing_model(model)
+                result[obj] = model
+            fallbacks.extend(ambiguous)
+
+        for obj in fallbacks:
+            model = obj.get_existing_model(self.containers)
+            if model:
+                result[obj] = model
+
+        return result
+
+    def _resolve_by_lookup(self, lookup, shadows):
+        """Resolves existing rows for shadows using a single lookup key.
+
+        :returns: A tuple of (matched, unmatched, ambiguous), where matched is
+                  a list of (shadow, model) tuples, unmatched is a list of
+                  shadows that weren't found using this lookup, and ambiguous
+                  is a list of shadows that matched multiple rows.
+
+        """
+        fields = [self.cls._meta.get_field(name)
+                  for name in (lookup if isinstance(lookup, tuple)
+                               else (lookup,))]
+        keyed = []
+        unmatched = []
+        for obj in shadows:
+            key = tuple(self._get_lookup_value(obj, field) for field in fields)
+            if not isinstance(lookup, tuple) and key[0] is None:
+                unmatched.append(obj)
+            else:
+                keyed.append((key, obj))
+        if not keyed:
+            return [], unmatched, []
+
+        query = django.db.models.Q()
+        for index, field in enumerate(fields):
+            values = set(key[index] for key, _obj in keyed)
+            match = django.db.models.Q(
+                **{field.attname + '__in': values - set([None])})
+            if None in values:
+                match |= django.db.models.Q(**{field.attname + '__isnull': True})
+            query &= match
+
+        rows = defaultdict(list)
+        for model in self.cls.__shadowclass__.objects.filter(query):
+            key = tuple(_normalize(field, getattr(model, field.attname))
+                        for field in fields)
+            rows[key].append(model)
+
+        matched, ambiguous = [], []
+        for key, obj in keyed:
+            models = rows.get(key)
+            if not models:
+                unmatched.append(obj)
+            elif len(models) > 1:
+                ambiguous.append(obj)
+            else:
+                matched.append((obj, models[0]))
+        return matched, unmatched, ambiguous
+
+    def _get_lookup_value(self, obj, field):
+        """Returns the normalized value of obj's field for use in a lookup"""
+        value = getattr(obj, field.name)
+        if isinstance(value, Shadow):
+            if value.get_primary_key():
+                value = value.get_primary_key()
+            else:
+                value = value.get_existing_model(self.containers)
+        if isinstance(value, django.db.models.Model):
+            value = value.pk
+        return _normalize(field, value)
+
+    def _update_in_bulk(self, shadows):
+        """Updates the changed attributes of existing rows represented by
+        shadows.
+
+        :returns: The number of rows that were actually changed.
+
+        """
+        updates = []
+        for obj in shadows:
+            diff = obj.get_diff_attrs(obj.get_existing_model(self.containers))
+            if diff:
+                model = obj.convert_to_model(self.containers)
+                updates.append(
+                    (model.pk, dict((attr, getattr(model, attr))
+                                    for attr in diff)))
+                obj._touched.clear()
+
+        update_in_bulk(self.cls.__shadowclass__, updates)
+        return len(updates)
+
+    def _create_in_bulk(self, shadows):
+        """Inserts new rows for shadows using multi-row INSERT statements.
+
+        Falls back to saving each new row individually if the Django model
+        cannot be created in bulk with its primary keys returned.
+
+        :returns: The number of rows created.
+
+        """
+        pending = [(obj, obj.convert_to_new_model(self.containers))
+                   for obj in shadows if not obj.update_only]
+        if can_create_in_bulk(self.cls.__shadowclass__):
+            self.cls.__shadowclass__.objects.bulk_create(
+                [model for _obj, model in pending], batch_size=BULK_BATCH_SIZE)
+        else:
+            for _obj, model in pending:
+                model.save()
+
+        for obj, model in pending:
+            if not obj.get_primary_key():
+                obj.set_primary_key(model.pk)
+            obj._touched.clear()
+        return len(pending)
 
     def cleanup(self):
         """Runs any necessary cleanup hooks after save is done"""
@@ -232,6 +441,20 @@ class Shadow(object):
         """
         return attr in cls._fields
 
+    @classmethod
+    def supports_bulk_save(cls):
+        """Returns True if containers of this class can be saved by
+        DefaultManager.save_in_bulk().
+
+        Shadow classes that customize how they are looked up or saved are
+        assumed to need the per-object save() path.  Subclasses whose
+        customizations are compatible with bulk saving may override this.
+
+        """
+        customizable = ('save', 'update', 'get_existing_model',
+                        'convert_to_model')
+        return not any(_overrides(cls, Shadow, name) for name in customizable)
+
     def copy(self, other):
         """Copies (only the touched) attributes of another instance (shallow)"""
         if isinstance(other, self.__class__):
@@ -301,9 +524,24 @@ class Shadow(object):
         if not model and self.update_only:
             return None
         elif not model:
-            model = self.__shadowclass__()
+            return self.convert_to_new_model(containers)
+
+        return self._copy_touched_to_model(model, containers)
+
+    def convert_to_new_model(self, containers=None):
+        """Return a new live Django model object based on the data of this one.
 
-        # Copy all modified attributes to the empty model object
+        As opposed to convert_to_model(), no attempt is made to look up an
+        existing database object, which makes this useful when it is already
+        known that this shadow object represents something new.
+
+        """
+        if containers is None:
+            containers = {}
+        return self._copy_touched_to_model(self.__shadowclass__(), containers)
+
+    def _copy_touched_to_model(self, model, containers):
+        # Copy all modified attributes to the model object
         for attr in self._touched:
             value = getattr(self, attr)
             if issubclass(value.__class__, Shadow):
@@ -524,6 +762,72 @@ class Shadow(object):
                 if _is_different(a)]
 
 
+def _overrides(cls, base, name):
+    """Returns True if cls overrides the name attribute of base"""
+    for klass in cls.__mro__:
+        if klass is base:
+            return False
+        if name in vars(klass):
+            return True
+    return False
+
+
+def _normalize(field, value):
+    """Normalizes value to the database representation of a model field, to
+    make values from shadows comparable to values loaded from the database.
+
+    """
+    if value is None:
+        return None
+    if field.is_relation:
+        field = field.target_field
+    return field.get_prep_value(value)
+
+
+def is_bulk_storage_enabled():
+    """Returns True if ipdevpoll is configured to use bulk storage"""
+    return ipdevpoll_conf.getboolean('ipdevpoll', 'bulk_storage',
+                                     fallback=False)
+
+
+def can_create_in_bulk(model):
+    """Returns True if new rows of the Django model can be inserted using
+    bulk_create(), while still having their primary keys set on the created
+    objects.
+
+    """
+    features = connection.features
+    returns_ids = (
+        getattr(features, 'can_return_ids_from_bulk_insert', False) or
+        getattr(features, 'can_return_rows_from_bulk_insert', False))
+    return (returns_ids and not model._meta.parents
+            and not _overrides(model, django.db.models.Model, 'save'))
+
+
+def update_in_bulk(model, updates):
+    """Updates rows of a Django model, merging all updates that set identical
+    values into single UPDATE statements.
+
+    :param model: A Django model class.
+    :param updates: A list of (primary_key, {attribute: value}) tuples.
+
+    """
+    groups = defaultdict(list)
+    singles = []
+    for pkey, values in updates:
+        try:
+            key = frozenset(values.items())
+        except TypeError:
+            singles.append((pkey, values))
+        else:
+            groups[key].append(pkey)
+
+    for key, pkeys in groups.items():
+        model.objects.filter(pk__in=pkeys).update(**dict(key))
+    for pkey, values in singles:
+        model.objects.filter(pk=pkey).update(**values)
+
+
 def shadowify(model):
     """Return a properly shadowed version of a Django model object.
 
@@ -26,6 +26,12 @@ class GraphiteConfigParser(NAVConfigParser):
 [carbon]
 host = 127.0.0.1
 port = 2003
+protocol = udp
+queue_size = 100000
+batch_size = 500
+flush_interval = 1.0
+spool_dir =
+spool_max_size = 104857600
 
 [graphiteweb]
 base=http://localhost:8000/
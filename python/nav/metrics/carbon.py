@@ -15,15 +15,30 @@
 #
 """
 This module implements various common API to send metrics to a
-Graphite/Carbon backend. It currently only supports the UDP line protocol,
-as it's the easiest to implement, and will also work without vodoo in
-asynchronous programs (i .e. such as ipdevpoll, which is implemented using
-Twisted).
+Graphite/Carbon backend.
+
+The UDP line protocol is used by default, as it's the easiest to implement.
+Alternatively, the TCP line or pickle protocols can be configured. Metrics
+sent using these are queued in memory and delivered in batches over a
+persistent connection by a background thread, so sending metrics never
+blocks the caller. This works equally well in asynchronous programs (i.e.
+such as ipdevpoll, which is implemented using Twisted) and in threaded
+programs.
 """
+import atexit
+import errno
+import fcntl
 import logging
+import os
+import pickle
 import socket
+import struct
+import threading
 import time
 import warnings
+
+from django.utils.six.moves import queue
+
 from nav.metrics import CONFIG
 
 _logger = logging.getLogger(__name__)
@@ -38,6 +53,18 @@ MAX_UDP_PAYLOAD = 1400
 # Minimum interval between socket error log entries, in seconds
 SOCKET_ERROR_MESSAGE_INTERVAL = 1
 
+# Delays between connection attempts to an unreachable carbon backend are
+# doubled for every failed attempt, starting with the minimum, and never
+# exceeding the maximum, both in seconds.
+MIN_RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 60
+# Socket timeout for connecting and sending over TCP, in seconds
+TCP_TIMEOUT = 10
+# The longest time to wait for queued metrics to be sent when exiting
+EXIT_FLUSH_TIMEOUT = 5
+
+PROTOCOLS = ('udp', 'line', 'pickle')
+
 
 class CarbonWarning(UserWarning):
     """Custom warning class for Carbon connection related warnings"""
@@ -118,7 +145,384 @@ def send_metrics(metric_tuples):
     """
     host = CONFIG.get("carbon", "host")
     port = CONFIG.getint("carbon", "port")
-    return send_metrics_to(metric_tuples, host, port)
+    protocol = CONFIG.get("carbon", "protocol")
+    if protocol == 'udp':
+        return send_metrics_to(metric_tuples, host, port)
+    else:
+        return get_client(host, port, protocol).send(metric_tuples)
+
+
+def get_client(host, port, protocol):
+    """Returns a CarbonClient for the given carbon backend.
+
+    Clients are shared by all callers within the same process. A process
+    forked after a client was created will get a new client of its own.
+
+    """
+    if protocol not in PROTOCOLS[1:]:
+        raise ValueError("Unsupported carbon protocol: %r" % protocol)
+    key = (host, port, protocol, os.getpid())
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = CarbonClient(
+                host, port, protocol,
+                queue_size=CONFIG.getint("carbon", "queue_size"),
+                batch_size=CONFIG.getint("carbon", "batch_size"),
+                flush_interval=CONFIG.getfloat("carbon", "flush_interval"),
+                spool=_get_configured_spool(host, port),
+            )
+    return client
+
+
+def get_client_stats():
+    """Returns the statistics of every CarbonClient of the current process.
+
+    :returns: A dict of {(host, port, protocol): stats}, where stats is the
+              dict returned by CarbonClient.get_stats().
+
+    """
+    pid = os.getpid()
+    return dict((key[:3], client.get_stats())
+                for key, client in list(_clients.items())
+                if key[3] == pid)
+
+
+def _get_configured_spool(host, port):
+    directory = CONFIG.get("carbon", "spool_dir")
+    if not directory:
+        return None
+    filename = "carbon-%s-%s.spool" % (host.replace(':', '_'), port)
+    return MetricSpool(os.path.join(directory, filename),
+                       CONFIG.getint("carbon", "spool_max_size"))
+
+
+@atexit.register
+def _flush_clients_at_exit():
+    pid = os.getpid()
+    for key, client in list(_clients.items()):
+        if key[3] == pid:
+            client.close(timeout=EXIT_FLUSH_TIMEOUT)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class CarbonClient(object):
+    """A client for Carbon's TCP line or pickle protocols.
+
+    Metrics are put on a bounded in-memory queue, and delivered in batches
+    by a background thread over a persistent connection. A batch is sent
+    whenever batch_size metrics have been queued, or flush_interval seconds
+    after the first metric of the batch was queued.
+
+    When the carbon backend is unreachable, the client reconnects with an
+    exponential backoff. Meanwhile, undelivered metrics are written to an
+    on-disk spool if one was given, to be delivered once the connection is
+    back. Without a spool, metrics are kept in the queue until it is full,
+    after which new metrics are dropped.
+
+    """
+    def __init__(self, host, port, protocol='line', queue_size=100000,
+                 batch_size=500, flush_interval=1.0, spool=None):
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool = spool
+        if protocol == 'pickle':
+            self._encode = metrics_to_pickle
+        elif protocol == 'line':
+            self._encode = metrics_to_lines
+        else:
+            raise ValueError("Unsupported carbon protocol: %r" % protocol)
+
+        self.sent = 0
+        self.dropped = 0
+        self.spooled = 0
+
+        self._queue = queue.Queue(queue_size)
+        self._pending = []
+        self._socket = None
+        self._reconnect_delay = MIN_RECONNECT_DELAY
+        self._next_connect = 0
+        self._stopping = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def __repr__(self):
+        return "<%s [%s]:%s>" % (self.__class__.__name__, self.host,
+                                 self.port)
+
+    def send(self, metric_tuples):
+        """Queues a list of metric tuples for delivery.
+
+        Never blocks; metrics that don't fit in the queue are dropped.
+
+        :param metric_tuples: A list of metric tuples in the form
+                              [(path, (timestamp, value)), ...]
+
+        """
+        self._ensure_thread()
+        for metric in metric_tuples:
+            try:
+                self._queue.put_nowait(metric)
+            except queue.Full:
+                self.dropped += 1
+
+    def get_stats(self):
+        """Returns a dict of counters describing the state of this client"""
+        return dict(sent=self.sent,
+                    queued=self._queue.qsize() + len(self._pending),
+                    dropped=self.dropped,
+                    spooled=self.spooled,
+                    connected=self._socket is not None)
+
+    def flush(self, timeout=None):
+        """Waits until all queued metrics have been delivered or spooled.
+
+        :param timeout: The maximum number of seconds to wait.
+        :returns: True if the queue was emptied within the timeout.
+
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self._queue.unfinished_tasks:
+            if not self._thread or not self._thread.is_alive():
+                return False
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self, timeout=None):
+        """Flushes queued metrics and stops the background thread"""
+        self.flush(timeout)
+        self._stopping.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(self.flush_interval + 1)
+        self._disconnect()
+
+    def _ensure_thread(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if not (self._thread and self._thread.is_alive()):
+                self._thread = threading.Thread(
+                    target=self._run, name="carbon-client")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self._process()
+            except Exception:  # pylint: disable=W0703
+                _logger.exception("unhandled error in carbon client "
+                                  "([%s]:%s), retrying in %s seconds",
+                                  self.host, self.port, self.flush_interval)
+                self._stopping.wait(self.flush_interval)
+
+    def _process(self):
+        """Delivers or spools a single batch of metrics"""
+        if not self._pending:
+            self._pending = self._get_batch()
+            if not self._pending:
+                return
+        unsent = self._deliver(self._pending)
+        self._settle(len(self._pending) - len(unsent))
+        self._pending = unsent
+        if unsent and self.spool:
+            self._spool(unsent)
+            self._settle(len(unsent))
+            self._pending = []
+        elif unsent:
+            self._stopping.wait(max(self._next_connect - time.time(), 0))
+
+    def _get_batch(self):
+        """Collects a batch of metrics from the queue, waiting at most
+        flush_interval seconds after the first one arrives.
+
+        """
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            if deadline is None:
+                timeout = self.flush_interval
+            else:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+            if deadline is None:
+                deadline = time.time() + self.flush_interval
+        return batch
+
+    def _settle(self, count):
+        """Marks count metrics taken from the queue as done"""
+        for _ in range(count):
+            self._queue.task_done()
+
+    def _deliver(self, batch):
+        """Sends a batch of metrics, replaying any spooled metrics first.
+
+        :returns: The list of metrics from batch that could not be sent.
+
+        """
+        if not self._connect():
+            return batch
+        if self.spool and not self._replay_spool():
+            return batch
+        return self._send_batch(batch)
+
+    def _send_batch(self, batch):
+        """Sends a list of metrics, batch_size metrics at a time.
+
+        :returns: The list of metrics that could not be sent.
+
+        """
+        for index in range(0, len(batch), self.batch_size):
+            chunk = batch[index:index + self.batch_size]
+            try:
+                self._socket.sendall(self._encode(chunk))
+            except (socket.error, socket.timeout) as error:
+                _handle_error(error, self.host, self.port)
+                self._disconnect()
+                self._schedule_reconnect()
+                return batch[index:]
+            self.sent += len(chunk)
+        return []
+
+    def _replay_spool(self):
+        spooled = self.spool.read_all()
+        if spooled:
+            _logger.info("replaying %d spooled metrics to carbon ([%s]:%s)",
+                         len(spooled), self.host, self.port)
+            unsent = self._send_batch(spooled)
+            if unsent:
+                self._spool(unsent)
+                return False
+        return True
+
+    def _spool(self, batch):
+        spoolable = [metric for metric in batch if _has_numeric_value(metric)]
+        if len(spoolable) < len(batch):
+            _logger.debug("not spooling %d metrics with non-numeric values",
+                          len(batch) - len(spoolable))
+            self.dropped += len(batch) - len(spoolable)
+        if not spoolable:
+            return
+        if self.spool.write(spoolable):
+            self.spooled += len(spoolable)
+        else:
+            self.dropped += len(spoolable)
+
+    def _connect(self):
+        if self._socket:
+            return True
+        if time.time() < self._next_connect:
+            return False
+        try:
+            self._socket = socket.create_connection((self.host, self.port),
+                                                    TCP_TIMEOUT)
+        except (socket.error, socket.timeout) as error:
+            _handle_error(error, self.host, self.port)
+            self._schedule_reconnect()
+            return False
+        _logger.debug("connected to carbon at [%s]:%s", self.host, self.port)
+        self._reconnect_delay = MIN_RECONNECT_DELAY
+        return True
+
+    def _schedule_reconnect(self):
+        self._next_connect = time.time() + self._reconnect_delay
+        self._reconnect_delay = min(self._reconnect_delay * 2,
+                                    MAX_RECONNECT_DELAY)
+
+    def _disconnect(self):
+        if self._socket:
+            try:
+                self._socket.close()
+            except socket.error:
+                pass
+            self._socket = None
+
+
+class MetricSpool(object):
+    """An on-disk spool of undelivered metrics.
+
+    Metrics are stored in the line protocol format. The spool file is locked
+    while in use, so several processes can safely share the same spool.
+
+    """
+    def __init__(self, path, max_size):
+        """
+        :param path: The path of the spool file.
+        :param max_size: The maximum size of the spool file, in bytes.
+
+        """
+        self.path = path
+        self.max_size = max_size
+
+    def write(self, metric_tuples):
+        """Appends metrics to the spool.
+
+        :returns: False if the metrics could not be written, e.g. because the
+                  spool is full.
+
+        """
+        data = b"".join(_metric_to_line(metric) for metric in metric_tuples)
+        try:
+            with open(self.path, 'ab') as spool:
+                fcntl.flock(spool, fcntl.LOCK_EX)
+                if spool.tell() + len(data) > self.max_size:
+                    _logger.warning("carbon spool %s is full, dropping %d "
+                                    "metrics", self.path, len(metric_tuples))
+                    return False
+                spool.write(data)
+        except (IOError, OSError) as error:
+            _logger.error("cannot write to carbon spool %s: %s",
+                          self.path, error)
+            return False
+        return True
+
+    def read_all(self):
+        """Removes and returns all metrics from the spool.
+
+        The spool is only emptied once it has been read successfully. Lines
+        that cannot be parsed are logged and discarded.
+
+        :returns: A list of metric tuples in the form
+                  [(path, (timestamp, value)), ...]
+
+        """
+        try:
+            with open(self.path, 'r+b') as spool:
+                fcntl.flock(spool, fcntl.LOCK_EX)
+                data = spool.read()
+                metrics = self._parse(data)
+                spool.seek(0)
+                spool.truncate()
+        except (IOError, OSError) as error:
+            if error.errno != errno.ENOENT:
+                _logger.error("cannot read carbon spool %s: %s",
+                              self.path, error)
+            return []
+        return metrics
+
+    def _parse(self, data):
+        metrics = []
+        for line in data.splitlines():
+            if not line:
+                continue
+            try:
+                metrics.append(_line_to_metric(line))
+            except ValueError:
+                _logger.warning("discarding invalid line in carbon spool "
+                                "%s: %r", self.path, line)
+        return metrics
 
 
 def _socktype_from_addr(addr):
@@ -133,6 +537,40 @@ def _metric_to_line(metric_tuple):
     return line.encode('utf-8')
 
 
+def _line_to_metric(line):
+    """Parses a line protocol line.
+
+    :raises: ValueError if the line is malformed.
+
+    """
+    path, value, timestamp = line.decode('utf-8').split()
+    return path, (int(timestamp), float(value))
+
+
+def _has_numeric_value(metric_tuple):
+    _path, (_timestamp, value) = metric_tuple
+    if value is None:
+        return False
+    try:
+        float(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def metrics_to_lines(metric_tuples):
+    """Encodes a list of metric tuples as a Carbon line protocol payload"""
+    return b"".join(_metric_to_line(metric) for metric in metric_tuples)
+
+
+def metrics_to_pickle(metric_tuples):
+    """Encodes a list of metric tuples as a Carbon pickle protocol payload"""
+    payload = pickle.dumps([(path, (int(timestamp), value))
+                            for path, (timestamp, value) in metric_tuples],
+                           protocol=2)
+    return struct.pack("!L", len(payload)) + payload
+
+
 def metrics_to_packets(metric_tuples):
     """
     Converts a list of metric tuples to a series of Graphite/Carbon
@@ -14,22 +14,21 @@
 # along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
 """Retrieval and calculations on raw numbers from Graphite metrics"""
-import codecs
 from datetime import datetime
-import json
 import logging
-from django.utils.six.moves.urllib.parse import urlencode, urljoin
-from django.utils.six.moves.urllib.request import Request, urlopen
-from django.utils.six.moves.urllib.error import HTTPError, URLError
 
-from nav.metrics import CONFIG, errors
+from django.utils import six
+
+from nav.metrics import CONFIG
+from nav.metrics.render import get_client, MAX_TARGETS_PER_REQUEST
 from nav.metrics.templates import (metric_path_for_packet_loss,
                                    metric_path_for_roundtrip_time)
 
 _logger = logging.getLogger(__name__)
 
 
-def get_metric_average(target, start="-5min", end="now", ignore_unknown=True):
+def get_metric_average(target, start="-5min", end="now", ignore_unknown=True,
+                       max_targets=MAX_TARGETS_PER_REQUEST):
     """Calculates the average value of a metric over a given period of time
 
     :param target: A metric path string or a list of multiple metric paths
@@ -38,13 +37,15 @@ def get_metric_average(target, start="-5min", end="now", ignore_unknown=True):
     :param ignore_unknown: Ignore unknown values when calculating the average.
                            Unless True, any unknown data in the series will
                            result in an average value of None.
+    :param max_targets: The maximum number of targets to ask for in a single
+                        request.
     :returns: A dict of {target: average_value} items. Targets that weren't
               found in Graphite will not be present in the dict.
 
     """
     start_time = datetime.now()
 
-    data = get_metric_data(target, start, end)
+    data = get_metric_data(target, start, end, max_targets=max_targets)
     result = {}
     for target in data:
         dpoints = [d[0] for d in target['datapoints']
@@ -75,13 +76,20 @@ def get_metric_max(target, start="-5min", end="now"):
     return result
 
 
-def get_metric_data(target, start="-5min", end="now"):
+def get_metric_data(target, start="-5min", end="now",
+                    max_targets=MAX_TARGETS_PER_REQUEST):
     """
     Retrieves raw datapoints from a graphite target for a given period of time.
 
+    Long lists of targets are split into several requests, which are sent
+    concurrently. Responses are cached for a short while; see
+    nav.metrics.render for details.
+
     :param target: A metric path string or a list of multiple metric paths
     :param start: A start time specification that Graphite will accept.
     :param end: An end time specification that Graphite will accept.
+    :param max_targets: The maximum number of targets to ask for in a single
+                        request.
 
     :returns: A raw, response from Graphite. Normally a list of dicts that
               represent the names and datapoints of each matched target,
@@ -93,9 +101,6 @@ def get_metric_data(target, start="-5min", end="now"):
     if not target:
         return []  # no point in wasting time on http requests for no data
 
-    base = CONFIG.get("graphiteweb", "base")
-    url = urljoin(base, "/render/")
-
     # What does Graphite accept of formats? Lets check if the parameters are
     # datetime objects and try to force a format then
     if isinstance(start, datetime):
@@ -103,38 +108,21 @@ def get_metric_data(target, start="-5min", end="now"):
     if isinstance(end, datetime):
         end = end.strftime('%H:%M%Y%m%d')
 
-    query = {
-        'target': target,
-        'from': start,
-        'until': end,
-        'format': 'json',
-    }
-    query = urlencode(query, True)
+    if isinstance(target, six.string_types):
+        target = [target]
 
     _logger.debug("get_metric_data%r", (target, start, end))
-    req = Request(url, data=query.encode('utf-8'))
-    try:
-        response = urlopen(req)
-        json_data = json.load(codecs.getreader('utf-8')(response))
-        _logger.debug("get_metric_data: returning %d results", len(json_data))
-        return json_data
-    except HTTPError as err:
-        _logger.error("Got a 500 error from graphite-web when fetching %s"
-                      "with data %s", err.url, query)
-        _logger.error("Graphite output: %s", err.fp.read())
-        raise errors.GraphiteUnreachableError(
-            "{0} is unreachable".format(base), err)
-    except URLError as err:
-        raise errors.GraphiteUnreachableError(
-            "{0} is unreachable".format(base), err)
-    except ValueError:
-        # response could not be decoded
-        return []
-    finally:
-        try:
-            response.close()
-        except NameError:
-            pass
+    client = get_client(CONFIG.get("graphiteweb", "base"))
+    json_data = client.render(target, start, end, max_targets=max_targets)
+    _logger.debug("get_metric_data: returning %d results", len(json_data))
+    return json_data
+
+
+def get_render_stats():
+    """Returns cache and request statistics for the graphite-web render
+    client, as a dict.
+    """
+    return get_client(CONFIG.get("graphiteweb", "base")).get_stats()
 
 
 DEFAULT_TIME_FRAMES = ('day', 'week', 'month')
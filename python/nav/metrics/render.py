@@ -0,0 +1,280 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""A client for the graphite-web render API.
+
+The client keeps a small pool of persistent HTTP connections to graphite-web.
+Long lists of targets are split into chunks, which are requested
+concurrently. Responses are cached for a short while, keyed on the set of
+targets and the requested time period, so that several users looking at the
+same data within seconds of each other only cause a single request. If a
+request for the same data is already in progress, the client waits for its
+response instead of making another one.
+
+"""
+from collections import OrderedDict
+import copy
+from io import BytesIO
+import json
+import logging
+from multiprocessing.pool import ThreadPool
+import socket
+import threading
+import time
+
+from django.utils.six.moves import http_client, queue
+from django.utils.six.moves.urllib.error import HTTPError
+from django.utils.six.moves.urllib.parse import urlencode, urljoin, urlsplit
+
+from nav.metrics import errors
+from nav.util import chunks
+
+_logger = logging.getLogger(__name__)
+
+# Maximum number of targets to ask for in a single request
+MAX_TARGETS_PER_REQUEST = 500
+# Maximum number of concurrent requests, and of idle connections to keep
+MAX_CONNECTIONS = 4
+# Number of seconds to keep responses in the cache
+CACHE_TTL = 30
+# Maximum number of responses to keep in the cache
+MAX_CACHE_ENTRIES = 1000
+# Seconds to wait for graphite-web to respond
+TIMEOUT = 60
+
+
+class GraphiteClient(object):
+    """A client for the render API of a single graphite-web instance"""
+
+    def __init__(self, base, max_connections=MAX_CONNECTIONS,
+                 cache_ttl=CACHE_TTL, clock=time.time):
+        """
+        :param base: The base URL of graphite-web.
+        :param max_connections: The maximum number of concurrent requests
+                                for a single render() call, and the maximum
+                                number of idle connections to keep open.
+        :param cache_ttl: The number of seconds to cache responses.
+        :param clock: A function that returns the current time in seconds.
+        """
+        self.base = base
+        self.url = urlsplit(urljoin(base, "/render/"))
+        self.max_connections = max_connections
+        self.cache_ttl = cache_ttl
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+        self._idle = queue.LifoQueue(max_connections)
+        self._cache = OrderedDict()  # key -> (expiry time, response)
+        self._pending = {}  # key -> threading.Event
+        self._lock = threading.Lock()
+
+    def render(self, targets, start, end,
+               max_targets=MAX_TARGETS_PER_REQUEST):
+        """Retrieves raw datapoints for a list of targets.
+
+        :param targets: A list of target expressions.
+        :param start: A start time specification that Graphite will accept.
+        :param end: An end time specification that Graphite will accept.
+        :param max_targets: The maximum number of targets to ask for in a
+                            single request.
+        :returns: A list of series dicts, as decoded from Graphite's JSON
+                  response.
+        :raises: GraphiteUnreachableError
+
+        """
+        targets = sorted(set(targets))
+        requests = [(chunk, start, end)
+                    for chunk in chunks(targets, max_targets)]
+        if len(requests) == 1:
+            responses = [self._render_cached(requests[0])]
+        else:
+            pool = ThreadPool(min(self.max_connections, len(requests)))
+            try:
+                responses = pool.map(self._render_cached, requests)
+            finally:
+                pool.close()
+                pool.join()
+
+        result = []
+        for response in responses:
+            result.extend(response)
+        return result
+
+    def get_stats(self):
+        """Returns a dict of cache and request statistics"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'requests': self.requests,
+                'errors': self.errors,
+                'avg_latency': (self.total_latency / self.requests
+                                if self.requests else 0.0),
+                'max_latency': self.max_latency,
+            }
+
+    def close(self):
+        """Closes all idle connections"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _render_cached(self, key):
+        while True:
+            with self._lock:
+                response = self._get_cached(key)
+                if response is not None:
+                    self.hits += 1
+                    return response
+                pending = self._pending.get(key)
+                if pending is None:
+                    self.misses += 1
+                    self._pending[key] = threading.Event()
+            if pending is None:
+                break
+            # someone else is already fetching this, wait for the result
+            pending.wait(TIMEOUT)
+
+        try:
+            response = self._render(*key)
+            with self._lock:
+                self._set_cached(key, response)
+            # callers must not be able to modify the cached series
+            return copy.deepcopy(response)
+        finally:
+            with self._lock:
+                self._pending.pop(key).set()
+
+    def _get_cached(self, key):
+        entry = self._cache.get(key)
+        if entry:
+            expiry, response = entry
+            if expiry > self.clock():
+                return copy.deepcopy(response)
+            del self._cache[key]
+
+    def _set_cached(self, key, response):
+        if self.cache_ttl <= 0:
+            return
+        self._cache.pop(key, None)
+        while len(self._cache) >= MAX_CACHE_ENTRIES:
+            self._cache.popitem(last=False)
+        self._cache[key] = (self.clock() + self.cache_ttl, response)
+
+    def _render(self, targets, start, end):
+        query = urlencode({
+            'target': targets,
+            'from': start,
+            'until': end,
+            'format': 'json',
+        }, True)
+        _logger.debug("render%r", (targets, start, end))
+        started = time.time()
+        try:
+            status, reason, headers, body = self._post(query.encode('utf-8'))
+        except (http_client.HTTPException, socket.error) as err:
+            self._count_request(started, failed=True)
+            raise errors.GraphiteUnreachableError(
+                "{0} is unreachable".format(self.base), err)
+        self._count_request(started, failed=status >= 400)
+
+        if status >= 400:
+            _logger.error("Got a %s error from graphite-web when fetching %s "
+                          "with data %s", status, self.url.geturl(), query)
+            _logger.error("Graphite output: %s", body)
+            err = HTTPError(self.url.geturl(), status, reason, headers,
+                            BytesIO(body))
+            raise errors.GraphiteUnreachableError(
+                "{0} is unreachable".format(self.base), err)
+
+        try:
+            json_data = json.loads(body.decode('utf-8'))
+        except ValueError:
+            # response could not be decoded
+            return []
+        _logger.debug("render: returning %d results", len(json_data))
+        return json_data
+
+    def _count_request(self, started, failed=False):
+        latency = time.time() - started
+        with self._lock:
+            self.requests += 1
+            self.errors += int(failed)
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def _post(self, body):
+        """Posts a request body to the render URL.
+
+        An idle connection may have been closed by the server, so we retry
+        once on a fresh connection.
+
+        """
+        path = self.url.path or '/'
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        try:
+            connection, reused = self._idle.get_nowait(), True
+        except queue.Empty:
+            connection, reused = self._connect(), False
+
+        while True:
+            try:
+                connection.request('POST', path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http_client.HTTPException, socket.error):
+                connection.close()
+                if not reused:
+                    raise
+                connection, reused = self._connect(), False
+            else:
+                break
+
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                self._idle.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+        return response.status, response.reason, response.msg, data
+
+    def _connect(self):
+        if self.url.scheme == 'https':
+            return http_client.HTTPSConnection(self.url.netloc,
+                                               timeout=TIMEOUT)
+        return http_client.HTTPConnection(self.url.netloc, timeout=TIMEOUT)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base):
+    """Returns the shared GraphiteClient for the graphite-web instance at
+    base.
+    """
+    with _clients_lock:
+        if base not in _clients:
+            _clients[base] = GraphiteClient(base)
+        return _clients[base]
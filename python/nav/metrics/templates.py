@@ -30,6 +30,17 @@ def metric_prefix_for_ipdevpoll_job(sysname, job_name):
                        job_name=escape_metric_name(job_name))
 
 
+def metric_path_for_ipdevpoll_lateness(job_name, bucket):
+    tmpl = "nav.ipdevpoll.{job_name}.lateness.{bucket}"
+    return tmpl.format(job_name=escape_metric_name(job_name),
+                       bucket=escape_metric_name(bucket))
+
+
+def metric_path_for_thresholdmon(name):
+    tmpl = "nav.thresholdmon.{name}"
+    return tmpl.format(name=escape_metric_name(name))
+
+
 def metric_path_for_bandwith(sysname, is_percent):
     tmpl = "{system}.bandwidth{percent}"
     return tmpl.format(system=metric_prefix_for_system(sysname),
@@ -59,14 +59,17 @@ This module should provide an API for evaluating threshold expressions.
 Alerting is outside of the scope of this module.
 
 """
+from collections import defaultdict, OrderedDict
 from datetime import timedelta
 from functools import partial
 import logging
+from multiprocessing.pool import ThreadPool
 import re
 
 from django.utils.six import iteritems, iterkeys
+from django.utils.six.moves.urllib.error import HTTPError
 
-from nav.metrics.data import get_metric_average
+from nav.metrics.data import get_metric_average, get_metric_data
 from nav.metrics.graphs import get_metric_meta, extract_series_name
 
 
@@ -87,6 +90,10 @@ YEAR = timedelta(days=365).total_seconds()
 
 MEGA = 1e6
 
+# Limits for ValueFetcher
+MAX_TARGETS_PER_REQUEST = 50
+MAX_CONCURRENT_REQUESTS = 4
+
 _logger = logging.getLogger(__name__)
 
 
@@ -136,6 +143,13 @@ class ThresholdEvaluator(object):
         start = "-{0}".format(interval_to_graphite(self.period))
         averages = get_metric_average(
             self.target, start=start, end='now', ignore_unknown=True)
+        return self.set_values(averages)
+
+    def set_values(self, averages):
+        """
+        Sets the values to evaluate from a dict of {series: average_value}
+        items, as retrieved from Graphite.
+        """
         _logger.debug("retrieved %d values from graphite for %r, "
                       "period %s: %r",
                       len(averages), self.target, self.period, averages)
@@ -197,6 +211,123 @@ class ThresholdEvaluator(object):
             return current
 
 
+class ValueFetcher(object):
+    """Retrieves values for many threshold evaluators at once.
+
+    Evaluators are grouped by period, and the distinct targets of each group
+    are merged into as few Graphite render requests as possible. Each target
+    is tagged using Graphite's aliasSub() function, so that the returned
+    series can be handed back to the evaluators that asked for them. The
+    requests are run concurrently.
+
+    If graphite-web rejects a merged request, e.g. because one of its
+    targets is invalid, each of its targets is retried in a request of its
+    own, so that a single bad rule does not cause every other rule in the
+    same request to fail.
+
+    """
+    def __init__(self, max_targets=MAX_TARGETS_PER_REQUEST,
+                 max_concurrent=MAX_CONCURRENT_REQUESTS):
+        self.max_targets = max_targets
+        self.max_concurrent = max_concurrent
+        self.requests = 0
+        self.failed_requests = 0
+
+    def fetch(self, evaluators):
+        """Retrieves values for a list of evaluators, just as if get_values()
+        had been called for each of them.
+
+        :returns: A dict mapping each evaluator whose values could not be
+                  retrieved to the exception that was raised.
+
+        """
+        requests = list(self._make_requests(evaluators))
+        failures = {}
+        while requests:
+            retries = []
+            for (start, targets), response in zip(requests,
+                                                  self._run(requests)):
+                self.requests += 1
+                if not isinstance(response, Exception):
+                    _fan_out(targets, response)
+                    continue
+
+                self.failed_requests += 1
+                if len(targets) > 1 and _is_rejection(response):
+                    _logger.debug("merged request for %d targets failed, "
+                                  "retrying them one by one", len(targets))
+                    retries.extend((start, OrderedDict([item]))
+                                   for item in targets.items())
+                else:
+                    for target_evaluators in targets.values():
+                        for evaluator in target_evaluators:
+                            failures[evaluator] = response
+            requests = retries
+        return failures
+
+    def _run(self, requests):
+        """Runs a list of requests concurrently, returning a list of their
+        responses or errors.
+        """
+        pool = ThreadPool(min(self.max_concurrent, len(requests)))
+        try:
+            return pool.map(_fetch_tagged_targets, requests)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _make_requests(self, evaluators):
+        """Yields (start, targets) tuples, where targets is an ordered dict
+        mapping each target in a single request to the evaluators that want
+        it.
+        """
+        groups = defaultdict(lambda: defaultdict(list))
+        for evaluator in evaluators:
+            start = "-{0}".format(interval_to_graphite(evaluator.period))
+            groups[start][evaluator.target].append(evaluator)
+
+        for start, targets in sorted(groups.items()):
+            targets = sorted(targets.items())
+            for index in range(0, len(targets), self.max_targets):
+                yield start, OrderedDict(targets[index:index+self.max_targets])
+
+
+def _fetch_tagged_targets(request):
+    start, targets = request
+    tagged = ['aliasSub({target},"^","{index}:")'.format(index=index,
+                                                         target=target)
+              for index, target in enumerate(targets)]
+    try:
+        return get_metric_data(tagged, start=start, end='now')
+    except Exception as error:  # pylint: disable=W0703
+        return error
+
+
+def _is_rejection(error):
+    """Returns True if error means graphite-web responded with an error,
+    rather than not responding at all.
+    """
+    return isinstance(getattr(error, 'cause', None), HTTPError)
+
+
+def _fan_out(targets, response):
+    averages = [{} for _target in targets]
+    for series in response:
+        index, _sep, name = series['target'].partition(':')
+        dpoints = [d[0] for d in series['datapoints'] if d[0] is not None]
+        if not dpoints:
+            continue
+        try:
+            averages[int(index)][name] = sum(dpoints) / len(dpoints)
+        except (ValueError, IndexError):
+            _logger.debug("ignoring unexpected series %r", series['target'])
+
+    for target_evaluators, target_averages in zip(targets.values(),
+                                                  averages):
+        for evaluator in target_evaluators:
+            evaluator.set_values(target_averages)
+
+
 def get_metric_maximum(metric):
     """
     Returns the maximum value of a metric, if one can be determined.
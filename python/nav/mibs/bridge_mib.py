@@ -43,7 +43,8 @@ class BridgeMib(mibretriever.MibRetriever):
     def get_forwarding_database(self):
         """Retrieves the forwarding database of the device."""
         columns = yield self.retrieve_columns(['dot1dTpFdbPort',
-                                               'dot1dTpFdbStatus'])
+                                               'dot1dTpFdbStatus'],
+                                              columnar=True)
         columns = self.translate_result(columns)
         valid = (row for row in columns.values()
                  if row['dot1dTpFdbStatus'] not in ('self', 'invalid'))
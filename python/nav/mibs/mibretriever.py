@@ -34,7 +34,7 @@ import logging
 
 from django.utils import six
 
-from twisted.internet import defer, reactor
+from twisted.internet import defer
 from twisted.internet.defer import returnValue
 from twisted.internet.error import TimeoutError
 
@@ -45,6 +45,11 @@ from nav.errors import GeneralException
 from nav.oids import OID
 from nav.smidumps import get_mib
 
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:  # Python 2
+    from collections import Mapping, MutableMapping
+
 _logger = logging.getLogger(__name__)
 TEXT_TYPES = ("DisplayString", "SnmpAdminString")
 
@@ -226,6 +231,136 @@ class MibTableResultRow(dict):
         self[0] = index
 
 
+class ColumnarTableResult(Mapping):
+    """A MIB table result stored column by column.
+
+    Acts as a read-only dictionary of { row_index: row }, like the results of
+    MibRetriever.retrieve_table() and retrieve_columns(), but stores each
+    column as a single list instead of allocating a dictionary per row. Rows
+    are light-weight ColumnarTableRow views, created on access.
+
+    Values are converted to Python values on first access if converters have
+    been set, e.g. by MibRetriever.translate_result().
+
+    """
+    def __init__(self, column_names):
+        self.column_names = list(column_names)
+        self.indexes = []
+        self._positions = {}
+        self._columns = dict((name, []) for name in self.column_names)
+        self._converters = {}
+        self._converted = {}
+
+    def add(self, index, column, value):
+        """Adds a single value to this table.
+
+        The first index object seen for a row is kept and shared by all its
+        columns.
+
+        """
+        position = self._positions.get(index)
+        if position is None:
+            position = self._positions[index] = len(self.indexes)
+            self.indexes.append(index)
+            for values in self._columns.values():
+                values.append(None)
+        self._columns[column][position] = value
+
+    def set_converters(self, converters):
+        """Sets functions to lazily convert the values of some columns.
+
+        :param converters: A dict of { column_name: function }.
+
+        """
+        for name, converter in converters.items():
+            if name in self._columns:
+                self._converters[name] = converter
+                self._converted[name] = bytearray(len(self.indexes))
+
+    def get_value(self, position, column):
+        """Returns the (converted) value of a column in a row position"""
+        values = self._columns[column]
+        if column in self._converted:
+            converted = self._converted[column]
+            if not converted[position]:
+                values[position] = self._converters[column](values[position])
+                converted[position] = 1
+        return values[position]
+
+    def set_value(self, position, column, value):
+        """Sets the value of a column in a row position"""
+        if column not in self._columns:
+            raise KeyError(column)
+        self._columns[column][position] = value
+        converted = self._converted.get(column)
+        if converted is not None:
+            converted[position] = 1
+
+    def column(self, name):
+        """Returns a list of all the (converted) values of a column, in row
+        order.
+
+        """
+        return [self.get_value(position, name)
+                for position in range(len(self.indexes))]
+
+    def __getitem__(self, index):
+        return ColumnarTableRow(self, self._positions[index])
+
+    def __contains__(self, index):
+        return index in self._positions
+
+    def __iter__(self):
+        return iter(self.indexes)
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def __repr__(self):
+        return "<%s columns=%r rows=%d>" % (self.__class__.__name__,
+                                            self.column_names, len(self))
+
+
+class ColumnarTableRow(MutableMapping):
+    """A row view of a ColumnarTableResult.
+
+    Acts like a MibTableResultRow: The row index is available through the
+    integer key 0, or as the member attribute 'index'.
+
+    """
+    __slots__ = ('table', 'position')
+
+    def __init__(self, table, position):
+        self.table = table
+        self.position = position
+
+    @property
+    def index(self):
+        return self.table.indexes[self.position]
+
+    def __getitem__(self, key):
+        if key == 0:
+            return self.index
+        return self.table.get_value(self.position, key)
+
+    def __setitem__(self, key, value):
+        self.table.set_value(self.position, key, value)
+
+    def __delitem__(self, key):
+        raise TypeError("columns cannot be deleted from table rows")
+
+    def __iter__(self):
+        yield 0
+        for name in self.table.column_names:
+            yield name
+
+    def __len__(self):
+        return len(self.table.column_names) + 1
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
 class MibRetrieverMaker(type):
     """Metaclass to create new functional MIB retriever classes.
 
@@ -390,80 +525,94 @@ class MibRetriever(object):
         if node.raw_mib_data['nodetype'] != 'column':
             self._logger.debug("%s is not a table column", column_name)
 
-        def _result_formatter(result):
-            formatted_result = {}
-            # result keys may be OID objects/tuples or strings, depending on
-            # snmp library used
-            if node.oid not in result and str(node.oid) not in result:
-                self._logger.debug("%s (%s) seems to be unsupported, result "
-                                   "keys were: %r",
-                                   column_name, node.oid, result.keys())
-                return {}
-            varlist = result.get(node.oid, result.get(str(node.oid), None))
-
-            for oid, value in varlist.items():
-                # Extract index information from oid
-                row_index = OID(oid).strip_prefix(node.oid)
-                if column_name in self.text_columns:
-                    value = safestring(value)
-                formatted_result[row_index] = value
+        deferred = self.agent_proxy.getTable([str(node.oid)])
+        deferred.addCallbacks(self._format_column, self._valueerror_handler,
+                              callbackArgs=(column_name,),
+                              errbackArgs=(column_name,))
+        return deferred
 
-            return formatted_result
+    def _format_column(self, result, column_name):
+        """Formats a single column from a getTable result as a dictionary:
 
-        def _valueerror_handler(failure):
-            failure.trap(ValueError)
-            self._logger.warning("got a possibly strange response from device "
-                                 "when asking for %s::%s, ignoring: %s",
-                                 self.mib.get('moduleName', ''), column_name,
-                                 failure.getErrorMessage())
-            return {}  # alternative is to retry or raise a Timeout exception
+          { row_index: column_value }
 
-        deferred = self.agent_proxy.getTable([str(node.oid)])
-        deferred.addCallbacks(_result_formatter, _valueerror_handler)
-        return deferred
+        """
+        return dict(self._iter_column(result, column_name))
 
-    def retrieve_columns(self, column_names):
+    def _iter_column(self, result, column_name):
+        """Generates (row_index, column_value) tuples for a single column
+        from a getTable result.
+
+        """
+        node = self.nodes[column_name]
+        # result keys may be OID objects/tuples or strings, depending on
+        # snmp library used
+        if node.oid not in result and str(node.oid) not in result:
+            self._logger.debug("%s (%s) seems to be unsupported, result "
+                               "keys were: %r",
+                               column_name, node.oid, result.keys())
+            return
+        varlist = result.get(node.oid, result.get(str(node.oid), None))
+        is_text = column_name in self.text_columns
+
+        for oid, value in varlist.items():
+            # Extract index information from oid
+            row_index = OID(oid).strip_prefix(node.oid)
+            if is_text:
+                value = safestring(value)
+            yield row_index, value
+
+    def _valueerror_handler(self, failure, column_name):
+        failure.trap(ValueError)
+        self._logger.warning("got a possibly strange response from device "
+                             "when asking for %s::%s, ignoring: %s",
+                             self.mib.get('moduleName', ''), column_name,
+                             failure.getErrorMessage())
+        return {}  # alternative is to retry or raise a Timeout exception
+
+    def retrieve_columns(self, column_names, columnar=False):
         """Retrieve a set of table columns.
 
         The table columns may come from different tables, as long as
-        the table rows are indexed the same way.
+        the table rows are indexed the same way.  All the columns are
+        requested at once, leaving it to the AgentProxy to retrieve them in
+        parallel if it can.
 
         Returns a deferred whose result is a dictionary:
 
           { row_index: MibTableResultRow instance }
 
-        """
-        def _sortkey(col):
-            return self.nodes[col].oid
-        columns = iter(sorted(column_names, key=_sortkey))
-
-        final_result = {}
-        my_deferred = defer.Deferred()
-
-        def _result_aggregate(result, column):
-            for row_index, value in result.items():
-                if row_index not in final_result:
-                    final_result[row_index] = \
-                        MibTableResultRow(row_index, column_names)
-                final_result[row_index][column] = value
-            return True
-
-        # schedule the next iteration (i.e. collect next column)
-        def _schedule_next(_result=None):
-            try:
-                column = next(columns)
-            except StopIteration:
-                my_deferred.callback(final_result)
-                return
-            deferred = self.retrieve_column(column)
-            deferred.addCallback(_result_aggregate, column)
-            deferred.addCallback(_schedule_next)
-            deferred.addErrback(my_deferred.errback)
+        If columnar is True, the result is a ColumnarTableResult instead,
+        which uses far less memory for large tables.
 
-        reactor.callLater(0, _schedule_next)
-        return my_deferred
+        """
+        column_names = list(column_names)
+
+        def _result_aggregate(result):
+            if columnar:
+                table = ColumnarTableResult(column_names)
+                for column in column_names:
+                    for row_index, value in self._iter_column(result, column):
+                        table.add(row_index, column, value)
+                return table
+
+            final_result = {}
+            for column in column_names:
+                for row_index, value in self._format_column(
+                        result, column).items():
+                    if row_index not in final_result:
+                        final_result[row_index] = \
+                            MibTableResultRow(row_index, column_names)
+                    final_result[row_index][column] = value
+            return final_result
+
+        oids = sorted(set(self.nodes[column].oid for column in column_names))
+        deferred = self.agent_proxy.getTable([str(oid) for oid in oids])
+        deferred.addCallbacks(_result_aggregate, self._valueerror_handler,
+                              errbackArgs=(", ".join(column_names),))
+        return deferred
 
-    def retrieve_table(self, table_name):
+    def retrieve_table(self, table_name, columnar=False):
         """Table retriever and formatter.
 
         Retrieves an entire MIB table.  Returns a deferred whose
@@ -475,11 +624,17 @@ class MibRetriever(object):
         dictionary value is a MibTableResultRow instance, which can be accessed
         as both a dictionary and a list.
 
+        If columnar is True, the result is a ColumnarTableResult instead,
+        which uses far less memory for large tables.
+
         """
         table = self.tables[table_name]
 
         def _result_formatter(result):
-            formatted_result = {}
+            if columnar:
+                formatted_result = ColumnarTableResult(table.columns.keys())
+            else:
+                formatted_result = {}
             for varlist in result.values():
                 # Build a table structure
                 for oid in sorted(varlist.keys()):
@@ -502,20 +657,30 @@ class MibRetriever(object):
                         continue
                     column_name = table.reverse_column_index[column_no]
 
+                    value = varlist[oid]
+                    if column_name in self.text_columns:
+                        value = safestring(value)
+
+                    if columnar:
+                        formatted_result.add(row_index, column_name, value)
+                        continue
+
                     if row_index not in formatted_result:
                         formatted_result[row_index] = MibTableResultRow(
                             row_index,
                             table.columns.keys(),
                         )
-
-                    value = varlist[oid]
-                    if column_name in self.text_columns:
-                        value = safestring(value)
                     formatted_result[row_index][column_name] = value
 
             return formatted_result
 
-        deferred = self.agent_proxy.getTable([str(table.table.oid)])
+        # Walk the accessible columns rather than the entire table, so that
+        # the AgentProxy may retrieve several columns in parallel
+        oids = sorted(column.oid for column in table.columns.values()
+                      if column.raw_mib_data.get('access') != 'noaccess')
+        if not oids:
+            oids = [table.table.oid]
+        deferred = self.agent_proxy.getTable([str(oid) for oid in oids])
         deferred.addCallback(_result_formatter)
         return deferred
 
@@ -529,7 +694,17 @@ class MibRetriever(object):
         applied.  This is useful to insert into a callback chain for
         result formatting.
 
+        A ColumnarTableResult is translated lazily, as its values are
+        accessed.
+
         """
+        if isinstance(result, ColumnarTableResult):
+            result.set_converters(
+                dict((column, cls.nodes[column].to_python)
+                     for column in result.column_names
+                     if column in cls.nodes))
+            return result
+
         for row in result.values():
             for column in row.keys():
                 if column in cls.nodes:
@@ -92,7 +92,8 @@ class QBridgeMib(mibretriever.MibRetriever):
     def get_forwarding_database(self):
         "Retrieves the forwarding databases of the device"
         columns = yield self.retrieve_columns(['dot1qTpFdbPort',
-                                               'dot1qTpFdbStatus'])
+                                               'dot1qTpFdbStatus'],
+                                              columnar=True)
         columns = self.translate_result(columns)
         valid = (row for row in columns.values()
                  if row['dot1qTpFdbStatus'] not in ('self', 'invalid'))
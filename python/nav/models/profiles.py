@@ -376,7 +376,22 @@ class AlertAddress(models.Model):
         """Handles sending of alerts to with defined alert notification types
 
            Return value should indicate if message was sent"""
+        return self._send([alert], [subscription])
 
+    @transaction.atomic
+    def send_digest(self, alerts, subscriptions):
+        """Sends several alerts as a single message, if the alert sender
+        supports it.
+
+        :param alerts: A list of AlertQueue objects.
+        :param subscriptions: A list of the AlertSubscription objects that
+                              each of the alerts are sent due to.
+        :returns: True if the message was sent.
+
+        """
+        return self._send(alerts, subscriptions)
+
+    def _send(self, alerts, subscriptions):
         _logger = logging.getLogger('nav.alertengine.alertaddress.send')
 
         # Determine the right language for the user.
@@ -384,27 +399,32 @@ class AlertAddress(models.Model):
             Account.PREFERENCE_KEY_LANGUAGE, 'en')
 
         if not (self.address or '').strip():
-            _logger.error(
-                 'Ignoring alert %d (%s: %s)! Account %s does not have an '
-                 'address set for the alertaddress with id %d, this needs '
-                 'to be fixed before the user will recieve any alerts.',
-                 alert.id, alert, alert.netbox, self.account, self.id)
+            for alert in alerts:
+                _logger.error(
+                    'Ignoring alert %d (%s: %s)! Account %s does not have an '
+                    'address set for the alertaddress with id %d, this needs '
+                    'to be fixed before the user will recieve any alerts.',
+                    alert.id, alert, alert.netbox, self.account, self.id)
 
             return True
 
         if self.type.is_blacklisted():
             _logger.warning(
                 'Not sending alert %s to %s as handler %s is blacklisted: %s',
-                alert.id, self.address, self.type,
-                self.type.blacklist_reason())
+                ', '.join(str(alert.id) for alert in alerts), self.address,
+                self.type, self.type.blacklist_reason())
             return False
 
         try:
-            self.type.send(self, alert, language=lang)
-            _logger.info(
-                'alert %d sent by %s to %s due to %s subscription %d',
-                alert.id, self.type, self.address,
-                subscription.get_type_display(), subscription.id)
+            if len(alerts) == 1:
+                self.type.send(self, alerts[0], language=lang)
+            else:
+                self.type.send_digest(self, alerts, language=lang)
+            for alert, subscription in zip(alerts, subscriptions):
+                _logger.info(
+                    'alert %d sent by %s to %s due to %s subscription %d',
+                    alert.id, self.type, self.address,
+                    subscription.get_type_display(), subscription.id)
 
         except FatalDispatcherException as error:
             _logger.error(
@@ -456,6 +476,33 @@ class AlertSender(models.Model):
     @transaction.atomic
     def send(self, *args, **kwargs):
         """Sends an alert via this medium."""
+        # Delegate sending of message
+        return self._get_dispatcher().send(*args, **kwargs)
+
+    @transaction.atomic
+    def send_digest(self, *args, **kwargs):
+        """Sends several alerts as a single message via this medium."""
+        return self._get_dispatcher().send_digest(*args, **kwargs)
+
+    def get_digest_threshold(self):
+        """Returns the number of alerts to the same address that should be
+        sent as a single message, or 0 if this medium does not send digests.
+        """
+        if not self.supported or self.is_blacklisted():
+            return 0
+        try:
+            return self._get_dispatcher().digest_threshold
+        except Exception:  # pylint: disable=broad-except
+            # Failures to load the dispatcher are handled when sending
+            return 0
+
+    @classmethod
+    def close_dispatchers(cls):
+        """Closes connections kept open by the loaded dispatchers"""
+        for dispatcher in cls._handlers.values():
+            dispatcher.close()
+
+    def _get_dispatcher(self):
         if not self.supported:
             raise FatalDispatcherException("{} is not supported".format(self.name))
         if self.handler not in self._handlers:
@@ -463,11 +510,7 @@ class AlertSender(models.Model):
             dispatcher = dispatcher_class(
                 config=AlertSender.config.get(self.handler, {}))
             self._handlers[self.handler] = dispatcher
-        else:
-            dispatcher = self._handlers[self.handler]
-
-        # Delegate sending of message
-        return dispatcher.send(*args, **kwargs)
+        return self._handlers[self.handler]
 
     def _load_dispatcher_class(self):
         # Get config
@@ -1322,6 +1365,30 @@ class AccountAlertQueue(models.Model):
 
         return sent
 
+    @staticmethod
+    def send_digest(queued_alerts):
+        """Sends several alerts that are queued for the same alert address as
+        a single message.
+
+        :returns: True if the message was sent.
+
+        """
+        address = queued_alerts[0].subscription.alert_address
+        try:
+            sent = address.send_digest(
+                [queued.alert for queued in queued_alerts],
+                [queued.subscription for queued in queued_alerts])
+        except FatalDispatcherException:
+            for queued in queued_alerts:
+                queued.delete()
+            return False
+
+        if sent:
+            for queued in queued_alerts:
+                queued.delete()
+
+        return sent
+
 
 # Make sure you update netmap-extras.js too if you change this! ;-)
 LINK_TYPES = (2, 'Layer 2'), (3, 'Layer 3')
@@ -0,0 +1,13 @@
+-- Notify listeners, such as pping, when netboxes are added or removed, or
+-- when their sysname or IP address changes
+CREATE OR REPLACE FUNCTION notify_netbox_change()
+RETURNS trigger AS $$
+  BEGIN
+    NOTIFY netbox_changed;
+    RETURN NULL;
+  END;
+$$ language plpgsql;
+
+CREATE TRIGGER netbox_changed_notify
+    AFTER INSERT OR DELETE OR UPDATE OF sysname, ip ON netbox
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_netbox_change();
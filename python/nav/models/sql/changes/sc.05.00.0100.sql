@@ -0,0 +1,17 @@
+-- Notify listeners, such as servicemon, when services are added or removed,
+-- or when their definitions or properties change
+CREATE OR REPLACE FUNCTION notify_service_change()
+RETURNS trigger AS $$
+  BEGIN
+    NOTIFY service_changed;
+    RETURN NULL;
+  END;
+$$ language plpgsql;
+
+CREATE TRIGGER service_changed_notify
+    AFTER INSERT OR DELETE OR UPDATE OF netboxid, active, handler ON service
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_service_change();
+
+CREATE TRIGGER serviceproperty_changed_notify
+    AFTER INSERT OR DELETE OR UPDATE ON serviceproperty
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_service_change();
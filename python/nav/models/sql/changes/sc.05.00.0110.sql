@@ -0,0 +1,18 @@
+-- Notify listeners, such as eventengine, when the layer 2 topology changes,
+-- so that cached topology graphs can be discarded
+CREATE OR REPLACE FUNCTION notify_topology_change()
+RETURNS trigger AS $$
+  BEGIN
+    NOTIFY topology_changed;
+    RETURN NULL;
+  END;
+$$ language plpgsql;
+
+CREATE TRIGGER swportvlan_topology_notify
+    AFTER INSERT OR DELETE OR UPDATE ON swportvlan
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_topology_change();
+
+CREATE TRIGGER interface_topology_notify
+    AFTER INSERT OR DELETE OR UPDATE OF netboxid, to_netboxid, to_interfaceid
+    ON interface
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_topology_change();
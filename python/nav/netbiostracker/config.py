@@ -29,6 +29,11 @@ class NetbiosTrackerConfig(NAVConfigParser):
     DEFAULT_CONFIG = u"""
 [main]
 encoding = cp850
+
+[scan]
+rate = 500
+retries = 2
+timeout = 1.0
 """
 
     def get_exceptions(self):
@@ -44,6 +49,14 @@ encoding = cp850
         """Get the encoding option"""
         return self.get('main', 'encoding')
 
+    def get_scan_options(self):
+        """Get the scan options, as keyword arguments to tracker.scan()"""
+        return dict(
+            rate=self.getfloat('scan', 'rate'),
+            retries=self.getint('scan', 'retries'),
+            timeout=self.getfloat('scan', 'timeout'),
+        )
+
 
 def create_list(exceptions):
     """Create a list of single ip-adresses from a list of IP instances"""
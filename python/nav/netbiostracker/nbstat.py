@@ -0,0 +1,291 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""A NetBIOS node status (NBSTAT) scanner.
+
+All requests are sent from a single non-blocking UDP socket, at a limited
+rate, while responses are read and parsed as they arrive.  Hosts that do not
+respond within a timeout are retried a limited number of times.
+
+The results are presented the same way the nbtscan program presents them.
+
+"""
+from collections import deque, namedtuple
+import errno
+import logging
+import random
+import select
+import socket
+import struct
+import time
+
+_logger = logging.getLogger(__name__)
+
+NETBIOS_NS_PORT = 137
+DEFAULT_RATE = 500  # requests per second
+DEFAULT_RETRIES = 2
+DEFAULT_TIMEOUT = 1.0  # seconds
+
+NBSTAT = 0x0021
+CLASS_IN = 0x0001
+GROUP_NAME = 0x8000
+
+WORKSTATION = 0x00
+MESSENGER = 0x03
+FILE_SERVER = 0x20
+
+SERVER = '<server>'
+UNKNOWN = '<unknown>'
+
+_HEADER = struct.Struct('!HHHHHH')
+_RR = struct.Struct('!HHIH')
+_NAME_ENTRY = struct.Struct('!15sBH')
+
+# pylint: disable=C0103
+NetbiosResult = namedtuple('NetbiosResult',
+                           'ip name server username mac')
+
+
+class NbstatError(Exception):
+    """An NBSTAT response could not be parsed"""
+
+
+class NbstatScanner(object):
+    """Scans IPv4 addresses for NetBIOS names.
+
+    Usage example:
+
+    >>> scanner = NbstatScanner(rate=100)
+    >>> for result in scanner.scan(['10.0.0.1', '10.0.0.2']):
+    ...     print(result)
+    NetbiosResult(ip='10.0.0.2', name='WS2', server='', username='<unknown>',
+                  mac='00:11:22:33:44:55')
+
+    """
+    def __init__(self, rate=DEFAULT_RATE, retries=DEFAULT_RETRIES,
+                 timeout=DEFAULT_TIMEOUT, encoding='cp850',
+                 port=NETBIOS_NS_PORT):
+        """
+        :param rate: The maximum number of requests to send per second, or 0
+                     to send requests as fast as possible.
+        :param retries: The number of times to resend a request to an
+                        address that doesn't respond.
+        :param timeout: The number of seconds to wait for each response.
+        :param encoding: The encoding of NetBIOS names.
+        :param port: The UDP port to send requests to.
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.retries = retries
+        self.timeout = timeout
+        self.encoding = encoding
+        self.port = port
+
+    def scan(self, addresses):
+        """Scans a list of IPv4 addresses.
+
+        :param addresses: A list of IP address strings.
+        :returns: A generator of NetbiosResult tuples, in the order responses
+                  are received.
+
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        try:
+            for result in _Scan(self, sock, addresses):
+                yield result
+        finally:
+            sock.close()
+
+
+class _Scan(object):
+    """The state of a single scan"""
+
+    def __init__(self, scanner, sock, addresses):
+        self.scanner = scanner
+        self.sock = sock
+        self.unsent = deque(addresses)
+        self.pending = {}  # ip -> (transaction id, attempt number)
+        self.answered = set()
+        self.deadlines = deque()  # (deadline, ip, attempt), in send order
+        self.next_send = 0
+        self.responses = 0
+        self.timeouts = 0
+
+    def __iter__(self):
+        while self.unsent or self.pending:
+            now = time.time()
+            self._expire(now)
+            if self.unsent and now >= self.next_send:
+                ip = self.unsent.popleft()
+                if ip not in self.answered:
+                    self._send(ip, now)
+                continue
+
+            wait = []
+            if self.deadlines:
+                wait.append(self.deadlines[0][0] - now)
+            if self.unsent:
+                wait.append(self.next_send - now)
+            readable, _, _ = select.select([self.sock], [], [],
+                                           max(0, min(wait or [0])))
+            if readable:
+                result = self._receive()
+                if result:
+                    yield result
+
+        _logger.debug("scan finished: %d responses, %d addresses timed out",
+                      self.responses, self.timeouts)
+
+    def _send(self, ip, now):
+        _txid, attempt = self.pending.get(ip, (None, 0))
+        txid = random.randint(0, 0xffff)
+        try:
+            self.sock.sendto(make_request(txid), (ip, self.scanner.port))
+        except socket.error as error:
+            if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                # the send buffer is full, try again in a while
+                self.unsent.appendleft(ip)
+            else:
+                # e.g. no route to host; there is no use in retrying
+                _logger.debug("sendto %s failed: %s", ip, error)
+                self.pending.pop(ip, None)
+            self.next_send = now + self.scanner.interval
+            return
+
+        attempt += 1
+        self.pending[ip] = (txid, attempt)
+        self.deadlines.append((now + self.scanner.timeout, ip, attempt))
+        self.next_send = now + self.scanner.interval
+
+    def _expire(self, now):
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _deadline, ip, attempt = self.deadlines.popleft()
+            if ip not in self.pending or self.pending[ip][1] != attempt:
+                continue  # answered or already resent
+            if attempt <= self.scanner.retries:
+                self.unsent.append(ip)  # retry
+            else:
+                del self.pending[ip]
+                self.timeouts += 1
+
+    def _receive(self):
+        try:
+            data, (ip, _port) = self.sock.recvfrom(4096)
+        except socket.error as error:
+            _logger.debug("recvfrom failed: %s", error)
+            return
+        if ip not in self.pending:
+            return  # unsolicited or late response
+        try:
+            txid, result = parse_response(data, ip, self.scanner.encoding)
+        except NbstatError as error:
+            _logger.debug("invalid response from %s: %s", ip, error)
+            return
+        if txid != self.pending[ip][0]:
+            _logger.debug("late response from %s", ip)
+        del self.pending[ip]
+        self.answered.add(ip)
+        self.responses += 1
+        return result
+
+
+def make_request(txid):
+    """Returns an NBSTAT request packet for the wildcard name "*"."""
+    header = _HEADER.pack(txid, 0, 1, 0, 0, 0)
+    question = encode_name(b'*' + b'\x00' * 15) + struct.pack('!HH', NBSTAT,
+                                                             CLASS_IN)
+    return header + question
+
+
+def encode_name(name):
+    """Encodes a 16 byte NetBIOS name using first-level encoding"""
+    encoded = bytearray([32])
+    for char in bytearray(name):
+        encoded.append(ord('A') + (char >> 4))
+        encoded.append(ord('A') + (char & 0x0f))
+    encoded.append(0)
+    return bytes(encoded)
+
+
+def parse_response(data, ip, encoding='cp850'):
+    """Parses an NBSTAT response packet.
+
+    :returns: A (transaction id, NetbiosResult) tuple.
+    :raises: NbstatError
+
+    """
+    try:
+        txid, _flags, _qdcount, ancount, _nscount, _arcount = \
+            _HEADER.unpack_from(data)
+        if ancount < 1:
+            raise NbstatError("no answer records")
+        offset = _skip_name(data, _HEADER.size)
+        rrtype, _rrclass, _ttl, _rdlength = _RR.unpack_from(data, offset)
+        if rrtype != NBSTAT:
+            raise NbstatError("unexpected record type %r" % rrtype)
+        offset += _RR.size
+        num_names = bytearray(data[offset:offset + 1])[0]
+        offset += 1
+
+        names = []
+        for _ in range(num_names):
+            name, suffix, flags = _NAME_ENTRY.unpack_from(data, offset)
+            names.append((name.decode(encoding).rstrip(), suffix,
+                          not flags & GROUP_NAME))
+            offset += _NAME_ENTRY.size
+
+        mac = bytearray(data[offset:offset + 6])
+        if len(mac) != 6:
+            raise NbstatError("truncated unit id")
+    except (struct.error, IndexError, UnicodeDecodeError) as error:
+        raise NbstatError(error)
+
+    return txid, make_result(ip, names, mac)
+
+
+def _skip_name(data, offset):
+    length = bytearray(data[offset:offset + 1])[0]
+    if length & 0xc0 == 0xc0:
+        return offset + 2  # compressed name pointer
+    while length:
+        offset += length + 1
+        length = bytearray(data[offset:offset + 1])[0]
+    return offset + 1
+
+
+def make_result(ip, names, mac):
+    """Makes a NetbiosResult from a list of (name, suffix, is_unique) tuples,
+    the same way nbtscan presents its results.
+    """
+    computer_name = None
+    server = ''
+    username = None
+    for name, suffix, unique in names:
+        if not unique:
+            continue
+        if suffix == WORKSTATION and computer_name is None:
+            computer_name = name
+        elif suffix == FILE_SERVER:
+            server = SERVER
+        elif suffix == MESSENGER and name != computer_name:
+            username = username or name
+
+    return NetbiosResult(
+        ip=ip,
+        name=computer_name or UNKNOWN,
+        server=server,
+        username=username or UNKNOWN,
+        mac=':'.join('%02x' % octet for octet in mac),
+    )
@@ -17,23 +17,15 @@
 #
 """Module for doing netbios scans"""
 import logging
-from collections import namedtuple
 from datetime import datetime
 from functools import wraps
 from time import time
-from subprocess import Popen, PIPE
 
 from django.db import transaction
-from django.utils import six
 
 from nav.models.manage import Arp, Netbios
-from nav.macaddress import MacAddress
-
-SPLITCHAR = '!'
-
-# pylint: disable=C0103
-NetbiosResult = namedtuple('NetbiosResult',
-                           'ip name server username mac')
+from nav.netbiostracker.nbstat import (NbstatScanner, DEFAULT_RATE,
+                                       DEFAULT_RETRIES, DEFAULT_TIMEOUT)
 
 _logger = logging.getLogger(__name__)
 
@@ -75,84 +67,24 @@ def get_addresses_to_scan(exclude_list=None):
 
 
 @timed
-def scan(addresses, ignore_failed_sendto=True, encoding="cp850", verbose=False):
+def scan(addresses, encoding='cp850', rate=DEFAULT_RATE,
+         retries=DEFAULT_RETRIES, timeout=DEFAULT_TIMEOUT):
     """Scan a list of ip-addresses for netbios names
 
     :param addresses: A list of IP address strings.
-    :param ignore_failed_sendto: Whether to ignore "sendto" failures, which may
-                                 sometimes be a low-level OS error reported for
-                                 individual addresses.
-    :param: encoding: Encoding to use when communicating with nbtscan
+    :param encoding: The encoding of netbios names.
+    :param rate: The maximum number of requests to send per second.
+    :param retries: The number of times to retry addresses that don't
+                    respond.
+    :param timeout: The number of seconds to wait for a response.
+    :returns: A list of NetbiosResult tuples.
     """
-
-    command = ['nbtscan', '-f-', '-s', SPLITCHAR]
-    if verbose:
-        command.append('-v')
-
     _logger.debug('Scanning %s addresses', len(addresses))
-    proc = Popen(command, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    stdout, stderr = proc.communicate('\n'.join(addresses).encode(encoding))
-
-    if isinstance(stderr, six.binary_type):
-        stderr = stderr.decode(encoding)
-    if isinstance(stdout, six.binary_type):
-        stdout = stdout.decode(encoding)
-
-    if ignore_failed_sendto:
-        stderr = _filter_failed_sendto(stderr)
-    if stderr:
-        raise Exception(stderr)
-
-    _logger.debug('Result from scan:\n%s', stdout)
-    return stdout
-
-
-def _filter_failed_sendto(data):
-    lines = data.splitlines()
-    return '\n'.join(
-        line
-        for line in lines
-        if 'sendto failed' not in line.lower()
-    )
-
-
-@timed
-def parse(nbtscan_output, encoding=None):
-    """Parse the results from a netbios scan"""
-
-    results = nbtscan_output.split('\n')
-    parsed_results = []
-    for result in results:
-        if result:
-            try:
-                args = [x.strip() for x in result.split(SPLITCHAR)]
-                netbiosresult = NetbiosResult(*args)
-                # Handle mac address with "-" separator (FreeBSD nbtscan).
-                netbiosresult = netbiosresult._replace(
-                    mac=str(MacAddress(netbiosresult.mac)))
-            except (TypeError, ValueError):
-                _logger.error('Error parsing %s', result)
-            else:
-                parsed_results.append(netbiosresult)
-
-    return parsed_results
-
-
-@timed
-def parse_get_workstations(verbose_nbtscan_output):
-    """Parse the results from a verbose netbios scan, get only workstations"""
-
-    results = verbose_nbtscan_output.split('\n')
-    parsed_results = {}
-    for result in results:
-        if result:
-            if result[-4:] not in (':00U', ':00G'):
-                continue
-            ip, name, _ = [p.strip()
-                             for p in result.split(SPLITCHAR, 2)]
-            parsed_results[ip] = name
-            break
-    return result
+    scanner = NbstatScanner(rate=rate, retries=retries, timeout=timeout,
+                            encoding=encoding)
+    results = list(scanner.scan(addresses))
+    _logger.debug('Got %s results from scan', len(results))
+    return results
 
 
 @timed
@@ -187,12 +119,12 @@ def fetch_database_entries():
     Create a structure that is suitable for comparing as a set with other
     structures
 
+    :returns: A dict mapping (ip, name, server, username, mac) tuples to
+              netbios ids.
     """
-    database_entries = {}
-    for entry in Netbios.objects.filter(end_time=datetime.max):
-        database_entries[(entry.ip, entry.name, entry.server, entry.username,
-                          entry.mac)] = entry
-    return database_entries
+    entries = Netbios.objects.filter(end_time=datetime.max).values_list(
+        'id', 'ip', 'name', 'server', 'username', 'mac')
+    return {tuple(entry[1:]): entry[0] for entry in entries}
 
 
 @timed
@@ -200,10 +132,9 @@ def fetch_database_entries():
 def set_end_time(database_entries, entries_to_end):
     """End the entries given"""
     _logger.debug('Ending %s entries', len(entries_to_end))
-    for key in entries_to_end:
-        entry = database_entries[key]
-        entry.end_time = datetime.now()
-        entry.save()
+    if entries_to_end:
+        ids = [database_entries[key] for key in entries_to_end]
+        Netbios.objects.filter(id__in=ids).update(end_time=datetime.now())
 
 
 @timed
@@ -211,7 +142,7 @@ def set_end_time(database_entries, entries_to_end):
 def create_entries(entries_to_create):
     """Create new netbios entries for the data given"""
     _logger.debug('Creating %s new entries', len(entries_to_create))
-    for entry in entries_to_create:
-        netbios = Netbios(ip=entry.ip, mac=entry.mac or None, name=entry.name,
-                          server=entry.server, username=entry.username)
-        netbios.save()
+    Netbios.objects.bulk_create(
+        Netbios(ip=entry.ip, mac=entry.mac or None, name=entry.name,
+                server=entry.server, username=entry.username)
+        for entry in entries_to_create)
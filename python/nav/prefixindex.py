@@ -0,0 +1,154 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Longest-prefix-match lookups of IP addresses in a set of prefixes.
+
+Example:
+
+>>> index = PrefixIndex([('10.0.0.0/8', 1), ('10.0.42.0/24', 2)])
+>>> index.lookup('10.0.42.1')
+2
+>>> index.lookup('10.1.0.1')
+1
+>>> index.lookup('192.168.0.1') is None
+True
+
+"""
+from IPy import IP
+
+ADDRESS_BITS = {4: 32, 6: 128}
+_MISSING = object()
+
+
+class PrefixIndex(object):
+    """An index of IPv4 and IPv6 prefixes, each associated with an arbitrary
+    value, for finding the longest (most specific) prefix matching an address.
+
+    Prefixes are stored as integers in one hash table per prefix length, so
+    that a lookup is at most one dictionary lookup per distinct prefix length
+    in the index, starting with the longest.  Building an index is cheap, so
+    it's simpler to build a new index than to update an existing one when the
+    set of prefixes changes.
+
+    """
+    def __init__(self, prefixes=None):
+        """Initializes a prefix index.
+
+        :param prefixes: An optional iterable of (prefix, value) tuples to add
+                         to the index. Prefixes may be IPy.IP objects or
+                         strings.
+
+        """
+        # {version: {prefixlen: {network bits as int: value}}}
+        self._tables = dict((version, {}) for version in ADDRESS_BITS)
+        # {version: [prefixlen, ...]}, sorted by descending prefix length
+        self._lengths = dict((version, []) for version in ADDRESS_BITS)
+        self._count = 0
+        if prefixes:
+            for prefix, value in prefixes:
+                self.add(prefix, value)
+
+    def __len__(self):
+        return self._count
+
+    def __repr__(self):
+        return "<%s with %d prefixes>" % (self.__class__.__name__, len(self))
+
+    def add(self, prefix, value):
+        """Adds a prefix to the index.
+
+        If the same prefix is already in the index, its value is replaced.
+
+        """
+        prefix = _as_ip(prefix)
+        version = prefix.version()
+        length = prefix.prefixlen()
+        shift = ADDRESS_BITS[version] - length
+
+        tables = self._tables[version]
+        if length not in tables:
+            tables[length] = {}
+            self._lengths[version] = sorted(tables, reverse=True)
+        table = tables[length]
+
+        key = prefix.int() >> shift
+        if key not in table:
+            self._count += 1
+        table[key] = value
+
+    def match(self, address):
+        """Finds the longest prefix that contains address.
+
+        :param address: An IPy.IP object or a string.
+        :returns: A (prefix, value) tuple, where prefix is an IPy.IP object,
+                  or None if no prefix in the index contains address.
+
+        """
+        address = _as_ip(address)
+        version = address.version()
+        bits = ADDRESS_BITS[version]
+        addr = address.int()
+        tables = self._tables[version]
+        for length in self._lengths[version]:
+            shift = bits - length
+            key = addr >> shift
+            table = tables[length]
+            if key in table:
+                prefix = IP(key << shift, ipversion=version).make_net(length)
+                return prefix, table[key]
+
+    def lookup(self, address, default=None):
+        """Returns the value associated with the longest prefix that contains
+        address, or default if no prefix in the index contains it.
+
+        :param address: An IPy.IP object or a string.
+
+        """
+        address = _as_ip(address)
+        version = address.version()
+        bits = ADDRESS_BITS[version]
+        addr = address.int()
+        tables = self._tables[version]
+        for length in self._lengths[version]:
+            value = tables[length].get(addr >> (bits - length), _MISSING)
+            if value is not _MISSING:
+                return value
+        return default
+
+    def lookup_all(self, address):
+        """Returns the values associated with all the prefixes that contain
+        address, starting with the longest prefix.
+
+        :param address: An IPy.IP object or a string.
+
+        """
+        address = _as_ip(address)
+        version = address.version()
+        bits = ADDRESS_BITS[version]
+        addr = address.int()
+        tables = self._tables[version]
+        values = []
+        for length in self._lengths[version]:
+            value = tables[length].get(addr >> (bits - length), _MISSING)
+            if value is not _MISSING:
+                values.append(value)
+        return values
+
+    def __contains__(self, address):
+        return self.match(address) is not None
+
+
+def _as_ip(address):
+    return address if isinstance(address, IP) else IP(address)
@@ -19,6 +19,7 @@ import time
 import logging
 
 from django.utils import six
+from twisted.internet import defer
 
 from nav.statemon import config, RunQueue, db, statistics, event
 
@@ -65,6 +66,9 @@ class AbstractChecker(object):
         return Event.UP, version
     """
     IPV6_SUPPORT = False
+    # Whether execute_async() is implemented, so that this checker can run
+    # in the reactor instead of in a thread
+    ASYNC_SUPPORT = False
     DESCRIPTION = ""
     ARGS = ()
     OPTARGS = ()
@@ -83,6 +87,7 @@ class AbstractChecker(object):
         self.netboxid = service['netboxid']
         self.args = service['args']
         self.version = service['version']
+        self._tested_version = self.version
         self._sysname = service['sysname']
         # This is (and should be) used by all subclasses
         self.port = int(service['args'].get('port', port))
@@ -105,8 +110,21 @@ class AbstractChecker(object):
         test. If the service has been unavailable for more than self.runcount
         times, it marks the service as down.
         """
-        orig_version = self.version
         status, info = self.execute_test()
+        delay = self.handle_result(status, info)
+        if delay is not None:
+            priority = delay + time.time()
+            # Queue ourself
+            self.runq.enq((priority, self))
+
+    def handle_result(self, status, info):
+        """
+        Handles the result of a test. If the status has changed, it returns
+        the number of seconds to wait before a new test is made to confirm
+        it, otherwise it returns None. If the service has been unavailable
+        for more than self.runcount tests, it marks the service as down.
+        """
+        orig_version = self._tested_version
         service = "%s:%s" % (self.sysname, self.get_type())
         _logger.info("%-20s -> %s", service, info)
 
@@ -128,10 +146,7 @@ class AbstractChecker(object):
                          "%s)", service, delay, status, info)
             # Update metrics every time to get proper 'uptime' for the service
             self.update_stats()
-            priority = delay + time.time()
-            # Queue ourself
-            self.runq.enq((priority, self))
-            return
+            return delay
 
         if status != self.status:
             _logger.critical("%-20s -> %s, %s", service, status, info)
@@ -162,6 +177,7 @@ class AbstractChecker(object):
         self.update_stats()
         self.update_timestamp()
         self.runcount = 0
+        return None
 
     def update_stats(self):
         """Send an updated metric to the Graphite backend"""
@@ -184,6 +200,7 @@ class AbstractChecker(object):
         Calls self.execute() which should be overridden
         by each subclass.
         """
+        self._tested_version = self.version
         start = time.time()
         try:
             status, info = self.execute()
@@ -193,10 +210,41 @@ class AbstractChecker(object):
         self.response_time = time.time()-start
         return status, info
 
+    def execute_test_async(self):
+        """
+        Executes and times the test without blocking.
+        Calls self.execute_async() which should be overridden
+        by each subclass that sets ASYNC_SUPPORT.
+
+        :returns: A deferred whose result is a (status, info) tuple.
+        """
+        self._tested_version = self.version
+        start = time.time()
+
+        def _timed(result):
+            self.response_time = time.time()-start
+            return result
+
+        def _failed(failure):
+            return event.Event.DOWN, failure.getErrorMessage()
+
+        deferred = defer.maybeDeferred(self.execute_async)
+        deferred.addErrback(_failed)
+        deferred.addCallback(_timed)
+        return deferred
+
     def execute(self):
         """Executes the actual service test implemented by a plugin"""
         raise NotImplementedError
 
+    def execute_async(self):
+        """Executes the actual service test implemented by a plugin, without
+        blocking.
+
+        :returns: A deferred whose result is a (status, info) tuple.
+        """
+        raise NotImplementedError
+
     @property
     def sysname(self):
         """Returns the sysname of which this service is running on.
@@ -14,15 +14,18 @@
 # License along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
 """HTTP Service Checker"""
+import base64
 import contextlib
 import socket
 
 from django.utils.six.moves.urllib.parse import urlsplit
 from django.utils.six.moves import http_client
+from twisted.internet import defer
 
 from nav import buildconf
 from nav.statemon.event import Event
 from nav.statemon.abstractchecker import AbstractChecker
+from nav.statemon import lineclient
 
 
 class HTTPConnection(http_client.HTTPConnection):
@@ -40,6 +43,7 @@ class HTTPConnection(http_client.HTTPConnection):
 class HttpChecker(AbstractChecker):
     """HTTP"""
     IPV6_SUPPORT = True
+    ASYNC_SUPPORT = True
     DESCRIPTION = "HTTP"
     OPTARGS = (
         ('url', ''),
@@ -58,35 +62,94 @@ class HttpChecker(AbstractChecker):
 
     def execute(self):
         ip, port = self.get_address()
-        url = self.args.get('url', '')
-        username = self.args.get('username')
-        password = self.args.get('password', '')
-        if not url:
-            url = "/"
-        _protocol, vhost, path, query, _fragment = urlsplit(url)
+        url, vhost, path = self._get_request_target()
 
         with contextlib.closing(self.connect(ip, port or self.PORT)) as i:
 
             if vhost:
                 i.host = vhost
 
-            if '?' in url:
-                path = path + '?' + query
             i.putrequest('GET', path)
-            i.putheader('User-Agent',
-                        'NAV/servicemon; version %s' % buildconf.VERSION)
-            if username:
-                auth = "%s:%s" % (username, password)
-                i.putheader("Authorization", "Basic %s" % auth.encode("base64"))
+            for header, value in self._get_headers():
+                i.putheader(header, value)
             i.endheaders()
             response = i.getresponse()
-            if 200 <= response.status < 400 or (response.status == 401 and not username):
-                status = Event.UP
-                version = response.getheader('SERVER')
-                self.version = version
-                info = 'OK (%s) %s' % (str(response.status), version)
-            else:
-                status = Event.DOWN
-                info = 'ERROR (%s) %s' % (str(response.status), url)
-
-            return status, info
+            return self._evaluate_response(url, response.status,
+                                           response.getheader('SERVER'))
+
+    @defer.inlineCallbacks
+    def execute_async(self):
+        ip, port = self.get_address()
+        port = port or self.PORT
+        url, vhost, path = self._get_request_target()
+
+        client = yield lineclient.connect(ip, port, self.timeout)
+        try:
+            client.write_line(('GET %s HTTP/1.0' % path).encode('utf-8'))
+            host = make_host_header(vhost or ip, port, self.PORT)
+            headers = [('Host', host)] + self._get_headers()
+            for header, value in headers:
+                client.write_line(('%s: %s' % (header, value)).encode('utf-8'))
+            client.write_line(b'')
+
+            status_line = yield client.read_line()
+            status = parse_status_line(status_line)
+            server = None
+            while True:
+                line = yield client.read_line()
+                if not line:
+                    break
+                name, _sep, value = line.partition(b':')
+                if name.strip().lower() == b'server':
+                    server = value.strip().decode('latin-1')
+        finally:
+            client.close()
+        defer.returnValue(self._evaluate_response(url, status, server))
+
+    def _get_request_target(self):
+        """Returns a tuple of the configured URL, its virtual host name and
+        the path (and query) to request.
+        """
+        url = self.args.get('url', '')
+        if not url:
+            url = "/"
+        _protocol, vhost, path, query, _fragment = urlsplit(url)
+        if '?' in url:
+            path = path + '?' + query
+        return url, vhost, path or '/'
+
+    def _get_headers(self):
+        headers = [('User-Agent',
+                    'NAV/servicemon; version %s' % buildconf.VERSION)]
+        username = self.args.get('username')
+        if username:
+            password = self.args.get('password', '')
+            auth = "%s:%s" % (username, password)
+            auth = base64.b64encode(auth.encode('utf-8')).decode('ascii')
+            headers.append(("Authorization", "Basic %s" % auth))
+        return headers
+
+    def _evaluate_response(self, url, status, version):
+        username = self.args.get('username')
+        if 200 <= status < 400 or (status == 401 and not username):
+            self.version = version
+            return Event.UP, 'OK (%s) %s' % (str(status), version)
+        else:
+            return Event.DOWN, 'ERROR (%s) %s' % (str(status), url)
+
+
+def make_host_header(host, port, default_port):
+    """Makes a Host header value the same way http_client does"""
+    if ':' in host:
+        host = '[%s]' % host
+    if port != default_port:
+        host = '%s:%s' % (host, port)
+    return host
+
+
+def parse_status_line(line):
+    """Returns the status code from an HTTP response status line"""
+    parts = line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith(b'HTTP/'):
+        raise ValueError("Invalid HTTP status line: %r" % line[:80])
+    return int(parts[1])
@@ -39,6 +39,8 @@ class HTTPSConnection(http_client.HTTPSConnection):
 
 class HttpsChecker(HttpChecker):
     """HTTPS"""
+    # TLS conversations are left to the synchronous implementation
+    ASYNC_SUPPORT = False
     PORT = 443
 
     def connect(self, ip, port):
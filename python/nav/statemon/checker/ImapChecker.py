@@ -19,8 +19,11 @@ import contextlib
 import socket
 import imaplib
 
+from twisted.internet import defer
+
 from nav.statemon.abstractchecker import AbstractChecker
 from nav.statemon.event import Event
+from nav.statemon import lineclient
 
 
 # pylint: disable=R0904
@@ -44,6 +47,7 @@ class ImapChecker(AbstractChecker):
     password
     """
     IPV6_SUPPORT = True
+    ASYNC_SUPPORT = True
     DESCRIPTION = "Internet mail application protocol"
     ARGS = (
         ('username', ''),
@@ -67,14 +71,65 @@ class ImapChecker(AbstractChecker):
             if user:
                 session.login(user, passwd)
                 session.logout()
-            version = ''
-            ver = ver.split(' ')
-            if len(ver) >= 2:
-                for i in ver[2:]:
-                    if i != "at":
-                        version += "%s " % i
-                    else:
-                        break
+            version = get_version(ver)
             self.version = version
 
             return Event.UP, version
+
+    @defer.inlineCallbacks
+    def execute_async(self):
+        user = self.args.get("username", "")
+        ip, port = self.get_address()
+        passwd = self.args.get("password", "")
+        client = yield lineclient.connect(ip, port, self.timeout)
+        try:
+            ver = yield client.read_line()
+            if not ver.startswith(b'* OK') and not ver.startswith(b'* PREAUTH'):
+                raise imaplib.IMAP4.error(ver.decode('utf-8', 'replace'))
+            if user:
+                client.write_line(b'a1 LOGIN ' + quote(user) + b' ' +
+                                  quote(passwd))
+                yield read_tagged_response(client, b'a1')
+                client.write_line(b'a2 LOGOUT')
+                yield read_tagged_response(client, b'a2')
+        finally:
+            client.close()
+        version = get_version(ver)
+        self.version = version
+        defer.returnValue((Event.UP, version))
+
+
+@defer.inlineCallbacks
+def read_tagged_response(client, tag):
+    """Reads lines from a LineClient until the response tagged by tag.
+
+    :raises imaplib.IMAP4.error: if the tagged response isn't OK.
+    """
+    prefix = tag + b' '
+    line = yield client.read_line()
+    while not line.startswith(prefix):
+        line = yield client.read_line()
+    if not line[len(prefix):].startswith(b'OK'):
+        raise imaplib.IMAP4.error(line.decode('utf-8', 'replace'))
+    defer.returnValue(line)
+
+
+def quote(arg):
+    """Quotes a string argument to an IMAP command"""
+    arg = arg.replace('\\', '\\\\').replace('"', '\\"')
+    return ('"%s"' % arg).encode('utf-8')
+
+
+def get_version(welcome):
+    """Extracts a server version from an IMAP welcome message"""
+    if isinstance(welcome, bytes):
+        welcome = welcome.decode('utf-8', 'replace')
+    version = ''
+    ver = welcome.split(' ')
+    if len(ver) >= 2:
+        for i in ver[2:]:
+            if i != "at":
+                version += "%s " % i
+            else:
+                break
+    return version
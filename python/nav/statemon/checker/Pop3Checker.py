@@ -17,13 +17,17 @@
 import socket
 import poplib
 
+from twisted.internet import defer
+
 from nav.statemon.abstractchecker import AbstractChecker
 from nav.statemon.event import Event
+from nav.statemon import lineclient
 
 
 class Pop3Checker(AbstractChecker):
     """Post office protocol"""
     IPV6_SUPPORT = True
+    ASYNC_SUPPORT = True
     DESCRIPTION = "Post office protocol"
     ARGS = (
         ('username', ''),
@@ -48,20 +52,65 @@ class Pop3Checker(AbstractChecker):
                 conn.user(user)
                 conn.pass_(passwd)
                 len(conn.list()[1])
-            version = ''
-            ver = ver.split(' ')
-            if len(ver) >= 1:
-                for i in ver[1:]:
-                    if i != "server":
-                        version += "%s " % i
-                    else:
-                        break
+            version = get_version(ver)
             self.version = version
         finally:
             conn.quit()
 
         return Event.UP, version
 
+    @defer.inlineCallbacks
+    def execute_async(self):
+        user = self.args.get("username", "")
+        passwd = self.args.get("password", "")
+        ip, port = self.get_address()
+        client = yield lineclient.connect(ip, port, self.timeout)
+        try:
+            ver = yield read_response(client)
+            if user:
+                client.write_line(b'USER ' + user.encode('utf-8'))
+                yield read_response(client)
+                client.write_line(b'PASS ' + passwd.encode('utf-8'))
+                yield read_response(client)
+                client.write_line(b'LIST')
+                yield read_response(client)
+                line = yield client.read_line()
+                while line != b'.':
+                    line = yield client.read_line()
+            client.write_line(b'QUIT')
+        finally:
+            client.close()
+        version = get_version(ver)
+        self.version = version
+        defer.returnValue((Event.UP, version))
+
+
+@defer.inlineCallbacks
+def read_response(client):
+    """Reads a single line response from a LineClient.
+
+    :raises poplib.error_proto: if the response isn't positive.
+    """
+    line = yield client.read_line()
+    if not line.startswith(b'+'):
+        raise poplib.error_proto(line.decode('utf-8', 'replace'))
+    defer.returnValue(line)
+
+
+def get_version(welcome):
+    """Extracts a server version from a POP3 welcome message"""
+    if isinstance(welcome, bytes):
+        welcome = welcome.decode('utf-8', 'replace')
+    version = ''
+    ver = welcome.split(' ')
+    if len(ver) >= 1:
+        for i in ver[1:]:
+            if i != "server":
+                version += "%s " % i
+            else:
+                break
+    return version
+
 
 class PopConnection(poplib.POP3):
     """Customized POP3 protocol interface"""
@@ -17,13 +17,17 @@
 import select
 import socket
 
+from twisted.internet import defer
+
 from nav.statemon.abstractchecker import AbstractChecker
+from nav.statemon import lineclient
 from nav.statemon.event import Event
 
 
 class PortChecker(AbstractChecker):
     """Generic TCP port checker"""
     IPV6_SUPPORT = True
+    ASYNC_SUPPORT = True
     DESCRIPTION = "Generic port checker"
     ARGS = (
         ('port', ''),
@@ -43,3 +47,17 @@ class PortChecker(AbstractChecker):
         sock.close()
 
         return status, txt
+
+    @defer.inlineCallbacks
+    def execute_async(self):
+        ip, port = self.get_address()
+        client = yield lineclient.connect(ip, port, self.timeout)
+        try:
+            # Like execute(), the service is considered alive whether it
+            # greets us or not
+            yield client.read_line()
+        except Exception:  # pylint: disable=broad-except
+            pass
+        finally:
+            client.close()
+        defer.returnValue((Event.UP, 'Alive'))
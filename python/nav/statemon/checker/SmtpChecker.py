@@ -18,13 +18,17 @@ import re
 import socket
 import smtplib
 
+from twisted.internet import defer
+
 from nav.statemon.abstractchecker import AbstractChecker
 from nav.statemon.event import Event
+from nav.statemon import lineclient
 
 
 class SmtpChecker(AbstractChecker):
     """SMTP"""
     IPV6_SUPPORT = True
+    ASYNC_SUPPORT = True
     DESCRIPTION = "Simple mail transport protocol"
     OPTARGS = (
         ('port', ''),
@@ -45,6 +49,20 @@ class SmtpChecker(AbstractChecker):
             smtp.quit()
         except smtplib.SMTPException:
             pass
+        return self._evaluate_greeting(code, msg)
+
+    @defer.inlineCallbacks
+    def execute_async(self):
+        ip, port = self.get_address()
+        client = yield lineclient.connect(ip, port, self.timeout)
+        try:
+            code, msg = yield read_reply(client)
+            client.write_line(b'QUIT')
+        finally:
+            client.close()
+        defer.returnValue(self._evaluate_greeting(code, msg.decode("utf-8")))
+
+    def _evaluate_greeting(self, code, msg):
         if code != 220:
             return Event.DOWN, msg
         try:
@@ -58,6 +76,28 @@ class SmtpChecker(AbstractChecker):
         return Event.UP, msg
 
 
+@defer.inlineCallbacks
+def read_reply(client):
+    """Reads a possibly multi-line SMTP reply from a LineClient, the same way
+    smtplib.SMTP.getreply() does.
+
+    :returns: A deferred whose result is a (code, message) tuple, where
+              message is the text of all lines of the reply, separated by
+              newlines.
+    """
+    lines = []
+    while True:
+        line = yield client.read_line()
+        lines.append(line[4:].strip(b' \t\r\n'))
+        if line[3:4] != b'-':
+            break
+    try:
+        code = int(line[:3])
+    except ValueError:
+        code = -1
+    defer.returnValue((code, b"\n".join(lines)))
+
+
 # pylint: disable=R0904
 class SMTP(smtplib.SMTP):
     """A customized SMTP protocol interface"""
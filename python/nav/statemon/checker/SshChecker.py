@@ -18,13 +18,17 @@
 
 import socket
 
+from twisted.internet import defer
+
 from nav.statemon.abstractchecker import AbstractChecker
 from nav.statemon.event import Event
+from nav.statemon import lineclient
 
 
 class SshChecker(AbstractChecker):
     """Checks for SSH availability"""
     IPV6_SUPPORT = True
+    ASYNC_SUPPORT = True
     DESCRIPTION = "Secure shell server"
     OPTARGS = (
         ('port', ''),
@@ -41,8 +45,7 @@ class SshChecker(AbstractChecker):
                                             self.timeout)
             stream = sock.makefile('rw')
             version = stream.readline().strip()
-            protocol, major = version.split('-')[:2]
-            stream.write("%s-%s-%s" % (protocol, major, "NAV_Servicemon"))
+            stream.write(make_version_reply(version))
             stream.flush()
         except Exception as err:
             return (Event.DOWN,
@@ -55,3 +58,33 @@ class SshChecker(AbstractChecker):
                 pass  # sock was never created
         self.version = version
         return Event.UP, version
+
+    @defer.inlineCallbacks
+    def execute_async(self):
+        ip, port = self.get_address()
+        try:
+            client = yield lineclient.connect(ip, port, self.timeout)
+            try:
+                line = yield client.read_line()
+                version = line.strip().decode('utf-8', 'replace')
+                client.write_line(make_version_reply(version).encode('utf-8'))
+            finally:
+                client.close()
+        except Exception as err:
+            result = (Event.DOWN,
+                      "Failed to send version reply to %s: %s" % (
+                          self.get_address(), str(err)))
+        else:
+            self.version = version
+            result = (Event.UP, version)
+        defer.returnValue(result)
+
+
+def make_version_reply(version):
+    """Makes our identification string in reply to the identification
+    string of an SSH server.
+
+    :raises ValueError: if the server's identification string is invalid.
+    """
+    protocol, major = version.split('-')[:2]
+    return "%s-%s-%s" % (protocol, major, "NAV_Servicemon")
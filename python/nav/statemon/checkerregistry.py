@@ -0,0 +1,120 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Incremental bookkeeping of service checker instances"""
+import logging
+
+from . import checkermap
+from .event import Event
+
+_logger = logging.getLogger(__name__)
+
+
+class CheckerRegistry(object):
+    """Keeps one service checker instance per service id.
+
+    Checkers are only rebuilt when the definition of their service changes,
+    so that unchanged checkers keep their state between reloads of the
+    service list.
+
+    """
+    def __init__(self, get_checker_class=checkermap.get):
+        """
+        :param get_checker_class: A function that returns a checker class
+                                  from a handler name, or None if there is
+                                  no such checker.
+        """
+        self.get_checker_class = get_checker_class
+        self.checkers = {}  # serviceid -> checker
+        self._definitions = {}  # serviceid -> definition of the service
+
+    def __len__(self):
+        return len(self.checkers)
+
+    def __iter__(self):
+        return iter(self.checkers.values())
+
+    def update(self, services, use_db_status):
+        """Updates the registry from a list of service definitions.
+
+        :param services: An iterable of service dicts, with the keys id,
+                         netboxid, handler, ip, sysname, args, version and
+                         up.
+        :param use_db_status: If true, new checkers start out with the
+                              status recorded in the database, otherwise
+                              they start out as up. Rebuilt checkers keep the
+                              status of the checker they replace.
+        :returns: A tuple (added, changed, removed) of sets of service ids.
+
+        """
+        seen = set()
+        added = set()
+        changed = set()
+        for service in services:
+            serviceid = service['id']
+            seen.add(serviceid)
+            definition = get_definition(service)
+            old_checker = self.checkers.get(serviceid)
+            if (old_checker is not None
+                    and self._definitions.get(serviceid) == definition):
+                continue
+
+            if old_checker is not None:
+                status = old_checker.status
+            elif use_db_status:
+                status = Event.UP if service['up'] == 'y' else Event.DOWN
+            else:
+                status = Event.UP
+            checker = self._make_checker(service, status)
+            if checker is None:
+                self.checkers.pop(serviceid, None)
+                self._definitions.pop(serviceid, None)
+                continue
+            if old_checker is None:
+                added.add(serviceid)
+            else:
+                changed.add(serviceid)
+            self.checkers[serviceid] = checker
+            self._definitions[serviceid] = definition
+
+        removed = set(self.checkers).difference(seen)
+        for serviceid in removed:
+            del self.checkers[serviceid]
+            del self._definitions[serviceid]
+        return added, changed, removed
+
+    def _make_checker(self, service, status):
+        handler = service['handler']
+        checker_class = self.get_checker_class(handler)
+        if not checker_class:
+            _logger.critical("no such checker: %s", handler)
+            return None
+        try:
+            checker = checker_class(service, status=status)
+        except Exception:  # pylint: disable=broad-except
+            _logger.critical("Checker %s (%s) failed to init. This checker "
+                             "will remain DISABLED:", handler, checker_class,
+                             exc_info=True)
+            return None
+        setattr(checker, 'active', service.get('active', True))
+        return checker
+
+
+def get_definition(service):
+    """Returns the parts of a service dict that require a checker to be
+    rebuilt when they change.
+    """
+    return (service['netboxid'], service['handler'], service['ip'],
+            service['sysname'], sorted(service['args'].items()))
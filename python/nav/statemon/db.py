@@ -39,7 +39,7 @@ from psycopg2.errorcodes import lookup as pg_err_lookup
 from nav.db import get_connection_string
 from nav.util import synchronized
 
-from . import checkermap
+from .checkerregistry import CheckerRegistry
 from .event import Event
 
 
@@ -70,13 +70,18 @@ class _DB(threading.Thread):
         self.queue = queue.Queue()
         self._hosts_to_ping = []
         self._checkers = []
+        self._registry = CheckerRegistry()
         self.db = None
+        # Incremented every time a new connection is made, since
+        # subscriptions to notifications don't survive a reconnect
+        self.connection_count = 0
 
     def connect(self):
         """Connects to the NAV database"""
         try:
             conn_str = get_connection_string(script_name='servicemon')
             self.db = psycopg2.connect(conn_str)
+            self.connection_count += 1
             atexit.register(self.close)
 
             _logger.info("Successfully (re)connected to NAVdb")
@@ -206,6 +211,38 @@ class _DB(threading.Thread):
                 self.db.rollback()
             raise DbError()
 
+    @synchronized(_queryLock)
+    def listen(self, channel):
+        """Subscribes to notifications on a channel.
+
+        :returns: The connection_count of the subscribed connection.
+
+        """
+        try:
+            cursor = self.cursor()
+            cursor.execute('LISTEN %s' % channel)
+            self.db.commit()
+        except Exception:
+            _logger.critical("Could not listen to %s", channel, exc_info=True)
+            raise DbError()
+        return self.connection_count
+
+    @synchronized(_queryLock)
+    def get_notifications(self):
+        """Returns the channel names of the notifications received since the
+        last call.
+
+        """
+        try:
+            self.db.poll()
+        except Exception:
+            _logger.critical("Could not poll for notifications",
+                             exc_info=True)
+            raise DbError()
+        channels = [notify.channel for notify in self.db.notifies]
+        del self.db.notifies[:]
+        return channels
+
     def new_event(self, event):
         """Places a new event on the queue to be posted to the db"""
         self.queue.put(event)
@@ -255,22 +292,19 @@ class _DB(threading.Thread):
             return self._hosts_to_ping
         return self._hosts_to_ping
 
-    def get_checkers(self, use_db_status, onlyactive=1):
+    def get_services(self, onlyactive=1):
         """
-        Returns a list of service checker instances based on the database
-        service handler registry.
+        Returns a list of service dicts, with the keys id, netboxid,
+        active, handler, version, ip, sysname, up and args.
 
+        :raises DbError: if the services could not be read.
         """
         query = """SELECT serviceid, property, value
         FROM serviceproperty
         order BY serviceid"""
 
         properties = defaultdict(dict)
-        try:
-            dbprops = self.query(query)
-        except DbError:
-            return self._checkers
-        for serviceid, prop, value in dbprops:
+        for serviceid, prop, value in self.query(query):
             if value:
                 properties[serviceid][prop] = value
 
@@ -278,48 +312,42 @@ class _DB(threading.Thread):
         service.active, handler, version, ip, sysname, service.up
         FROM service JOIN netbox ON
         (service.netboxid=netbox.netboxid) order by serviceid"""
-        try:
-            fromdb = self.query(query)
-        except DbError:
-            return self._checkers
 
-        self._checkers = []
+        services = []
         for (serviceid, netboxid, active, handler, version, ip,
-             sysname, upstate) in fromdb:
-            checker = checkermap.get(handler)
-            if not checker:
-                _logger.critical("no such checker: %s", handler)
+             sysname, upstate) in self.query(query):
+            if onlyactive and not active:
                 continue
-            service = {
+            services.append({
                 'id': serviceid,
                 'netboxid': netboxid,
+                'active': active,
+                'handler': handler,
                 'ip': ip,
                 'sysname': sysname,
                 'args': properties[serviceid],
-                'version': version
-                }
+                'version': version,
+                'up': upstate,
+            })
+        return services
 
-            kwargs = {}
-            if use_db_status:
-                if upstate == 'y':
-                    upstate = Event.UP
-                else:
-                    upstate = Event.DOWN
-                kwargs['status'] = upstate
-
-            try:
-                new_checker = checker(service, **kwargs)
-            except Exception:
-                _logger.critical("Checker %s (%s) failed to init. This checker "
-                                 "will remain DISABLED:", handler, checker,
-                                 exc_info=True)
-                continue
+    def get_checkers(self, use_db_status, onlyactive=1):
+        """
+        Returns a list of service checker instances based on the database
+        service handler registry.
 
-            if onlyactive and not active:
-                continue
-            else:
-                setattr(new_checker, 'active', active)
+        Checkers of services that haven't changed since the last call are
+        the same instances as were returned by the last call.
 
-            self._checkers += [new_checker]
-        _logger.info("Returned %s checkers", len(self._checkers))
+        """
+        try:
+            services = self.get_services(onlyactive)
+        except DbError:
+            return self._checkers
+        added, changed, removed = self._registry.update(services,
+                                                        use_db_status)
+        self._checkers = list(self._registry)
+        _logger.info("Returned %s checkers (%d added, %d changed, "
+                     "%d removed)", len(self._checkers), len(added),
+                     len(changed), len(removed))
         return self._checkers
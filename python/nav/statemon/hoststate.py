@@ -0,0 +1,113 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Reachability state tracking for pinged netboxes"""
+
+from .netbox import Netbox
+
+
+class HostStates(object):
+    """Keeps track of the netboxes to ping and of their reachability.
+
+    Instead of keeping a history of round trip times for each netbox, only
+    the number of consecutive unanswered requests is kept, so that state
+    changes can be found as each ping result is added.
+
+    """
+    def __init__(self, threshold):
+        """
+        :param threshold: The number of consecutive unanswered requests
+                          needed before a netbox is considered down.
+        """
+        self.threshold = threshold
+        self.netboxes = {}  # netboxid -> Netbox
+        self.ip_to_netboxid = {}
+        self.misses = {}  # netboxid -> consecutive unanswered requests
+        self.down = set()
+
+    def __len__(self):
+        return len(self.netboxes)
+
+    def set_netboxes(self, rows):
+        """Updates the set of netboxes to ping.
+
+        Netboxes new to this tracker, which are marked as down in the
+        database, start out as down, without being reported as state changes.
+
+        :param rows: An iterable of (netboxid, sysname, ip, up) tuples.
+        :returns: A tuple (added, changed, removed) of sets of netbox ids,
+                  where changed are netboxes whose sysname or IP address
+                  changed.
+
+        """
+        seen = set()
+        added = set()
+        changed = set()
+        for netboxid, sysname, ip, up in rows:
+            seen.add(netboxid)
+            netbox = self.netboxes.get(netboxid)
+            if netbox is None:
+                added.add(netboxid)
+                self.netboxes[netboxid] = Netbox(netboxid, sysname, ip, up)
+                self.ip_to_netboxid[ip] = netboxid
+                if up != 'y':
+                    self.misses[netboxid] = self.threshold
+                    self.down.add(netboxid)
+                else:
+                    self.misses[netboxid] = 0
+            elif netbox.sysname != sysname or netbox.ip != ip:
+                changed.add(netboxid)
+                if self.ip_to_netboxid.get(netbox.ip) == netboxid:
+                    del self.ip_to_netboxid[netbox.ip]
+                netbox.sysname, netbox.ip = sysname, ip
+                self.ip_to_netboxid[ip] = netboxid
+
+        removed = set(self.netboxes).difference(seen)
+        for netboxid in removed:
+            netbox = self.netboxes.pop(netboxid)
+            if self.ip_to_netboxid.get(netbox.ip) == netboxid:
+                del self.ip_to_netboxid[netbox.ip]
+            del self.misses[netboxid]
+            self.down.discard(netboxid)
+        return added, changed, removed
+
+    def update(self, results):
+        """Updates the reachability states with a round of ping results.
+
+        :param results: An iterable of (ip, rtt) tuples, where rtt is -1 if
+                        the host didn't reply.
+        :returns: A tuple (went_down, came_up) of lists of netbox ids whose
+                  state changed.
+
+        """
+        went_down = []
+        came_up = []
+        misses = self.misses
+        for ip, rtt in results:
+            netboxid = self.ip_to_netboxid.get(ip)
+            if netboxid is None:
+                continue
+            if rtt == -1:
+                count = misses[netboxid] + 1
+                misses[netboxid] = count
+                if count >= self.threshold and netboxid not in self.down:
+                    self.down.add(netboxid)
+                    went_down.append(netboxid)
+            else:
+                misses[netboxid] = 0
+                if netboxid in self.down:
+                    self.down.discard(netboxid)
+                    came_up.append(netboxid)
+        return went_down, came_up
@@ -0,0 +1,141 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Asynchronous conversations with line based TCP services.
+
+A LineClient lets a service checker hold a conversation with a TCP service,
+such as an SMTP or a POP3 server, in the Twisted reactor:
+
+>>> @defer.inlineCallbacks
+... def check(ip, port):
+...     client = yield connect(ip, port, timeout=5)
+...     try:
+...         banner = yield client.read_line()
+...         client.write_line(b'QUIT')
+...     finally:
+...         client.close()
+...     defer.returnValue(banner)
+
+Every operation is bounded by the timeout given to connect(), and the entire
+conversation by twice that timeout.  When an operation times out, the
+connection is closed.
+
+"""
+from collections import deque
+
+from twisted.internet import defer, protocol, reactor
+from twisted.internet.error import ConnectionDone, TimeoutError
+
+# Lines longer than this are considered a protocol violation
+MAX_LINE_LENGTH = 16384
+
+
+class LineTooLong(Exception):
+    """A line received from a service was longer than MAX_LINE_LENGTH"""
+
+
+class LineClient(protocol.Protocol):
+    """A protocol to read and write lines one at a time"""
+    delimiter = b'\n'
+
+    def __init__(self, timeout, clock=reactor):
+        self.timeout = timeout
+        self.clock = clock
+        self.deadline = clock.seconds() + 2 * timeout
+        self._buffer = b''
+        self._lines = deque()
+        self._waiting = None
+        self._timer = None
+        self._reason = None
+
+    def dataReceived(self, data):
+        self._buffer += data
+        lines = self._buffer.split(self.delimiter)
+        self._buffer = lines.pop()
+        self._lines.extend(line.rstrip(b'\r') for line in lines)
+        if len(self._buffer) > MAX_LINE_LENGTH:
+            self._abort(LineTooLong("line exceeds %d octets" %
+                                    MAX_LINE_LENGTH))
+        self._deliver()
+
+    def connectionLost(self, reason=ConnectionDone):
+        if self._buffer:
+            self._lines.append(self._buffer)
+            self._buffer = b''
+        if self._reason is None:
+            self._reason = reason
+        self._deliver()
+
+    def read_line(self):
+        """Reads the next line from the service, without its line ending.
+
+        :returns: A deferred whose result is a line of bytes.
+
+        """
+        if self._waiting is not None:
+            raise RuntimeError("already waiting for a line")
+        self._waiting = defer.Deferred()
+        timeout = min(self.timeout, self.deadline - self.clock.seconds())
+        self._timer = self.clock.callLater(
+            max(0, timeout), self._abort,
+            TimeoutError("timed out after %s seconds" % self.timeout))
+        waiting = self._waiting
+        self._deliver()
+        return waiting
+
+    def write_line(self, line):
+        """Writes a line to the service, adding a CRLF line ending"""
+        self.transport.write(line + b'\r\n')
+
+    def close(self):
+        """Closes the connection to the service"""
+        if self.transport is not None:
+            self.transport.loseConnection()
+
+    def _deliver(self):
+        if self._waiting is None:
+            return
+        if self._lines:
+            self._fire(self._waiting.callback, self._lines.popleft())
+        elif self._reason is not None:
+            self._fire(self._waiting.errback, self._reason)
+
+    def _fire(self, method, result):
+        self._waiting = None
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        self._timer = None
+        method(result)
+
+    def _abort(self, error):
+        self._reason = error
+        self._lines.clear()
+        self._buffer = b''
+        if self.transport is not None:
+            self.transport.abortConnection()
+        self._deliver()
+
+
+def connect(host, port, timeout, clock=reactor):
+    """Connects to a line based TCP service.
+
+    :param host: An IPv4 or IPv6 address.
+    :param timeout: The number of seconds to wait for the connection to be
+                    established, and for each subsequent line to be read.
+    :returns: A deferred whose result is a connected LineClient.
+
+    """
+    creator = protocol.ClientCreator(clock, LineClient, timeout, clock)
+    return creator.connectTCP(host, port, timeout=timeout)
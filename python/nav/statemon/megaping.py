@@ -13,18 +13,25 @@
 # details.  You should have received a copy of the GNU General Public License
 # along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
-"""Ping multiple hosts at once."""
+"""Ping multiple hosts at once.
+
+All echo requests are sent and all replies are received by a single thread,
+using non-blocking sockets and select().  Requests are paced by a token
+bucket, and every host gets its own reply timeout, derived from the round trip
+times previously measured for it.
+
+"""
 
-import threading
 import time
 import socket
 import select
+import struct
 import os
-import random
+import errno
+import heapq
 import logging
-import hashlib
+from collections import deque
 
-from nav.daemon import safesleep as sleep
 from nav.statemon import config
 
 from .icmppacket import ICMP_MINLEN, PacketV4, PacketV6
@@ -32,6 +39,21 @@ from .icmppacket import ICMP_MINLEN, PacketV4, PacketV6
 
 _logger = logging.getLogger(__name__)
 
+# The echo request payload starts with a cookie identifying the request: A
+# random per-process salt, the index of the destination host and the number
+# of the ping round.
+COOKIE = struct.Struct('!8sII')
+COOKIE_LENGTH = COOKIE.size
+SALT = os.urandom(8)
+
+# Offsets of the fields that change between echo requests to the same host
+_CHECKSUM_OFFSET = 2
+_SEQUENCE_OFFSET = 6
+_ROUND_OFFSET = ICMP_MINLEN + 12
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS)
+RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
+
 
 # pylint: disable=W0703
 def make_sockets():
@@ -59,18 +81,24 @@ def make_sockets():
 
 class Host(object):
     """
-    Contains the destination address and current sequence number of a host.
+    Contains the destination address and current sequence number of a host,
+    as well as estimates of its round trip time.
     """
-    COOKIE_LENGTH = len(hashlib.new('md5').digest())
+    COOKIE_LENGTH = COOKIE_LENGTH
 
-    def __init__(self, ip):
+    def __init__(self, ip, index=0):
         self.ip = ip
-        # Random value for the cookie
-        self.rnd = random.randint(10000, 2**16-1)
+        # Identifies this host in the cookie of its echo requests
+        self.index = index
         # Time the echo was sent
         self.time = 0
         # Used in nextseq
         self.certain = 0
+        # Smoothed round trip time and round trip time variation
+        self.srtt = None
+        self.rttvar = None
+        # Reply timeout, or None if it must be the maximum timeout
+        self.rto = None
 
         # Check IP version and choose packet class
         if self.is_valid_ipv6():
@@ -82,6 +110,7 @@ class Host(object):
 
         self.packet.id = os.getpid() % 65536
         self.reply = None
+        self._layout = None
 
     def make_packet(self, size, cookie=None):
         """Makes the next echo reply packet"""
@@ -90,15 +119,72 @@ class Host(object):
         self.packet.data = cookie.ljust(size-ICMP_MINLEN)
         return self.packet.assemble(), cookie
 
-    def make_cookie(self):
+    def make_cookie(self, round_=0):
         """Makes and returns a request identifier to be used as data in a ping
         packet.
         """
-        cookie = hashlib.new('md5')
-        cookie.update(self.ip.encode('ASCII'))
-        cookie.update(str(self.rnd).encode('ASCII'))
-        cookie.update(str(self.time).encode('ASCII'))
-        return cookie.digest()
+        return COOKIE.pack(SALT, self.index, round_ & 0xffffffff)
+
+    def make_echo(self, size, round_):
+        """Makes the next echo request packet for a ping round.
+
+        This is equivalent to make_packet(size, make_cookie(round_)), but
+        everything except the sequence number, round number and checksum is
+        laid out and summed up only once.
+
+        """
+        if self._layout is None or self._layout[0] != size:
+            self._layout = self._make_layout(size)
+        _size, template, partial_sum = self._layout
+
+        sequence = self.packet.sequence
+        round_field = struct.pack('!I', round_ & 0xffffffff)
+        sum_ = partial_sum + sequence + sum(struct.unpack('HH', round_field))
+        sum_ = (sum_ & 0xffff) + (sum_ >> 16)
+        sum_ = (sum_ & 0xffff) + (sum_ >> 16)
+
+        packet = bytearray(template)
+        struct.pack_into('H', packet, _CHECKSUM_OFFSET, ~sum_ & 0xffff)
+        struct.pack_into('H', packet, _SEQUENCE_OFFSET, sequence)
+        packet[_ROUND_OFFSET:_ROUND_OFFSET + 4] = round_field
+        return bytes(packet)
+
+    def _make_layout(self, size):
+        packet = self.packet
+        template = struct.pack('BBHHH', packet.type, packet.code, 0,
+                               packet.id, 0)
+        template += self.make_cookie(0).ljust(size-ICMP_MINLEN)
+        if len(template) & 1:
+            template += b'\0'
+        words = struct.unpack('%dH' % (len(template) // 2), template)
+        return size, template[:size], sum(words)
+
+    def update_rtt(self, rtt):
+        """Updates the round trip time estimates of this host with a measured
+        round trip time, like TCP does (RFC 6298).
+
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = self.srtt + 4 * self.rttvar
+
+    def back_off(self):
+        """Doubles the reply timeout of this host, after it failed to reply
+        in time.
+
+        """
+        if self.rto is not None:
+            self.rto *= 2
+
+    def get_timeout(self, min_timeout, max_timeout):
+        """Returns the number of seconds to wait for this host to reply"""
+        if self.rto is None:
+            return max_timeout
+        return min(max_timeout, max(min_timeout, self.rto))
 
     def is_v6(self):
         """
@@ -138,6 +224,45 @@ class Host(object):
             self.ip, self.packet.sequence)
 
 
+class TokenBucket(object):
+    """Paces events to an average rate, allowing for bursts of a limited
+    size.
+    """
+    def __init__(self, rate, burst=1, clock=time.time):
+        """
+        :param rate: The average number of events per second, or None for
+                     no limit.
+        :param burst: The maximum number of events allowed in a burst.
+        """
+        self.rate = float(rate) if rate else None
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.tokens = float(self.burst)
+        self.updated = clock()
+
+    def _refill(self, now):
+        elapsed = max(0, now - self.updated)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def consume(self, now=None):
+        """Consumes a token, returning True if one was available"""
+        if self.rate is None:
+            return True
+        self._refill(self.clock() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def get_wait(self, now=None):
+        """Returns the number of seconds until a token is available"""
+        if self.rate is None:
+            return 0
+        self._refill(self.clock() if now is None else now)
+        return max(0, (1 - self.tokens) / self.rate)
+
+
 class MegaPing(object):
     """
     Sends icmp echo to multiple hosts in parallell.
@@ -147,7 +272,7 @@ class MegaPing(object):
     timeUsed = pinger.ping()
     results = pinger.results()
     """
-    _requests = _sender = _getter = _sender_finished = None
+    _requests = None
 
     def __init__(self, sockets, conf=None):
 
@@ -163,10 +288,23 @@ class MegaPing(object):
 
         # Delay between each packet is transmitted
         self._delay = float(self._conf.get('delay', 2))/1000  # convert from ms
+        # Average number of packets to transmit per second, overrides delay
+        rate = float(self._conf.get('rate', 0))
+        if not rate and self._delay > 0:
+            rate = 1 / self._delay
+        self._rate = rate or None
+        self._burst = int(self._conf.get('burst', 10))
         # Timeout before considering hosts as down
-        self._timeout = int(self._conf.get('timeout', 5))
+        self._timeout = float(self._conf.get('timeout', 5))
+        # The shortest reply timeout of hosts with known round trip times
+        self._min_timeout = min(self._timeout,
+                                float(self._conf.get('min_timeout', 1)))
         # Dictionary with all the hosts, populated by set_hosts()
         self._hosts = {}
+        # Dictionary of all the hosts by their cookie index
+        self._host_index = {}
+        self._next_index = 0
+        self._round = 0
 
         packetsize = int(self._conf.get('packetsize', 64))
         if packetsize < 44:
@@ -192,6 +330,14 @@ class MegaPing(object):
             self._sock4 = sockets[1]
             _logger.info("No sockets passed as argument, creating own")
 
+        for sock in (self._sock6, self._sock4):
+            sock.setblocking(False)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                RECEIVE_BUFFER_SIZE)
+            except socket.error as error:
+                _logger.debug("Could not set receive buffer size: %s", error)
+
     def set_hosts(self, ips):
         """
         Specify a list of ip addresses to ping. If we alredy have the host
@@ -202,10 +348,13 @@ class MegaPing(object):
         currenthosts = {}
         for ip in ips:
             if ip not in self._hosts:
-                currenthosts[ip] = Host(ip)
+                currenthosts[ip] = Host(ip, self._next_index)
+                self._next_index = (self._next_index + 1) % 2**32
             else:
                 currenthosts[ip] = self._hosts[ip]
         self._hosts = currenthosts
+        self._host_index = dict((host.index, host)
+                                for host in currenthosts.values())
 
     def reset(self):
         """
@@ -214,91 +363,103 @@ class MegaPing(object):
         self._requests = {}
         for host in self._hosts.values():
             host.reply = None
-        self._sender_finished = 0
 
     def ping(self):
         """
         Send icmp echo to all configured hosts. Returns the
         time used.
         """
-        # Start working
         self.reset()
-        self._sender = threading.Thread(target=self._send_requests,
-                                        name="sender")
-        self._getter = threading.Thread(target=self._get_responses,
-                                        name="getter")
-        self._sender.daemon = True
-        self._getter.daemon = True
-        self._sender.start()
-        self._getter.start()
-        self._getter.join()
-        return self._elapsedtime
+        self._round = (self._round + 1) % 2**32
+        start = time.time()
 
-    def _send_requests(self):
+        # Hosts with the longest timeouts go first, so that waiting for them
+        # overlaps with sending requests to the others
+        timeouts = dict(
+            (host.index, host.get_timeout(self._min_timeout, self._timeout))
+            for host in self._hosts.values())
+        queue = deque(sorted(self._hosts.values(),
+                             key=lambda h: timeouts[h.index], reverse=True))
+        deadlines = []
+        bucket = TokenBucket(self._rate, self._burst)
+        sockets = [self._sock6, self._sock4]
+
+        while queue or self._requests:
+            now = time.time()
+            blocked = False
+            if queue:
+                blocked = self._send_requests(queue, bucket, timeouts,
+                                              deadlines)
+            self._expire_requests(deadlines, now)
+            if not queue and not self._requests:
+                break
 
-        # Get ip addresses to ping
-        hosts = self._hosts.values()
+            waits = []
+            if queue:
+                waits.append(bucket.get_wait())
+            if deadlines:
+                waits.append(deadlines[0][0] - time.time())
+            wait = max(0, min(waits)) if waits else 0
+            if blocked:
+                # give the kernel a chance to drain its send buffer
+                wait = max(wait, 0.001)
+
+            readable, _wt, _er = select.select(sockets, [], [], wait)
+            for sock in readable:
+                self._get_responses(sock, sock is self._sock6)
+
+        self._elapsedtime = time.time() - start
+        return self._elapsedtime
 
-        # Ping each host
-        for host in hosts:
-            host.time = time.time()
-            # create and save a request identifier
-            packet, cookie = host.make_packet(self._packetsize)
-            self._requests[cookie] = host
-            host.next_seq()
+    def _send_requests(self, queue, bucket, timeouts, deadlines):
+        """Sends as many queued requests as the token bucket allows.
+
+        Returns True if sending was stopped by a full send buffer.
 
+        """
+        while queue and bucket.consume():
+            host = queue.popleft()
+            packet = host.make_echo(self._packetsize, self._round)
             try:
                 if not host.is_v6():
                     self._sock4.sendto(packet, (host.ip, 0))
                 else:
                     self._sock6.sendto(packet, (host.ip, 0, 0, 0))
-            except Exception as error:
+            except socket.error as error:
+                if error.errno in _WOULD_BLOCK:
+                    queue.appendleft(host)
+                    return True
                 _logger.info("Failed to ping %s [%s]", host.ip, error)
+                continue
 
-            sleep(self._delay)
-        self._sender_finished = time.time()
-
-    def _get_responses(self):
-        start = time.time()
-        timeout = self._timeout
-
-        while not self._sender_finished or self._requests:
-            if self._sender_finished:
-                runtime = time.time() - self._sender_finished
-                if runtime > self._timeout:
-                    break
-                else:
-                    timeout = self._timeout - runtime
-
-            # Listen for incoming data on sockets
-            readable, _wt, _er = select.select([self._sock6, self._sock4],
-                                               [], [], timeout)
-
-            # If data found
-            if readable:
-                # okay to use time here, because select has told us
-                # there is data and we don't care to measure the time
-                # it takes the system to give us the packet.
-                arrival = time.time()
-
-                # Find out which socket got data and read
-                for sock in readable:
-                    try:
-                        raw_pong, sender = sock.recvfrom(4096)
-                    except socket.error:
-                        _logger.critical("RealityError -2", exc_info=True)
-                        continue
-
-                    is_ipv6 = sock == self._sock6
-                    self._process_response(raw_pong, sender, is_ipv6, arrival)
-            elif self._sender_finished:
-                break
-
-        # Everything else timed out
-        for host in self._requests.values():
-            host.reply = None
-        end = time.time()
-        self._elapsedtime = end - start
+            host.time = time.time()
+            host.next_seq()
+            self._requests[host.index] = host
+            heapq.heappush(deadlines,
+                           (host.time + timeouts[host.index], host.index))
+        return False
+
+    def _expire_requests(self, deadlines, now):
+        """Gives up on the requests whose reply timeouts have passed"""
+        while deadlines and deadlines[0][0] <= now:
+            _deadline, index = heapq.heappop(deadlines)
+            host = self._requests.pop(index, None)
+            if host:
+                host.back_off()
+
+    def _get_responses(self, sock, is_ipv6):
+        """Reads all available responses from a socket"""
+        while True:
+            try:
+                raw_pong, sender = sock.recvfrom(4096)
+            except socket.error as error:
+                if error.errno not in _WOULD_BLOCK:
+                    _logger.critical("RealityError -2", exc_info=True)
+                return
+            # okay to use time here, because select has told us there is
+            # data and we don't care to measure the time it takes the system
+            # to give us the packet.
+            self._process_response(raw_pong, sender, is_ipv6, time.time())
 
     def _process_response(self, raw_pong, sender, is_ipv6, arrival):
         # Extract header info and payload
@@ -321,23 +482,33 @@ class MegaPing(object):
                           "packet: %r)", sender, self._pid, pong, raw_pong)
             return
 
-        cookie = pong.data[:Host.COOKIE_LENGTH]
-
-        # Find the host with this cookie
         try:
-            host = self._requests[cookie]
-        except KeyError:
-            _logger.debug("packet from %r does not match any outstanding "
-                          "request: %r (raw packet: %r cookie: %r)",
-                          sender, pong, raw_pong, cookie)
+            salt, index, round_ = COOKIE.unpack(pong.data[:COOKIE_LENGTH])
+        except struct.error:
+            salt = index = round_ = None
+        host = self._host_index.get(index)
+        if salt != SALT or round_ != self._round or not host:
+            _logger.debug("packet from %r does not match any request in this "
+                          "round: %r (raw packet: %r)", sender, pong, raw_pong)
+            return
+
+        if host.reply is not None:
+            _logger.debug("Duplicate response from %r", sender)
             return
 
-        # Delete the entry of the host who has replied and add the pingtime
         pingtime = arrival - host.time
+        host.update_rtt(pingtime)
+        if self._requests.pop(index, None) is None:
+            # The host has already timed out, but its round trip time
+            # estimates will make it wait longer next time
+            _logger.debug("Late response from %-16s in %03.3f ms",
+                          sender, pingtime*1000)
+            return
+
+        # Add the pingtime of the host who has replied
         host.reply = pingtime
         _logger.debug("Response from %-16s in %03.3f ms",
                       sender, pingtime*1000)
-        del self._requests[cookie]
 
     def results(self):
         """
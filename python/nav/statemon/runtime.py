@@ -0,0 +1,184 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Scheduling and execution of service checkers in the Twisted reactor.
+
+Every checker has its own deadline for its next check, kept in a single
+heap which is served by a single reactor timer.  Checkers that support it
+(ASYNC_SUPPORT) are run in the reactor itself, so that a check that waits
+for a slow service costs nothing but an open socket.  Legacy checkers are run
+in a bounded thread pool.
+
+"""
+import heapq
+import itertools
+import logging
+import random
+
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+_logger = logging.getLogger(__name__)
+
+
+class CheckerRuntime(object):
+    """Runs a set of service checkers at a fixed interval"""
+
+    def __init__(self, interval, max_concurrent=1000, max_threads=20,
+                 clock=reactor):
+        """
+        :param interval: The number of seconds between each check of a
+                         service.
+        :param max_concurrent: The maximum number of checks to run at the
+                               same time.
+        :param max_threads: The maximum number of threads to run legacy
+                            checkers in.
+        :param clock: The reactor to run checks in.
+        """
+        self.interval = interval
+        self.clock = clock
+        self.max_threads = max_threads
+        self.threadpool = None
+        self.checks_completed = 0
+        self._semaphore = defer.DeferredSemaphore(max_concurrent)
+        self._checkers = {}  # id(checker) -> checker
+        self._schedule = []  # heap of (deadline, sequence, checker)
+        self._entries = {}  # id(checker) -> sequence of its heap entry
+        self._sequence = itertools.count()
+        self._timer = None
+        self._running = False
+
+    def __len__(self):
+        return len(self._checkers)
+
+    def start(self):
+        """Starts running checks"""
+        self._running = True
+        if self.threadpool is None:
+            self.threadpool = ThreadPool(maxthreads=self.max_threads,
+                                         name='servicemon')
+        self.threadpool.start()
+        self._set_timer()
+
+    def stop(self):
+        """Stops running checks and waits for running legacy checkers to
+        finish.
+        """
+        self._running = False
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        self._timer = None
+        if self.threadpool is not None:
+            self.threadpool.stop()
+
+    def set_checkers(self, checkers):
+        """Sets the checkers to run.
+
+        Already known checker instances keep their schedule.  New
+        instances are scheduled at random points within the next interval,
+        to spread the load.
+
+        """
+        now = self.clock.seconds()
+        current = {}
+        for checker in checkers:
+            key = id(checker)
+            current[key] = checker
+            if key not in self._checkers:
+                self._schedule_at(checker,
+                                  now + random.uniform(0, self.interval))
+        removed = sum(1 for key in self._checkers if key not in current)
+        if removed:
+            _logger.info("%d checkers were removed", removed)
+        self._checkers = current
+        self._set_timer()
+
+    def _schedule_at(self, checker, deadline):
+        sequence = next(self._sequence)
+        self._entries[id(checker)] = sequence
+        heapq.heappush(self._schedule, (deadline, sequence, checker))
+
+    def _set_timer(self):
+        if not self._running:
+            return
+        while self._schedule and not self._is_current(self._schedule[0]):
+            heapq.heappop(self._schedule)
+        if not self._schedule:
+            return
+        deadline = self._schedule[0][0]
+        if self._timer is not None and self._timer.active():
+            if self._timer.getTime() <= deadline:
+                return
+            self._timer.cancel()
+        delay = max(0, deadline - self.clock.seconds())
+        self._timer = self.clock.callLater(delay, self._run_due)
+
+    def _is_current(self, entry):
+        _deadline, sequence, checker = entry
+        return (self._checkers.get(id(checker)) is checker
+                and self._entries.get(id(checker)) == sequence)
+
+    def _run_due(self):
+        self._timer = None
+        now = self.clock.seconds()
+        while self._schedule and self._schedule[0][0] <= now:
+            entry = heapq.heappop(self._schedule)
+            if self._is_current(entry):
+                checker = entry[2]
+                del self._entries[id(checker)]
+                self._run(checker)
+        self._set_timer()
+
+    def _run(self, checker):
+        started = self.clock.seconds()
+        deferred = self._semaphore.run(self._execute, checker)
+        deferred.addCallback(self._handle_result, checker)
+        deferred.addErrback(self._log_failure, checker)
+        deferred.addCallback(self._reschedule, checker, started)
+        return deferred
+
+    def _execute(self, checker):
+        if checker.ASYNC_SUPPORT:
+            return checker.execute_test_async()
+        else:
+            return threads.deferToThreadPool(self.clock, self.threadpool,
+                                             checker.execute_test)
+
+    @staticmethod
+    def _handle_result(result, checker):
+        status, info = result
+        return checker.handle_result(status, info)
+
+    @staticmethod
+    def _log_failure(failure, checker):
+        _logger.error("Unhandled error while checking %r",
+                      checker, exc_info=(failure.type, failure.value,
+                                         failure.getTracebackObject()))
+
+    def _reschedule(self, delay, checker, started):
+        self.checks_completed += 1
+        if self._checkers.get(id(checker)) is not checker:
+            return  # the checker was removed while it was running
+        now = self.clock.seconds()
+        if delay is None:
+            deadline = started + self.interval
+            if deadline < now:
+                _logger.warning("%s:%s took longer than the check interval",
+                                checker.sysname, checker.get_type())
+                deadline = now
+        else:
+            deadline = now + delay
+        self._schedule_at(checker, deadline)
+        self._set_timer()
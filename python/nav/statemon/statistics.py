@@ -38,6 +38,18 @@ def update(sysname, timestamp, status, responsetime, serviceid=None,
            handler=""):
     """Sends metric updates to graphite.
 
+    The parameters are the same as for make_metrics().
+
+    """
+    send_metrics(make_metrics(sysname, timestamp, status, responsetime,
+                              serviceid, handler))
+
+
+def make_metrics(sysname, timestamp, status, responsetime, serviceid=None,
+                 handler=""):
+    """Makes a list of metric tuples to send to graphite, so that the
+    metrics of several devices or services can be sent at once.
+
     :param sysname: Sysname of the device in question.
     :param timestamp: Timestamp of the measurements. If None or 'N', the
                     current time will be used.
@@ -61,8 +73,7 @@ def update(sysname, timestamp, status, responsetime, serviceid=None,
     if timestamp is None or timestamp == 'N':
         timestamp = time.time()
 
-    metrics = [
+    return [
         (status_name, (timestamp, 0 if status == event.Event.UP else 1)),
         (response_name, (timestamp, responsetime))
     ]
-    send_metrics(metrics)
@@ -19,6 +19,7 @@ from __future__ import absolute_import
 
 import logging
 from optparse import OptionParser
+import time
 from collections import defaultdict
 
 import django
@@ -31,7 +32,10 @@ from nav.models.fields import INFINITY
 from nav.models.manage import Netbox, Interface, Sensor
 from nav.models.thresholds import ThresholdRule
 from nav.models.event import EventQueue as Event, AlertHistory
+from nav.metrics.carbon import send_metrics
 from nav.metrics.lookup import lookup
+from nav.metrics.templates import metric_path_for_thresholdmon
+from nav.metrics.thresholds import ValueFetcher
 
 LOG_FILE = 'thresholdmon.log'
 
@@ -64,36 +68,77 @@ def make_option_parser():
 
 
 def scan():
-    """Scans for threshold rules and evaluates them"""
+    """Scans for threshold rules and evaluates them.
+
+    The values of all rules are retrieved up front, using as few concurrent
+    Graphite requests as possible, before each rule is evaluated.
+
+    """
+    start = time.time()
     rules = ThresholdRule.objects.all()
     alerts = get_unresolved_threshold_alerts()
 
     _logger.info("evaluating %d rules", len(rules))
-    for rule in rules:
-        evaluate_rule(rule, alerts)
-    _logger.info("done")
+    evaluators = [(rule, rule.get_evaluator()) for rule in rules]
+    fetcher = ValueFetcher()
+    failures = fetcher.fetch([evaluator for _rule, evaluator in evaluators])
+    _logger.debug("retrieved values for %d rules using %d requests",
+                  len(evaluators), fetcher.requests)
+
+    lags = []
+    for rule, evaluator in evaluators:
+        if evaluator in failures:
+            _logger.error("Unable to get values for rule %r: %s",
+                          rule, failures[evaluator])
+        else:
+            evaluate_rule(rule, alerts, evaluator)
+        lags.append(time.time() - start)
+
+    runtime = time.time() - start
+    _send_scan_metrics(start, runtime, len(evaluators), fetcher, lags)
+    _logger.info("done in %.2f seconds", runtime)
+
+
+def _send_scan_metrics(timestamp, runtime, rule_count, fetcher, lags):
+    values = [
+        ('runtime', runtime),
+        ('rules', rule_count),
+        ('requests', fetcher.requests),
+        ('failed_requests', fetcher.failed_requests),
+    ]
+    if lags:
+        values.append(('max_rule_lag', max(lags)))
+        values.append(('avg_rule_lag', sum(lags) / len(lags)))
+    send_metrics([(metric_path_for_thresholdmon(name), (timestamp, value))
+                  for name, value in values])
 
 
 # pylint: disable=W0703
-def evaluate_rule(rule, alerts):
+def evaluate_rule(rule, alerts, evaluator=None):
     """
     Evaluates the current status of a single rule and posts events if
     necessary.
+
+    :param evaluator: The rule's ThresholdEvaluator, with values already
+                      retrieved. If omitted, a new evaluator is made and its
+                      values are retrieved from Graphite.
     """
     _logger.debug("evaluating rule %r", rule)
 
-    evaluator = rule.get_evaluator()
-    try:
-        if not evaluator.get_values():
-            _logger.warning(
-                "did not find any matching values for rule %r %s",
-                rule.target, rule.alert
+    if evaluator is None:
+        evaluator = rule.get_evaluator()
+        try:
+            evaluator.get_values()
+        except Exception:
+            _logger.exception(
+                "Unhandled exception while getting values for rule: %r", rule
             )
-    except Exception:
-        _logger.exception(
-            "Unhandled exception while getting values for rule: %r", rule
+            return
+    if not evaluator.result:
+        _logger.warning(
+            "did not find any matching values for rule %r %s",
+            rule.target, rule.alert
         )
-        return
 
     # post new exceed events
     try:
@@ -0,0 +1,77 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Staging of computed topology data for set-based database updates.
+
+Rather than issuing one query per interface, the topology updaters COPY
+their results into temporary tables and apply them to the real tables using
+a few set-based statements.  The staging tables are dropped when the
+enclosing transaction commits.
+
+"""
+from django.utils import six
+
+NULL = r'\N'
+_ESCAPES = (
+    ('\\', '\\\\'),
+    ('\t', '\\t'),
+    ('\n', '\\n'),
+    ('\r', '\\r'),
+)
+
+
+def create_staging_table(cursor, name, columns, rows):
+    """Creates a temporary table and fills it with rows using COPY.
+
+    Must be called inside a transaction, as the table is dropped on commit.
+
+    :param cursor: A database cursor.
+    :param name: The name of the temporary table.
+    :param columns: A sequence of (column name, SQL type) tuples.
+    :param rows: An iterable of tuples, matching columns.
+    :returns: The number of rows copied to the table.
+
+    """
+    cursor.execute("CREATE TEMPORARY TABLE {name} ({columns}) "
+                   "ON COMMIT DROP".format(
+                       name=name,
+                       columns=", ".join(" ".join(column)
+                                         for column in columns)))
+    data, count = format_copy_data(rows)
+    cursor.copy_from(six.StringIO(data), name,
+                     columns=[column for column, _type in columns])
+    cursor.execute("ANALYZE {name}".format(name=name))
+    return count
+
+
+def format_copy_data(rows):
+    """Formats rows in PostgreSQL's COPY text format.
+
+    :returns: A tuple of (formatted text, number of rows).
+
+    """
+    lines = ["\t".join(_format_value(value) for value in row)
+             for row in rows]
+    data = "".join(line + "\n" for line in lines)
+    return data, len(lines)
+
+
+def _format_value(value):
+    if value is None:
+        return NULL
+    value = six.text_type(value)
+    for char, escaped in _ESCAPES:
+        value = value.replace(char, escaped)
+    return value
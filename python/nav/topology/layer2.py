@@ -16,10 +16,10 @@
 """Functions for updating the database's layer 2 topology"""
 import logging
 
-from django.db import transaction
-from django.db.models import Q
+from django.db import connection, transaction
 
 from nav.topology.analyze import Port
+from nav.topology.bulk import create_staging_table
 
 from nav.models.manage import Interface, Netbox
 
@@ -31,57 +31,86 @@ _logger = logging.getLogger(__name__)
 def update_layer2_topology(links):
     """Updates the layer 2 topology in the NAV database.
 
+    The links are staged in a temporary table, which is used to update the
+    topology of all the source interfaces and to clear the topology of
+    interfaces that were not touched, using a single statement for each.
+
     :param links: a list of edges from an adjacency graph
 
     """
-    for source, dest in links:
-        _update_interface_topology(source, dest)
-
-    touched_ifc_ids = [source[1] for source, _dest in links]
-    _clear_topology_for_nontouched(touched_ifc_ids)
+    cursor = connection.cursor()
+    create_staging_table(
+        cursor, 'layer2_staging',
+        [('interfaceid', 'INTEGER'), ('to_netboxid', 'INTEGER'),
+         ('to_interfaceid', 'INTEGER')],
+        get_staging_rows(links))
+
+    _update_interface_topology(cursor)
+    _clear_topology_for_nontouched(cursor)
     _clear_topology_for_mismatched_state_links()
 
 
-def _update_interface_topology(source_node, dest_node):
-    """Updates topology information for the source_node Interface.
+def get_staging_rows(links):
+    """Returns a list of (interfaceid, to_netboxid, to_interfaceid) tuples
+    for links.
 
-    The interface's topology will _only_ be updated if its netbox is up, it is
-    administratively up, is not missing, and its current topology information
-    differs from what we want to set it to.
+    If a source interface has several links, the last one wins.
 
     """
-    _netboxid, interfaceid = source_node
-    ifc = Interface.objects.filter(id=interfaceid,
-                                   ifadminstatus=Interface.ADM_UP,
-                                   netbox__up=Netbox.UP_UP,
-                                   gone_since__isnull=True)
+    rows = {}
+    for source_node, dest_node in links:
+        _netboxid, interfaceid = source_node
+        if isinstance(dest_node, Port):
+            dest = (int(dest_node[0]), int(dest_node[1]))
+        else:
+            dest = (int(dest_node), None)
+        rows[int(interfaceid)] = dest
+    return [(interfaceid,) + dest for interfaceid, dest in rows.items()]
 
-    if isinstance(dest_node, Port):
-        kwargs = {'to_netbox': int(dest_node[0]),
-                  'to_interface': int(dest_node[1])}
-    else:
-        kwargs = {'to_netbox': int(dest_node),
-                  'to_interface': None}
 
-    ifc = ifc.exclude(**kwargs)
-    ifc.update(**kwargs)
+def _update_interface_topology(cursor):
+    """Updates topology information for the staged source interfaces.
 
+    An interface's topology will _only_ be updated if its netbox is up, it is
+    administratively up, is not missing, and its current topology information
+    differs from what we want to set it to.
 
-def _clear_topology_for_nontouched(touched_ifc_ids):
-    """Clears topology information for all interfaces that are administratively
-    up, except for those in the touched_ifc_ids list and those who currently
-    have no associated topology information.
+    """
+    cursor.execute("""
+        UPDATE interface
+        SET to_netboxid = s.to_netboxid, to_interfaceid = s.to_interfaceid
+        FROM layer2_staging s, netbox n
+        WHERE interface.interfaceid = s.interfaceid
+          AND interface.netboxid = n.netboxid
+          AND n.up = %s
+          AND interface.ifadminstatus = %s
+          AND interface.gone_since IS NULL
+          AND (interface.to_netboxid, interface.to_interfaceid)
+              IS DISTINCT FROM (s.to_netboxid, s.to_interfaceid)
+    """, [Netbox.UP_UP, Interface.ADM_UP])
+    _logger.debug("updated topology for %d interfaces", cursor.rowcount)
+
+
+def _clear_topology_for_nontouched(cursor):
+    """Clears topology information for all interfaces that are operationally
+    up or administratively down, except for the staged ones and those who
+    currently have no associated topology information.
 
     """
-    up_or_disabled = (
-        Q(ifoperstatus=Interface.OPER_UP) |
-        Q(ifadminstatus=Interface.ADM_DOWN)
-    )
-    up_or_disabled_ifcs = Interface.objects.filter(up_or_disabled,
-                                                   netbox__up=Netbox.UP_UP)
-    nontouched_ifcs = up_or_disabled_ifcs.exclude(id__in=touched_ifc_ids)
-    clearable_ifcs = nontouched_ifcs.exclude(to_netbox__isnull=True)
-    clearable_ifcs.update(to_netbox=None, to_interface=None)
+    cursor.execute("""
+        UPDATE interface
+        SET to_netboxid = NULL, to_interfaceid = NULL
+        FROM netbox n
+        WHERE interface.netboxid = n.netboxid
+          AND n.up = %s
+          AND (interface.ifoperstatus = %s OR interface.ifadminstatus = %s)
+          AND interface.to_netboxid IS NOT NULL
+          AND NOT EXISTS (
+            SELECT 1 FROM layer2_staging s
+            WHERE s.interfaceid = interface.interfaceid)
+    """, [Netbox.UP_UP, Interface.OPER_UP, Interface.ADM_DOWN])
+    _logger.debug("cleared topology for %d non-touched interfaces",
+                  cursor.rowcount)
 
 
 def _clear_topology_for_mismatched_state_links():
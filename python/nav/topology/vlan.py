@@ -25,12 +25,13 @@ from IPy import IP
 
 from django.utils import six
 from django.db.models import Q
-from django.db import transaction
+from django.db import connection, transaction
 
 from nav.models.manage import (GwPortPrefix, Interface, SwPortVlan,
                                SwPortBlocked, Prefix, Vlan)
 
 from nav.netmap import stubs
+from nav.topology.bulk import create_staging_table
 
 _logger = logging.getLogger(__name__)
 NO_TRUNK = Q(trunk=False) | Q(trunk__isnull=True)
@@ -371,24 +372,60 @@ class VlanTopologyUpdater(object):
 
     @transaction.atomic()
     def update(self):
-        """Updates the VLAN topology in the NAV database"""
-        for ifc, vlans in self.ifc_vlan_map.items():
-            for vlan, dirstr in vlans.items():
-                self._update_or_create_new_swportvlan_entry(ifc, vlan, dirstr)
-            self._remove_dead_swpvlan_records_for_ifc(ifc)
+        """Updates the VLAN topology in the NAV database.
 
-        self._delete_swportvlans_from_untouched_ifcs()
+        The computed topology is staged in a temporary table, from which
+        obsolete swportvlan records are deleted, changed directions are
+        updated and new records are inserted using set-based statements.
 
-    @classmethod
-    def _update_or_create_new_swportvlan_entry(cls, ifc, vlan, dirstr):
-        direction = cls._direction_from_string(dirstr)
-        obj, created = SwPortVlan.objects.get_or_create(
-            interface=ifc, vlan=vlan,
-            defaults={'direction': direction})
-        if not created and obj.direction != direction:
-            obj.direction = direction
-            obj.save()
-        return object
+        """
+        cursor = connection.cursor()
+        staged = create_staging_table(
+            cursor, 'swportvlan_staging',
+            [('interfaceid', 'INTEGER'), ('vlanid', 'INTEGER'),
+             ('direction', 'CHAR(1)')],
+            self._get_staging_rows())
+        _logger.debug("staged %d swportvlan records", staged)
+
+        cursor.execute("""
+            DELETE FROM swportvlan
+            WHERE NOT EXISTS (
+              SELECT 1 FROM swportvlan_staging s
+              WHERE s.interfaceid = swportvlan.interfaceid
+                AND s.vlanid = swportvlan.vlanid)
+        """)
+        deleted = cursor.rowcount
+        cursor.execute("""
+            UPDATE swportvlan
+            SET direction = s.direction
+            FROM swportvlan_staging s
+            WHERE s.interfaceid = swportvlan.interfaceid
+              AND s.vlanid = swportvlan.vlanid
+              AND s.direction IS DISTINCT FROM swportvlan.direction
+        """)
+        updated = cursor.rowcount
+        cursor.execute("""
+            INSERT INTO swportvlan (interfaceid, vlanid, direction)
+            SELECT s.interfaceid, s.vlanid, s.direction
+            FROM swportvlan_staging s
+            WHERE NOT EXISTS (
+              SELECT 1 FROM swportvlan
+              WHERE swportvlan.interfaceid = s.interfaceid
+                AND swportvlan.vlanid = s.vlanid)
+        """)
+        inserted = cursor.rowcount
+        _logger.debug("swportvlan: %d deleted, %d updated, %d inserted",
+                      deleted, updated, inserted)
+
+    def _get_staging_rows(self):
+        """Returns a list of (interfaceid, vlanid, direction) tuples for the
+        interface/vlan combinations in ifc_vlan_map.
+        """
+        rows = {}
+        for ifc, vlans in self.ifc_vlan_map.items():
+            for vlan, dirstr in vlans.items():
+                rows[(ifc.pk, vlan.pk)] = self._direction_from_string(dirstr)
+        return [key + (direction,) for key, direction in rows.items()]
 
     DIRECTION_MAP = {
         'up': SwPortVlan.DIRECTION_UP,
@@ -403,28 +440,6 @@ class VlanTopologyUpdater(object):
                 if string in cls.DIRECTION_MAP
                 else SwPortVlan.DIRECTION_UNDEFINED)
 
-    def _remove_dead_swpvlan_records_for_ifc(self, ifc):
-        records_for_ifc = SwPortVlan.objects.filter(interface=ifc)
-        active_vlans = self.ifc_vlan_map[ifc].keys()
-        dead = records_for_ifc.exclude(vlan__in=active_vlans)
-        dead.delete()
-
-    def _delete_swportvlans_from_untouched_ifcs(self):
-        """Deletes old swportvlan entries that weren't touched by this update"""
-        # this can turn into a rather huge, and surprisingly inefficient SQL
-        # statement if we let PostgreSQL do all the work, so we calculate the
-        # set difference using Python instead
-        touched_interfaceids = set(ifc.pk for ifc in self.ifc_vlan_map)
-        existing_interfaceids = set(
-            SwPortVlan.objects.distinct().values_list('interface__id',
-                                                      flat=True)
-        )
-        to_delete = existing_interfaceids.difference(touched_interfaceids)
-        if to_delete:
-            _logger.debug("deleting obsolete swpvlan records for these ifcs: "
-                          "%s", to_delete)
-            SwPortVlan.objects.filter(interface__id__in=to_delete).delete()
-
 
 def build_layer2_graph(related_extra=None):
     """Builds a graph representation of the layer 2 topology stored in the NAV
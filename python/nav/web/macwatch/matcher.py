@@ -0,0 +1,213 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Matching of watched MAC addresses against active cam records.
+
+All watches are loaded into an index, and the open cam records are read in
+a single pass, so that the number of queries does not depend on the number
+of watches.  Matches are compared to the existing MacWatchMatch records, and
+events for new matches are posted in a single transaction.
+
+"""
+from collections import defaultdict, namedtuple
+from datetime import datetime
+import logging
+
+from django.db import transaction
+
+from nav.models.event import EventQueue, EventQueueVar
+from nav.models.manage import Cam
+from nav.web.macwatch.models import MacWatchMatch
+from nav.web.macwatch.utils import MAC_ADDR_MAX_LEN, strip_delimiters
+
+_logger = logging.getLogger(__name__)
+
+# Occurences of the mac-address nearest to the edges has highest
+# priority
+LOCATION_PRIORITY = {u'GSW': 1, u'GW': 1, u'SW': 2, u'EDGE': 3}
+
+# pylint: disable=C0103
+CamRecord = namedtuple('CamRecord',
+                       'id mac netbox_id category sysname module port')
+
+
+class MacWatchIndex(object):
+    """An index of MacWatch objects, for finding all the watches that match
+    a MAC address.
+
+    Watched addresses and prefixes are stored as integers in one hash table
+    per prefix length, so that a lookup is at most one dictionary lookup per
+    distinct prefix length among the watches.
+
+    """
+    def __init__(self, watches):
+        self._tables = defaultdict(dict)  # {nybbles: {int: [watch, ...]}}
+        for watch in watches:
+            self.add(watch)
+
+    def add(self, watch):
+        """Adds a MacWatch to the index"""
+        length = watch.prefix_length or MAC_ADDR_MAX_LEN
+        prefix = int(strip_delimiters(watch.mac)[:length], 16)
+        self._tables[length].setdefault(prefix, []).append(watch)
+
+    def lookup(self, mac):
+        """Returns a list of the watches that match a MAC address"""
+        value = int(strip_delimiters(mac), 16)
+        watches = []
+        for length, table in self._tables.items():
+            watches.extend(
+                table.get(value >> 4 * (MAC_ADDR_MAX_LEN - length), ()))
+        return watches
+
+
+def get_open_cam_records():
+    """Returns an iterator of CamRecord tuples for all open cam records.
+
+    The records are read using a server-side cursor.
+
+    """
+    cams = Cam.objects.filter(end_time=datetime.max, netbox__isnull=False)
+    return (CamRecord(*row) for row in cams.values_list(
+        'id', 'mac', 'netbox_id', 'netbox__category_id', 'sysname', 'module',
+        'port').iterator())
+
+
+def find_matches(index, cam_records):
+    """Finds the watches that match a set of cam records.
+
+    For each watch and MAC address, only the cam records that are closest to
+    the edge of the network are kept.
+
+    :param index: A MacWatchIndex.
+    :param cam_records: An iterable of CamRecord tuples.
+    :returns: A list of (watch, cam record) tuples.
+
+    """
+    found = defaultdict(list)
+    for record in cam_records:
+        for watch in index.lookup(record.mac):
+            found[(watch, record.mac)].append(record)
+
+    matches = []
+    for (watch, mac), records in found.items():
+        _logger.debug('%s: %s cam records for %s',
+                      watch.mac, len(records), mac)
+        matches.extend((watch, record)
+                       for record in prioritize_location(records))
+    return matches
+
+
+def prioritize_location(cam_records):
+    """Returns the cam records that are closest to the edge of the network.
+
+    The search may return more than one hit. This happens as mactrace not
+    always manages to calculate the correct topology. In that case, choose
+    the results which are "lowest" in the topology. We do this based on
+    catid, where GSW|GW is top, followed by SW and then EDGE.
+
+    A MAC _may_ be active on two ports at the same time (due to duplicate
+    MAC addresses, errors in the db and so on). This is such a small problem
+    that we ignore it for the time being.
+
+    """
+    ranked = [(LOCATION_PRIORITY.get(record.category, 0), record)
+              for record in cam_records]
+    rank = max(priority for priority, _record in ranked)
+    return [record for priority, record in ranked if priority == rank]
+
+
+def get_new_matches(matches):
+    """Compares matches to the existing MacWatchMatch records.
+
+    Where there is more than one existing record for a match, something
+    strange has happened; all but the one that posted an event latest in
+    time are deleted.
+
+    :param matches: A list of (watch, cam record) tuples.
+    :returns: The matches that have no existing MacWatchMatch record, i.e.
+              MAC addresses that have moved or appeared since the last check.
+
+    """
+    existing = defaultdict(list)
+    for match in MacWatchMatch.objects.filter(
+            cam__end_time=datetime.max).values_list(
+                'id', 'macwatch_id', 'cam_id', 'posted'):
+        existing[match[1:3]].append(match)
+
+    new_matches = []
+    unwanted = []
+    for watch, record in matches:
+        known = existing.get((watch.id, record.id), [])
+        if not known:
+            new_matches.append((watch, record))
+        elif len(known) > 1:
+            _logger.info('%s matches found for macwatch = %s',
+                         len(known), watch.id)
+            unwanted.extend(get_unwanted_matches(known))
+
+    if unwanted:
+        _logger.info('Deleting matches %s', unwanted)
+        MacWatchMatch.objects.filter(id__in=unwanted).delete()
+    return new_matches
+
+
+def get_unwanted_matches(known):
+    """Returns the ids of all but the match that posted an event latest in
+    time.
+
+    :param known: A list of (id, macwatch id, cam id, posted) tuples.
+
+    """
+    posted = [match for match in known if match[3]]
+    keep = max(posted, key=lambda match: match[3])[0] if posted else None
+    return [match[0] for match in known if match[0] != keep]
+
+
+@transaction.atomic()
+def post_events(matches):
+    """Posts a macWarning event and creates a MacWatchMatch record for each
+    match, all in one transaction.
+
+    :param matches: A list of (watch, cam record) tuples.
+
+    """
+    events = [EventQueue(source_id='macwatch', target_id='eventEngine',
+                         netbox_id=record.netbox_id, event_type_id='info',
+                         value=100, severity=50)
+              for _watch, record in matches]
+    EventQueue.objects.bulk_create(events)
+    EventQueueVar.objects.bulk_create(
+        EventQueueVar(event_queue=event, variable=variable, value=value)
+        for event, (watch, record) in zip(events, matches)
+        for variable, value in get_event_variables(watch, record).items()
+        if value is not None)
+    MacWatchMatch.objects.bulk_create(
+        MacWatchMatch(macwatch=watch, cam_id=record.id)
+        for watch, record in matches)
+
+
+def get_event_variables(watch, record):
+    """Returns the event variables of a macWarning event"""
+    varmap = {
+        'sysname': record.sysname,
+        'port': record.port,
+        'mac': record.mac,
+        'macwatch-mac': watch.mac,
+        'alerttype': 'macWarning',
+    }
+    if record.module:
+        varmap['module'] = record.module
+    return varmap
@@ -1,8 +1,108 @@
-from nav.models.profiles import AlertSender
+from datetime import datetime
+
+import pytest
+
+from nav.models.event import AlertQueue, EventType, Subsystem
+from nav.models.manage import Location, NetboxGroup, NetboxCategory
+from nav.models.profiles import (AlertSender, Expression, Filter, MatchField,
+                                 Operator)
 from nav.alertengine.dispatchers import Dispatcher
+from nav.alertengine.filtermatcher import FilterMatcher
+
+EVENT_TYPE = 10
+SEVERITY = 12
+CATEGORY = 13
+GROUP = 14
+SYSNAME = 15
+IP = 16
+ROOM = 17
+LOCATION = 18
 
 
 def test_all_handlers_should_be_loadable():
     for sender in AlertSender.objects.filter(supported=True):
         dispatcher = sender._load_dispatcher_class()
         assert issubclass(dispatcher, Dispatcher)
+
+
+@pytest.mark.parametrize("expressions", [
+    [],
+    [(SYSNAME, Operator.EQUALS, 'localhost.example.org')],
+    [(SYSNAME, Operator.EQUALS, 'LOCALHOST.example.org')],
+    [(SYSNAME, Operator.NOT_EQUAL, 'localhost.example.org')],
+    [(SYSNAME, Operator.STARTSWITH, 'LOCAL')],
+    [(SYSNAME, Operator.ENDSWITH, '.com')],
+    [(SYSNAME, Operator.CONTAINS, 'EXAMPLE')],
+    [(SYSNAME, Operator.REGEXP, r'^local\w+\.')],
+    [(SYSNAME, Operator.WILDCARD, 'local%.example._rg')],
+    [(SYSNAME, Operator.WILDCARD, 'LOCALHOST%')],
+    [(SEVERITY, Operator.GREATER, '40')],
+    [(SEVERITY, Operator.LESS_EQ, '40')],
+    [(SEVERITY, Operator.NOT_EQUAL, '50'),
+     (SYSNAME, Operator.NOT_EQUAL, 'other.example.org')],
+    [(SEVERITY, Operator.NOT_EQUAL, '50'),
+     (SYSNAME, Operator.NOT_EQUAL, 'localhost.example.org')],
+    [(CATEGORY, Operator.IN, 'GW|SRV')],
+    [(CATEGORY, Operator.EQUALS, 'SRV'), (CATEGORY, Operator.EQUALS, 'GW')],
+    [(EVENT_TYPE, Operator.EQUALS, 'boxState'), (ROOM, Operator.IN, 'myroom')],
+    [(GROUP, Operator.EQUALS, 'filtermatchers')],
+    [(GROUP, Operator.EQUALS, 'filtermatchers'),
+     (CATEGORY, Operator.EQUALS, 'SRV')],
+    [(GROUP, Operator.IN, 'nosuchgroup')],
+    [(LOCATION, Operator.EQUALS, 'filtermatcherparent')],
+    [(LOCATION, Operator.EQUALS, 'nosuchlocation')],
+    [(IP, Operator.EQUALS, '127.0.0.1')],
+    [(IP, Operator.IN, '127.0.0.0/8|10.0.0.0/8')],
+    [(IP, Operator.IN, '10.0.0.0/8')],
+    [(IP, Operator.CONTAINS, '127.0.0.1')],
+    [(IP, Operator.NOT_EQUAL, '127.0.0.2')],
+    [(IP, Operator.WILDCARD, '127.%')],
+    [(IP, Operator.REGEXP, r'^127\.0\.0\.2$')],
+])
+def test_filter_matcher_should_agree_with_database(db, filter_alert,
+                                                   expressions):
+    filtr = Filter(name='filter matcher test')
+    filtr.save()
+    for match_field_id, operator, value in expressions:
+        Expression(filter=filtr, operator=operator, value=value,
+                   match_field=MatchField.objects.get(id=match_field_id)
+                   ).save()
+
+    matcher = FilterMatcher([filter_alert])
+    assert matcher.get_compiled_filter(filtr) is not None
+    assert matcher.verify(filtr, filter_alert) == filtr.verify(filter_alert)
+
+
+@pytest.mark.parametrize("pattern", [
+    r'^[[:alpha:]]+\.example',
+    r'\ylocalhost\y',
+    r'\mlocal',
+])
+def test_filter_matcher_should_leave_postgresql_regexps_to_database(
+        db, filter_alert, pattern):
+    filtr = Filter(name='filter matcher test')
+    filtr.save()
+    Expression(filter=filtr, operator=Operator.REGEXP, value=pattern,
+               match_field=MatchField.objects.get(id=SYSNAME)).save()
+
+    matcher = FilterMatcher([filter_alert])
+    assert matcher.get_compiled_filter(filtr) is None
+    assert matcher.verify(filtr, filter_alert) == filtr.verify(filter_alert)
+    assert matcher.verify(filtr, filter_alert)
+
+
+@pytest.fixture()
+def filter_alert(localhost):
+    parent = Location(id='filtermatcherparent')
+    parent.save()
+    Location.objects.filter(id='mylocation').update(parent=parent)
+    group = NetboxGroup(id='filtermatchers', description='test')
+    group.save()
+    NetboxCategory(netbox=localhost, category=group).save()
+
+    alert = AlertQueue(source=Subsystem.objects.first(), time=datetime.now(),
+                       netbox=localhost,
+                       event_type=EventType.objects.get(id='boxState'),
+                       value=100, severity=50)
+    alert.save()
+    return alert
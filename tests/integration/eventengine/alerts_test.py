@@ -1,8 +1,7 @@
 from nav.eventengine.alerts import (get_list_of_templates_for, TemplateDetails,
-                                    ensure_alert_templates_are_available,
-                                    _render_template, AlertGenerator)
+                                    _render_template, AlertGenerator,
+                                    AlertTemplateRegistry, ALERT_TEMPLATE_DIR)
 from mock import Mock
-from django.template import loader
 
 
 def test_should_be_able_to_find_snmpagentdown_alert_msg_templates():
@@ -15,15 +14,13 @@ def test_should_be_able_to_find_snmpagentdown_alert_msg_templates():
 def test_should_be_able_to_load_snmpagentdown_alert_msg_template():
     details = TemplateDetails(name='snmpAgentState/snmpAgentDown-email.txt',
                               msgtype='email', language='en')
-    ensure_alert_templates_are_available()
-    template = loader.get_template(details.name)
+    template = AlertTemplateRegistry(ALERT_TEMPLATE_DIR).get_template(details)
     assert template
 
 
 def test_should_be_able_to_render_snmpagentdown_alert_msg_template():
     details = TemplateDetails(name='snmpAgentState/snmpAgentDown-email.txt',
                               msgtype='email', language='en')
-    ensure_alert_templates_are_available()
     event = Mock(varmap={})
     alert = AlertGenerator(event)
     _, output = _render_template(details, alert)
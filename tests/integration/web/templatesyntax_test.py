@@ -6,7 +6,7 @@ from django.conf import settings
 from django.template import loader
 from django.template.loaders import app_directories
 
-from nav.eventengine.alerts import (ensure_alert_templates_are_available,
+from nav.eventengine.alerts import (AlertTemplateRegistry, TemplateDetails,
                                     ALERT_TEMPLATE_DIR)
 import pytest
 
@@ -27,7 +27,6 @@ def get_template_list(directories=None):
     if not template_dirs:
         template_dirs = list(getattr(settings, 'TEMPLATE_DIRS', []))  # Outdated, remove when on 1.11
     if not directories:
-        ensure_alert_templates_are_available()
         directories = template_dirs + list(get_nav_app_template_dirs())
 
     for tmpldir in directories:
@@ -58,3 +57,10 @@ def get_nav_app_template_dirs():
 @pytest.mark.parametrize("template_name", get_template_list())
 def test_template_syntax(template_name):
     loader.get_template(template_name)
+
+
+@pytest.mark.parametrize("template_name",
+                         get_template_list([ALERT_TEMPLATE_DIR]))
+def test_alert_template_syntax(template_name):
+    registry = AlertTemplateRegistry(ALERT_TEMPLATE_DIR)
+    registry.get_template(TemplateDetails(template_name, None, None))
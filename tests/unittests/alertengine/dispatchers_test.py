@@ -0,0 +1,134 @@
+"""Tests for batched alert dispatch"""
+import socket
+from smtplib import SMTPServerDisconnected
+
+from mock import Mock, patch
+import pytest
+
+from nav.alertengine.base import send_queued_alerts
+from nav.alertengine.dispatchers import DispatcherException, find_message
+from nav.alertengine.dispatchers.email_dispatcher import Email
+from nav.alertengine.dispatchers.slack_dispatcher import Slack
+
+
+def _make_alert(alertid):
+    alert = Mock(id=alertid)
+    alert.messages.all.return_value = [
+        Mock(language='en', type='email',
+             message='Subject: alert %d\nbody of %d' % (alertid, alertid)),
+        Mock(language='en', type='sms', message='sms %d' % alertid),
+    ]
+    return alert
+
+
+def _make_address(address='user@example.org'):
+    return Mock(address=address, DEBUG_MODE=False)
+
+
+def test_find_message_should_search_all_messages():
+    alert = _make_alert(1)
+    assert find_message(alert, 'en', 'sms') == 'sms 1'
+    assert find_message(alert, 'no', 'sms') is None
+
+
+class TestEmail(object):
+    @patch('nav.alertengine.dispatchers.email_dispatcher.get_connection')
+    def test_should_reuse_connection_until_closed(self, get_connection):
+        email = Email()
+        email.send(_make_address(), _make_alert(1))
+        email.send(_make_address(), _make_alert(2))
+        assert get_connection.call_count == 1
+        connection = get_connection.return_value
+        assert connection.send_messages.call_count == 2
+
+        email.close()
+        connection.close.assert_called_once_with()
+        email.send(_make_address(), _make_alert(3))
+        assert get_connection.call_count == 2
+
+    @patch('nav.alertengine.dispatchers.email_dispatcher.get_connection')
+    def test_should_reconnect_after_smtp_error(self, get_connection):
+        connection = get_connection.return_value
+        connection.send_messages.side_effect = SMTPServerDisconnected('gone')
+        email = Email()
+        with pytest.raises(DispatcherException):
+            email.send(_make_address(), _make_alert(1))
+        connection.close.assert_called_once_with()
+
+        connection.send_messages.side_effect = None
+        email.send(_make_address(), _make_alert(2))
+        assert get_connection.call_count == 2
+
+    @patch('nav.alertengine.dispatchers.email_dispatcher.get_connection')
+    def test_digest_should_contain_all_alerts(self, get_connection):
+        Email().send_digest(_make_address(), [_make_alert(1), _make_alert(2)])
+        message = get_connection.return_value.send_messages.call_args[0][0][0]
+        assert message.subject == '2 alerts from NAV'
+        assert 'alert 1\n' in message.body
+        assert 'body of 2' in message.body
+        assert message.extra_headers['X-NAV-Alert-ID'] == '1, 2'
+
+    def test_digest_threshold_should_come_from_config(self):
+        assert Email().digest_threshold == 0
+        assert Email(config={'digest_threshold': '5'}).digest_threshold == 5
+
+
+class TestSlack(object):
+    URL = 'https://hooks.example.org/services/T0/B0/X'
+
+    @patch('nav.alertengine.dispatchers.slack_dispatcher.http_client')
+    def test_should_reuse_connection(self, http_client):
+        connection = http_client.HTTPSConnection.return_value
+        connection.getresponse.return_value = Mock(status=200)
+        slack = Slack(config={})
+        slack.send(_make_address(self.URL), _make_alert(1))
+        slack.send(_make_address(self.URL), _make_alert(2))
+        assert http_client.HTTPSConnection.call_count == 1
+        assert connection.request.call_args[0][:2] == (
+            'POST', '/services/T0/B0/X')
+
+    @patch('nav.alertengine.dispatchers.slack_dispatcher.http_client')
+    def test_should_retry_once_on_closed_connection(self, http_client):
+        http_client.HTTPException = Exception
+        stale, fresh = Mock(), Mock()
+        stale.getresponse.return_value = Mock(status=200)
+        fresh.getresponse.return_value = Mock(status=200)
+        http_client.HTTPSConnection.side_effect = [stale, fresh]
+        slack = Slack(config={})
+        slack.send(_make_address(self.URL), _make_alert(1))
+
+        stale.request.side_effect = socket.error('reset')
+        slack.send(_make_address(self.URL), _make_alert(2))
+        assert fresh.request.called
+
+    @patch('nav.alertengine.dispatchers.slack_dispatcher.http_client')
+    def test_server_error_should_be_temporary(self, http_client):
+        connection = http_client.HTTPSConnection.return_value
+        connection.getresponse.return_value = Mock(status=503, reason='Busy')
+        connection.getresponse.return_value.read.return_value = b''
+        with pytest.raises(DispatcherException):
+            Slack(config={}).send(_make_address(self.URL), _make_alert(1))
+
+
+class TestSendQueuedAlerts(object):
+    def _make_queued_alerts(self, count, threshold):
+        address = Mock()
+        address.type.get_digest_threshold.return_value = threshold
+        return [Mock(subscription=Mock(alert_address=address))
+                for _ in range(count)]
+
+    @patch('nav.alertengine.base.AccountAlertQueue.send_digest')
+    def test_should_send_digest_at_threshold(self, send_digest):
+        queued_alerts = self._make_queued_alerts(3, threshold=3)
+        send_digest.return_value = True
+        assert send_queued_alerts(queued_alerts) == [True] * 3
+        send_digest.assert_called_once_with(queued_alerts)
+        assert not any(queued.send.called for queued in queued_alerts)
+
+    @patch('nav.alertengine.base.AccountAlertQueue.send_digest')
+    def test_should_send_individually_below_threshold(self, send_digest):
+        queued_alerts = self._make_queued_alerts(2, threshold=3)
+        queued_alerts[1].send.return_value = False
+        assert send_queued_alerts(queued_alerts) == [
+            queued_alerts[0].send.return_value, False]
+        assert not send_digest.called
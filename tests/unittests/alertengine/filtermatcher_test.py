@@ -0,0 +1,216 @@
+"""Tests for the in-memory alert profile filter matcher"""
+from mock import Mock
+import pytest
+
+from nav.models.profiles import Expression, MatchField, Operator
+from nav.alertengine.filtermatcher import (FilterMatcher, UnsupportedExpression,
+                                           compile_filter)
+
+SYSNAME = MatchField(name='Sysname', value_id='netbox.sysname',
+                     data_type=MatchField.STRING)
+SEVERITY = MatchField(name='Severity', value_id='alertq.severity',
+                      data_type=MatchField.INTEGER)
+CATEGORY = MatchField(name='Category', value_id='cat.catid',
+                      data_type=MatchField.STRING)
+GROUP = MatchField(name='Group', value_id='netboxgroup.netboxgroupid',
+                   data_type=MatchField.STRING)
+GROUP_DESCR = MatchField(name='Group description',
+                         value_id='netboxgroup.descr',
+                         data_type=MatchField.STRING)
+LOCATION = MatchField(name='Location', value_id='location.locationid',
+                      data_type=MatchField.STRING)
+IP = MatchField(name='IP address', value_id='netbox.ip',
+                data_type=MatchField.IP)
+
+LOCATIONS = {'norway': {'norway', 'trondheim'}, 'trondheim': {'trondheim'}}
+
+
+def _make_filter(*expressions):
+    filtr = Mock(id=1)
+    filtr.expression_set.select_related.return_value = [
+        Expression(match_field=match_field, operator=operator, value=value)
+        for match_field, operator, value in expressions
+    ]
+    return filtr
+
+
+def _compile(*expressions):
+    def get_location_descendants(location_ids):
+        return set().union(*(LOCATIONS.get(l, set()) for l in location_ids))
+    return compile_filter(_make_filter(*expressions), get_location_descendants)
+
+
+def _matches(compiled, *rows):
+    return compiled.matches([tuple(row.get(path) for path in compiled.paths)
+                             for row in rows])
+
+
+class TestPlainLookups(object):
+    @pytest.mark.parametrize("operator,value,expected", [
+        (Operator.EQUALS, 'gw1.example.org', True),
+        (Operator.EQUALS, 'GW1.example.org', False),
+        (Operator.STARTSWITH, 'GW1', True),
+        (Operator.ENDSWITH, '.ORG', True),
+        (Operator.CONTAINS, 'EXAMPLE', True),
+        (Operator.CONTAINS, 'example.com', False),
+        (Operator.REGEXP, r'^GW\d\.', True),
+        (Operator.WILDCARD, 'GW%.example._rg', True),
+        (Operator.WILDCARD, 'gw%.example', False),
+    ])
+    def test_sysname_should_match_like_the_database(self, operator, value,
+                                                   expected):
+        compiled = _compile((SYSNAME, operator, value))
+        assert _matches(compiled,
+                        {'netbox__sysname': 'gw1.example.org'}) == expected
+
+    @pytest.mark.parametrize("operator,value,expected", [
+        (Operator.GREATER, '50', True),
+        (Operator.GREATER, '60', False),
+        (Operator.GREATER_EQ, '60', True),
+        (Operator.LESS, '100', True),
+        (Operator.LESS_EQ, '59', False),
+        (Operator.IN, '10|60', True),
+        (Operator.CONTAINS, '6', True),
+    ])
+    def test_severity_should_be_compared_as_integer(self, operator, value,
+                                                    expected):
+        compiled = _compile((SEVERITY, operator, value))
+        assert _matches(compiled, {'severity': 60}) == expected
+
+    def test_null_value_should_not_match(self):
+        compiled = _compile((SYSNAME, Operator.CONTAINS, 'example'))
+        assert not _matches(compiled, {})
+
+    def test_later_expression_on_same_lookup_should_replace_earlier(self):
+        compiled = _compile((CATEGORY, Operator.EQUALS, 'GW'),
+                            (CATEGORY, Operator.EQUALS, 'SW'))
+        assert _matches(compiled, {'netbox__category__id': 'SW'})
+        assert not _matches(compiled, {'netbox__category__id': 'GW'})
+
+    def test_deleted_alert_should_not_match_empty_filter(self):
+        compiled = _compile()
+        assert _matches(compiled, {})
+        assert not compiled.matches([])
+
+
+class TestExclusions(object):
+    def test_not_equal_should_exclude(self):
+        compiled = _compile((SYSNAME, Operator.NOT_EQUAL, 'gw1'))
+        assert not _matches(compiled, {'netbox__sysname': 'gw1'})
+        assert _matches(compiled, {'netbox__sysname': 'gw2'})
+
+    def test_not_equal_should_not_exclude_null(self):
+        compiled = _compile((SYSNAME, Operator.NOT_EQUAL, 'gw1'))
+        assert _matches(compiled, {})
+
+    def test_should_only_exclude_when_all_exclusions_match(self):
+        compiled = _compile((SYSNAME, Operator.NOT_EQUAL, 'gw1'),
+                            (SEVERITY, Operator.NOT_EQUAL, '50'))
+        assert _matches(compiled, {'netbox__sysname': 'gw1', 'severity': 60})
+        assert not _matches(compiled,
+                            {'netbox__sysname': 'gw1', 'severity': 50})
+
+    def test_exclusion_on_multi_valued_relation_is_unsupported(self):
+        with pytest.raises(UnsupportedExpression):
+            _compile((GROUP, Operator.NOT_EQUAL, 'servers'))
+
+
+class TestMultiValuedRelations(object):
+    def test_any_group_should_match(self):
+        compiled = _compile((GROUP, Operator.EQUALS, 'servers'))
+        assert _matches(compiled,
+                        {'netbox__netboxcategory__category__id': 'core'},
+                        {'netbox__netboxcategory__category__id': 'servers'})
+
+    def test_conditions_should_be_met_by_same_group(self):
+        compiled = _compile((GROUP, Operator.EQUALS, 'servers'),
+                            (GROUP_DESCR, Operator.CONTAINS, 'critical'))
+        core = {'netbox__netboxcategory__category__id': 'core',
+                'netbox__netboxcategory__category__description': 'critical'}
+        servers = {'netbox__netboxcategory__category__id': 'servers',
+                   'netbox__netboxcategory__category__description': 'misc'}
+        assert not _matches(compiled, core, servers)
+        servers['netbox__netboxcategory__category__description'] = 'Critical'
+        assert _matches(compiled, core, servers)
+
+
+class TestLocations(object):
+    def test_should_match_descendant_location(self):
+        compiled = _compile((LOCATION, Operator.EQUALS, 'norway'))
+        assert _matches(compiled, {'netbox__room__location': 'trondheim'})
+
+    def test_should_not_match_ancestor_location(self):
+        compiled = _compile((LOCATION, Operator.IN, 'trondheim|bergen'))
+        assert not _matches(compiled, {'netbox__room__location': 'norway'})
+
+
+class TestIpAddresses(object):
+    @pytest.mark.parametrize("operator,value,expected", [
+        (Operator.EQUALS, '10.0.1.5', True),
+        (Operator.EQUALS, '10.0.1.5/24', False),
+        (Operator.NOT_EQUAL, '10.0.1.6', True),
+        (Operator.IN, '10.0.0.0/16', True),
+        (Operator.IN, '10.1.0.0/16|10.0.1.0/24', True),
+        (Operator.IN, '10.0.1.128/25', False),
+        (Operator.IN, '2001:db8::/32', False),
+        (Operator.CONTAINS, '10.0.1.5', True),
+        (Operator.CONTAINS, '10.0.1.0/24', False),
+        (Operator.WILDCARD, '10.0.1.%', True),
+        (Operator.REGEXP, r'^10\.0\.2\.', False),
+    ])
+    def test_ipv4_should_match_like_inet(self, operator, value, expected):
+        compiled = _compile((IP, operator, value))
+        assert _matches(compiled, {'netbox__ip': '10.0.1.5'}) == expected
+
+    def test_ipv6_should_match_prefix(self):
+        compiled = _compile((IP, Operator.IN, '2001:db8:1::/48'))
+        assert _matches(compiled, {'netbox__ip': '2001:db8:1::10'})
+        assert not _matches(compiled, {'netbox__ip': '2001:db8:2::10'})
+
+    @pytest.mark.parametrize("operator,value", [
+        (Operator.IN, '10.0.0.0/33'),
+        (Operator.EQUALS, 'gw1'),
+        (Operator.GREATER, '10.0.0.1'),
+    ])
+    def test_should_not_compile_unsupported_ip_expressions(self, operator,
+                                                          value):
+        with pytest.raises(UnsupportedExpression):
+            _compile((IP, operator, value))
+
+
+class TestUnsupportedExpressions(object):
+    def test_ordering_of_strings_is_unsupported(self):
+        with pytest.raises(UnsupportedExpression):
+            _compile((SYSNAME, Operator.GREATER, 'm'))
+
+    @pytest.mark.parametrize("pattern", [
+        r'^gw[[:digit:]]',
+        r'\ygw1\y',
+        r'\mgw',
+        r'gw1\M',
+        r'\bgw1',
+        r'***=gw1',
+        r'(?P<name>gw)',
+    ])
+    def test_postgresql_specific_regexp_is_unsupported(self, pattern):
+        with pytest.raises(UnsupportedExpression):
+            _compile((SYSNAME, Operator.REGEXP, pattern))
+
+    @pytest.mark.parametrize("pattern", [
+        r'^gw\d\.example\.(org|com)$',
+        r'(?:gw|sw)\w+\s*',
+        r'[a-z\-]+\\d',
+    ])
+    def test_portable_regexp_is_supported(self, pattern):
+        assert _compile((SYSNAME, Operator.REGEXP, pattern))
+
+    def test_invalid_integer_is_unsupported(self):
+        with pytest.raises(UnsupportedExpression):
+            _compile((SEVERITY, Operator.EQUALS, 'high'))
+
+    def test_matcher_should_fall_back_to_database(self):
+        filtr = _make_filter((SYSNAME, Operator.GREATER, 'm'))
+        alert = Mock(id=10)
+        matcher = FilterMatcher([alert])
+        assert matcher.verify(filtr, alert) is filtr.verify.return_value
+        filtr.verify.assert_called_once_with(alert)
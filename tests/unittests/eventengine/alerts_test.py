@@ -1,8 +1,10 @@
 from unittest import TestCase
 import datetime
+import os
 from nav.models.event import EventQueue as Event, Subsystem, EventType
 from nav.models.manage import Netbox, Device
-from nav.eventengine.alerts import AlertGenerator
+from nav.eventengine.alerts import (AlertGenerator, AlertTemplateRegistry,
+                                    TemplateDetails)
 
 
 class MockedAlertGenerator(AlertGenerator):
@@ -65,3 +67,70 @@ class AlertHistoryFromEventTests(AlertFromEventBase):
         self.event.state = self.event.STATE_END
         alert = MockedAlertGenerator(self.event)
         self.assertTrue(alert.make_alert_history() is None)
+
+
+class TestAlertTemplateRegistry(object):
+    def _make_registry(self, tmpdir, now):
+        directory = tmpdir.mkdir('alertmsg')
+        directory.mkdir('boxState').join('boxDown-email.txt').write(
+            u'{{ netbox }} is down')
+        directory.join('boxState', 'boxDown-sms.no.txt').write(u'nede')
+        directory.join('boxState', 'README').write(u'not a template')
+        registry = AlertTemplateRegistry(str(directory), check_interval=60,
+                                         clock=lambda: now[0])
+        return directory, registry
+
+    def test_should_index_templates_by_event_and_alert_type(self, tmpdir):
+        _, registry = self._make_registry(tmpdir, [0])
+        assert registry.get_templates('boxState', 'boxDown') == [
+            TemplateDetails(os.path.join('boxState', 'boxDown-email.txt'),
+                            'email', 'en'),
+            TemplateDetails(os.path.join('boxState', 'boxDown-sms.no.txt'),
+                            'sms', 'no'),
+        ]
+        assert registry.get_templates('boxState') == []
+        assert registry.get_templates('linkState', 'linkDown') == []
+
+    def test_should_compile_template_once(self, tmpdir):
+        _, registry = self._make_registry(tmpdir, [0])
+        details = registry.get_templates('boxState', 'boxDown')[0]
+        template = registry.get_template(details)
+        assert registry.get_template(details) is template
+        assert template.render({'netbox': 'gw1'}) == 'gw1 is down'
+
+    def test_should_only_notice_changes_after_check_interval(self, tmpdir):
+        now = [0]
+        directory, registry = self._make_registry(tmpdir, now)
+        registry.get_templates('boxState', 'boxDown')
+        directory.join('boxState', 'boxUp-email.txt').write(u'up')
+        assert registry.get_templates('boxState', 'boxUp') == []
+        now[0] = 61
+        assert len(registry.get_templates('boxState', 'boxUp')) == 1
+
+    def test_should_recompile_modified_template(self, tmpdir):
+        now = [0]
+        directory, registry = self._make_registry(tmpdir, now)
+        details = registry.get_templates('boxState', 'boxDown')[0]
+        registry.get_template(details)
+        template_file = directory.join('boxState', 'boxDown-email.txt')
+        template_file.write(u'{{ netbox }} is unreachable')
+        template_file.setmtime(template_file.mtime() + 10)
+        now[0] = 61
+        assert registry.get_template(details).render(
+            {'netbox': 'gw1'}) == 'gw1 is unreachable'
+
+    def test_missing_directory_should_have_no_templates(self, tmpdir):
+        registry = AlertTemplateRegistry(str(tmpdir.join('missing')))
+        assert registry.get_templates('boxState', 'boxDown') == []
+
+    def test_should_include_and_extend_templates_in_tree(self, tmpdir):
+        directory, registry = self._make_registry(tmpdir, [0])
+        directory.join('base.txt').write(
+            u'NAV: {% block body %}{% endblock %}')
+        directory.join('boxState', 'footer.txt').write(u'-- {{ netbox }}')
+        directory.join('boxState', 'boxUp-email.txt').write(
+            u'{% extends "base.txt" %}{% block body %}{{ netbox }} is up '
+            u'{% include "./footer.txt" %}{% endblock %}')
+        details = registry.get_templates('boxState', 'boxUp')[0]
+        assert registry.get_template(details).render(
+            {'netbox': 'gw1'}) == 'NAV: gw1 is up -- gw1'
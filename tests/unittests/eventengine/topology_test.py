@@ -0,0 +1,109 @@
+import networkx
+from mock import Mock, patch
+
+from nav.eventengine import topology
+from nav.eventengine.topology import TopologyCache, VlanTopology
+
+
+class Box(object):
+    UP_UP = 'y'
+
+    def __init__(self, id, up='y'):
+        self.id = id
+        self.up = up
+
+    def __eq__(self, other):
+        return self.id == getattr(other, 'id', None)
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return 'Box(%r)' % self.id
+
+
+def _make_chain(*ids):
+    boxes = {i: Box(i) for i in ids}
+    graph = networkx.MultiGraph()
+    for source, target in zip(ids, ids[1:]):
+        graph.add_edge(boxes[source], boxes[target])
+    return boxes, graph
+
+
+def test_path_should_lead_to_router():
+    boxes, graph = _make_chain(1, 2, 3, 4)
+    tree = VlanTopology(graph).get_router_tree(boxes[1], frozenset())
+    assert tree.get_path(boxes[4], [boxes[3]]) == [boxes[4], boxes[3],
+                                                   boxes[2], boxes[1]]
+
+
+def test_down_box_should_block_path_but_not_its_own():
+    boxes, graph = _make_chain(1, 2, 3, 4)
+    topo = VlanTopology(graph)
+    tree = topo.get_router_tree(boxes[1], frozenset([2, 3]))
+    assert tree.get_path(boxes[3], topo.get_neighbors(boxes[3])) == []
+    assert tree.get_path(boxes[2], topo.get_neighbors(boxes[2])) == [
+        boxes[2], boxes[1]]
+
+
+def test_router_tree_should_be_reused_for_same_down_set():
+    boxes, graph = _make_chain(1, 2)
+    topo = VlanTopology(graph)
+    tree = topo.get_router_tree(boxes[1], frozenset([2]))
+    assert topo.get_router_tree(boxes[1], frozenset([2])) is tree
+    assert topo.get_router_tree(boxes[1], frozenset()) is not tree
+
+
+def test_disconnected_box_should_not_be_connected():
+    boxes, graph = _make_chain(1, 2)
+    graph.add_edge(Box(3), Box(4))
+    topo = VlanTopology(graph)
+    assert topo.is_connected([boxes[2]], boxes[1])
+    assert not topo.is_connected([Box(3)], boxes[1])
+
+
+def test_cache_should_build_graph_once_until_cleared():
+    vlan = Mock(id=10)
+    with patch('nav.eventengine.topology.get_graph_for_vlan',
+               return_value=networkx.MultiGraph()) as get_graph:
+        cache = TopologyCache()
+        assert cache.get(vlan) is cache.get(vlan)
+        cache.clear()
+        cache.get(vlan)
+        assert get_graph.call_count == 2
+
+
+def test_paths_to_netboxes_should_be_found_in_one_search():
+    boxes, graph = _make_chain(1, 2, 3)
+    router_port = Mock()
+    router_port.interface.netbox = boxes[1]
+    prefix = Mock(vlan=Mock(id=1))
+    prefix.get_router_ports.return_value = [router_port]
+    for box in boxes.values():
+        box.get_prefix = Mock(return_value=prefix)
+
+    with patch('nav.eventengine.topology._topology_cache', TopologyCache()), \
+            patch('nav.eventengine.topology.get_graph_for_vlan',
+                  return_value=graph), \
+            patch('nav.eventengine.topology.get_down_netbox_ids',
+                  return_value=frozenset([2, 3])), \
+            patch('nav.eventengine.topology.RouterTree',
+                  wraps=topology.RouterTree) as router_tree:
+        paths = topology.get_paths_to_netboxes([boxes[2], boxes[3]])
+    assert paths == {boxes[2]: [boxes[2], boxes[1]], boxes[3]: []}
+    assert router_tree.call_count == 1
+
+
+def test_reachability_check_should_look_up_down_netboxes_once():
+    netbox, nav = Mock(ip='10.0.0.10'), Mock()
+    down = frozenset([2])
+    with patch('nav.eventengine.topology.NAVServer.make_for',
+               return_value=nav), \
+            patch('nav.eventengine.topology.get_down_netbox_ids',
+                  return_value=down) as get_down, \
+            patch('nav.eventengine.topology.get_path_to_netbox',
+                  side_effect=[[netbox], []]) as get_path:
+        assert not topology.netbox_appears_reachable(netbox)
+    assert get_down.call_count == 1
+    assert get_path.call_count == 2
+    assert all(args[1] is down for args, _ in get_path.call_args_list)
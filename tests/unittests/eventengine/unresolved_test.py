@@ -0,0 +1,49 @@
+from mock import Mock, patch
+
+from nav.eventengine import unresolved
+from nav.eventengine.alerts import AlertGenerator
+from nav.models.event import EventQueue as Event
+
+
+def _make_alert(pk, key=(1, 'thing', 'boxState')):
+    return Mock(pk=pk, get_key=Mock(return_value=key))
+
+
+@patch('nav.eventengine.unresolved._unresolved_alerts_map', {})
+def test_added_alert_should_be_found():
+    alert = _make_alert(1)
+    unresolved.add(alert)
+    assert unresolved.refers_to_unresolved_alert(alert) is alert
+
+
+@patch('nav.eventengine.unresolved._unresolved_alerts_map', {})
+def test_resolved_alert_should_be_removed():
+    alert = _make_alert(1)
+    unresolved.add(alert)
+    unresolved.remove(_make_alert(1))
+    assert not unresolved.refers_to_unresolved_alert(alert)
+
+
+@patch('nav.eventengine.unresolved._unresolved_alerts_map', {})
+def test_resolving_another_alert_should_not_remove_unresolved_alert():
+    alert = _make_alert(1)
+    unresolved.add(alert)
+    unresolved.remove(_make_alert(2))
+    assert unresolved.refers_to_unresolved_alert(alert) is alert
+
+
+@patch('nav.eventengine.unresolved._unresolved_alerts_map', {})
+def test_posted_alert_states_should_update_map():
+    history = _make_alert(1)
+    event = Mock(state=Event.STATE_START, varmap={},
+                 get_key=history.get_key)
+    generator = AlertGenerator(event)
+    generator.make_alert_history = Mock(return_value=history)
+    generator._post_alert_messages = Mock()
+
+    generator._post_alert_history()
+    assert unresolved.refers_to_unresolved_alert(event) is history
+
+    generator.state = Event.STATE_END
+    generator._post_alert_history()
+    assert not unresolved.refers_to_unresolved_alert(event)
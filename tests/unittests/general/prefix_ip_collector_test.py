@@ -3,8 +3,12 @@
 """Tests for prefix_ip_collector"""
 
 import unittest
-from datetime import datetime
-from nav.activeipcollector.manager import find_range, get_timestamp
+from datetime import datetime, timedelta
+
+from mock import patch
+
+from nav.activeipcollector.collector import ActiveIpCounter
+from nav.activeipcollector.manager import find_range, get_timestamp, store
 
 
 class TestPrefixIpCollector(unittest.TestCase):
@@ -17,3 +21,74 @@ class TestPrefixIpCollector(unittest.TestCase):
     def test_find_timestamp(self):
         ts = datetime(2012, 10, 4, 14, 30)
         self.assertEqual(get_timestamp(ts), 1349353800)
+
+
+class TestActiveIpCounter(unittest.TestCase):
+    now = datetime(2012, 10, 4, 14, 30)
+    prefixes = ['10.0.0.0/16', '10.0.1.0/24', '10.0.2.0/24', '10.0.1.1/32']
+
+    def test_should_count_distinct_addresses_in_all_containing_prefixes(self):
+        counter = ActiveIpCounter(self.prefixes, self.now)
+        counter.add('10.0.1.1', '00:00:00:00:00:01')
+        counter.add('10.0.1.2', '00:00:00:00:00:01')
+        counter.add('10.0.1.2', '00:00:00:00:00:01')
+        counter.add('192.168.0.1', '00:00:00:00:00:02')
+        self.assertEqual(sorted(counter.get_rows()), [
+            ('10.0.0.0/16', self.now, 2, 1),
+            ('10.0.1.0/24', self.now, 2, 1),
+        ])
+
+    def test_should_include_empty_prefixes(self):
+        counter = ActiveIpCounter(self.prefixes, self.now)
+        counter.add('10.0.1.1', '00:00:00:00:00:01')
+        rows = counter.get_rows(include_empty=True)
+        self.assertIn(('10.0.2.0/24', self.now, 0, 0), rows)
+        self.assertIn(('10.0.1.1/32', self.now, 0, 0), rows)
+
+    def test_interval_range_should_cover_active_period(self):
+        counter = ActiveIpCounter(self.prefixes, self.now, intervals=10)
+        start = self.now - timedelta(minutes=100)
+        end = self.now - timedelta(minutes=30)
+        self.assertEqual(list(counter.get_interval_range(start, end)),
+                         [1, 2, 3])
+
+    def test_interval_range_should_be_limited_to_intervals(self):
+        counter = ActiveIpCounter(self.prefixes, self.now, intervals=2)
+        start = self.now - timedelta(days=1)
+        self.assertEqual(list(counter.get_interval_range(start, datetime.max)),
+                         [0, 1, 2])
+
+    def test_rows_should_be_ordered_by_time(self):
+        counter = ActiveIpCounter(self.prefixes, self.now, intervals=2)
+        counter.add('10.0.2.1', '00:00:00:00:00:01', [0, 2])
+        hour_ago = self.now - timedelta(hours=1)
+        self.assertEqual(counter.get_rows(), [
+            ('10.0.0.0/16', hour_ago, 1, 1),
+            ('10.0.2.0/24', hour_ago, 1, 1),
+            ('10.0.0.0/16', self.now, 1, 1),
+            ('10.0.2.0/24', self.now, 1, 1),
+        ])
+
+    def test_should_count_overlapping_records_once_per_interval(self):
+        counter = ActiveIpCounter(self.prefixes, self.now, intervals=5)
+        counter.add('10.0.2.1', '00:00:00:00:00:01', range(1, 4))
+        counter.add('10.0.2.1', '00:00:00:00:00:01', range(2, 5))
+        counter.add('10.0.2.2', '00:00:00:00:00:01', range(3, 4))
+        counter.add('10.0.1.5', '00:00:00:00:00:01', range(3, 4))
+        interval = timedelta(minutes=30)
+        rows = [row for row in counter.get_rows() if row[0] == '10.0.2.0/24']
+        self.assertEqual(rows, [
+            ('10.0.2.0/24', self.now - 4 * interval, 1, 1),
+            ('10.0.2.0/24', self.now - 3 * interval, 2, 1),
+            ('10.0.2.0/24', self.now - 2 * interval, 1, 1),
+            ('10.0.2.0/24', self.now - 1 * interval, 1, 1),
+        ])
+
+class TestStore(unittest.TestCase):
+    @patch('nav.activeipcollector.manager.METRICS_BATCH_SIZE', 6)
+    @patch('nav.activeipcollector.manager.send_metrics')
+    def test_should_send_metrics_in_batches(self, send_metrics):
+        when = datetime(2012, 10, 4, 14, 30)
+        store([('10.0.%d.0/24' % i, when, 1, 1) for i in range(5)])
+        self.assertEqual([len(call[0][0]) for call in
+                          send_metrics.call_args_list], [6, 6, 3])
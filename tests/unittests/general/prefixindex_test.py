@@ -0,0 +1,59 @@
+from IPy import IP
+
+from nav.prefixindex import PrefixIndex
+
+
+class TestPrefixIndex(object):
+    def setup_method(self):
+        self.index = PrefixIndex([
+            ('10.0.0.0/8', 1),
+            ('10.0.42.0/24', 2),
+            ('10.0.42.128/25', 3),
+            ('2001:db8::/32', 4),
+            ('2001:db8:1::/48', 5),
+        ])
+
+    def test_should_find_longest_matching_prefix(self):
+        assert self.index.lookup('10.0.42.200') == 3
+        assert self.index.lookup('10.0.42.1') == 2
+        assert self.index.lookup('10.1.0.1') == 1
+
+    def test_should_find_longest_matching_ipv6_prefix(self):
+        assert self.index.lookup('2001:db8:1::1') == 5
+        assert self.index.lookup('2001:db8:2::1') == 4
+
+    def test_should_return_default_on_no_match(self):
+        assert self.index.lookup('192.168.0.1') is None
+        assert self.index.lookup('192.168.0.1', 'nope') == 'nope'
+
+    def test_should_not_mix_address_families(self):
+        assert self.index.lookup('::a00:1') is None
+
+    def test_should_accept_ip_objects(self):
+        assert self.index.lookup(IP('10.0.42.1')) == 2
+
+    def test_match_should_return_matching_prefix(self):
+        assert self.index.match('10.0.42.1') == (IP('10.0.42.0/24'), 2)
+        assert self.index.match('192.168.0.1') is None
+
+    def test_should_match_network_address_of_prefix(self):
+        assert self.index.lookup('10.0.42.128') == 3
+
+    def test_lookup_all_should_find_all_matching_prefixes(self):
+        assert self.index.lookup_all('10.0.42.200') == [3, 2, 1]
+        assert self.index.lookup_all('2001:db8:2::1') == [4]
+        assert self.index.lookup_all('192.168.0.1') == []
+
+    def test_contains(self):
+        assert '10.0.0.1' in self.index
+        assert '192.168.0.1' not in self.index
+
+    def test_default_route_should_match_everything(self):
+        self.index.add('0.0.0.0/0', 0)
+        assert self.index.lookup('192.168.0.1') == 0
+        assert self.index.lookup('10.0.42.1') == 2
+
+    def test_readding_prefix_should_replace_value(self):
+        self.index.add('10.0.42.0/24', 42)
+        assert self.index.lookup('10.0.42.1') == 42
+        assert len(self.index) == 5
@@ -0,0 +1,69 @@
+from unittest import TestCase
+
+from mock import patch
+
+from nav.ipdevpoll import dataloader
+from nav.ipdevpoll.dataloader import NetboxSnapshotCache
+from nav.ipdevpoll.shadows import Netbox, NetboxType
+
+
+def _make_netbox(sysname='example-sw.example.org'):
+    netbox = Netbox()
+    netbox.id = 42
+    netbox.sysname = sysname
+    netbox.ip = '10.0.0.42'
+    netbox.type = NetboxType()
+    netbox.type.id = 1
+    netbox.type.name = 'C3750'
+    return netbox
+
+
+class NetboxSnapshotCacheTest(TestCase):
+    def setUp(self):
+        self.cache = NetboxSnapshotCache()
+
+    def test_load_should_return_equal_copy(self):
+        netbox = _make_netbox()
+        snapshot = self.cache.store(netbox)
+        loaded = self.cache.load(42, snapshot.version)
+        self.assertIsNot(loaded, netbox)
+        self.assertEqual(loaded.sysname, netbox.sysname)
+        self.assertEqual(loaded.ip, netbox.ip)
+        self.assertEqual(loaded.type.name, 'C3750')
+
+    def test_unchanged_netbox_should_keep_version(self):
+        first = self.cache.store(_make_netbox())
+        second = self.cache.store(_make_netbox())
+        self.assertEqual(first.version, second.version)
+
+    def test_changed_netbox_should_bump_version(self):
+        first = self.cache.store(_make_netbox())
+        second = self.cache.store(_make_netbox(sysname='other.example.org'))
+        self.assertEqual(second.version, first.version + 1)
+
+    def test_load_of_wrong_version_should_return_none(self):
+        snapshot = self.cache.store(_make_netbox())
+        self.assertIsNone(self.cache.load(42, snapshot.version + 1))
+
+    def test_load_of_unknown_netbox_should_return_none(self):
+        self.assertIsNone(self.cache.load(1, 1))
+
+
+class LoadNetboxFromCacheOrDbTest(TestCase):
+    def setUp(self):
+        self.cache = NetboxSnapshotCache()
+        self.snapshot = self.cache.store(_make_netbox())
+
+    def test_unversioned_load_should_use_database(self):
+        with patch.object(dataloader, 'netbox_snapshots', self.cache), \
+                patch.object(dataloader, 'run_in_thread') as run_in_thread:
+            dataloader.load_netbox_from_cache_or_db(42)
+        run_in_thread.assert_called_once_with(dataloader.load_netbox, 42)
+
+    def test_versioned_load_should_use_snapshot(self):
+        with patch.object(dataloader, 'netbox_snapshots', self.cache), \
+                patch.object(dataloader, 'run_in_thread') as run_in_thread:
+            result = dataloader.load_netbox_from_cache_or_db(
+                42, self.snapshot.version)
+        self.assertFalse(run_in_thread.called)
+        self.assertEqual(result.result.sysname, 'example-sw.example.org')
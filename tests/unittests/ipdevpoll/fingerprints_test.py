@@ -0,0 +1,51 @@
+"""Tests for ipdevpoll's record set fingerprints"""
+import time
+
+from nav.ipdevpoll.fingerprints import Fingerprints, diff_groups, get_digest
+
+
+def test_digest_should_not_depend_on_record_order():
+    assert get_digest(['a', 'b', 'c']) == get_digest(['c', 'a', 'b'])
+
+
+def test_digest_should_change_when_records_change():
+    assert get_digest(['a', 'b']) != get_digest(['a', 'b', 'c'])
+
+
+def test_changed_groups_should_include_added_and_removed_groups():
+    previous = Fingerprints.from_groups({1: ['a'], 2: ['b'], 3: ['c']})
+    current = Fingerprints.from_groups({1: ['a'], 2: ['x'], 4: ['d']})
+    assert current.get_changed_groups(previous) == {'2', '3', '4'}
+
+
+def test_json_roundtrip_should_preserve_fingerprints():
+    fingerprints = Fingerprints.from_groups({1: ['a'], 2: ['b']}, 42.0)
+    loaded = Fingerprints.from_json(fingerprints.to_json())
+    assert loaded.digests == fingerprints.digests
+    assert loaded.synced == 42.0
+
+
+def test_invalid_json_should_give_no_fingerprints():
+    assert Fingerprints.from_json('foobar') is None
+    assert Fingerprints.from_json('{"digests": {}}') is None
+
+
+def test_diff_without_previous_fingerprints_should_compare_everything():
+    current, changed = diff_groups({1: ['a']}, None)
+    assert changed is None
+    assert current.digests == {'1': get_digest(['a'])}
+
+
+def test_diff_should_keep_time_of_last_full_comparison():
+    synced = time.time() - 60
+    previous = Fingerprints.from_groups({1: ['a'], 2: ['b']}, synced)
+    current, changed = diff_groups({1: ['a'], 2: ['c']}, previous)
+    assert changed == {'2'}
+    assert current.synced == synced
+
+
+def test_diff_with_stale_fingerprints_should_compare_everything():
+    previous = Fingerprints.from_groups({1: ['a']}, time.time() - 7 * 3600)
+    current, changed = diff_groups({1: ['a']}, previous)
+    assert changed is None
+    assert current.synced > previous.synced
@@ -1,5 +1,24 @@
+from IPy import IP
+from mock import Mock, patch
+import pytest
+import pytest_twisted
+from twisted.internet import defer
+
+from nav.ipdevpoll import shadows
+from nav.ipdevpoll.fingerprints import Fingerprints
 from nav.ipdevpoll.storage import ContainerRepository
 from nav.ipdevpoll.plugins.arp import ipv6_address_in_mappings, Arp
+from nav.prefixindex import PrefixIndex
+
+
+@pytest.fixture
+def prefix_cache(monkeypatch):
+    """Gives each test an empty Arp prefix cache, and restores the original
+    cache afterwards.
+    """
+    monkeypatch.setattr(Arp, 'prefix_cache', PrefixIndex())
+    monkeypatch.setattr(Arp, 'prefix_cache_update_time',
+                        Arp.prefix_cache_update_time)
 
 
 def test_none_in_mappings_should_not_raise():
@@ -11,3 +30,42 @@ def test_make_new_mappings_should_not_raise_on_empty_ip():
     a = Arp(None, None, ContainerRepository())
     mappings = [(None, '00:0b:ad:c0:ff:ee')]
     a._make_new_mappings(mappings)
+
+
+def test_find_largest_matching_prefix_should_prefer_longest_prefix(
+        prefix_cache):
+    prefixes = [{'id': 1, 'net_address': '10.0.42.0/24'},
+                {'id': 2, 'net_address': '10.0.0.0/8'}]
+    Arp._update_prefix_cache_with_result(prefixes)
+    a = Arp(None, None, ContainerRepository())
+    assert a._find_largest_matching_prefix(IP('10.0.42.1')) == 1
+    assert a._find_largest_matching_prefix(IP('10.0.1.1')) == 2
+    assert a._find_largest_matching_prefix(IP('192.168.0.1')) is None
+
+
+@pytest.mark.twisted
+@pytest_twisted.inlineCallbacks
+def test_incremental_diff_should_only_compare_changed_address_blocks(
+        prefix_cache):
+    unchanged = (IP('10.0.1.1'), '00:00:00:00:00:01')
+    changed = (IP('10.0.2.1'), '00:00:00:00:00:02')
+    previous = Fingerprints.from_groups({
+        '10.0.1.0/24': ['10.0.1.1 00:00:00:00:00:01'],
+        '10.0.2.0/24': ['10.0.2.1 00:00:00:00:00:99'],
+    })
+    a = Arp(Mock(id=1, sysname='gw'), None, ContainerRepository())
+    loader = Mock(return_value=defer.succeed({}))
+    with patch('nav.ipdevpoll.fingerprints.is_incremental_enabled',
+               return_value=True), \
+            patch('nav.ipdevpoll.db.run_in_thread',
+                  return_value=defer.succeed(previous)), \
+            patch.object(a, '_load_existing_mappings', loader):
+        yield a._process_data([(1, unchanged[0], unchanged[1]),
+                               (2, changed[0], changed[1])])
+
+    loader.assert_called_once_with({'10.0.2.0/24'})
+    arps = a.containers[shadows.Arp]
+    assert list(arps) == [changed]
+    info = a.containers[shadows.NetboxInfo][('fingerprints', 'arp')]
+    assert Fingerprints.from_json(info.value).get_changed_groups(
+        previous) == {'10.0.2.0/24'}
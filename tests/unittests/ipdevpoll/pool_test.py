@@ -0,0 +1,105 @@
+from mock import Mock, patch
+
+import pytest
+from twisted.internet import defer
+from twisted.protocols import amp
+
+from nav.ipdevpoll import dataloader, jobs
+from nav.ipdevpoll.pool import (WorkerPool, Worker, Job, UpdateNetbox,
+                                ForgetNetbox)
+
+
+def _make_worker(pool):
+    worker = Worker(pool, None, None)
+    worker.process = Mock(connection_lost=False)
+    worker.process.callRemote.side_effect = lambda *a, **kw: defer.Deferred()
+    pool.workers.add(worker)
+    return worker
+
+
+@pytest.fixture
+def pool():
+    with patch.object(WorkerPool, '_spawn_worker'):
+        pool = WorkerPool(2, None)
+        pool.max_worker_load = 10
+        yield pool
+
+
+def test_should_place_job_in_least_loaded_worker(pool):
+    busy = _make_worker(pool)
+    idle = _make_worker(pool)
+    busy.load = 5
+    pool._execute(Job, cost=2, netbox=1)
+    assert idle.load == 2
+    assert busy.load == 5
+
+
+def test_should_queue_job_when_no_worker_has_capacity(pool):
+    first = _make_worker(pool)
+    second = _make_worker(pool)
+    first.load = second.load = 9
+    second.queued_cost = 1
+    pool._execute(Job, cost=5, netbox=1)
+    assert len(first.queue) == 1
+    assert pool.get_stats()['queue_length'] == 1
+
+
+def test_queued_job_should_be_reported_started_when_dispatched(pool):
+    worker = _make_worker(pool)
+    pool._execute(Job, cost=10, netbox=1)
+    on_start = Mock()
+    pool._execute(Job, cost=10, on_start=on_start, netbox=2)
+    assert not on_start.called
+    worker.load = 0
+    pool._run_queued_jobs(worker)
+    on_start.assert_called_once_with()
+
+
+def test_idle_worker_should_steal_queued_job(pool):
+    busy = _make_worker(pool)
+    pool._execute(Job, cost=10, netbox=1)
+    pool._execute(Job, cost=10, netbox=2)
+    assert len(busy.queue) == 1
+
+    idle = _make_worker(pool)
+    pool._run_queued_jobs(idle)
+    assert not busy.queue
+    assert idle.load == 10
+    assert pool.steal_count == 1
+
+
+def test_cancel_should_abort_queued_job(pool):
+    worker = _make_worker(pool)
+    pool._execute(Job, cost=10, netbox=1)
+    deferred = pool._execute(Job, cost=10, netbox=2)
+    failures = []
+    deferred.addErrback(failures.append)
+    pool.cancel(deferred)
+    assert not worker.queue
+    assert failures[0].check(jobs.AbortedJobError)
+
+
+def test_worker_should_be_recycled_on_memory_growth(pool):
+    pool.max_memory_growth = 100
+    worker = _make_worker(pool)
+    worker.get_memory_growth = Mock(return_value=200)
+    pool._check_memory_growth(worker)
+    assert worker.retiring
+    assert worker.done()
+    assert pool.recycle_count == 1
+
+
+def test_worker_should_forget_netbox_when_snapshot_is_too_large(pool):
+    worker = _make_worker(pool)
+    snapshots = dataloader.NetboxSnapshotCache()
+    snapshots[1] = dataloader.NetboxSnapshot(1, b'small')
+    with patch.object(dataloader, 'netbox_snapshots', snapshots):
+        assert worker.push_netbox(1) == 1
+        worker.process.callRemote.assert_called_with(
+            UpdateNetbox, netbox=1, version=1, snapshot=b'small')
+
+        snapshots[1] = dataloader.NetboxSnapshot(
+            2, b'x' * (amp.MAX_VALUE_LENGTH + 1))
+        assert worker.push_netbox(1) is None
+        worker.process.callRemote.assert_called_with(ForgetNetbox, netbox=1)
+        assert 1 not in worker.netbox_versions
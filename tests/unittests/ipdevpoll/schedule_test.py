@@ -26,9 +26,142 @@ def test_netbox_job_scheduler_reschedule_on_success(netbox_job_scheduler):
     netbox_job_scheduler.callLater = clock.callLater
     netbox_job_scheduler.start()
     clock.advance(1)
+    on_start = netbox_job_scheduler._job_started
     pool.execute_job.assert_called_once_with('myjob', 1, plugins=[],
-                                             interval=10)
+                                             interval=10, on_start=on_start)
     clock.advance(10)
     assert pool.execute_job.call_count == 2
     pool.execute_job.assert_called_with('myjob', 1, plugins=[],
-                                        interval=10)
+                                        interval=10, on_start=on_start)
+
+
+def test_job_cost_should_not_include_time_in_worker_queue(
+        netbox_job_scheduler, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(schedule.time, 'time', lambda: now[0])
+    monkeypatch.setattr(schedule.JobCostEstimator, 'instance',
+                        schedule.JobCostEstimator())
+    monkeypatch.setattr(schedule.NetboxJobScheduler, 'job_counters', {})
+    result = defer.Deferred()
+    netbox_job_scheduler.pool.execute_job.return_value = result
+    netbox_job_scheduler.execute_job()
+
+    now[0] = 130.0  # the job has been waiting in a worker queue
+    netbox_job_scheduler._job_started()
+    now[0] = 135.0
+    result.callback(True)
+    assert schedule.JobCostEstimator.instance.get('myjob', 1) == 5.0
+
+
+def test_job_cost_should_not_be_updated_by_job_that_never_started(
+        netbox_job_scheduler, monkeypatch):
+    monkeypatch.setattr(schedule.JobCostEstimator, 'instance',
+                        schedule.JobCostEstimator())
+    monkeypatch.setattr(schedule.NetboxJobScheduler, 'job_counters', {})
+    result = defer.Deferred()
+    netbox_job_scheduler.pool.execute_job.return_value = result
+    netbox_job_scheduler.execute_job()
+    result.callback(True)
+    assert schedule.JobCostEstimator.instance.get('myjob', 1) == \
+        schedule.DEFAULT_JOB_COST
+
+
+def _make_scheduler(name, netbox_id, due, cost, interval=10):
+    job = Mock()
+    job.name = name
+    job.interval = interval
+    job.intensity = 0
+    netbox = Mock()
+    netbox.id = netbox_id
+    scheduler = schedule.NetboxJobScheduler(job, netbox, Mock())
+    scheduler._due = due
+    scheduler._cost = cost
+    scheduler.cancelled = False
+    scheduler.execute_job = Mock(side_effect=scheduler.count_job)
+    return scheduler
+
+
+@pytest.fixture
+def deadline_queue(monkeypatch):
+    monkeypatch.setattr(schedule.NetboxJobScheduler, 'job_counters', {})
+    monkeypatch.setattr(schedule.NetboxJobScheduler, 'global_intensity', 1)
+    return schedule.DeadlineQueue()
+
+
+def test_deadline_queue_should_admit_least_slack_first(deadline_queue):
+    schedule.NetboxJobScheduler.job_counters['busy'] = 1
+    relaxed = _make_scheduler('myjob', 1, due=100, cost=1)
+    urgent = _make_scheduler('myjob', 2, due=100, cost=8)
+    deadline_queue.push(relaxed)
+    deadline_queue.push(urgent)
+    assert len(deadline_queue) == 2
+
+    schedule.NetboxJobScheduler.job_counters['busy'] = 0
+    deadline_queue.dispatch()
+    assert urgent.execute_job.called
+    assert not relaxed.execute_job.called
+
+
+def test_deadline_queue_should_respect_cost_budget(deadline_queue,
+                                                   monkeypatch):
+    monkeypatch.setattr(schedule.NetboxJobScheduler, 'global_intensity', 10)
+    deadline_queue.max_cost = 10
+    first = _make_scheduler('myjob', 1, due=100, cost=8)
+    second = _make_scheduler('myjob', 2, due=101, cost=8)
+    deadline_queue.push(first)
+    deadline_queue.push(second)
+    assert first.execute_job.called
+    assert not second.execute_job.called
+
+    deadline_queue.release(first)
+    assert second.execute_job.called
+
+
+def test_deadline_queue_should_skip_cancelled_jobs(deadline_queue):
+    schedule.NetboxJobScheduler.job_counters['busy'] = 1
+    scheduler = _make_scheduler('myjob', 1, due=100, cost=1)
+    deadline_queue.push(scheduler)
+    scheduler.cancelled = True
+
+    schedule.NetboxJobScheduler.job_counters['busy'] = 0
+    deadline_queue.dispatch()
+    assert not scheduler.execute_job.called
+    assert len(deadline_queue) == 0
+
+
+def test_lateness_histogram_should_count_in_correct_buckets():
+    histogram = schedule.LatenessHistogram(buckets=(0, 10))
+    assert histogram.add(0) == 'le_0'
+    assert histogram.add(5) == 'le_10'
+    assert histogram.add(50) == 'inf'
+    assert histogram.items() == [('le_0', 1), ('le_10', 1), ('inf', 1)]
+    assert histogram.max == 50
+
+
+def test_cost_estimator_should_fall_back_to_job_mean():
+    estimator = schedule.JobCostEstimator()
+    estimator.set_costs({('myjob', 1): 10.0, ('myjob', 2): 20.0})
+    assert estimator.get('myjob', 1) == 10.0
+    assert estimator.get('myjob', 3) == 15.0
+    assert estimator.get('otherjob', 1) == schedule.DEFAULT_JOB_COST
+
+
+def test_cost_estimator_should_smooth_updates():
+    estimator = schedule.JobCostEstimator()
+    estimator.set_costs({('myjob', 1): 10.0})
+    estimator.update('myjob', 1, 20.0)
+    assert 10.0 < estimator.get('myjob', 1) < 20.0
+
+
+def test_deadline_queue_should_refund_cost_of_job_that_failed_to_dispatch(
+        deadline_queue, monkeypatch):
+    monkeypatch.setattr(schedule.NetboxJobScheduler, 'deadline_queue',
+                        deadline_queue)
+    deadline_queue.max_cost = 10
+    scheduler = _make_scheduler('myjob', 1, due=100, cost=8)
+    del scheduler.execute_job
+    scheduler.pool.execute_job.side_effect = RuntimeError("No ready workers")
+    scheduler.reschedule = Mock()
+    deadline_queue.push(scheduler)
+    assert scheduler.reschedule.called
+    assert deadline_queue.running_cost == 0
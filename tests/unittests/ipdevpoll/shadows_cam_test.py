@@ -0,0 +1,34 @@
+from mock import Mock, patch
+
+from nav.ipdevpoll.shadows.cam import Cam, CamManager
+
+
+def _make_manager(found):
+    with patch('nav.ipdevpoll.fingerprints.is_incremental_enabled',
+               return_value=True):
+        manager = CamManager(Cam, Mock())
+    manager.get_managed = Mock(return_value=found)
+    return manager
+
+
+@patch('nav.ipdevpoll.fingerprints.load_fingerprints')
+@patch('nav.ipdevpoll.fingerprints.diff_groups',
+       return_value=(Mock(), set(['1', 'None'])))
+def test_ports_without_ifindex_should_always_be_changed(diff_groups,
+                                                         load_fingerprints):
+    manager = _make_manager([Cam(1, 'aa'), Cam(2, 'bb'), Cam(None, 'cc')])
+    manager._find_changed_ports()
+    assert manager._changed_ports == set([1, None])
+
+
+@patch('nav.ipdevpoll.fingerprints.load_fingerprints')
+@patch('nav.ipdevpoll.fingerprints.diff_groups',
+       return_value=(Mock(), set()))
+def test_unchanged_fingerprints_should_still_compare_missing_ifindex(
+        diff_groups, load_fingerprints):
+    found = [Cam(1, 'aa'), Cam(None, 'cc')]
+    manager = _make_manager(found)
+    manager._find_changed_ports()
+    manager._previously_open = {}
+    manager._map_found_to_open()
+    assert manager._new == set([Cam(None, 'cc')])
@@ -0,0 +1,125 @@
+from bisect import bisect_right
+
+from twisted.internet import defer
+from twisted.internet.error import TimeoutError
+
+from nav.oids import OID
+from nav.ipdevpoll.snmp.bulk import BulkTableRetriever, AgentTuning
+
+IFDESCR = '.1.3.6.1.2.1.2.2.1.2'
+IFTYPE = '.1.3.6.1.2.1.2.2.1.3'
+IFMTU = '.1.3.6.1.2.1.2.2.1.4'
+END_OF_MIB_VIEW = OID('.1.3.6.1.6')
+
+
+class FakeAgent(object):
+    """Answers GETBULK requests from an in-memory MIB view"""
+    ip = '10.0.0.1'
+    port = 161
+
+    def __init__(self, mib, max_varbinds=None, timeout_above=None,
+                 delayed=False):
+        self.mib = sorted((tuple(OID(oid)), value) for oid, value in mib)
+        self.oids = [oid for oid, _value in self.mib]
+        self.max_varbinds = max_varbinds
+        self.timeout_above = timeout_above
+        self.delayed = delayed
+        self.requests = []
+        self.pending = []
+
+    def _getbulk(self, nonrepeaters, max_repetitions, oids):
+        self.requests.append((max_repetitions, len(oids)))
+        if (self.timeout_above is not None and
+                max_repetitions > self.timeout_above):
+            return defer.fail(TimeoutError())
+        columns = [self._walk_from(oid) for oid in oids]
+        varbinds = []
+        for repetition in range(max_repetitions):
+            for column in columns:
+                varbinds.append(column[repetition])
+        if self.max_varbinds:
+            varbinds = varbinds[:self.max_varbinds]
+        if self.delayed:
+            deferred = defer.Deferred()
+            self.pending.append((deferred, varbinds))
+            return deferred
+        return defer.succeed(varbinds)
+
+    def respond(self):
+        while self.pending:
+            deferred, varbinds = self.pending.pop(0)
+            deferred.callback(varbinds)
+
+    def _walk_from(self, oid):
+        start = bisect_right(self.oids, tuple(oid))
+        rest = self.mib[start:]
+        return rest + [(END_OF_MIB_VIEW, None)] * 1000
+
+
+def _make_mib(rows=25):
+    mib = []
+    for index in range(1, rows + 1):
+        mib.append(('%s.%d' % (IFDESCR, index), 'eth%d' % index))
+        mib.append(('%s.%d' % (IFTYPE, index), 6))
+        mib.append(('%s.%d' % (IFMTU, index), 1500))
+    return mib
+
+
+def _retrieve(agent, oids, tuning, **kwargs):
+    results = []
+    BulkTableRetriever(agent, oids, tuning, **kwargs).retrieve().addBoth(
+        results.append)
+    return results[0]
+
+
+def test_should_retrieve_all_columns():
+    agent = FakeAgent(_make_mib())
+    result = _retrieve(agent, [IFDESCR, IFTYPE], AgentTuning(10),
+                       max_columns=2)
+    assert len(result[IFDESCR]) == 25
+    assert len(result[IFTYPE]) == 25
+    assert result[IFDESCR][IFDESCR + '.3'] == 'eth3'
+    assert all(count == 2 for _reps, count in agent.requests)
+
+
+def test_should_split_columns_into_concurrent_requests():
+    agent = FakeAgent(_make_mib(), delayed=True)
+    retriever = BulkTableRetriever(agent, [IFDESCR, IFTYPE, IFMTU],
+                                   AgentTuning(10), max_columns=2,
+                                   max_in_flight=2)
+    deferred = retriever.retrieve()
+    assert agent.requests == [(10, 2), (10, 1)]
+
+    agent.respond()
+    results = []
+    deferred.addCallback(results.append)
+    assert all(len(column) == 25 for column in results[0].values())
+
+
+def test_should_learn_truncated_response_size():
+    agent = FakeAgent(_make_mib(), max_varbinds=7)
+    tuning = AgentTuning(10)
+    result = _retrieve(agent, [IFDESCR, IFTYPE], tuning, max_columns=2)
+    assert all(len(column) == 25 for column in result.values())
+    assert tuning.max_varbinds == 7
+    assert tuning.get_repetitions(2) == 3
+
+
+def test_should_back_off_on_timeouts():
+    agent = FakeAgent(_make_mib(), timeout_above=3)
+    tuning = AgentTuning(10)
+    result = _retrieve(agent, [IFDESCR], tuning)
+    assert len(result[IFDESCR]) == 25
+    assert tuning.max_repetitions <= 3
+
+
+def test_should_give_up_on_persistent_timeouts():
+    agent = FakeAgent(_make_mib(), timeout_above=0)
+    result = _retrieve(agent, [IFDESCR], AgentTuning(10))
+    assert result.check(TimeoutError)
+
+
+def test_empty_column_should_give_empty_result():
+    agent = FakeAgent(_make_mib())
+    result = _retrieve(agent, ['.1.3.6.1.2.1.2.2.1.1'], AgentTuning(10))
+    assert result == {'.1.3.6.1.2.1.2.2.1.1': {}}
@@ -0,0 +1,82 @@
+import pytest
+from twisted.internet import defer
+
+from nav.ipdevpoll.snmp.common import AgentProxyMixIn
+
+
+class FakeAgentProxy(object):
+    """Records getTable calls and lets the test decide when they finish"""
+    def __init__(self, *args, **kwargs):
+        self.calls = []
+
+    def getTable(self, oids, **kwargs):
+        deferred = defer.Deferred()
+        self.calls.append((oids, deferred))
+        return deferred
+
+
+class CachingAgentProxy(AgentProxyMixIn, FakeAgentProxy):
+    pass
+
+
+IFDESCR = '.1.3.6.1.2.1.2.2.1.2'
+IFTABLE = '.1.3.6.1.2.1.2.2'
+IFTABLE_RESULT = {
+    IFTABLE: {
+        IFDESCR + '.1': b'eth0',
+        IFDESCR + '.2': b'eth1',
+        '.1.3.6.1.2.1.2.2.1.3.1': 6,
+    }
+}
+
+
+@pytest.fixture
+def agent():
+    return CachingAgentProxy()
+
+
+def _result_of(deferred):
+    results = []
+    deferred.addBoth(results.append)
+    assert results, "deferred has not fired"
+    return results[0]
+
+
+def test_narrower_request_should_be_served_from_cache(agent):
+    first = agent.getTable([IFTABLE])
+    agent.calls[0][1].callback(IFTABLE_RESULT)
+    assert _result_of(first) == IFTABLE_RESULT
+
+    second = agent.getTable([IFDESCR])
+    assert len(agent.calls) == 1
+    assert _result_of(second) == {
+        IFDESCR: {IFDESCR + '.1': b'eth0', IFDESCR + '.2': b'eth1'}
+    }
+
+
+def test_concurrent_requests_should_be_coalesced(agent):
+    first = agent.getTable([IFTABLE])
+    second = agent.getTable([IFDESCR])
+    assert len(agent.calls) == 1
+
+    agent.calls[0][1].callback(IFTABLE_RESULT)
+    assert _result_of(first) == IFTABLE_RESULT
+    assert len(_result_of(second)[IFDESCR]) == 2
+
+
+def test_broader_request_should_not_be_served_from_cache(agent):
+    agent.getTable([IFDESCR])
+    agent.calls[0][1].callback({IFDESCR: {}})
+    agent.getTable([IFTABLE])
+    assert len(agent.calls) == 2
+
+
+def test_failure_should_propagate_to_coalesced_requests(agent):
+    first = agent.getTable([IFTABLE])
+    second = agent.getTable([IFDESCR])
+    agent.calls[0][1].errback(defer.TimeoutError())
+    assert _result_of(first).check(defer.TimeoutError)
+    assert _result_of(second).check(defer.TimeoutError)
+
+    agent.getTable([IFTABLE])
+    assert len(agent.calls) == 2, "failed walk should not be cached"
@@ -1,4 +1,8 @@
-from nav.ipdevpoll.storage import get_shadow_sort_order
+from mock import Mock, patch
+
+from nav.models import manage
+from nav.ipdevpoll.storage import (get_shadow_sort_order, update_in_bulk,
+                                   ContainerRepository, DefaultManager)
 from nav.ipdevpoll import shadows
 
 
@@ -8,3 +12,60 @@ from nav.ipdevpoll import shadows
 def test_netboxinfo_should_always_sort_last():
     classes = get_shadow_sort_order()
     assert classes[-1] is shadows.NetboxInfo
+
+
+def test_shadows_with_custom_save_should_not_support_bulk_save():
+    assert not shadows.Vlan.supports_bulk_save()
+    assert not shadows.Prefix.supports_bulk_save()
+
+
+def test_plain_shadows_should_support_bulk_save():
+    assert shadows.Module.supports_bulk_save()
+    assert shadows.SwPortVlan.supports_bulk_save()
+
+
+def test_interface_and_arp_should_support_bulk_save():
+    assert shadows.Interface.supports_bulk_save()
+    assert shadows.Arp.supports_bulk_save()
+
+
+def test_update_in_bulk_should_merge_identical_updates():
+    model = Mock()
+    update_in_bulk(model, [(1, {'end_time': 42}),
+                           (2, {'end_time': 42}),
+                           (3, {'end_time': 42, 'miss_count': 1})])
+
+    filter_calls = model.objects.filter.call_args_list
+    assert len(filter_calls) == 2
+    assert sorted(sorted(c[1]['pk__in']) for c in filter_calls) == [
+        [1, 2], [3]]
+
+
+def test_update_in_bulk_should_update_unhashable_values_separately():
+    model = Mock()
+    update_in_bulk(model, [(1, {'value': [1, 2]}),
+                           (2, {'value': [1, 2]})])
+
+    assert model.objects.filter.call_count == 2
+
+
+def test_resolve_existing_models_should_match_rows_by_lookup():
+    containers = ContainerRepository()
+    netbox = containers.factory(None, shadows.Netbox)
+    netbox.id = 1
+    found = containers.factory('found', shadows.Module)
+    found.netbox = netbox
+    found.name = 'found'
+    missing = containers.factory('missing', shadows.Module)
+    missing.netbox = netbox
+    missing.name = 'missing'
+
+    existing = manage.Module(id=10, netbox_id=1, name='found', device_id=5)
+    manager = DefaultManager(shadows.Module, containers)
+    with patch.object(manage.Module, 'objects') as objects:
+        objects.filter.return_value = [existing]
+        result = manager.resolve_existing_models([found, missing])
+
+    assert result == {found: existing}
+    assert found.id == 10
+    assert missing.id is None
@@ -0,0 +1,148 @@
+import pickle
+import socket
+import struct
+import threading
+
+import pytest
+
+from nav.metrics.carbon import (CarbonClient, MetricSpool, metrics_to_lines,
+                                metrics_to_pickle)
+
+METRICS = [('nav.foo', (1000, 1)), ('nav.bar', (1000, 2.5))]
+
+
+def test_metrics_to_lines():
+    assert metrics_to_lines(METRICS) == (b"nav.foo 1 1000\n"
+                                         b"nav.bar 2.5 1000\n")
+
+
+def test_metrics_to_pickle_should_have_length_header():
+    payload = metrics_to_pickle(METRICS)
+    length, = struct.unpack("!L", payload[:4])
+    assert length == len(payload) - 4
+    assert pickle.loads(payload[4:]) == METRICS
+
+
+def test_invalid_protocol_should_raise():
+    with pytest.raises(ValueError):
+        CarbonClient('localhost', 2003, protocol='carrier-pigeon')
+
+
+class TestMetricSpool(object):
+    def test_read_all_should_return_written_metrics(self, tmpdir):
+        spool = MetricSpool(str(tmpdir.join('test.spool')), 1024)
+        assert spool.write(METRICS)
+        assert spool.read_all() == [('nav.foo', (1000, 1.0)),
+                                    ('nav.bar', (1000, 2.5))]
+
+    def test_read_all_should_empty_spool(self, tmpdir):
+        spool = MetricSpool(str(tmpdir.join('test.spool')), 1024)
+        spool.write(METRICS)
+        spool.read_all()
+        assert spool.read_all() == []
+
+    def test_read_all_from_missing_spool_should_return_nothing(self, tmpdir):
+        spool = MetricSpool(str(tmpdir.join('missing.spool')), 1024)
+        assert spool.read_all() == []
+
+    def test_write_should_refuse_to_exceed_max_size(self, tmpdir):
+        spool = MetricSpool(str(tmpdir.join('test.spool')), 20)
+        assert not spool.write(METRICS)
+
+    def test_read_all_should_skip_invalid_lines(self, tmpdir):
+        path = tmpdir.join('test.spool')
+        path.write(b"nav.foo 1.0 1000\nnav.bar None 1000\nnav.baz 2",
+                   mode='wb')
+        spool = MetricSpool(str(path), 1024)
+        assert spool.read_all() == [('nav.foo', (1000, 1.0))]
+        assert spool.read_all() == []
+
+
+class TestCarbonClient(object):
+    def setup_method(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.received = b""
+        self.receiver = threading.Thread(target=self._receive)
+        self.receiver.start()
+
+    def teardown_method(self):
+        self.server.close()
+
+    def _receive(self):
+        conn, _ = self.server.accept()
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            self.received += data
+        conn.close()
+
+    def test_should_send_queued_metrics_in_batches(self):
+        client = CarbonClient('127.0.0.1', self.port, batch_size=1,
+                              flush_interval=0.1)
+        client.send(METRICS)
+        assert client.flush(timeout=5)
+        client.close()
+        self.receiver.join(5)
+
+        assert self.received == metrics_to_lines(METRICS)
+        stats = client.get_stats()
+        assert stats['sent'] == 2
+        assert stats['queued'] == 0
+
+    def test_should_drop_metrics_when_queue_is_full(self):
+        client = CarbonClient('127.0.0.1', self.port, queue_size=1)
+        client._ensure_thread = lambda: None
+        client.send(METRICS)
+        assert client.get_stats()['dropped'] == 1
+        socket.create_connection(('127.0.0.1', self.port)).close()
+        self.receiver.join(5)
+
+    def test_should_spool_metrics_when_unreachable(self, tmpdir):
+        spool = MetricSpool(str(tmpdir.join('test.spool')), 1024)
+        client = CarbonClient('127.0.0.1', 1, flush_interval=0.1,
+                              spool=spool)
+        client.send(METRICS)
+        assert client.flush(timeout=5)
+        client.close()
+
+        assert client.get_stats()['spooled'] == 2
+        assert len(spool.read_all()) == 2
+        socket.create_connection(('127.0.0.1', self.port)).close()
+        self.receiver.join(5)
+
+    def test_should_not_spool_non_numeric_values(self, tmpdir):
+        spool = MetricSpool(str(tmpdir.join('test.spool')), 1024)
+        client = CarbonClient('127.0.0.1', 1, flush_interval=0.1,
+                              spool=spool)
+        client.send(METRICS + [('nav.none', (1000, None))])
+        assert client.flush(timeout=5)
+        client.close()
+
+        stats = client.get_stats()
+        assert stats['spooled'] == 2
+        assert stats['dropped'] == 1
+        assert len(spool.read_all()) == 2
+        socket.create_connection(('127.0.0.1', self.port)).close()
+        self.receiver.join(5)
+
+    def test_sender_thread_should_survive_errors(self):
+        client = CarbonClient('127.0.0.1', self.port, flush_interval=0.1)
+        deliver = client._deliver
+        calls = []
+
+        def _fail_once(batch):
+            calls.append(batch)
+            if len(calls) == 1:
+                raise ValueError("boom")
+            return deliver(batch)
+
+        client._deliver = _fail_once
+        client.send(METRICS)
+        assert client.flush(timeout=5)
+        client.close()
+        self.receiver.join(5)
+        assert self.received == metrics_to_lines(METRICS)
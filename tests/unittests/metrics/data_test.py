@@ -1,6 +1,5 @@
 import pytest
-from mock import patch
-from io import BytesIO
+from mock import Mock, patch
 
 from nav.metrics.errors import GraphiteUnreachableError
 from nav.metrics.data import get_metric_data
@@ -20,6 +19,9 @@ def test_get_metric_data_with_no_graphite_server_should_fail():
 
 def test_get_metric_data_can_parse_response():
     target = "nav.devices.example-sw_example_org.ports.1.ifInOctets"
-    with patch('nav.metrics.data.urlopen') as urlopen:
-        urlopen.return_value = BytesIO(b'[1]')
+    with patch('nav.metrics.render.http_client') as http_client:
+        response = Mock(status=200, will_close=False)
+        response.read.return_value = b'[1]'
+        connection = http_client.HTTPConnection.return_value
+        connection.getresponse.return_value = response
         assert get_metric_data(target) == [1]
@@ -0,0 +1,147 @@
+import json
+import socket
+
+from mock import Mock, patch
+import pytest
+
+from nav.metrics.errors import GraphiteUnreachableError
+from nav.metrics.render import GraphiteClient
+
+
+def _response(body, status=200, will_close=False):
+    response = Mock(status=status, reason='OK', will_close=will_close)
+    response.read.return_value = body
+    return response
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def http_client():
+    with patch('nav.metrics.render.http_client') as http_client:
+        http_client.HTTPException = Exception
+        connection = http_client.HTTPConnection.return_value
+        connection.getresponse.return_value = _response(b'[]')
+        yield http_client
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def client(clock):
+    return GraphiteClient('http://graphite.example.org:8000/', clock=clock)
+
+
+class TestGraphiteClient(object):
+    def test_should_post_to_render_url(self, http_client, client):
+        client.render(['a.b'], '-5min', 'now')
+        http_client.HTTPConnection.assert_called_once_with(
+            'graphite.example.org:8000', timeout=60)
+        connection = http_client.HTTPConnection.return_value
+        method, path, body, _headers = connection.request.call_args[0]
+        assert (method, path) == ('POST', '/render/')
+        assert b'target=a.b' in body
+
+    def test_should_reuse_connection(self, http_client, client):
+        client.render(['a.b'], '-5min', 'now')
+        client.render(['a.c'], '-5min', 'now')
+        assert http_client.HTTPConnection.call_count == 1
+
+    def test_should_retry_once_on_stale_connection(self, http_client,
+                                                   client):
+        stale, fresh = Mock(), Mock()
+        stale.getresponse.side_effect = [_response(b'[]'),
+                                         socket.error('reset')]
+        fresh.getresponse.return_value = _response(b'[1]')
+        http_client.HTTPConnection.side_effect = [stale, fresh]
+        client.render(['a.b'], '-5min', 'now')
+        assert client.render(['a.c'], '-5min', 'now') == [1]
+        stale.close.assert_called_once_with()
+
+    def test_unreachable_server_should_raise(self, http_client, client):
+        connection = http_client.HTTPConnection.return_value
+        connection.request.side_effect = socket.error('refused')
+        with pytest.raises(GraphiteUnreachableError):
+            client.render(['a.b'], '-5min', 'now')
+        assert client.get_stats()['errors'] == 1
+
+    def test_server_error_should_raise_with_http_error(self, http_client,
+                                                       client):
+        connection = http_client.HTTPConnection.return_value
+        connection.getresponse.return_value = _response(b'oops', status=500)
+        with pytest.raises(GraphiteUnreachableError) as excinfo:
+            client.render(['a.b'], '-5min', 'now')
+        assert excinfo.value.cause.code == 500
+        assert excinfo.value.cause.read() == b'oops'
+
+    def test_should_split_targets_into_chunks(self, http_client, client):
+        def connect(*_args, **_kwargs):
+            connection = Mock()
+
+            def respond():
+                body = connection.request.call_args[0][2].decode('utf-8')
+                return _response(json.dumps([body.count('target=')]).encode())
+
+            connection.getresponse.side_effect = respond
+            return connection
+
+        http_client.HTTPConnection.side_effect = connect
+        result = client.render(['a.%d' % i for i in range(5)], '-5min', 'now',
+                               max_targets=2)
+        assert sorted(result) == [1, 2, 2]
+        assert client.get_stats()['requests'] == 3
+
+
+class TestGraphiteClientCache(object):
+    def test_should_cache_normalized_target_set(self, http_client, client):
+        client.render(['a.b', 'a.c'], '-5min', 'now')
+        client.render(['a.c', 'a.b', 'a.c'], '-5min', 'now')
+        connection = http_client.HTTPConnection.return_value
+        assert connection.request.call_count == 1
+        stats = client.get_stats()
+        assert (stats['hits'], stats['misses'], stats['requests']) == (1, 1, 1)
+
+    def test_should_not_share_cache_between_periods(self, http_client,
+                                                     client):
+        client.render(['a.b'], '-5min', 'now')
+        client.render(['a.b'], '-1day', 'now')
+        connection = http_client.HTTPConnection.return_value
+        assert connection.request.call_count == 2
+
+    def test_cached_response_should_expire(self, http_client, client, clock):
+        client.render(['a.b'], '-5min', 'now')
+        clock.now += client.cache_ttl
+        client.render(['a.b'], '-5min', 'now')
+        connection = http_client.HTTPConnection.return_value
+        assert connection.request.call_count == 2
+
+    def test_should_not_cache_errors(self, http_client, client):
+        connection = http_client.HTTPConnection.return_value
+        connection.getresponse.return_value = _response(b'', status=500)
+        with pytest.raises(GraphiteUnreachableError):
+            client.render(['a.b'], '-5min', 'now')
+        connection.getresponse.return_value = _response(b'[1]')
+        assert client.render(['a.b'], '-5min', 'now') == [1]
+
+    def test_modifying_result_should_not_affect_cache(self, http_client,
+                                                      client):
+        series = [{'target': 'a.b', 'datapoints': [[1.0, 60]]}]
+        connection = http_client.HTTPConnection.return_value
+        connection.getresponse.return_value = _response(
+            json.dumps(series).encode('utf-8'))
+        first = client.render(['a.b'], '-5min', 'now')
+        first[0]['datapoints'][0][0] = None
+        first[0]['target'] = 'changed'
+        assert client.render(['a.b'], '-5min', 'now') == series
+        second = client.render(['a.b'], '-5min', 'now')
+        second[0]['datapoints'].append([2.0, 120])
+        assert client.render(['a.b'], '-5min', 'now') == series
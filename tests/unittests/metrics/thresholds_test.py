@@ -1,7 +1,13 @@
+from datetime import timedelta
+
+from django.utils.six.moves.urllib.error import HTTPError
+from mock import patch
 import pytest
 
+from nav.metrics.errors import GraphiteUnreachableError
 from nav.metrics.graphs import (extract_series_name,
                                 translate_serieslist_to_regex)
+from nav.metrics.thresholds import ThresholdEvaluator, ValueFetcher
 
 series_name_data = (
     ('scaleToSeconds(nonNegativeDerivative(scale(nav.devices.example-sw_example_org.ports.Po3.ifOutOctets,8)),1)',
@@ -39,3 +45,83 @@ def test_translate_serieslist_to_regex(series, matches, nonmatches):
 
     for string in nonmatches:
         assert not pattern.match(string), "%s matches %s" % (string, series)
+
+
+class TestValueFetcher(object):
+    @staticmethod
+    def _render(targets, start, end):
+        """Fakes a Graphite render response for aliasSub-tagged targets"""
+        response = []
+        for target in targets:
+            tag = target.rsplit(',', 1)[1].strip('")')
+            series = target[len('aliasSub('):].split(',')[0]
+            response.append({'target': tag + series,
+                             'datapoints': [[1.0, 0], [None, 60], [3.0, 120]]})
+        return response
+
+    @patch('nav.metrics.thresholds.get_metric_data')
+    def test_should_merge_targets_with_same_period(self, get_metric_data):
+        get_metric_data.side_effect = self._render
+        evaluators = [ThresholdEvaluator('a.b', raw=True),
+                      ThresholdEvaluator('a.c', raw=True),
+                      ThresholdEvaluator('a.b', raw=True),
+                      ThresholdEvaluator('a.b', period=timedelta(hours=1),
+                                         raw=True)]
+        fetcher = ValueFetcher()
+        assert fetcher.fetch(evaluators) == {}
+        assert fetcher.requests == 2
+        assert evaluators[0].result == {'a.b': {'value': 2.0}}
+        assert evaluators[1].result == {'a.c': {'value': 2.0}}
+        assert evaluators[2].result == evaluators[0].result
+        assert evaluators[2].result is not evaluators[0].result
+        assert evaluators[3].result == {'a.b': {'value': 2.0}}
+
+    @patch('nav.metrics.thresholds.get_metric_data')
+    def test_should_split_requests_at_max_targets(self, get_metric_data):
+        get_metric_data.side_effect = self._render
+        evaluators = [ThresholdEvaluator('a.%d' % i, raw=True)
+                      for i in range(5)]
+        fetcher = ValueFetcher(max_targets=2)
+        fetcher.fetch(evaluators)
+        assert fetcher.requests == 3
+        assert all(e.result == {e.target: {'value': 2.0}} for e in evaluators)
+
+    @patch('nav.metrics.thresholds.get_metric_data')
+    def test_should_report_failed_evaluators(self, get_metric_data):
+        error = GraphiteUnreachableError("down")
+        get_metric_data.side_effect = error
+        evaluator = ThresholdEvaluator('a.b', raw=True)
+        fetcher = ValueFetcher()
+        assert fetcher.fetch([evaluator]) == {evaluator: error}
+        assert fetcher.failed_requests == 1
+
+    @patch('nav.metrics.thresholds.get_metric_data')
+    def test_should_only_fail_invalid_target_in_merged_request(
+            self, get_metric_data):
+        error = GraphiteUnreachableError(
+            "rejected", HTTPError('/render/', 400, 'Bad Request', {}, None))
+
+        def _render(targets, start, end):
+            if any('invalid(' in target for target in targets):
+                raise error
+            return self._render(targets, start, end)
+
+        get_metric_data.side_effect = _render
+        evaluators = [ThresholdEvaluator('a.b', raw=True),
+                      ThresholdEvaluator('invalid(a.c', raw=True),
+                      ThresholdEvaluator('a.d', raw=True)]
+        fetcher = ValueFetcher()
+        assert fetcher.fetch(evaluators) == {evaluators[1]: error}
+        assert fetcher.requests == 4
+        assert fetcher.failed_requests == 2
+        assert evaluators[0].result == {'a.b': {'value': 2.0}}
+        assert evaluators[2].result == {'a.d': {'value': 2.0}}
+
+    @patch('nav.metrics.thresholds.get_metric_data')
+    def test_should_not_retry_targets_when_unreachable(self, get_metric_data):
+        get_metric_data.side_effect = GraphiteUnreachableError("down")
+        evaluators = [ThresholdEvaluator('a.b', raw=True),
+                      ThresholdEvaluator('a.c', raw=True)]
+        fetcher = ValueFetcher()
+        assert set(fetcher.fetch(evaluators)) == set(evaluators)
+        assert fetcher.requests == 1
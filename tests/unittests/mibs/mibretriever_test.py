@@ -0,0 +1,90 @@
+from mock import Mock
+
+from twisted.internet import defer
+
+from nav.mibs.if_mib import IfMib
+from nav.mibs.mibretriever import ColumnarTableResult
+
+IFDESCR = '.1.3.6.1.2.1.2.2.1.2'
+IFTYPE = '.1.3.6.1.2.1.2.2.1.3'
+
+
+def _result_of(deferred):
+    results = []
+    deferred.addBoth(results.append)
+    return results[0]
+
+
+def test_retrieve_columns_should_request_all_columns_at_once():
+    agent = Mock()
+    agent.getTable.return_value = defer.succeed({
+        IFDESCR: {IFDESCR + '.1': b'eth0'},
+        IFTYPE: {IFTYPE + '.1': 6},
+    })
+    result = _result_of(IfMib(agent).retrieve_columns(['ifDescr', 'ifType']))
+
+    agent.getTable.assert_called_once_with([IFDESCR, IFTYPE])
+    assert result[(1,)]['ifDescr'] == 'eth0'
+    assert result[(1,)]['ifType'] == 6
+
+
+def test_retrieve_table_should_request_accessible_columns():
+    agent = Mock()
+    agent.getTable.return_value = defer.succeed({
+        IFDESCR: {IFDESCR + '.1': b'eth0'},
+    })
+    result = _result_of(IfMib(agent).retrieve_table('ifTable'))
+
+    oids = agent.getTable.call_args[0][0]
+    assert IFDESCR in oids
+    assert IFTYPE in oids
+    assert '.1.3.6.1.2.1.2.2' not in oids
+    assert result[(1,)]['ifDescr'] == 'eth0'
+
+
+def test_columnar_table_should_act_like_dict_of_rows():
+    agent = Mock()
+    agent.getTable.return_value = defer.succeed({
+        IFDESCR: {IFDESCR + '.1': b'eth0', IFDESCR + '.2': b'eth1'},
+        IFTYPE: {IFTYPE + '.1': 6},
+    })
+    result = _result_of(IfMib(agent).retrieve_columns(['ifDescr', 'ifType'],
+                                                      columnar=True))
+
+    assert isinstance(result, ColumnarTableResult)
+    assert len(result) == 2
+    assert (1,) in result
+    row = result[(2,)]
+    assert row[0] == (2,)
+    assert row.index == (2,)
+    assert row['ifDescr'] == 'eth1'
+    assert row['ifType'] is None
+    assert dict(result[(1,)]) == {0: (1,), 'ifDescr': 'eth0', 'ifType': 6}
+
+
+def test_columnar_table_should_share_index_between_columns():
+    table = ColumnarTableResult(['a', 'b'])
+    table.add((1, 2), 'a', 'x')
+    table.add((1, 2), 'b', 'y')
+    assert len(table.indexes) == 1
+    assert table.column('a') == ['x']
+    assert table.column('b') == ['y']
+
+
+def test_columnar_table_should_translate_lazily():
+    table = ColumnarTableResult(['ifType'])
+    table.add((1,), 'ifType', 6)
+    converter = Mock(return_value='ethernetCsmacd')
+    table.set_converters({'ifType': converter})
+    assert not converter.called
+
+    row = table[(1,)]
+    assert row['ifType'] == 'ethernetCsmacd'
+    assert row['ifType'] == 'ethernetCsmacd'
+    converter.assert_called_once_with(6)
+
+
+def test_translate_result_should_support_columnar_tables():
+    table = ColumnarTableResult(['ifAdminStatus'])
+    table.add((1,), 'ifAdminStatus', 1)
+    assert IfMib.translate_result(table)[(1,)]['ifAdminStatus'] == 'up'
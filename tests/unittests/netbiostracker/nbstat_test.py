@@ -0,0 +1,128 @@
+"""Tests for the NBSTAT scanner, using a local stub NetBIOS responder"""
+import socket
+import struct
+import threading
+
+import pytest
+
+from nav.netbiostracker.nbstat import (NbstatScanner, NbstatError,
+                                       NetbiosResult, encode_name,
+                                       make_request, parse_response)
+
+MAC = b'\x00\x1a\x2b\x3c\x4d\x5e'
+
+
+def make_response(txid, names, mac=MAC):
+    """Makes an NBSTAT response from a list of (name, suffix, flags)"""
+    entries = b''.join(struct.pack('!15sBH', name.ljust(15), suffix, flags)
+                       for name, suffix, flags in names)
+    rdata = struct.pack('!B', len(names)) + entries + mac + b'\x00' * 40
+    return (struct.pack('!HHHHHH', txid, 0x8400, 0, 1, 0, 0) +
+            encode_name(b'*' + b'\x00' * 15) +
+            struct.pack('!HHIH', 0x21, 1, 0, len(rdata)) + rdata)
+
+
+WORKSTATION_NAMES = [
+    (b'WS1', 0x00, 0x0400),
+    (b'WORKGROUP', 0x00, 0x8400),
+    (b'WS1', 0x20, 0x0400),
+    (b'WS1', 0x03, 0x0400),
+    (b'JOHN', 0x03, 0x0400),
+]
+
+
+class StubResponder(threading.Thread):
+    """Responds to NBSTAT requests on the loopback interface"""
+
+    def __init__(self, names, drop_first=0):
+        super(StubResponder, self).__init__()
+        self.daemon = True
+        self.names = names
+        self.drop_first = drop_first
+        self.requests = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+
+    def run(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(1024)
+            except socket.error:
+                return
+            self.requests += 1
+            if self.requests > self.drop_first:
+                txid = struct.unpack('!H', data[:2])[0]
+                self.sock.sendto(make_response(txid, self.names), addr)
+
+    def stop(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def responder():
+    responder = StubResponder(WORKSTATION_NAMES)
+    responder.start()
+    yield responder
+    responder.stop()
+
+
+def test_request_should_be_wildcard_nbstat_query():
+    request = make_request(0x1234)
+    assert len(request) == 50
+    assert request[:2] == b'\x12\x34'
+    assert request[13:15] == b'CK'  # '*' in first-level encoding
+    assert request[-4:] == b'\x00\x21\x00\x01'
+
+
+def test_should_parse_names_like_nbtscan():
+    txid, result = parse_response(make_response(42, WORKSTATION_NAMES),
+                                  '10.0.0.1')
+    assert txid == 42
+    assert result == NetbiosResult('10.0.0.1', 'WS1', '<server>', 'JOHN',
+                                   '00:1a:2b:3c:4d:5e')
+
+
+def test_should_report_unknown_names():
+    _txid, result = parse_response(
+        make_response(1, [(b'WORKGROUP', 0x00, 0x8400)]), '10.0.0.1')
+    assert result.name == '<unknown>'
+    assert result.server == ''
+    assert result.username == '<unknown>'
+
+
+def test_truncated_response_should_fail():
+    with pytest.raises(NbstatError):
+        parse_response(make_response(1, WORKSTATION_NAMES)[:70], '10.0.0.1')
+
+
+def test_should_scan_stub_responder(responder):
+    scanner = NbstatScanner(port=responder.port, timeout=0.5)
+    assert list(scanner.scan(['127.0.0.1'])) == [
+        NetbiosResult('127.0.0.1', 'WS1', '<server>', 'JOHN',
+                      '00:1a:2b:3c:4d:5e')]
+
+
+def test_zero_rate_should_scan_without_limit(responder):
+    scanner = NbstatScanner(rate=0, port=responder.port, timeout=0.5)
+    assert scanner.interval == 0
+    assert len(list(scanner.scan(['127.0.0.1']))) == 1
+
+
+def test_should_retry_unanswered_requests():
+    responder = StubResponder(WORKSTATION_NAMES, drop_first=2)
+    responder.start()
+    try:
+        scanner = NbstatScanner(port=responder.port, retries=2, timeout=0.05)
+        results = list(scanner.scan(['127.0.0.1']))
+    finally:
+        responder.stop()
+    assert len(results) == 1
+    assert responder.requests == 3
+
+
+def test_should_give_up_after_retries(responder):
+    responder.drop_first = 10
+    scanner = NbstatScanner(port=responder.port, retries=1, timeout=0.05)
+    assert list(scanner.scan(['127.0.0.1'])) == []
+    assert responder.requests == 2
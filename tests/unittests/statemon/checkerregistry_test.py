@@ -0,0 +1,52 @@
+"""Tests for the incremental service checker registry"""
+from nav.statemon.checkerregistry import CheckerRegistry
+from nav.statemon.event import Event
+
+
+class FakeChecker(object):
+    def __init__(self, service, status=Event.UP):
+        self.service = service
+        self.status = status
+
+
+def _make_service(serviceid, handler='ssh', up='y', **args):
+    return {'id': serviceid, 'netboxid': 1, 'handler': handler,
+            'ip': '10.0.0.1', 'sysname': 'example', 'args': args,
+            'version': '', 'up': up}
+
+
+def _make_registry():
+    return CheckerRegistry(
+        get_checker_class=lambda handler: FakeChecker if handler else None)
+
+
+def test_new_checkers_should_get_status_from_db():
+    registry = _make_registry()
+    assert registry.update([_make_service(1, up='n')], True) == (
+        {1}, set(), set())
+    assert registry.checkers[1].status == Event.DOWN
+
+
+def test_unchanged_checkers_should_keep_their_instances():
+    registry = _make_registry()
+    registry.update([_make_service(1, port='22')], True)
+    checker = registry.checkers[1]
+    assert registry.update([_make_service(1, port='22')], True) == (
+        set(), set(), set())
+    assert registry.checkers[1] is checker
+
+
+def test_changed_checkers_should_be_rebuilt_with_status():
+    registry = _make_registry()
+    registry.update([_make_service(1, port='22'), _make_service(2)], True)
+    registry.checkers[1].status = Event.DOWN
+    assert registry.update([_make_service(1, port='2222')], False) == (
+        set(), {1}, {2})
+    assert registry.checkers[1].service['args'] == {'port': '2222'}
+    assert registry.checkers[1].status == Event.DOWN
+
+
+def test_unknown_handler_should_be_skipped():
+    registry = _make_registry()
+    registry.update([_make_service(1, handler='')], True)
+    assert len(registry) == 0
@@ -0,0 +1,50 @@
+"""Tests for pping's host state tracking"""
+from nav.statemon.hoststate import HostStates
+
+
+def _make_states(threshold=3):
+    states = HostStates(threshold)
+    states.set_netboxes([(1, 'a', '10.0.0.1', 'y'),
+                         (2, 'b', '10.0.0.2', 'n')])
+    return states
+
+
+def test_netbox_marked_down_in_db_should_start_out_down():
+    states = _make_states()
+    assert states.down == {2}
+
+
+def test_netbox_should_go_down_after_threshold_misses():
+    states = _make_states()
+    for _ in range(2):
+        assert states.update([('10.0.0.1', -1)]) == ([], [])
+    assert states.update([('10.0.0.1', -1)]) == ([1], [])
+    assert states.update([('10.0.0.1', -1)]) == ([], [])
+
+
+def test_reply_should_bring_netbox_up_and_reset_misses():
+    states = _make_states()
+    assert states.update([('10.0.0.1', -1), ('10.0.0.2', 0.01)]) == ([], [2])
+    states.update([('10.0.0.1', 0.01)])
+    assert states.misses[1] == 0
+
+
+def test_changed_netboxes_should_be_reported():
+    states = _make_states()
+    added, changed, removed = states.set_netboxes([
+        (1, 'a', '10.0.0.11', 'y'),
+        (3, 'c', '10.0.0.3', 'y'),
+    ])
+    assert (added, changed, removed) == ({3}, {1}, {2})
+    assert states.ip_to_netboxid == {'10.0.0.11': 1, '10.0.0.3': 3}
+    assert states.down == set()
+
+
+def test_unchanged_netboxes_should_keep_their_state():
+    states = _make_states()
+    states.update([('10.0.0.1', -1)])
+    assert states.set_netboxes([(1, 'a', '10.0.0.1', 'y'),
+                                (2, 'b', '10.0.0.2', 'y')]) == (
+                                    set(), set(), set())
+    assert states.misses[1] == 1
+    assert states.down == {2}
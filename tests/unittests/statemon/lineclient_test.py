@@ -0,0 +1,76 @@
+"""Tests for line based conversations with services"""
+import pytest
+from twisted.internet import task
+from twisted.internet.error import ConnectionDone, TimeoutError
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
+
+from nav.statemon.lineclient import LineClient, LineTooLong, MAX_LINE_LENGTH
+
+
+def _make_client(timeout=5):
+    clock = task.Clock()
+    client = LineClient(timeout, clock)
+    client.makeConnection(StringTransport())
+    return clock, client
+
+
+def _result(deferred):
+    results = []
+    deferred.addBoth(results.append)
+    assert results, "deferred has not fired"
+    return results[0]
+
+
+def test_lines_should_be_read_without_line_endings():
+    _clock, client = _make_client()
+    client.dataReceived(b'220 first\r\n220 sec')
+    assert _result(client.read_line()) == b'220 first'
+    pending = client.read_line()
+    client.dataReceived(b'ond\n')
+    assert _result(pending) == b'220 second'
+
+
+def test_written_lines_should_end_with_crlf():
+    _clock, client = _make_client()
+    client.write_line(b'QUIT')
+    assert client.transport.value() == b'QUIT\r\n'
+
+
+def test_read_should_time_out():
+    clock, client = _make_client(timeout=5)
+    pending = client.read_line()
+    clock.advance(5)
+    assert _result(pending).check(TimeoutError)
+    assert client.transport.disconnecting
+
+
+def test_conversation_should_be_bounded_by_twice_the_timeout():
+    clock, client = _make_client(timeout=5)
+    for _ in range(3):
+        clock.advance(4)
+        client.dataReceived(b'line\n')
+        assert _result(client.read_line()) == b'line'
+    pending = client.read_line()
+    clock.advance(0)
+    assert _result(pending).check(TimeoutError)
+
+
+def test_lost_connection_should_fail_pending_read():
+    _clock, client = _make_client()
+    pending = client.read_line()
+    client.connectionLost(Failure(ConnectionDone()))
+    assert _result(pending).check(ConnectionDone)
+
+
+def test_overlong_line_should_fail():
+    _clock, client = _make_client()
+    client.dataReceived(b'x' * (MAX_LINE_LENGTH + 1))
+    assert _result(client.read_line()).check(LineTooLong)
+
+
+def test_concurrent_reads_should_be_refused():
+    _clock, client = _make_client()
+    client.read_line()
+    with pytest.raises(RuntimeError):
+        client.read_line()
@@ -0,0 +1,69 @@
+"""Tests for the pping ICMP engine"""
+from mock import Mock
+
+from nav.statemon.icmppacket import PacketV4, inet_checksum
+from nav.statemon.megaping import Host, MegaPing, TokenBucket
+
+
+def test_echo_should_equal_generically_assembled_packet():
+    host = Host('10.0.0.1', index=42)
+    host.packet.sequence = 1234
+    expected, _cookie = host.make_packet(64, host.make_cookie(7))
+    assert host.make_echo(64, 7) == expected
+
+
+def test_echo_checksum_should_verify():
+    host = Host('10.0.0.1', index=3)
+    for sequence in (0, 1, 0xfffe, 0xffff):
+        host.packet.sequence = sequence
+        assert inet_checksum(host.make_echo(65, 0xffffffff)) == 0
+
+
+def test_token_bucket_should_allow_burst_then_pace():
+    clock = Mock(return_value=0.0)
+    bucket = TokenBucket(rate=100, burst=2, clock=clock)
+    assert bucket.consume()
+    assert bucket.consume()
+    assert not bucket.consume()
+    assert abs(bucket.get_wait() - 0.01) < 1e-9
+    clock.return_value = 0.01
+    assert bucket.consume()
+
+
+def test_host_without_round_trip_times_should_get_max_timeout():
+    assert Host('10.0.0.1').get_timeout(1, 5) == 5
+
+
+def test_host_timeout_should_follow_round_trip_times():
+    host = Host('10.0.0.1')
+    for _ in range(10):
+        host.update_rtt(0.5)
+    assert host.get_timeout(1, 5) == 1
+    assert 0.5 < host.get_timeout(0.1, 5) < 1
+    host.back_off()
+    assert host.get_timeout(1, 5) > 1
+
+
+def test_late_response_should_update_round_trip_time_only():
+    pinger = MegaPing([Mock(), Mock()], conf={})
+    pinger.set_hosts(['10.0.0.1'])
+    pinger.reset()
+    host = pinger._hosts['10.0.0.1']
+    host.time = 100.0
+    reply = _make_reply(pinger, host)
+
+    pinger._process_response(reply, ('10.0.0.1', 0), False, 100.25)
+    assert host.reply is None
+    assert host.srtt == 0.25
+
+    pinger._requests[host.index] = host
+    pinger._process_response(reply, ('10.0.0.1', 0), False, 100.5)
+    assert host.reply == 0.5
+
+
+def _make_reply(pinger, host):
+    pong = PacketV4()
+    pong.type = PacketV4.ICMP_ECHO_REPLY
+    pong.id = pinger._pid
+    pong.data = host.make_cookie(pinger._round).ljust(56)
+    return b'\0' * 20 + pong.assemble()
@@ -0,0 +1,114 @@
+"""Tests for the servicemon checker runtime"""
+from mock import Mock
+from twisted.internet import defer, task
+
+from nav.statemon.runtime import CheckerRuntime
+
+
+class FakeChecker(object):
+    ASYNC_SUPPORT = True
+    sysname = 'example'
+
+    def __init__(self, serviceid, delays=()):
+        self.serviceid = serviceid
+        self.delays = list(delays)
+        self.pending = []
+
+    def execute_test_async(self):
+        self.pending.append(defer.Deferred())
+        return self.pending[-1]
+
+    def handle_result(self, status, info):
+        return self.delays.pop(0) if self.delays else None
+
+    def finish(self):
+        self.pending.pop(0).callback(('UP', 'ok'))
+
+    @classmethod
+    def get_type(cls):
+        return 'fake'
+
+    def __eq__(self, other):
+        return self.serviceid == getattr(other, 'serviceid', None)
+
+    def __hash__(self):
+        return hash(self.serviceid)
+
+
+def _make_runtime(checkers, **kwargs):
+    clock = task.Clock()
+    runtime = CheckerRuntime(60, clock=clock, **kwargs)
+    runtime.threadpool = Mock()
+    runtime.start()
+    runtime.set_checkers(checkers)
+    return clock, runtime
+
+
+def test_new_checkers_should_run_within_one_interval():
+    checkers = [FakeChecker(i) for i in range(10)]
+    clock, _runtime = _make_runtime(checkers)
+    clock.advance(60)
+    assert all(len(checker.pending) == 1 for checker in checkers)
+
+
+def test_checker_should_run_once_per_interval():
+    checker = FakeChecker(1)
+    clock, runtime = _make_runtime([checker])
+    clock.advance(60)
+    clock.advance(1)
+    checker.finish()
+    assert runtime.checks_completed == 1
+    clock.advance(58.999)
+    assert not checker.pending
+    clock.advance(60)
+    assert len(checker.pending) == 1
+
+
+def test_retry_delay_should_be_honored():
+    checker = FakeChecker(1, delays=[5])
+    clock, _runtime = _make_runtime([checker])
+    clock.advance(60)
+    checker.finish()
+    clock.advance(5)
+    assert len(checker.pending) == 1
+
+
+def test_known_checkers_should_keep_their_schedule():
+    known = FakeChecker(1)
+    clock, runtime = _make_runtime([known])
+    clock.advance(60)
+    known.finish()
+    runtime.set_checkers([known, FakeChecker(2)])
+    clock.advance(59.999)
+    assert not known.pending
+    assert len(runtime) == 2
+
+
+def test_removed_checker_should_not_run():
+    checker = FakeChecker(1)
+    clock, runtime = _make_runtime([checker])
+    runtime.set_checkers([FakeChecker(2)])
+    clock.advance(120)
+    assert not checker.pending
+
+
+def test_replaced_checker_should_not_be_rescheduled():
+    old = FakeChecker(1)
+    clock, runtime = _make_runtime([old])
+    clock.advance(60)
+    new = FakeChecker(1)
+    runtime.set_checkers([new])
+    old.finish()
+    clock.advance(120)
+    assert not old.pending
+    assert new.pending
+
+
+def test_concurrency_should_be_bounded():
+    checkers = [FakeChecker(i) for i in range(10)]
+    clock, _runtime = _make_runtime(checkers, max_concurrent=3)
+    clock.advance(60)
+    running = [c for c in checkers if c.pending]
+    assert len(running) == 3
+    running[0].finish()
+    assert len([c for c in checkers if c.pending]) == 3
@@ -0,0 +1,62 @@
+"""Tests for set-based topology updates"""
+from mock import Mock
+
+from nav.models.manage import SwPortVlan
+from nav.topology.analyze import Port
+from nav.topology.bulk import create_staging_table, format_copy_data
+from nav.topology.layer2 import get_staging_rows
+from nav.topology.vlan import VlanTopologyUpdater
+
+
+class TestFormatCopyData(object):
+    def test_should_format_tab_separated_lines(self):
+        assert format_copy_data([(1, 2, 'o'), (3, None, 'x')]) == (
+            "1\t2\to\n3\t\\N\tx\n", 2)
+
+    def test_should_escape_special_characters(self):
+        data, _count = format_copy_data([('a\tb\\c\nd',)])
+        assert data == "a\\tb\\\\c\\nd\n"
+
+    def test_no_rows_should_give_empty_data(self):
+        assert format_copy_data([]) == ("", 0)
+
+
+def test_create_staging_table_should_copy_rows():
+    cursor = Mock()
+    count = create_staging_table(
+        cursor, 'staging', [('a', 'INTEGER'), ('b', 'INTEGER')],
+        [(1, 2), (3, 4)])
+    assert count == 2
+    create = cursor.execute.call_args_list[0][0][0]
+    assert create == ("CREATE TEMPORARY TABLE staging (a INTEGER, b INTEGER) "
+                      "ON COMMIT DROP")
+    data, table = cursor.copy_from.call_args[0]
+    assert data.read() == "1\t2\n3\t4\n"
+    assert table == 'staging'
+    assert cursor.copy_from.call_args[1] == {'columns': ['a', 'b']}
+
+
+def test_vlan_staging_rows_should_map_directions():
+    ifc1, ifc2 = Mock(pk=1), Mock(pk=2)
+    vlan10, vlan20 = Mock(pk=10), Mock(pk=20)
+    updater = VlanTopologyUpdater({
+        ifc1: {vlan10: 'up', vlan20: 'blocked'},
+        ifc2: {vlan10: 'bogus'},
+    })
+    assert sorted(updater._get_staging_rows()) == [
+        (1, 10, SwPortVlan.DIRECTION_UP),
+        (1, 20, SwPortVlan.DIRECTION_BLOCKED),
+        (2, 10, SwPortVlan.DIRECTION_UNDEFINED),
+    ]
+
+
+def test_layer2_staging_rows_should_let_last_link_win():
+    links = [
+        (Port((1, 11)), Port((2, 21))),
+        (Port((1, 12)), 3),
+        (Port((1, 11)), Port((4, 41))),
+    ]
+    assert sorted(get_staging_rows(links)) == [
+        (11, 4, 41),
+        (12, 3, None),
+    ]
@@ -0,0 +1,67 @@
+"""Tests for the set-based MAC watch matcher"""
+from datetime import datetime
+
+from nav.web.macwatch.models import MacWatch
+from nav.web.macwatch.matcher import (CamRecord, MacWatchIndex, find_matches,
+                                      get_event_variables,
+                                      get_unwanted_matches)
+
+FULL = MacWatch(id=1, mac='00:1a:2b:3c:4d:5e')
+OUI = MacWatch(id=2, mac='00:1a:2b:00:00:00', prefix_length=6)
+LONG_PREFIX = MacWatch(id=3, mac='00:1a:2b:3c:00:00', prefix_length=8)
+OTHER = MacWatch(id=4, mac='aa:bb:cc:00:00:00', prefix_length=6)
+
+
+def _cam(camid, mac, category='EDGE', module='1'):
+    return CamRecord(camid, mac, 10, category, 'sw1', module, 'Gi1/0/1')
+
+
+class TestMacWatchIndex(object):
+    def setup_method(self):
+        self.index = MacWatchIndex([FULL, OUI, LONG_PREFIX, OTHER])
+
+    def test_should_find_all_matching_watches(self):
+        assert sorted(w.id for w in self.index.lookup('00:1a:2b:3c:4d:5e')) \
+            == [1, 2, 3]
+
+    def test_should_find_prefix_watches(self):
+        assert self.index.lookup('00:1a:2b:ff:ff:ff') == [OUI]
+        assert self.index.lookup('aa:bb:cc:00:00:01') == [OTHER]
+
+    def test_should_not_find_unwatched_mac(self):
+        assert self.index.lookup('00:1a:2c:00:00:00') == []
+
+
+class TestFindMatches(object):
+    def test_should_prefer_records_closest_to_edge(self):
+        index = MacWatchIndex([FULL])
+        edge = _cam(1, FULL.mac, 'EDGE')
+        matches = find_matches(index, [_cam(2, FULL.mac, 'GW'), edge,
+                                       _cam(3, FULL.mac, 'SW')])
+        assert matches == [(FULL, edge)]
+
+    def test_should_prioritize_each_mac_of_a_prefix_separately(self):
+        index = MacWatchIndex([OUI])
+        first = _cam(1, '00:1a:2b:00:00:01', 'SW')
+        second = _cam(2, '00:1a:2b:00:00:02', 'GW')
+        assert sorted(find_matches(index, [first, second])) == [
+            (OUI, first), (OUI, second)]
+
+    def test_should_keep_duplicates_on_same_level(self):
+        index = MacWatchIndex([FULL])
+        cams = [_cam(1, FULL.mac), _cam(2, FULL.mac)]
+        assert sorted(find_matches(index, cams)) == [(FULL, cams[0]),
+                                                     (FULL, cams[1])]
+
+
+def test_should_keep_latest_posted_match():
+    known = [(1, 1, 1, datetime(2020, 1, 1)), (2, 1, 1, datetime(2020, 1, 2)),
+             (3, 1, 1, None)]
+    assert get_unwanted_matches(known) == [1, 3]
+
+
+def test_event_variables_should_omit_empty_module():
+    varmap = get_event_variables(OUI, _cam(1, '00:1a:2b:00:00:01', module=''))
+    assert 'module' not in varmap
+    assert varmap['macwatch-mac'] == OUI.mac
+    assert varmap['alerttype'] == 'macWarning'
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License version 3 as published by the Free
+# Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Compares the memory usage and CPU time of dict-based and columnar MIB table
+results, using a synthetic dot1qTpFdbTable getTable() response.
+
+Usage: mibtable-benchmark.py [ROWS]
+
+"""
+from __future__ import print_function
+
+import gc
+import sys
+import time
+import tracemalloc
+
+import django
+
+FDB_PORT = '.1.3.6.1.2.1.17.7.1.2.2.1.2'
+FDB_STATUS = '.1.3.6.1.2.1.17.7.1.2.2.1.3'
+DEFAULT_ROWS = 500000
+
+
+def main(args):
+    rows = int(args[0]) if args else DEFAULT_ROWS
+    django.setup()
+    from nav.mibs.qbridge_mib import QBridgeMib
+
+    print("Building a synthetic %d row forwarding table..." % rows)
+    response = make_fdb_response(rows)
+    mib = QBridgeMib(FakeAgentProxy(response))
+    columns = ['dot1qTpFdbPort', 'dot1qTpFdbStatus']
+
+    for columnar in (False, True):
+        label = "columnar" if columnar else "dict"
+        result, peak, build_time = measure(build_result, mib, columns,
+                                           columnar)
+        read_time = timed(read_fdb, mib, result)
+        print("%-8s build: %6.2fs  translate+read: %6.2fs  "
+              "peak memory: %7.1f MiB" % (label, build_time, read_time,
+                                          peak / 1024.0 / 1024.0))
+        del result
+        gc.collect()
+
+
+def make_fdb_response(rows):
+    """Makes a getTable() style response of rows FDB entries, spread over 10
+    VLANs.
+
+    """
+    ports = {}
+    statuses = {}
+    for row in range(rows):
+        vlan = row % 10 + 1
+        mac = (0, 0x50, 0x56, (row >> 16) & 0xff, (row >> 8) & 0xff,
+               row & 0xff)
+        suffix = '.%d.%s' % (vlan, '.'.join(str(octet) for octet in mac))
+        ports[FDB_PORT + suffix] = row % 48 + 1
+        statuses[FDB_STATUS + suffix] = 3
+    return {FDB_PORT: ports, FDB_STATUS: statuses}
+
+
+def build_result(mib, columns, columnar):
+    """Formats a result the same way as MibRetriever.retrieve_columns()"""
+    results = []
+    mib.retrieve_columns(columns, columnar=columnar).addBoth(results.append)
+    return results[0]
+
+
+def read_fdb(mib, result):
+    """Reads the result the same way QBridgeMib.get_forwarding_database()
+    does.
+
+    """
+    result = mib.translate_result(result)
+    return [(row[0], row['dot1qTpFdbPort']) for row in result.values()
+            if row['dot1qTpFdbStatus'] not in ('self', 'invalid')]
+
+
+def measure(func, *args):
+    """Runs func(*args), returning its result, the peak memory allocated while it ran
+    and the time it took to run.
+
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.process_time()
+    result = func(*args)
+    elapsed = time.process_time() - start
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak, elapsed
+
+
+def timed(func, *args):
+    start = time.process_time()
+    func(*args)
+    return time.process_time() - start
+
+
+class FakeAgentProxy(object):
+    """Answers getTable() from a canned response"""
+    def __init__(self, response):
+        self.response = response
+
+    def getTable(self, oids):
+        from twisted.internet import defer
+        return defer.succeed(dict((oid, self.response.get(oid, {}))
+                                  for oid in oids))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License version 3 as published by the Free
+# Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Benchmarks the pping ICMP engine by pinging a large number of loopback
+addresses.
+
+Every address in 127.0.0.0/8 is answered by the local kernel, which makes it
+a convenient echo responder for any number of hosts.  A number of silent
+hosts can be added from 192.0.2.0/24 (TEST-NET-1), to see how unanswered
+requests affect the duration of a round.
+
+Must be run as root, to be able to create raw sockets.
+
+"""
+from __future__ import print_function
+
+import argparse
+import resource
+import time
+
+
+def main():
+    args = make_argparser().parse_args()
+
+    from nav.statemon import megaping
+
+    conf = {'rate': args.rate, 'burst': args.burst, 'delay': 0,
+            'timeout': args.timeout, 'min_timeout': args.min_timeout}
+    pinger = megaping.MegaPing(megaping.make_sockets(), conf=conf)
+    hosts = make_loopback_addresses(args.hosts)
+    hosts += ['192.0.2.%d' % (i + 1) for i in range(min(args.silent, 254))]
+    pinger.set_hosts(hosts)
+    print("Pinging %d hosts (%d silent) at %s packets/s" % (
+        len(hosts), args.silent, args.rate or "unlimited"))
+
+    for round_ in range(1, args.rounds + 1):
+        cpu_start = get_cpu_time()
+        elapsed = pinger.ping()
+        cpu_time = get_cpu_time() - cpu_start
+        replies = sum(1 for _ip, rtt in pinger.results() if rtt != -1)
+        print("round %d: %d/%d replies in %.2fs (%.0f hosts/s), "
+              "%.2fs CPU" % (round_, replies, len(hosts), elapsed,
+                             len(hosts) / elapsed, cpu_time))
+        time.sleep(args.pause)
+
+
+def make_argparser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--hosts", type=int, default=50000,
+                        help="number of loopback hosts to ping")
+    parser.add_argument("--silent", type=int, default=0,
+                        help="number of silent hosts to ping (max 254)")
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="number of ping rounds")
+    parser.add_argument("--pause", type=float, default=1,
+                        help="seconds to pause between rounds")
+    parser.add_argument("--rate", type=float, default=5000,
+                        help="packets per second, 0 means unlimited")
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=5)
+    parser.add_argument("--min-timeout", type=float, default=1)
+    return parser
+
+
+def make_loopback_addresses(count):
+    """Returns count distinct addresses from 127.0.0.0/8, skipping network
+    and broadcast-like addresses.
+
+    """
+    addresses = []
+    number = 0
+    while len(addresses) < count:
+        number += 1
+        octets = ((number >> 16) & 0xff, (number >> 8) & 0xff, number & 0xff)
+        if octets[2] in (0, 255):
+            continue
+        addresses.append('127.%d.%d.%d' % octets)
+    return addresses
+
+
+def get_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License version 3 as published by the Free
+# Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Benchmarks the servicemon checker runtime against local stub servers.
+
+A child process runs stub SSH, SMTP and HTTP servers on the loopback
+interface, which answer after a configurable latency, to mimic services
+across a network.  The same set of port, ssh, smtp and http checkers is then
+run through the checker runtime twice: once using the asynchronous checker
+implementations, and once forcing the legacy implementations into the
+thread pool.
+
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+PORTS = {'ssh': 12022, 'smtp': 12025, 'http': 12080}
+
+
+def main():
+    args = make_argparser().parse_args()
+    if args.serve:
+        serve(args.latency)
+        return
+
+    server = subprocess.Popen([sys.executable, __file__, '--serve',
+                               '--latency', str(args.latency)])
+    try:
+        time.sleep(1)
+        for use_async in (True, False):
+            run_benchmark(args, use_async)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def make_argparser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--services", type=int, default=2000,
+                        help="number of services to check")
+    parser.add_argument("--latency", type=float, default=0.1,
+                        help="seconds the stub servers wait before "
+                             "answering")
+    parser.add_argument("--maxthreads", type=int, default=20)
+    parser.add_argument("--maxconcurrent", type=int, default=1000)
+    parser.add_argument("--serve", action="store_true",
+                        help=argparse.SUPPRESS)
+    return parser
+
+
+def run_benchmark(args, use_async):
+    """Runs each checker once through a fresh runtime in a child process,
+    since a reactor cannot be restarted.
+    """
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+
+    from twisted.internet import reactor
+    from nav.statemon.event import Event
+    from nav.statemon.runtime import CheckerRuntime
+
+    checkers = make_checkers(args.services)
+    for checker in checkers:
+        if not use_async:
+            checker.ASYNC_SUPPORT = False
+        checker.handle_result = make_result_handler(checker)
+    runtime = CheckerRuntime(0.001, max_concurrent=args.maxconcurrent,
+                             max_threads=args.maxthreads)
+    cpu_start = get_cpu_time()
+    start = time.time()
+
+    def _check_progress():
+        if runtime.checks_completed >= len(checkers):
+            elapsed = time.time() - start
+            cpu_time = get_cpu_time() - cpu_start
+            down = sum(1 for c in checkers if c.last_status != Event.UP)
+            print("%-7s %d checks (%d down) in %.2fs (%.0f checks/s), "
+                  "%.2fs CPU" % ('async' if use_async else 'threads',
+                                 len(checkers), down, elapsed,
+                                 len(checkers) / elapsed, cpu_time))
+            runtime.stop()
+            reactor.stop()
+        else:
+            reactor.callLater(0.01, _check_progress)
+
+    runtime.start()
+    runtime.set_checkers(checkers)
+    reactor.callLater(0, _check_progress)
+    reactor.run()
+    os._exit(0)
+
+
+def make_checkers(count):
+    """Makes count checkers, evenly distributed across the stub services"""
+    from nav.statemon.checker.PortChecker import PortChecker
+    from nav.statemon.checker.SshChecker import SshChecker
+    from nav.statemon.checker.SmtpChecker import SmtpChecker
+    from nav.statemon.checker.HttpChecker import HttpChecker
+
+    kinds = [(PortChecker, 'smtp'), (SshChecker, 'ssh'),
+             (SmtpChecker, 'smtp'), (HttpChecker, 'http')]
+    checkers = []
+    for serviceid in range(count):
+        checker_class, stub = kinds[serviceid % len(kinds)]
+        service = {'id': serviceid, 'netboxid': serviceid,
+                   'sysname': 'stub%d' % serviceid, 'ip': '127.0.0.1',
+                   'args': {'port': PORTS[stub], 'timeout': 5},
+                   'version': ''}
+        checkers.append(checker_class(service))
+    return checkers
+
+
+def make_result_handler(checker):
+    """Makes a result handler that records the result instead of posting
+    events and metrics, and postpones the next check beyond the benchmark.
+    """
+    checker.last_status = None
+
+    def handle_result(status, _info):
+        checker.last_status = status
+        return 3600
+    return handle_result
+
+
+def serve(latency):
+    """Runs stub servers until terminated"""
+    from twisted.internet import reactor, protocol
+    from twisted.protocols.basic import LineReceiver
+
+    class Banner(LineReceiver):
+        banner = b''
+
+        def connectionMade(self):
+            reactor.callLater(latency, self.sendLine, self.banner)
+
+    class Ssh(Banner):
+        banner = b'SSH-2.0-OpenSSH_7.4 Stub'
+
+        def lineReceived(self, line):
+            self.transport.loseConnection()
+
+    class Smtp(Banner):
+        banner = b'220-stub.example.org ESMTP Stub\r\n220 ready'
+
+        def lineReceived(self, line):
+            if line.upper().startswith(b'QUIT'):
+                self.sendLine(b'221 bye')
+                self.transport.loseConnection()
+
+    class Http(LineReceiver):
+        def lineReceived(self, line):
+            if not line:
+                reactor.callLater(latency, self.respond)
+
+        def respond(self):
+            self.transport.write(b'HTTP/1.0 200 OK\r\nServer: Stub/1.0\r\n'
+                                 b'Content-Length: 2\r\n\r\nok')
+            self.transport.loseConnection()
+
+    for name, stub in (('ssh', Ssh), ('smtp', Smtp), ('http', Http)):
+        factory = protocol.ServerFactory()
+        factory.protocol = stub
+        reactor.listenTCP(PORTS[name], factory, backlog=1024,
+                          interface='127.0.0.1')
+    reactor.run()
+
+
+def get_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+if __name__ == '__main__':
+    main()